@@ -56,11 +56,15 @@ def extract_links_from_page(html):
         if a.has_attr("href")
     ]
 
+# первый <script> после <body> - без построения дерева BeautifulSoup
+BODY_RE = re.compile(r"<body\b", re.IGNORECASE)
+SCRIPT_RE = re.compile(r"<script\b[^>]*>(.*?)</script\s*>", re.IGNORECASE | re.DOTALL)
+
 def extract_first_script(html):
     """Extract JSON data from first script tag."""
-    soup = BeautifulSoup(html, "lxml")
-    script = soup.body.find("script")
-    text = script.string or ""
+    body = BODY_RE.search(html)
+    script = SCRIPT_RE.search(html, body.end() if body else 0)
+    text = script.group(1) if script else ""
     idx = text.find("{")
     return text[idx:] if idx >= 0 else ""
 
@@ -2,9 +2,19 @@
 # -*- coding: utf-8 -*-
 
 import os
+import io
+import gzip
 import json
 import argparse
 
+try:
+    import zstandard
+except ImportError:  # --compress zstd только с установленным пакетом
+    zstandard = None
+
+# сжатие NDJSON-шардов: имя -> расширение (как в realty.pfimport.json_stream)
+COMPRESSIONS = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+
 
 
 def process_all_files(root_dir: str, output_file: str, ext: str = ".json"):
@@ -174,52 +184,148 @@ def transform_property(data):
 
     return transformed
 
+def iter_properties(root_dir: str, ext: str = ".json"):
+    """
+    Рекурсивно обходит root_dir, для каждого файла с расширением ext
+    загружает JSON, применяет transform_property и отдаёт результат,
+    пропуская дубликаты по id.
+    """
+    seen_ids = set()
+
+    for dirpath, dirnames, filenames in os.walk(root_dir):
+        for filename in filenames:
+            if not filename.lower().endswith(ext):
+                continue
+
+            file_path = os.path.join(dirpath, filename)
+            try:
+                with open(file_path, "r", encoding="utf-8") as fin:
+                    data = json.load(fin)
+
+                new_obj = transform_property(data)
+                if new_obj is None:
+                    continue
+
+                obj_id = new_obj.get("id")
+                # Если id уже встречался — пропускаем
+                if obj_id is not None:
+                    if obj_id in seen_ids:
+                        print(f"Дубликат пропущен: id={obj_id} (файл {file_path})")
+                        continue
+                    seen_ids.add(obj_id)
+
+            except Exception as e:
+                print(f"Ошибка обработки {file_path}: {e}")
+                continue
+
+            yield new_obj
+
+
 def process_all_files(root_dir: str, output_file: str, ext: str = ".json"):
     """
     Рекурсивно обходит root_dir, для каждого файла с расширением ext
     загружает JSON, применяет transform_property, убирает дубликаты по id
     и пишет результат в output_file в формате JSON-массива.
     """
-    seen_ids = set()
     first_obj = True
 
     with open(output_file, "w", encoding="utf-8") as fout:
         fout.write("[\n")
 
-        for dirpath, dirnames, filenames in os.walk(root_dir):
-            for filename in filenames:
-                if not filename.lower().endswith(ext):
-                    continue
+        for new_obj in iter_properties(root_dir, ext):
+            # Запись объекта в выходной файл
+            if not first_obj:
+                fout.write(",\n")
+            fout.write(json.dumps(new_obj, ensure_ascii=False, indent=2))
+            first_obj = False
 
-                file_path = os.path.join(dirpath, filename)
-                try:
-                    with open(file_path, "r", encoding="utf-8") as fin:
-                        data = json.load(fin)
+        fout.write("\n]\n")
 
-                    new_obj = transform_property(data)
-                    if new_obj is None:
-                        continue
+    print(f"Обработка завершена. Результат записан в {output_file}")
 
-                    obj_id = new_obj.get("id")
-                    # Если id уже встречался — пропускаем
-                    if obj_id is not None:
-                        if obj_id in seen_ids:
-                            print(f"Дубликат пропущен: id={obj_id} (файл {file_path})")
-                            continue
-                        seen_ids.add(obj_id)
 
-                    # Запись объекта в выходной файл
-                    if not first_obj:
-                        fout.write(",\n")
-                    fout.write(json.dumps(new_obj, ensure_ascii=False, indent=2))
-                    first_obj = False
+def _open_shard(path: str, compression: str):
+    if compression == "gzip":
+        return gzip.open(path, "wt", encoding="utf-8")
+    if compression == "zstd":
+        writer = zstandard.ZstdCompressor().stream_writer(open(path, "wb"))
+        return io.TextIOWrapper(writer, encoding="utf-8")
+    return open(path, "w", encoding="utf-8")
 
-                except Exception as e:
-                    print(f"Ошибка обработки {file_path}: {e}")
 
-        fout.write("\n]\n")
+def _write_manifest(path: str, manifest: dict):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def process_all_files_ndjson(
+    root_dir: str,
+    output_dir: str,
+    prefix: str,
+    ext: str = ".json",
+    shard_size: int = 5000,
+    compression: str = "none",
+):
+    """
+    То же, что process_all_files, но в NDJSON-шарды
+    {prefix}-00001.ndjson[.gz|.zst] по shard_size объектов и манифест
+    {prefix}.manifest.json (формат ShardedNDJSONWriter из realty). Шард
+    попадает в манифест дописанным - его можно импортировать сразу,
+    каждый шард отдельно и параллельно с остальными.
+    """
+    if compression == "zstd" and zstandard is None:
+        raise SystemExit("Для --compress zstd нужен пакет zstandard")
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, f"{prefix}.manifest.json")
+    manifest = {
+        "format": "ndjson",
+        "compression": compression,
+        "items": 0,
+        "complete": False,
+        "shards": [],
+    }
+    _write_manifest(manifest_path, manifest)
+
+    fout, shard_path, in_shard = None, None, 0
+
+    def close_shard():
+        fout.close()
+        os.replace(shard_path + ".part", shard_path)
+        manifest["shards"].append(
+            {
+                "file": os.path.basename(shard_path),
+                "items": in_shard,
+                "bytes": os.path.getsize(shard_path),
+            }
+        )
+        _write_manifest(manifest_path, manifest)
+
+    for new_obj in iter_properties(root_dir, ext):
+        if fout is None:
+            number = len(manifest["shards"]) + 1
+            name = f"{prefix}-{number:05d}.ndjson{COMPRESSIONS[compression]}"
+            shard_path = os.path.join(output_dir, name)
+            fout = _open_shard(shard_path + ".part", compression)
+        fout.write(json.dumps(new_obj, ensure_ascii=False))
+        fout.write("\n")
+        in_shard += 1
+        manifest["items"] += 1
+        if in_shard >= shard_size:
+            close_shard()
+            fout, in_shard = None, 0
+
+    if fout is not None:
+        close_shard()
+    manifest["complete"] = True
+    _write_manifest(manifest_path, manifest)
+
+    print(
+        f"Обработка завершена. {manifest['items']} объектов в "
+        f"{len(manifest['shards'])} шардах, манифест {manifest_path}"
+    )
 
-    print(f"Обработка завершена. Результат записан в {output_file}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
@@ -233,13 +339,41 @@ if __name__ == "__main__":
     parser.add_argument(
         "-o", "--output-file",
         required=True,
-        help="Путь к выходному JSON-файлу"
+        help="Путь к выходному JSON-файлу (для ndjson - рядом манифест и шарды)"
     )
     parser.add_argument(
         "-e", "--extension",
         default=".json",
         help="Расширение файлов для обработки (по умолчанию .html)"
     )
+    parser.add_argument(
+        "-f", "--format",
+        choices=["json", "ndjson"],
+        default="json",
+        help="json - один JSON-массив, ndjson - шарды + манифест"
+    )
+    parser.add_argument(
+        "--compress",
+        choices=list(COMPRESSIONS),
+        default="none",
+        help="Сжатие NDJSON-шардов"
+    )
+    parser.add_argument(
+        "--shard-size",
+        type=int,
+        default=5000,
+        help="Объектов в одном NDJSON-шарде"
+    )
     args = parser.parse_args()
 
-    process_all_files(args.input_dir, args.output_file, args.extension)
+    if args.format == "ndjson":
+        process_all_files_ndjson(
+            args.input_dir,
+            os.path.dirname(args.output_file) or ".",
+            os.path.basename(args.output_file).split(".", 1)[0],
+            args.extension,
+            args.shard_size,
+            args.compress,
+        )
+    else:
+        process_all_files(args.input_dir, args.output_file, args.extension)
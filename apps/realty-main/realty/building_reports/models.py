@@ -1,3 +1,5 @@
+import statistics
+
 from django.db import models
 from django.utils import timezone
 from dateutil.relativedelta import relativedelta
@@ -97,7 +99,6 @@ class PFSnapshotBuilding(models.Model):
             Building as PFBuilding,
         )
 
-        uploader = PFJsonUpload()
         today = timezone.now().date()
 
         # Теперь PFBuilding действительно имеет поле dld_building
@@ -111,27 +112,23 @@ class PFSnapshotBuilding(models.Model):
             # группируем объявления по нормализованной «комнатности»
             groups: dict[str, dict] = {}
             for obj in sale_qs + rent_qs:
-                key = uploader._normalize_bedroom_key(obj.bedrooms)
+                key = PFJsonUpload.bedroom_key_from_norm(obj.bedrooms_norm)
                 if key not in groups:
                     groups[key] = {"sales": [], "rents": []}
 
             for obj in sale_qs:
-                key = uploader._normalize_bedroom_key(obj.bedrooms)
+                key = PFJsonUpload.bedroom_key_from_norm(obj.bedrooms_norm)
                 groups[key]["sales"].append(obj)
             for obj in rent_qs:
-                key = uploader._normalize_bedroom_key(obj.bedrooms)
+                key = PFJsonUpload.bedroom_key_from_norm(obj.bedrooms_norm)
                 groups[key]["rents"].append(obj)
 
             # общее число квартир берем из связанного realty.main.models.Building
             units = getattr(b.dld_building, "total_units", 0) or 0
 
-            # функция для медианы
+            # медиана (0 для пустого списка) – цены уже в памяти, считаем точно
             def median(lst: list[float]) -> float:
-                if not lst:
-                    return 0
-                s = sorted(lst)
-                n = len(s)
-                return s[n // 2] if n % 2 else (s[n // 2 - 1] + s[n // 2]) / 2
+                return statistics.median(lst) if lst else 0
 
             # для каждой «комнатности» считаем метрики
             for bed, bucket in groups.items():
@@ -0,0 +1,285 @@
+"""
+Двухуровневый кэш: LRU процесса поверх общего кэша (diskcache / Redis).
+
+TwoTierCache - бэкенд Django, который оборачивает другой алиас из CACHES
+(OPTIONS["SHARED_CACHE"]). Значения с ключами из LOCAL_KEY_PREFIXES
+(статистика, reference, разрешение сущностей) дополнительно держатся в
+памяти процесса: не больше LOCAL_MAX_ENTRIES записей, не дольше
+LOCAL_TIMEOUT секунд. Остальные ключи (OTP, токены сброса пароля) всегда
+читаются из общего кэша - удаление в другом процессе видно сразу.
+
+Инвалидация по версии: в общем кэше лежит счётчик поколения
+(GENERATION_KEY). bump_cache_generation() после импорта увеличивает его,
+каждый процесс сверяет поколение не чаще раза в GENERATION_CHECK_INTERVAL
+секунд и при расхождении очищает свой LRU.
+
+Счётчики Prometheus: cache_hits_total{cache,tier}, cache_misses_total{cache},
+cache_evictions_total{cache,reason}.
+"""
+
+import logging
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.base import BaseCache
+from prometheus_client import Counter
+
+logger = logging.getLogger(__name__)
+
+GENERATION_KEY = "cache_generation"
+
+CACHE_HITS_TOTAL = Counter(
+    "cache_hits_total",
+    "Cache hits",
+    ["cache", "tier"],
+)
+CACHE_MISSES_TOTAL = Counter(
+    "cache_misses_total",
+    "Cache misses (both tiers)",
+    ["cache"],
+)
+CACHE_EVICTIONS_TOTAL = Counter(
+    "cache_evictions_total",
+    "Entries dropped from the in-process tier",
+    ["cache", "reason"],
+)
+
+_MISSING = object()
+
+
+class TwoTierCache(BaseCache):
+    """
+    OPTIONS:
+        SHARED_CACHE - алиас общего кэша в CACHES (обязателен);
+        LOCAL_MAX_ENTRIES - размер LRU процесса (1024);
+        LOCAL_TIMEOUT - TTL записи в LRU, секунд (30);
+        LOCAL_KEY_PREFIXES - какие ключи держать в LRU;
+        GENERATION_CHECK_INTERVAL - как часто сверять поколение, секунд (5).
+    """
+
+    def __init__(self, location, params):
+        options = dict(params.get("OPTIONS", {}))
+        self._shared_alias = options.pop("SHARED_CACHE")
+        self._local_max_entries = int(options.pop("LOCAL_MAX_ENTRIES", 1024))
+        self._local_timeout = float(options.pop("LOCAL_TIMEOUT", 30))
+        self._local_prefixes = tuple(
+            options.pop(
+                "LOCAL_KEY_PREFIXES",
+                ("stats_aggregation_", "reference_values_", "entity_resolution_"),
+            )
+        )
+        self._check_interval = float(options.pop("GENERATION_CHECK_INTERVAL", 5))
+        super().__init__({**params, "OPTIONS": options})
+        self._name = location or self._shared_alias
+        # (key, version) -> (expires_at, pickled value)
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = None
+        self._generation_checked_at = 0.0
+
+    @property
+    def shared(self) -> BaseCache:
+        return caches[self._shared_alias]
+
+    # --- LRU процесса ---------------------------------------------------------
+
+    def _is_local(self, key) -> bool:
+        return isinstance(key, str) and key.startswith(self._local_prefixes)
+
+    def _local_key(self, key, version):
+        return key, self.version if version is None else version
+
+    def _local_clear(self, reason: str):
+        with self._lock:
+            dropped = len(self._local)
+            self._local.clear()
+        if dropped:
+            CACHE_EVICTIONS_TOTAL.labels(cache=self._name, reason=reason).inc(dropped)
+
+    def _check_generation(self):
+        now = time.monotonic()
+        if now - self._generation_checked_at < self._check_interval:
+            return
+        self._generation_checked_at = now
+        generation = self.shared.get(GENERATION_KEY)
+        if generation != self._generation:
+            if self._generation is not None:
+                logger.info("Cache generation %s -> %s", self._generation, generation)
+            self._generation = generation
+            self._local_clear("invalidated")
+
+    def _local_get(self, key, version):
+        self._check_generation()
+        local_key = self._local_key(key, version)
+        with self._lock:
+            entry = self._local.get(local_key)
+            if entry is None:
+                return _MISSING
+            expires_at, pickled = entry
+            if expires_at <= time.monotonic():
+                del self._local[local_key]
+                expired = True
+            else:
+                self._local.move_to_end(local_key)
+                expired = False
+        if expired:
+            CACHE_EVICTIONS_TOTAL.labels(cache=self._name, reason="expired").inc()
+            return _MISSING
+        return pickle.loads(pickled)
+
+    def _local_set(self, key, value, version, timeout=DEFAULT_TIMEOUT):
+        ttl = self._local_timeout
+        if timeout is not DEFAULT_TIMEOUT and timeout is not None:
+            ttl = min(ttl, timeout)
+        if ttl <= 0:
+            self._local_delete(key, version)
+            return
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        local_key = self._local_key(key, version)
+        evicted = 0
+        with self._lock:
+            self._local[local_key] = (time.monotonic() + ttl, pickled)
+            self._local.move_to_end(local_key)
+            while len(self._local) > self._local_max_entries:
+                self._local.popitem(last=False)
+                evicted += 1
+        if evicted:
+            CACHE_EVICTIONS_TOTAL.labels(cache=self._name, reason="capacity").inc(
+                evicted
+            )
+
+    def _local_delete(self, key, version):
+        with self._lock:
+            self._local.pop(self._local_key(key, version), None)
+
+    # --- API кэша Django ------------------------------------------------------
+
+    def get(self, key, default=None, version=None):
+        is_local = self._is_local(key)
+        if is_local:
+            value = self._local_get(key, version)
+            if value is not _MISSING:
+                CACHE_HITS_TOTAL.labels(cache=self._name, tier="local").inc()
+                return value
+        value = self.shared.get(key, _MISSING, version=version)
+        if value is _MISSING:
+            CACHE_MISSES_TOTAL.labels(cache=self._name).inc()
+            return default
+        CACHE_HITS_TOTAL.labels(cache=self._name, tier="shared").inc()
+        if is_local:
+            self._local_set(key, value, version)
+        return value
+
+    def get_many(self, keys, version=None):
+        result = {}
+        rest = []
+        for key in keys:
+            value = _MISSING
+            if self._is_local(key):
+                value = self._local_get(key, version)
+            if value is _MISSING:
+                rest.append(key)
+            else:
+                result[key] = value
+        if result:
+            CACHE_HITS_TOTAL.labels(cache=self._name, tier="local").inc(len(result))
+        if rest:
+            found = self.shared.get_many(rest, version=version)
+            if found:
+                CACHE_HITS_TOTAL.labels(cache=self._name, tier="shared").inc(
+                    len(found)
+                )
+            if len(found) < len(rest):
+                CACHE_MISSES_TOTAL.labels(cache=self._name).inc(
+                    len(rest) - len(found)
+                )
+            for key, value in found.items():
+                if self._is_local(key):
+                    self._local_set(key, value, version)
+            result.update(found)
+        return result
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, timeout, version=version)
+        if self._is_local(key):
+            self._local_set(key, value, version, timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.shared.add(key, value, timeout, version=version)
+        if added and self._is_local(key):
+            self._local_set(key, value, version, timeout)
+        return added
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.shared.set_many(data, timeout, version=version)
+        for key, value in data.items():
+            if self._is_local(key) and key not in failed:
+                self._local_set(key, value, version, timeout)
+        return failed
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.shared.touch(key, timeout, version=version)
+
+    def delete(self, key, version=None):
+        self._local_delete(key, version)
+        return self.shared.delete(key, version=version)
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        for key in keys:
+            self._local_delete(key, version)
+        self.shared.delete_many(keys, version=version)
+
+    def has_key(self, key, version=None):
+        if self._is_local(key) and self._local_get(key, version) is not _MISSING:
+            return True
+        return self.shared.has_key(key, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        self._local_delete(key, version)
+        return self.shared.incr(key, delta, version=version)
+
+    def decr(self, key, delta=1, version=None):
+        self._local_delete(key, version)
+        return self.shared.decr(key, delta, version=version)
+
+    def clear(self):
+        self._local_clear("cleared")
+        self.shared.clear()
+
+    def close(self, **kwargs):
+        self.shared.close(**kwargs)
+
+    # --- Поколения ------------------------------------------------------------
+
+    def bump_generation(self) -> int:
+        """Новое поколение: LRU всех процессов очистятся при следующей сверке."""
+        if self.shared.add(GENERATION_KEY, 1, timeout=None):
+            generation = 1
+        else:
+            try:
+                generation = self.shared.incr(GENERATION_KEY)
+            except ValueError:  # ключ вытеснен между add и incr
+                generation = 1
+                self.shared.set(GENERATION_KEY, generation, timeout=None)
+        self._generation = generation
+        self._generation_checked_at = time.monotonic()
+        self._local_clear("invalidated")
+        return generation
+
+
+def bump_cache_generation(alias: str = "default"):
+    """
+    Вызывается в конце импорта. Для обычного бэкенда (DummyCache в dev,
+    голый diskcache) ничего не делает и возвращает None.
+    """
+    backend = caches[alias]
+    if not isinstance(backend, TwoTierCache):
+        return None
+    generation = backend.bump_generation()
+    logger.info("Cache generation bumped to %s", generation)
+    return generation
@@ -5,6 +5,7 @@ from realty.pfimport.tasks import scrape_property_finder
 from datetime import timedelta
 from django.utils import timezone
 from realty.main.tasks import compute_aggregation_for_caching
+from realty.main.tasks import refresh_market_summary_task
 
 
 class Command(BaseCommand):
@@ -13,6 +14,7 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         now_midnight = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
         compute_aggregation_for_caching.using(run_after=now_midnight).enqueue()
+        refresh_market_summary_task.enqueue()
         scrape_property_finder.using(
             run_after=now_midnight + timedelta(hours=8)
         ).enqueue()
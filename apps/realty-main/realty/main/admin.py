@@ -376,6 +376,7 @@ class MasterProjecAtdmin(admin.ModelAdmin):
 
 
 from .models import CsvImport
+from .models import run_csv_import
 
 
 @admin.register(CsvImport)
@@ -387,9 +388,26 @@ class CsvImportAdmin(admin.ModelAdmin):
         "giper_csv_url",
         "transactions_csv_url",
     )
-    readonly_fields = ("created_at", "started_at", "finished_at", "status", "log")
+    readonly_fields = (
+        "created_at",
+        "started_at",
+        "finished_at",
+        "status",
+        "log",
+        "checkpoint_offset",
+        "checkpoint_rows",
+        "source_size",
+    )
     list_filter = ("status",)
     search_fields = ("giper_csv_url", "transactions_csv_url")
+    actions = ["resume_import"]
+
+    @admin.action(description="Продолжить упавший импорт с checkpoint")
+    def resume_import(self, request, queryset):
+        failed = list(queryset.filter(status="failed").values_list("pk", flat=True))
+        for pk in failed:
+            run_csv_import.enqueue(pk)
+        self.message_user(request, f"Поставлено в очередь: {len(failed)}")
 
 
 from .models import CsvRentImport
@@ -401,3 +419,54 @@ class CsvRentImportAdmin(admin.ModelAdmin):
     readonly_fields = ("created_at", "started_at", "finished_at", "status", "log")
     list_filter = ("status",)
     search_fields = ("rents_csv_url",)
+
+
+from .models import CacheWarmRun
+
+
+@admin.register(CacheWarmRun)
+class CacheWarmRunAdmin(admin.ModelAdmin):
+    list_display = (
+        "id",
+        "started_at",
+        "status",
+        "full",
+        "total_keys",
+        "done_keys",
+        "failed_keys",
+        "duration_seconds",
+    )
+    readonly_fields = (
+        "started_at",
+        "finished_at",
+        "status",
+        "full",
+        "changed_since",
+        "workers",
+        "total_keys",
+        "done_keys",
+        "failed_keys",
+        "duration_seconds",
+        "log",
+    )
+    list_filter = ("status", "full")
+
+
+from .models import MarketSummary
+
+
+@admin.register(MarketSummary)
+class MarketSummaryAdmin(admin.ModelAdmin):
+    list_display = (
+        "id",
+        "generated_at",
+        "total_transactions",
+        "total_rental_transactions",
+        "avg_price",
+        "avg_rent",
+        "duration_seconds",
+    )
+
+    def has_add_permission(self, request):
+        # строку пишет refresh_market_summary
+        return False
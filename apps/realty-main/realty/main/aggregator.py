@@ -1,13 +1,21 @@
+from typing import Dict
 from typing import Optional
 
+from django.db import connections
+from django.db.models import Aggregate
 from django.db.models import Avg
 from django.db.models import Count
+from django.db.models import DecimalField
+from django.db.models import FloatField
 from django.db.models import Max
 from django.db.models import Min
+from django.db.models import Q
 from django.db.models import Sum
+from django.db.models.functions import Coalesce
 
 from .models import Building
 from .models import MergedTransaction
+from .sketch import QuantileSketch
 
 
 def _calc_percent_change(
@@ -22,14 +30,133 @@ def _calc_percent_change(
     return ((current_value - previous_value) / previous_value) * 100.0
 
 
-def _approximate_median_via_minmax(min_val, max_val):
+def _sketch_median(qs) -> float:
     """
-    Приближённая медиана как (min_val + max_val) / 2,
-    если оба значения не None.
+    Медиана transaction_price через QuantileSketch (погрешность <= 1%) для
+    БД без percentile_cont: один потоковый проход по ценам, без сортировки
+    и загрузки объектов. NULL-цены пропускаем, как Avg/Min/Max.
     """
-    if min_val is not None and max_val is not None:
-        return (min_val + max_val) / 2.0
-    return None
+    prices = (
+        qs.filter(transaction_price__isnull=False)
+        .order_by()
+        .values_list("transaction_price", flat=True)
+    )
+    return QuantileSketch.from_values(prices.iterator(chunk_size=5000)).quantile(0.5)
+
+
+class PercentileCont(Aggregate):
+    """
+    percentile_cont(p) WITHIN GROUP (ORDER BY expr) - есть только в PostgreSQL.
+    FILTER (WHERE ...) Django добавляет сам, если передан filter=.
+    """
+
+    function = "percentile_cont"
+    name = "PercentileCont"
+    template = "%(function)s(%(percentile)s) WITHIN GROUP (ORDER BY %(expressions)s)"
+    output_field = FloatField()
+
+    def __init__(self, expression, percentile=0.5, **extra):
+        super().__init__(expression, percentile=float(percentile), **extra)
+
+
+def _price_expr():
+    # NULL цена считается как 0 - так же, как float(o.transaction_price or 0)
+    return Coalesce(
+        "transaction_price",
+        0,
+        output_field=DecimalField(max_digits=15, decimal_places=2),
+    )
+
+
+def _sqm_expr():
+    return Coalesce("sqm", 0.0, output_field=FloatField())
+
+
+def _streamed_median(qs, count: int) -> float:
+    """
+    Медиана без поддержки percentile в БД: сортируем в SQL и берём
+    одну-две средние строки через OFFSET, объекты в память не грузим.
+    """
+    if not count:
+        return 0.0
+    lo = (count - 1) // 2
+    hi = count // 2
+    values = list(
+        qs.annotate(_median_price=_price_expr())
+        .order_by("_median_price")
+        .values_list("_median_price", flat=True)[lo : hi + 1]
+    )
+    if not values:
+        return 0.0
+    return (float(values[0]) + float(values[-1])) / 2.0
+
+
+def aggregate_periods(
+    qs, periods: Dict[str, tuple], with_median: bool = True
+) -> Dict[str, dict]:
+    """
+    Считает метрики сразу для нескольких диапазонов дат одним SQL-запросом
+    (условные агрегаты Count/Sum/Min/Max с FILTER по каждому диапазону).
+
+    periods: {"current": (start, end), "previous": (start, end), ...}
+    Границы включительные (gte/lte), диапазоны могут пересекаться.
+    Третьим элементом можно передать доп. Q для группы, например
+    {"area": (start, end, Q(area_id__in=ids))}.
+
+    Возвращает {key: {count, sum_price, avg_price, median, sum_sqm, avg_area,
+    min_price, max_price}}. Медиана - percentile_cont в PostgreSQL,
+    иначе _streamed_median (два коротких запроса на период);
+    with_median=False - медиану не считаем (0.0).
+    """
+    if not periods:
+        return {}
+
+    # Сужаем выборку до объединения диапазонов, чтобы работал индекс по дате
+    qs = qs.filter(
+        date_of_transaction__gte=min(p[0] for p in periods.values()),
+        date_of_transaction__lte=max(p[1] for p in periods.values()),
+    ).order_by()
+    use_percentile = with_median and connections[qs.db].vendor == "postgresql"
+
+    filters = {}
+    aggregates = {}
+    for key, (start, end, *extra) in periods.items():
+        q = Q(date_of_transaction__gte=start, date_of_transaction__lte=end)
+        if extra and extra[0] is not None:
+            q &= extra[0]
+        filters[key] = q
+        aggregates[f"{key}__count"] = Count("pk", filter=q)
+        aggregates[f"{key}__sum_price"] = Sum(_price_expr(), filter=q)
+        aggregates[f"{key}__sum_sqm"] = Sum(_sqm_expr(), filter=q)
+        aggregates[f"{key}__min_price"] = Min(_price_expr(), filter=q)
+        aggregates[f"{key}__max_price"] = Max(_price_expr(), filter=q)
+        if use_percentile:
+            aggregates[f"{key}__median"] = PercentileCont(_price_expr(), filter=q)
+
+    agg = qs.aggregate(**aggregates)
+
+    result = {}
+    for key in periods:
+        count = agg[f"{key}__count"] or 0
+        sum_price = float(agg[f"{key}__sum_price"] or 0)
+        sum_sqm = float(agg[f"{key}__sum_sqm"] or 0)
+        if not with_median:
+            median = 0.0
+        elif use_percentile:
+            median = float(agg[f"{key}__median"] or 0)
+        else:
+            median = _streamed_median(qs.filter(filters[key]), count)
+        result[key] = {
+            "count": count,
+            "sum_price": sum_price,
+            "avg_price": sum_price / count if count else 0.0,
+            "median": median,
+            "sum_sqm": sum_sqm,
+            "avg_area": sum_sqm / count if count else 0.0,
+            "min_price": float(agg[f"{key}__min_price"] or 0),
+            "max_price": float(agg[f"{key}__max_price"] or 0),
+        }
+    return result
 
 
 def _aggregator_for_qs(qs):
@@ -44,20 +171,24 @@ def _aggregator_for_qs(qs):
       - sum_price
       - sum_sqm
       - avg_roi
-      - median_price (по min+max, приблизительно)
+      - median_price (percentile_cont в PostgreSQL, иначе QuantileSketch)
       - avg_price_sqm (sum_price / sum_sqm)
     При извлечении значений из агрегаций приводим Decimal → float.
     """
-    agg = qs.aggregate(
-        deals_count=Count("*"),
-        buildings_count=Count("building", distinct=True),
-        avg_price=Avg("transaction_price"),
-        min_price=Min("transaction_price"),
-        max_price=Max("transaction_price"),
-        sum_price=Sum("transaction_price"),
-        sum_sqm=Sum("sqm"),
-        avg_roi=Avg("roi"),
-    )
+    aggregates = {
+        "deals_count": Count("*"),
+        "buildings_count": Count("building", distinct=True),
+        "avg_price": Avg("transaction_price"),
+        "min_price": Min("transaction_price"),
+        "max_price": Max("transaction_price"),
+        "sum_price": Sum("transaction_price"),
+        "sum_sqm": Sum("sqm"),
+        "avg_roi": Avg("roi"),
+    }
+    use_percentile = connections[qs.db].vendor == "postgresql"
+    if use_percentile:
+        aggregates["median_price"] = PercentileCont("transaction_price")
+    agg = qs.aggregate(**aggregates)
     avg_price = float(agg["avg_price"]) if agg["avg_price"] is not None else 0.0
     min_price = float(agg["min_price"]) if agg["min_price"] is not None else 0.0
     max_price = float(agg["max_price"]) if agg["max_price"] is not None else 0.0
@@ -65,7 +196,10 @@ def _aggregator_for_qs(qs):
     sum_sqm = float(agg["sum_sqm"] or 0.0)
     avg_roi = float(agg["avg_roi"]) if agg["avg_roi"] is not None else 0.0
 
-    median_price_approx = _approximate_median_via_minmax(min_price, max_price)
+    if use_percentile:
+        median_price = float(agg["median_price"] or 0.0)
+    else:
+        median_price = _sketch_median(qs) if agg["deals_count"] else 0.0
     avg_price_sqm = sum_price / sum_sqm if sum_sqm > 0 else 0.0
 
     return {
@@ -77,7 +211,7 @@ def _aggregator_for_qs(qs):
         "sum_price": sum_price,
         "sum_sqm": sum_sqm,
         "avg_roi": avg_roi,
-        "median_price": median_price_approx if median_price_approx is not None else 0.0,
+        "median_price": median_price,
         "avg_price_sqm": avg_price_sqm,
     }
 
@@ -0,0 +1,268 @@
+"""
+Инкрементальный прогрев кэша статистики (calc_and_save_search_log).
+
+Вместо полного прохода по всем Area × Building × Project:
+  1) берём started_at последнего успешного CacheWarmRun;
+  2) находим здания/районы, по которым с тех пор появились (или изменились)
+     MergedTransaction / MergedRentalTransaction - отдельно для sales и rental;
+  3) сбрасываем reference-ключи, в которые они входят (весь Дубай и
+     reference района для поиска по зданию/проекту);
+  4) пересчитываем ключи: весь Дубай -> районы -> здания и проекты.
+
+Ключи считаются в пуле процессов (settings.CACHE_WARMER_WORKERS). Кэш должен
+быть общим для процессов (diskcache/redis), с LocMemCache прогрев бесполезен.
+Ключи незатронутых сущностей не пересчитываются. Импорт меняет поколение
+данных (data_generation), поэтому их старые значения больше не читаются;
+новые досчитываются по запросу (single_flight) и истекают по TTL (1 день).
+
+Удалённые сделки и подмена таблицы (--shadow, rollback_transactions) по
+updated_at не видны - такие пути вызывают request_full_warm(), и следующий
+прогрев идёт по всем сущностям.
+"""
+
+import logging
+import time
+from concurrent.futures import as_completed
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.utils import timezone
+
+from .models import Area
+from .models import Building
+from .models import CacheWarmRun
+from .models import MergedRentalTransaction
+from .models import MergedTransaction
+from .models import Project
+from .stats import area_reference_cache_key
+from .stats import calc_and_save_search_log
+from .stats import reference_cache_key
+from .utils import _get_period_range
+
+logger = logging.getLogger(__name__)
+
+TRANSACTION_TYPES = ["sales", "rental"]
+PERIODS = [
+    "1 month",
+    "3 months",
+    "6 months",
+    "1 year",
+    "2 years",
+]
+
+# Как часто сохранять прогресс в CacheWarmRun
+PROGRESS_SAVE_EVERY = 50
+
+WarmJob = Tuple[str, Optional[str], str]  # (transaction_type, search_substring, period)
+
+
+def _transactions_qs(transaction_type: str):
+    if transaction_type == "rental":
+        return MergedRentalTransaction.objects.all()
+    return MergedTransaction.objects.filter(transaction_type="sales")
+
+
+def _names(qs, field: str) -> List[str]:
+    return sorted(
+        set(
+            qs.filter(**{f"{field}__isnull": False})
+            .exclude(**{field: ""})
+            .values_list(field, flat=True)
+        )
+    )
+
+
+def affected_entities(
+    transaction_type: str, since=None
+) -> Optional[Dict[str, List[str]]]:
+    """
+    Имена районов, зданий и проектов, чьи ключи надо пересчитать.
+
+    since=None - полный прогрев (все сущности, как раньше).
+    Возвращает None, если с момента since сделок этого типа не было.
+    """
+    if since is None:
+        return {
+            "areas": _names(Area.objects.all(), "name_en"),
+            "buildings": _names(Building.objects.all(), "english_name"),
+            "projects": _names(Project.objects.all(), "english_name"),
+        }
+
+    changed = _transactions_qs(transaction_type).filter(updated_at__gte=since)
+    if not changed.exists():
+        return None
+
+    building_ids: Set[int] = set(
+        changed.filter(building_id__isnull=False)
+        .order_by()
+        .values_list("building_id", flat=True)
+        .distinct()
+    )
+    area_ids: Set[int] = set(
+        changed.filter(area_id__isnull=False)
+        .order_by()
+        .values_list("area_id", flat=True)
+        .distinct()
+    )
+
+    buildings = Building.objects.filter(id__in=building_ids)
+    area_ids.update(
+        buildings.filter(area_id__isnull=False).values_list("area_id", flat=True)
+    )
+    return {
+        "areas": _names(Area.objects.filter(id__in=area_ids), "name_en"),
+        "buildings": _names(buildings, "english_name"),
+        "projects": _names(
+            Project.objects.filter(buildings__id__in=building_ids), "english_name"
+        ),
+    }
+
+
+def invalidate_reference_keys(transaction_type: str, search_names: List[str]):
+    """
+    Сбрасывает reference-ключи (весь Дубай + район для зданий/проектов),
+    чтобы calc_and_save_search_log пересчитал их, а не взял старые.
+    """
+    keys = []
+    for period in PERIODS:
+        start, end = _get_period_range(period)
+        ref_key = reference_cache_key(transaction_type, start, end, None)
+        keys.append(ref_key)
+        keys.extend(area_reference_cache_key(ref_key, name) for name in search_names)
+    cache.delete_many(keys)
+
+
+def _warm_one(job: WarmJob) -> Tuple[WarmJob, float, Optional[str]]:
+    """Пересчитывает один ключ. Выполняется в процессе пула."""
+    transaction_type, search_substring, period = job
+    t0 = time.monotonic()
+    try:
+        calc_and_save_search_log(
+            transaction_type=transaction_type,
+            search_substring=search_substring,
+            property_components=None,
+            period_str=period,
+            return_dict=True,  # We don't need to save to DB
+            use_cache=True,
+            refresh=True,
+        )
+    except Exception as e:  # один ключ не должен ронять весь прогрев
+        return job, time.monotonic() - t0, str(e)
+    return job, time.monotonic() - t0, None
+
+
+def _run_jobs(run: CacheWarmRun, jobs: List[WarmJob], workers: int):
+    def on_done(job, elapsed, error):
+        run.done_keys += 1
+        if error:
+            run.failed_keys += 1
+            run.log += f"FAILED {job}: {error}\n"
+            logger.error("Cache warm failed for %s: %s", job, error)
+        else:
+            logger.debug("Cache warmed %s in %.2fs", job, elapsed)
+        if run.done_keys % PROGRESS_SAVE_EVERY == 0:
+            run.save(update_fields=["done_keys", "failed_keys", "log"])
+
+    if workers <= 1:
+        for job in jobs:
+            on_done(*_warm_one(job))
+        return
+
+    # Соединения родителя не должны достаться дочерним процессам
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_warm_one, job) for job in jobs]
+        for future in as_completed(futures):
+            on_done(*future.result())
+
+
+def request_full_warm(reason: str):
+    """
+    Следующий прогрев - полный: сделки удалены или таблица подменена целиком,
+    и по updated_at затронутые сущности не найти.
+    """
+    CacheWarmRun.objects.create(status="requested", full=True, log=f"{reason}\n")
+    logger.info("Full cache warm requested: %s", reason)
+
+
+def _full_warm_requested(since) -> bool:
+    return CacheWarmRun.objects.filter(
+        status="requested", started_at__gte=since
+    ).exists()
+
+
+def warm_cache(full: bool = False, workers: Optional[int] = None) -> CacheWarmRun:
+    """
+    Прогревает кэш статистики. full=True - все сущности, иначе только
+    затронутые новыми сделками с момента последнего успешного прогрева
+    (или все, если с тех пор был request_full_warm).
+    """
+    if workers is None:
+        workers = getattr(settings, "CACHE_WARMER_WORKERS", 1)
+
+    last_run = (
+        CacheWarmRun.objects.filter(status="completed").order_by("-started_at").first()
+    )
+    since = None if full or last_run is None else last_run.started_at
+    if since is not None and _full_warm_requested(since):
+        since = None
+    run = CacheWarmRun.objects.create(
+        full=since is None, changed_since=since, workers=workers
+    )
+    t0 = time.monotonic()
+    logger.info("Starting cache warm #%s (since=%s, workers=%s)", run.pk, since, workers)
+
+    try:
+        # Сначала весь Дубай (он же reference для районов), потом остальное
+        dubai_jobs: List[WarmJob] = []
+        entity_jobs: List[WarmJob] = []
+        for transaction_type in TRANSACTION_TYPES:
+            entities = affected_entities(transaction_type, since)
+            if entities is None:
+                run.log += f"{transaction_type}: no changes\n"
+                continue
+            run.log += (
+                f"{transaction_type}: {len(entities['areas'])} areas, "
+                f"{len(entities['buildings'])} buildings, "
+                f"{len(entities['projects'])} projects\n"
+            )
+            invalidate_reference_keys(
+                transaction_type, entities["buildings"] + entities["projects"]
+            )
+            for period in PERIODS:
+                dubai_jobs.append((transaction_type, None, period))
+                for kind in ("areas", "buildings", "projects"):
+                    for name in entities[kind]:
+                        entity_jobs.append((transaction_type, name, period))
+
+        run.total_keys = len(dubai_jobs) + len(entity_jobs)
+        run.save(update_fields=["total_keys", "log"])
+
+        _run_jobs(run, dubai_jobs, workers)
+        _run_jobs(run, entity_jobs, workers)
+        run.status = "completed"
+    except Exception as e:
+        logger.exception("Cache warm #%s failed", run.pk)
+        run.status = "failed"
+        run.log += f"ERROR: {e}\n"
+    finally:
+        run.finished_at = timezone.now()
+        run.duration_seconds = time.monotonic() - t0
+        run.save()
+
+    logger.info(
+        "Finished cache warm #%s: %s/%s keys (%s failed) in %.1fs",
+        run.pk,
+        run.done_keys,
+        run.total_keys,
+        run.failed_keys,
+        run.duration_seconds,
+    )
+    return run
@@ -0,0 +1,90 @@
+"""
+Поколения данных для ключей кэша.
+
+Каждый импорт увеличивает счётчик своей области:
+  - sales    - сделки продажи, здания и проекты (populate_db, populate_db_2 /
+               run_csv_import, rollback_transactions sales);
+  - rental   - аренда (populate_db_rents / run_csv_rent_import);
+  - listings - объявления PF (run_pfjson_import, PFJsonUpload.process_json).
+Номер поколения входит в ключи статистики, reference, разрешения сущностей,
+страниц объявлений и GeoJSON - после импорта старые ключи просто перестают
+читаться и истекают по TTL, без общего сброса кэша; ключи других областей
+(например, аренды после импорта продаж) остаются в силе.
+
+Счётчики лежат в общем кэше. Если счётчик вытеснен, он заводится заново
+от текущего времени в мс - номер не повторит ни одно из прошлых поколений.
+"""
+
+import logging
+import time
+from functools import wraps
+from typing import Dict
+
+from django.core.cache import cache
+from django.views.decorators.cache import cache_page
+
+from realty.core.cache import bump_cache_generation
+
+logger = logging.getLogger(__name__)
+
+SCOPES = ("sales", "rental", "listings")
+
+
+def _key(scope: str) -> str:
+    if scope not in SCOPES:
+        raise ValueError(f"Unknown data generation scope: {scope}")
+    return f"data_generation_{scope}"
+
+
+def generation_scope(transaction_type: str) -> str:
+    """Область для transaction_type (как в aggregator: не rental - продажи)."""
+    return "rental" if transaction_type == "rental" else "sales"
+
+
+def _generations(*scopes: str) -> Dict[str, int]:
+    keys = {_key(scope): scope for scope in scopes}
+    found = cache.get_many(list(keys))
+    result = {}
+    for key, scope in keys.items():
+        value = found.get(key)
+        if value is None:
+            seed = int(time.time() * 1000)
+            cache.add(key, seed, timeout=None)
+            value = cache.get(key) or seed
+        result[scope] = value
+    return result
+
+
+def data_generation(*scopes: str) -> str:
+    """Токен для ключа кэша, например "sales12" или "sales12.listings5"."""
+    generations = _generations(*scopes)
+    return ".".join(f"{scope}{generations[scope]}" for scope in scopes)
+
+
+def bump_data_generation(*scopes: str):
+    """Вызывается в конце импорта: новые номера поколений для scopes."""
+    for scope in scopes:
+        key = _key(scope)
+        try:
+            generation = cache.incr(key)
+        except ValueError:  # счётчика ещё нет или вытеснен
+            generation = int(time.time() * 1000)
+            cache.set(key, generation, timeout=None)
+        logger.info("Data generation %s -> %s", scope, generation)
+    # ключи старого поколения в LRU процессов больше не нужны
+    bump_cache_generation()
+
+
+def cache_page_for_generation(timeout: int, *scopes: str):
+    """cache_page, у которого в префиксе ключа - текущее поколение scopes."""
+
+    def decorator(view):
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            key_prefix = data_generation(*scopes)
+            cached_view = cache_page(timeout, key_prefix=key_prefix)(view)
+            return cached_view(request, *args, **kwargs)
+
+        return wrapped
+
+    return decorator
@@ -0,0 +1,121 @@
+"""
+Ликвидность (special liquidity calc) пачкой, без N+1.
+
+Для каждого (year, month) берём уникальные здания со сделками,
+ratio = liquidity_parameter_one / total_units (total_units здания,
+а если его нет - проекта), усредняем по зданиям месяца, затем по месяцам.
+
+Параметры и total_units читаются одним JOIN-запросом
+(BuildingLiquidityParameterOne -> Building -> Project), дальше всё в памяти.
+Используется в stats.calc_and_save_search_log, отчётах и прогреве кэша.
+"""
+
+from collections import defaultdict
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Tuple
+
+from django.db.models.functions import ExtractMonth
+from django.db.models.functions import ExtractYear
+
+from .models import BuildingLiquidityParameterOne
+
+BuildingMonth = Tuple[int, int, int]  # (building_id, year, month)
+
+# Ограничение на размер IN (...) - SQLite не любит тысячи параметров
+BUILDING_IDS_CHUNK = 500
+
+
+def building_months(qs, start, end) -> List[BuildingMonth]:
+    """
+    Уникальные (building_id, year, month) по сделкам qs за [start, end].
+    Один SELECT DISTINCT вместо загрузки транзакций.
+    """
+    return list(
+        qs.filter(
+            building_id__isnull=False,
+            date_of_transaction__gte=start,
+            date_of_transaction__lte=end,
+        )
+        .annotate(
+            _year=ExtractYear("date_of_transaction"),
+            _month=ExtractMonth("date_of_transaction"),
+        )
+        .order_by()
+        .values_list("building_id", "_year", "_month")
+        .distinct()
+    )
+
+
+def effective_total_units(building_total_units, project_total_units) -> int:
+    """total_units здания, если > 0, иначе проекта, иначе 0."""
+    if building_total_units and building_total_units > 0:
+        return building_total_units
+    if project_total_units:
+        return project_total_units
+    return 0
+
+
+def load_liquidity_ratios(
+    keys: Iterable[BuildingMonth],
+) -> Dict[BuildingMonth, float]:
+    """
+    {(building_id, year, month): liq / total_units} для всех ключей,
+    у которых есть параметр ликвидности и total_units > 0.
+    """
+    keys = set(keys)
+    if not keys:
+        return {}
+
+    building_ids = sorted({b_id for b_id, _, _ in keys})
+    years = {yy for _, yy, _ in keys}
+    months = {mm for _, _, mm in keys}
+
+    ratios = {}
+    for i in range(0, len(building_ids), BUILDING_IDS_CHUNK):
+        rows = BuildingLiquidityParameterOne.objects.filter(
+            building_id__in=building_ids[i : i + BUILDING_IDS_CHUNK],
+            year__in=years,
+            month__in=months,
+        ).values_list(
+            "building_id",
+            "year",
+            "month",
+            "liquidity_parameter_one",
+            "building__total_units",
+            "building__project__total_units",
+        )
+        for b_id, yy, mm, liq, b_units, p_units in rows:
+            key = (b_id, yy, mm)
+            # unique_together гарантирует одну запись, но year/month__in
+            # вернут и лишние комбинации - отсекаем их
+            if key not in keys:
+                continue
+            tu = effective_total_units(b_units, p_units)
+            if tu > 0:  # только если >0
+                ratios[key] = float(liq or 0) / tu
+    return ratios
+
+
+def compute_liquidity(keys: Iterable[BuildingMonth]) -> float:
+    """
+    Среднее по месяцам от среднего по зданиям ratio = liq / total_units.
+    Месяцы без данных не участвуют; если данных нет вообще - 0.0.
+    """
+    keys = set(keys)
+    ratios = load_liquidity_ratios(keys)
+
+    month_ratios = defaultdict(list)
+    for (_b_id, yy, mm), ratio in ratios.items():
+        month_ratios[(yy, mm)].append(ratio)
+
+    monthly_averages = [sum(r) / len(r) for r in month_ratios.values()]
+    if monthly_averages:
+        return sum(monthly_averages) / len(monthly_averages)
+    return 0.0
+
+
+def compute_liquidity_for_queryset(qs, start, end) -> float:
+    """Ликвидность по сделкам qs за период [start, end]."""
+    return compute_liquidity(building_months(qs, start, end))
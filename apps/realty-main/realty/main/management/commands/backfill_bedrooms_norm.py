@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand
+from realty.main.models import backfill_bedrooms_norm
+from realty.main.models import MergedRentalTransaction
+from realty.main.models import MergedTransaction
+from realty.pfimport.models import PFListRent
+from realty.pfimport.models import PFListSale
+
+MODELS = {
+    "sales": MergedTransaction,
+    "rental": MergedRentalTransaction,
+    "pfsale": PFListSale,
+    "pfrent": PFListRent,
+}
+
+
+class Command(BaseCommand):
+    """
+    Заполнение bedrooms_norm у существующих строк (после миграции или
+    правок через update() / bulk_update):
+        python manage.py backfill_bedrooms_norm
+        python manage.py backfill_bedrooms_norm --model pfsale
+    Импорты заполняют поле сами (BedroomsNormField.pre_save).
+    """
+
+    help = "Fills bedrooms_norm on transactions and PF listings."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--model",
+            choices=[*MODELS, "all"],
+            default="all",
+            help="Какую таблицу заполнить (по умолчанию все)",
+        )
+
+    def handle(self, *args, **options):
+        keys = list(MODELS) if options["model"] == "all" else [options["model"]]
+        for key in keys:
+            t0 = time.monotonic()
+            updated = backfill_bedrooms_norm(MODELS[key])
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"{key}: {updated} rows updated in {time.monotonic() - t0:.1f}s"
+                )
+            )
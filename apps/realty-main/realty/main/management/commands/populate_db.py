@@ -6,9 +6,12 @@ from django.core.management.base import BaseCommand
 from django.utils import timezone
 from rapidfuzz import fuzz
 from rapidfuzz import process
+from realty.main.cache_warmer import request_full_warm
+from realty.main.data_generation import bump_data_generation
 from realty.main.management.projects import get_projects_file
 from realty.main.management.utils import download_dubai_pulse_csv
 from realty.main.management.utils import safe_str_value
+from realty.main.market_summary import refresh_market_summary
 from realty.main.models import Area
 from realty.main.models import Building
 from realty.main.models import BuildingLiquidityParameterOne
@@ -16,6 +19,8 @@ from realty.main.models import Function
 from realty.main.models import MergedTransaction
 from realty.main.models import Project
 from realty.main.models import Room
+from realty.main.rollups import rebuild_rollups
+from realty.main.search_index import rebuild_search_index
 
 logger = logging.getLogger(__name__)
 
@@ -50,10 +55,15 @@ class Command(BaseCommand):
             Building.objects.all().delete()
             Project.objects.all().delete()
             Area.objects.all().delete()
+            request_full_warm("populate_db --clean")
             logger.info("Clean complete.")
 
         self.populate_projects_and_buildings(projects_file)
         self.populate_transactions(transactions_file)
+        rebuild_rollups("sales")
+        refresh_market_summary()
+        bump_data_generation("sales")
+        rebuild_search_index()
         logger.info("Population complete.")
 
     def populate_projects_and_buildings(self, projects_file):
@@ -1,15 +1,31 @@
 import csv
 import datetime
+import json
 import os
+from collections import defaultdict
 
 from django.core.management.base import BaseCommand
 from django.core.management.base import CommandError
 from django.db import transaction
+from django.utils import timezone
+from realty.main.cache_warmer import request_full_warm
+from realty.main.data_generation import bump_data_generation
+from realty.main.market_summary import refresh_market_summary
 from realty.main.models import Area
 from realty.main.models import Building
-from realty.main.models import BuildingLiquidityParameterOne
-from realty.main.models import MergedTransaction
+from realty.main.models import CsvImport
+from realty.main.models import normalize_bedrooms
 from realty.main.models import Project
+from realty.main.rollups import rebuild_rollups
+from realty.main.search_index import rebuild_search_index
+from realty.main.table_swap import ShadowValidationError
+from realty.main.transactions_loader import commit_chunk
+from realty.main.transactions_loader import iter_csv_rows
+from realty.main.transactions_loader import replace_sales_from_staging
+from realty.main.transactions_loader import staging_lock
+from realty.main.transactions_loader import start_staging
+
+UNKNOWN_PROJECT = "unknow project"
 
 
 class Command(BaseCommand):
@@ -22,9 +38,15 @@ class Command(BaseCommand):
 
     По умолчанию (без аргументов) возьмёт файлы giper_matched_output.csv и tr_28_03_2025.csv
     из текущей директории, chunk_size=5000.
+
+    Сделки грузятся потоково в staging (см. realty.main.transactions_loader)
+    и заменяют старые одной транзакцией в конце - сайт всё время видит
+    полные данные. С --import-id прогресс пишется в CsvImport, и повторный
+    запуск после падения продолжает с checkpoint. С --shadow сделки
+    подменяются blue/green-обменом таблиц (см. realty.main.table_swap).
     """
 
-    help = "Populates the DB with buildings and transactions, clearing all old data."
+    help = "Populates the DB with buildings and transactions, replacing all old data."
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -43,46 +65,108 @@ class Command(BaseCommand):
             "--chunk-size",
             type=int,
             default=5000,
-            help="Размер порции (bulk_create) для транзакций",
+            help="Размер порции (одна транзакция + checkpoint) для транзакций",
+        )
+        parser.add_argument(
+            "--import-id",
+            type=int,
+            default=None,
+            help="CsvImport, в котором хранится checkpoint (для продолжения)",
+        )
+        parser.add_argument(
+            "--shadow",
+            action="store_true",
+            help="Грузить в теневую таблицу и подменять живую после проверки "
+            "(blue/green, откат - rollback_transactions)",
         )
 
-    @transaction.atomic
     def handle(self, *args, **options):
         giper_csv_path = options["giper_csv"]
         transactions_csv_path = options["transactions_csv"]
         chunk_size = options["chunk_size"]
 
-        # 1) Сносим всё из связанных таблиц
-        self._clean_all()
+        csv_import = None
+        if options["import_id"]:
+            try:
+                csv_import = CsvImport.objects.get(pk=options["import_id"])
+            except CsvImport.DoesNotExist:
+                raise CommandError(f"CsvImport {options['import_id']} не найден.")
+
+        for path in (giper_csv_path, transactions_csv_path):
+            if not os.path.isfile(path):
+                raise CommandError(f"Файл {path} не найден.")
+
+        # Всё, что не обновлено после этого момента, в конце удаляется
+        self.load_started = timezone.now()
+
+        # staging общая на все импорты: параллельный запуск получит ошибку,
+        # а не перемешает свои строки с нашими
+        try:
+            with staging_lock():
+                total = self._replace_data(
+                    giper_csv_path,
+                    transactions_csv_path,
+                    chunk_size,
+                    csv_import,
+                    options["shadow"],
+                )
+        except (ValueError, ShadowValidationError) as e:
+            raise CommandError(str(e))
+        self.stdout.write(f"  Replaced with {total} transactions.")
+
+        # 4) Здания / проекты / районы, которых больше нет в giper
+        self._remove_stale()
 
-        # 2) Загружаем данные из giper_matched_output.csv
-        if not os.path.isfile(giper_csv_path):
-            raise CommandError(f"Файл {giper_csv_path} не найден.")
+        # 5) Помесячные агрегаты (rollup): данные заменены целиком - пересчитываем все
+        self.stdout.write("Rebuilding sales rollups ...")
+        rebuild_rollups("sales")
+        # сделки заменены целиком: удалённые по updated_at не найти
+        request_full_warm("populate_db_2")
+
+        # 6) Снимок для market_overview и индекс автокомплита
+        refresh_market_summary()
+        bump_data_generation("sales")
+        rebuild_search_index()
+
+        self.stdout.write(self.style.SUCCESS("Done populating DB!"))
+
+    def _replace_data(
+        self, giper_csv_path, transactions_csv_path, chunk_size, csv_import, shadow
+    ):
+        # 1) Area / Project / Building из giper_matched_output.csv (upsert)
         self.stdout.write(self.style.SUCCESS(f"Loading from {giper_csv_path}..."))
-        self._load_giper_data(giper_csv_path)
+        with transaction.atomic():
+            self._load_giper_data(giper_csv_path)
 
-        # 3) Загружаем транзакции из tr_28_03_2025.csv
-        if not os.path.isfile(transactions_csv_path):
-            raise CommandError(f"Файл {transactions_csv_path} не найден.")
+        # 2) Транзакции из tr_28_03_2025.csv -> staging, порциями с checkpoint
         self.stdout.write(
             self.style.SUCCESS(f"Loading from {transactions_csv_path}...")
         )
-        self._load_transactions_in_chunks(transactions_csv_path, chunk_size)
-
-        self.stdout.write(self.style.SUCCESS("Done populating DB!"))
-
-    def _clean_all(self):
-        self.stdout.write(self.style.WARNING("Deleting old data..."))
-        MergedTransaction.objects.all().delete()
-        BuildingLiquidityParameterOne.objects.all().delete()
-        Building.objects.all().delete()
-        Project.objects.all().delete()
-        Area.objects.all().delete()
-        self.stdout.write(self.style.WARNING("All old data removed."))
+        self._stage_transactions(transactions_csv_path, chunk_size, csv_import)
+
+        # 3) Подмена сделок и BuildingLiquidityParameterOne одной транзакцией
+        self.stdout.write("Replacing transactions ...")
+        return replace_sales_from_staging(csv_import, shadow=shadow)
+
+    def _remove_stale(self):
+        with transaction.atomic():
+            buildings, _ = Building.objects.filter(
+                updated_at__lt=self.load_started
+            ).delete()
+            projects, _ = Project.objects.filter(
+                updated_at__lt=self.load_started
+            ).delete()
+            areas, _ = Area.objects.exclude(pk__in=self.seen_area_ids).delete()
+        self.stdout.write(
+            self.style.WARNING(
+                f"Removed stale objects: {buildings} buildings (with related), "
+                f"{projects} projects (with related), {areas} areas."
+            )
+        )
 
     def _load_giper_data(self, csv_path):
         """
-        Считывает giper_matched_output.csv и создаёт:
+        Считывает giper_matched_output.csv и создаёт/обновляет:
           Area, Project, Building.
         Если нет project_name_en_out и project_number => building привязывается к проекту "unknow project".
         Кроме того, для Building записываем (в facilities, например) словари вида {
@@ -90,12 +174,44 @@ class Command(BaseCommand):
           "2 B/R": ...,
           ...
         } для подсчёта same_rooms_count_in_building.
+
+        Существующие записи обновляются на месте (id не меняются, ссылки из
+        pfimport и отчётов не теряются), поэтому удалять всё заранее не нужно.
         """
-        self.unknown_project = Project.objects.create(english_name="unknow project")
+        self.unknown_project = (
+            Project.objects.filter(english_name=UNKNOWN_PROJECT).order_by("pk").first()
+            or Project(english_name=UNKNOWN_PROJECT)
+        )
+        self.unknown_project.save()  # обновляем updated_at - не «устаревший»
+
+        # Существующие объекты по тем же ключам, что и при создании
+        area_pool = {}
+        for area in Area.objects.order_by("pk"):
+            area_pool.setdefault(area.name_en, area)
+        project_area = {}
+        for project_id, area_name in Building.objects.order_by("pk").values_list(
+            "project_id", "area__name_en"
+        ):
+            project_area.setdefault(project_id, area_name or "")
+        project_pool = defaultdict(list)
+        for proj in Project.objects.exclude(pk=self.unknown_project.pk).order_by("pk"):
+            key = (
+                proj.english_name or "",
+                proj.project_number or "",
+                project_area.get(proj.pk, ""),
+            )
+            project_pool[key].append(proj)
+        building_pool = defaultdict(list)
+        for b in Building.objects.order_by("pk"):
+            building_pool[((b.english_name or "").lower(), b.project_id)].append(b)
 
         area_map = {}
         project_map = {}
         building_map = {}
+        self.seen_area_ids = set()
+        self.buildings_per_project = defaultdict(int)
+        self.rooms_by_building = {}
+        self.bedrooms_norm_cache = {}
 
         with open(csv_path, mode="r", encoding="utf-8-sig") as f:
             reader = csv.DictReader(f)
@@ -104,8 +220,11 @@ class Command(BaseCommand):
                 area_name_en = (row.get("area_name_en_out") or "").strip()
                 if area_name_en:
                     if area_name_en not in area_map:
-                        area_obj = Area.objects.create(name_en=area_name_en)
+                        area_obj = area_pool.get(area_name_en) or Area.objects.create(
+                            name_en=area_name_en
+                        )
                         area_map[area_name_en] = area_obj
+                        self.seen_area_ids.add(area_obj.pk)
                     else:
                         area_obj = area_map[area_name_en]
                 else:
@@ -121,21 +240,16 @@ class Command(BaseCommand):
                 except ValueError:
                     total_units = None
 
-                # Ключ для project_map – например, (project_name_en, project_number, area_name_en)
-                # В зависимости от того, насколько уникальны ваши данные.
-                # Или просто project_number, если он уникален.
+                # Ключ для project_map – (project_name_en, project_number, area_name_en)
                 if project_name_en or project_number:
                     project_key = (project_name_en, project_number, area_name_en)
                     if project_key not in project_map:
-                        # создаём новый
-                        proj = Project.objects.create(
-                            english_name=project_name_en if project_name_en else None,
-                            project_number=project_number if project_number else None,
-                            total_units=total_units,
-                            # Можем привязать Project к area, если по ТЗ нужно (не всегда это требуется)
-                            # В моделях нет прямого FK Project->Area, но если нужно - добавьте поле
-                            # ИЛИ же можно просто игнорировать area тут.
-                        )
+                        pool = project_pool.get(project_key)
+                        proj = pool.pop(0) if pool else Project()
+                        proj.english_name = project_name_en or None
+                        proj.project_number = project_number or None
+                        proj.total_units = total_units
+                        proj.save()
                         project_map[project_key] = proj
                     else:
                         proj = project_map[project_key]
@@ -163,9 +277,7 @@ class Command(BaseCommand):
 
                 # Собираем данные о комнатах
                 # У giper_matched_output.csv есть столбцы "1br","2br","3br","4br","other"
-                # Для удобства положим в словарь building_facilities["rooms_count"] = {...}
-                building_facilities = {}
-                building_facilities["rooms_count"] = {
+                rooms_count = {
                     "1 B/R": self._safe_int(row.get("1br")),
                     "2 B/R": self._safe_int(row.get("2br")),
                     "3 B/R": self._safe_int(row.get("3br")),
@@ -180,200 +292,131 @@ class Command(BaseCommand):
                 except ValueError:
                     b_total_units = None
 
-                # Создадим Building
-                b = Building.objects.create(
-                    project=proj,
-                    area=area_obj,
-                    english_name=building_name_en,
-                    floor_count=floor_count,
-                    building_count=building_count_val,
-                    total_units=b_total_units,
-                )
-                # Сохраним словарь в building.facilities (или another JSONField)
-                # Но у модели Building в исходном коде нет JSONField,
-                # можно хранить в building.property_type или building.arabic_name,
-                # но лучше расширить модель.
-                # Для примера допустим, что "arabic_name" для нас свободно или
-                # используем "property_type" как JSON. Это не очень корректно, но покажем идею:
-                b.property_type = "RoomsData"  # какая-то пометка
-                # а сами counts в extra поле "facilities"?
-                # Но нет "facilities" в модели. Пришлось бы добавить поле.
-                # Чтобы уместиться в ТЗ – покажем вариант хранения словаря в python:
-                # создадим поле "facilities" если вы можете. Если нет – вариантов два:
-                #   A) Расширить модель
-                #   B) Хранить как текст JSON
-                # Предположим, что "arabic_name" нам не нужно, и туда упрячем JSON
-                import json
-
-                b.arabic_name = json.dumps(building_facilities)
+                pool = building_pool.get((building_name_en.lower(), proj.pk))
+                b = pool.pop(0) if pool else Building()
+                b.project = proj
+                b.area = area_obj
+                b.english_name = building_name_en
+                b.floor_count = floor_count
+                b.building_count = building_count_val
+                b.total_units = b_total_units
+                # Модель Building не имеет JSON-поля для комнат, поэтому
+                # словарь хранится как JSON в arabic_name (с пометкой в property_type)
+                b.property_type = "RoomsData"
+                b.arabic_name = json.dumps({"rooms_count": rooms_count})
                 b.save()
 
                 # Сохраним в building_map, чтобы потом легче искать по building_name_en
                 building_map[building_name_en.lower()] = b
+                self.rooms_by_building[b.pk] = rooms_count
+                self.buildings_per_project[proj.pk] += 1
 
         # Сохраняем полученные словари как атрибуты self,
         # чтобы далее переиспользовать в транзакциях
         self.area_map = area_map
         self.project_map = project_map
         self.building_map = building_map
+        # Поиск проекта по названию из tr_*.csv: первый проект с таким именем
+        self.project_by_name = {}
+        for (pname, _pnum, _aname), pobj in project_map.items():
+            self.project_by_name.setdefault(pname.lower(), pobj)
 
-    def _load_transactions_in_chunks(self, csv_path, chunk_size):
+    def _stage_transactions(self, csv_path, chunk_size, csv_import):
+        """
+        Из файла tr_28_03_2025.csv (огромного) построчно читаем строки сделок
+        в staging порциями по chunk_size; каждая порция коммитится вместе с
+        checkpoint, так что после падения продолжаем с последней порции.
         """
-        Из файла tr_28_03_2025.csv (огромного) построчно читаем, создаём MergedTransaction.
-        transaction_type = 'sales'.
+        offset, row_count = start_staging(csv_import, os.path.getsize(csv_path))
+        if offset:
+            self.stdout.write(f"  Resuming after row {row_count} (byte {offset})...")
+
+        buffer = []
+        row_offset = offset
+        for row, row_offset in iter_csv_rows(csv_path, offset):
+            row_count += 1
+            staged = self._staging_row(row_count, row)
+            if staged is not None:
+                buffer.append(staged)
+
+            if len(buffer) >= chunk_size:
+                commit_chunk(buffer, csv_import, row_offset, row_count)
+                self.stdout.write(f"  Imported {row_count} rows so far...")
+                buffer.clear()
+
+        # Финальный кусок
+        commit_chunk(buffer, csv_import, row_offset, row_count)
+        self.stdout.write(f"  Finished importing {row_count} rows total.")
+
+    def _staging_row(self, row_number, row):
+        """
+        Строка tr_*.csv -> кортеж для staging (порядок STAGING_COLUMNS)
+        или None, если строку надо пропустить. transaction_type = 'sales'.
         Вычисляем:
             building_rooms_count (если у проекта 1 здание => project.total_units, иначе 0),
-            same_rooms_count_in_building (по rooms_en + building.facilities["rooms_count"]).
-        По итогу считаем LiquidityParameterOne -> количество сделок (sales) в (год,месяц) для каждого Building.
+            same_rooms_count_in_building (по rooms_en + rooms_count здания).
         """
-        transactions_buffer = []
-        self.liquidity_counter = {}  # (building_id, year, month) -> count
-
-        with open(csv_path, mode="r", encoding="utf-8-sig") as f:
-            reader = csv.DictReader(f)
-            row_count = 0
-
-            for row in reader:
-                row_count += 1
-
-                # 1) Основные поля
-                transaction_type = "sales"  # по условию
-                instance_date_str = row.get("instance_date") or ""
-                try:
-                    date_of_transaction = datetime.datetime.strptime(
-                        instance_date_str, "%d-%m-%Y"
-                    ).date()
-                except ValueError:
-                    # Непарсибельная дата - пропустим
-                    continue
-
-                # float/decimal поля
-                procedure_area = self._safe_float(row.get("procedure_area"))
-                actual_worth = self._safe_float(row.get("actual_worth"))
-                meter_sale_price = self._safe_float(row.get("meter_sale_price"))
-
-                # Поиск Building
-                building_name_en = (row.get("building_name_en") or "").strip()
-                bkey = building_name_en.lower()
-                building_obj = self.building_map.get(bkey)  # или None
-
-                # Поиск проекта (по project_name_en)
-                project_name_en = (row.get("project_name_en") or "").strip()
-                # Т.к. в _load_giper_data мы делали ключ (pn, pnum, area_name)
-                # тут точно воспроизвести сложнее.
-                # Либо вы там создаёте map по одному названию,
-                # либо тоже "unknown project", если не найдено.
-                # Упростим: попытаемся найти любой Project,
-                # у которого english_name=project_name_en (lower).
-                # Для быстрого поиска – сделаем словарь
-                proj = None
-                if project_name_en:
-                    # итерируем по self.project_map, ищем подходящий
-                    found = False
-                    for (pname, pnum, aname), pobj in self.project_map.items():
-                        if pname.lower() == project_name_en.lower():
-                            proj = pobj
-                            found = True
-                            break
-                    if not found:
-                        # не нашли - unknown
-                        proj = self.unknown_project
-                else:
-                    proj = self.unknown_project
-
-                # Поиск area (по area_name_en)
-                area_name_en = (row.get("area_name_en") or "").strip()
-                area_obj = self.area_map.get(area_name_en)
-
-                # building_rooms_count:
-                #   = project.total_units, если у проекта ровно 1 здание, иначе 0.
-                building_rooms_count = 0
-                if proj and proj.total_units:
-                    # Проверим, не кэшировали ли мы "сколько зданий"?
-                    # Можно в конце _load_giper_data посчитать project->count(buildings).
-                    # Но проще: project.buildings.count() -> может быть затратно, но приемлемо, если проектов мало.
-                    # Для оптимизации – заранее посчитаем, как ниже.
-                    if not hasattr(proj, "_buildings_count"):
-                        proj._buildings_count = proj.buildings.count()
-                    if proj._buildings_count == 1:
-                        building_rooms_count = proj.total_units or 0
-
-                # same_rooms_count_in_building:
-                #   нужно извлечь rooms_en, а потом посмотреть, сколько в building.facilities["rooms_count"].
-                #   "rooms_en" может быть "1 B/R","2 B/R","3 B/R","4 B/R","Studio" и т.д.
-                rooms_en = (row.get("rooms_en") or "").strip()
-                same_rooms_count = 0
-                if building_obj and building_obj.arabic_name:
-                    # Распарсим json
-                    import json
-
-                    try:
-                        b_fac = json.loads(building_obj.arabic_name)
-                        room_map = b_fac.get("rooms_count", {})
-                        # Сопоставляем "1 B/R" -> room_map["1 B/R"]
-                        # Можно сделать простейший if:
-                        if rooms_en in room_map:
-                            same_rooms_count = room_map[rooms_en]
-                        else:
-                            same_rooms_count = room_map.get("other", 0)
-                    except:
-                        pass
-
-                # Год сделки
-                deal_year = date_of_transaction.year
-                deal_month = date_of_transaction.month
-
-                # В liquidity_counter прибавим 1
-                if building_obj:
-                    key = (building_obj.id, deal_year, deal_month)
-                    self.liquidity_counter[key] = self.liquidity_counter.get(key, 0) + 1
-
-                # Собираем объект для MergedTransaction
-                mt = MergedTransaction(
-                    transaction_type=transaction_type,
-                    building=building_obj,
-                    date_of_transaction=date_of_transaction,
-                    building_name=building_name_en,
-                    location_name=area_name_en,
-                    number_of_rooms=rooms_en,
-                    sqm=procedure_area,
-                    transaction_price=actual_worth,
-                    meter_sale_price=meter_sale_price,
-                    deal_year=deal_year,
-                    area=area_obj,
-                    building_rooms_count=building_rooms_count,
-                    same_rooms_count_in_building=same_rooms_count,
-                )
-                transactions_buffer.append(mt)
-
-                # bulk_create порциями
-                if len(transactions_buffer) >= chunk_size:
-                    MergedTransaction.objects.bulk_create(transactions_buffer)
-                    self.stdout.write(f"  Imported {row_count} rows so far...")
-                    transactions_buffer.clear()
-
-            # Финальный кусок
-            if transactions_buffer:
-                MergedTransaction.objects.bulk_create(transactions_buffer)
-                self.stdout.write(f"  Finished importing {row_count} rows total.")
-
-        # Теперь сохраним BuildingLiquidityParameterOne
-        self.stdout.write("Filling BuildingLiquidityParameterOne ...")
-        blpo_bulk = []
-        for (building_id, year, month), cnt in self.liquidity_counter.items():
-            blpo_bulk.append(
-                BuildingLiquidityParameterOne(
-                    building_id=building_id,
-                    year=year,
-                    month=month,
-                    liquidity_parameter_one=cnt,
-                )
-            )
-        BuildingLiquidityParameterOne.objects.bulk_create(blpo_bulk)
-        self.stdout.write(
-            f"Done BuildingLiquidityParameterOne: {len(blpo_bulk)} records."
+        instance_date_str = row.get("instance_date") or ""
+        try:
+            date_of_transaction = datetime.datetime.strptime(
+                instance_date_str, "%d-%m-%Y"
+            ).date()
+        except ValueError:
+            # Непарсибельная дата - пропустим
+            return None
+
+        # Поиск Building
+        building_name_en = (row.get("building_name_en") or "").strip()
+        building_obj = self.building_map.get(building_name_en.lower())  # или None
+
+        # Поиск проекта (по project_name_en), не нашли - unknown
+        project_name_en = (row.get("project_name_en") or "").strip()
+        proj = self.project_by_name.get(project_name_en.lower(), self.unknown_project)
+
+        # Поиск area (по area_name_en)
+        area_name_en = (row.get("area_name_en") or "").strip()
+        area_obj = self.area_map.get(area_name_en)
+
+        # building_rooms_count:
+        #   = project.total_units, если у проекта ровно 1 здание, иначе 0.
+        building_rooms_count = 0
+        if proj.total_units and self.buildings_per_project.get(proj.pk) == 1:
+            building_rooms_count = proj.total_units
+
+        # same_rooms_count_in_building:
+        #   "rooms_en" может быть "1 B/R","2 B/R","3 B/R","4 B/R","Studio" и т.д.
+        rooms_en = (row.get("rooms_en") or "").strip()
+        same_rooms_count = 0
+        if building_obj:
+            room_map = self.rooms_by_building.get(building_obj.pk, {})
+            if rooms_en in room_map:
+                same_rooms_count = room_map[rooms_en]
+            else:
+                same_rooms_count = room_map.get("other", 0)
+
+        return (
+            row_number,
+            building_obj.pk if building_obj else None,
+            area_obj.pk if area_obj else None,
+            date_of_transaction,
+            building_name_en,
+            area_name_en,
+            rooms_en,
+            self._bedrooms_norm(rooms_en),
+            self._safe_float(row.get("procedure_area")),
+            self._safe_float(row.get("actual_worth")),
+            self._safe_float(row.get("meter_sale_price")),
+            date_of_transaction.year,
+            building_rooms_count,
+            same_rooms_count,
         )
 
+    def _bedrooms_norm(self, rooms_en):
+        """normalize_bedrooms с кэшем: значений rooms_en - единицы."""
+        if rooms_en not in self.bedrooms_norm_cache:
+            self.bedrooms_norm_cache[rooms_en] = normalize_bedrooms(rooms_en)
+        return self.bedrooms_norm_cache[rooms_en]
+
     def _safe_float(self, val):
         """Возвращает float(val) или 0.0, если не парсится."""
         if not val:
@@ -2,20 +2,30 @@ import csv
 import datetime
 import gc
 import re
+import sys
 from decimal import Decimal
 from decimal import InvalidOperation
 from pathlib import Path
 
 from django.core.management.base import BaseCommand
 from django.core.management.base import CommandError
+from django.db import connection
 from django.db import transaction
 from django.utils import timezone
 from rapidfuzz import fuzz
 from rapidfuzz import process
+from realty.main.cache_warmer import request_full_warm
+from realty.main.data_generation import bump_data_generation
+from realty.main.market_summary import refresh_market_summary
 from realty.main.models import Area
 from realty.main.models import Building
 from realty.main.models import MergedRentalTransaction
 from realty.main.models import Project
+from realty.main.rollups import rebuild_rollups
+from realty.main.table_swap import create_shadow
+from realty.main.table_swap import insert_objects
+from realty.main.table_swap import ShadowValidationError
+from realty.main.table_swap import swap_in_shadow
 
 
 class Command(BaseCommand):
@@ -37,6 +47,12 @@ class Command(BaseCommand):
             default=1,
             help="Номер строки (1-based), с которой начинать обработку CSV (включая заголовок).",
         )
+        parser.add_argument(
+            "--shadow",
+            action="store_true",
+            help="Полная перезаливка в теневую таблицу с подменой живой после "
+            "проверки (blue/green, откат - rollback_transactions).",
+        )
 
     def handle(self, *args, **options):
         csv_file = options["csv_file"]
@@ -53,9 +69,23 @@ class Command(BaseCommand):
         # )
         # if confirm.lower().startswith("y"):
         # 1) Очистить данные?
-        if options["clean_first"]:
+        # (year, month) изменённых сделок - по ним потом пересчитываем rollup
+        self.touched_months = set()
+        self.cleaned = False
+        # blue/green: живую таблицу не чистим, пишем в теневую
+        self.shadow_table = None
+        self.pending = []
+        if options["shadow"]:
+            if start_line > 1:
+                raise CommandError("--shadow - полная перезаливка, без --start-line.")
+            self.shadow_table = create_shadow(MergedRentalTransaction)
+            self.stdout.write(
+                self.style.WARNING(f"Загрузка в теневую таблицу {self.shadow_table}")
+            )
+        elif options["clean_first"]:
             self.stdout.write(self.style.WARNING("Чищу MergedRentalTransaction…"))
             MergedRentalTransaction.objects.all().delete()
+            self.cleaned = True
             self.stdout.write(
                 self.style.WARNING("Все записи MergedRentalTransaction удалены.")
             )
@@ -65,6 +95,7 @@ class Command(BaseCommand):
             )
             if confirm.lower().startswith("y"):
                 MergedRentalTransaction.objects.all().delete()
+                self.cleaned = True
                 self.stdout.write(
                     self.style.WARNING("Все записи MergedRentalTransaction удалены.")
                 )
@@ -85,6 +116,24 @@ class Command(BaseCommand):
             self.style.SUCCESS(f"Всего строк во входном файле: {total_lines}")
         )
 
+        if self.shadow_table:
+            self.dedupe_shadow()
+            try:
+                swap_in_shadow(MergedRentalTransaction)
+            except ShadowValidationError as e:
+                raise CommandError(str(e))
+            self.cleaned = True  # таблица заменена целиком
+            self.stdout.write(self.style.SUCCESS("Теневая таблица подменила живую."))
+
+        # Помесячные агрегаты: после очистки - полностью, иначе только затронутые месяцы
+        if self.cleaned:
+            rebuild_rollups("rental")
+            request_full_warm("populate_db_rents (table replaced)")
+        elif self.touched_months:
+            rebuild_rollups("rental", months=self.touched_months)
+        refresh_market_summary()
+        bump_data_generation("rental")
+
     def init_cached_data(self):
         """
         Считываем один раз все Project, Area и Building,
@@ -150,6 +199,7 @@ class Command(BaseCommand):
                     self.style.NOTICE(f"Обрабатываю строку {idx}/{total_lines}")
                 )
 
+                self.handle_chunk(rows_buffer)
                 rows_buffer.clear()
                 gc.collect()
 
@@ -173,6 +223,23 @@ class Command(BaseCommand):
                 row, area_obj, project_obj, building_obj
             )
 
+        if self.shadow_table:
+            insert_objects(MergedRentalTransaction, self.shadow_table, self.pending)
+            self.pending.clear()
+
+    def dedupe_shadow(self):
+        """
+        В теневой таблице на (contract_id, date_of_transaction) оставляем
+        последнюю строку - как update_or_create при загрузке в живую.
+        """
+        table = connection.ops.quote_name(self.shadow_table)
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {table} WHERE contract_id IS NOT NULL AND id NOT IN ("
+                f"SELECT MAX(id) FROM {table} WHERE contract_id IS NOT NULL "
+                f"GROUP BY contract_id, date_of_transaction)"
+            )
+
     def row_is_relevant(self, row) -> bool:
         """
         - ejari_bus_property_type_en == "Unit"
@@ -320,6 +387,7 @@ class Command(BaseCommand):
 
         # period
         period_value = self.get_period(date_of_transaction)
+        self.touched_months.add((date_of_transaction.year, date_of_transaction.month))
 
         defaults = {
             "transaction_type": "rental",
@@ -375,7 +443,13 @@ class Command(BaseCommand):
             "period": period_value,
         }
 
-        if contract_id:
+        if self.shadow_table:
+            # в теневую таблицу - пачкой в конце handle_chunk,
+            # дубли (contract_id, дата) убирает dedupe_shadow
+            self.pending.append(
+                MergedRentalTransaction(contract_id=contract_id or None, **defaults)
+            )
+        elif contract_id:
             # update_or_create по (contract_id, date_of_transaction)
             obj, created = MergedRentalTransaction.objects.update_or_create(
                 contract_id=contract_id,
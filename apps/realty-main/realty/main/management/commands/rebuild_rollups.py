@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+from realty.main.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    """
+    Полный пересчёт помесячных агрегатов (TransactionMonthlyRollup):
+        python manage.py rebuild_rollups
+        python manage.py rebuild_rollups --transaction-type=rental
+    Импорты (populate_db_2, populate_db_rents) обновляют rollup сами,
+    команда нужна для первичного заполнения и после ручных правок данных.
+    """
+
+    help = "Rebuilds TransactionMonthlyRollup from MergedTransaction / MergedRentalTransaction."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--transaction-type",
+            choices=["sales", "rental", "all"],
+            default="all",
+            help="Какой тип сделок пересчитать (по умолчанию оба)",
+        )
+
+    def handle(self, *args, **options):
+        transaction_type = options["transaction_type"]
+        types = ["sales", "rental"] if transaction_type == "all" else [transaction_type]
+        for t in types:
+            t0 = time.monotonic()
+            total = rebuild_rollups(t)
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"{t}: {total} rollup rows in {time.monotonic() - t0:.1f}s"
+                )
+            )
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+from realty.main.search_index import rebuild_search_index
+
+
+class Command(BaseCommand):
+    """
+    Пересборка индекса автокомплита (SearchEntry):
+        python manage.py rebuild_search_index
+    populate_db и populate_db_2 пересобирают индекс сами, команда нужна
+    после ручных правок районов, зданий и проектов.
+    """
+
+    help = "Rebuilds the autocomplete search index for areas, buildings and projects."
+
+    def handle(self, *args, **options):
+        t0 = time.monotonic()
+        total = rebuild_search_index()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{total} search entries in {time.monotonic() - t0:.1f}s"
+            )
+        )
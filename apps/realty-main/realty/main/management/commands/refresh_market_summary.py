@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from realty.main.market_summary import refresh_market_summary
+from realty.main.tasks import refresh_market_summary_task
+
+
+class Command(BaseCommand):
+    """
+    Пересчёт снимка MarketSummary (market_overview):
+        python manage.py refresh_market_summary
+        python manage.py refresh_market_summary --schedule
+    --schedule ставит в очередь задачу, которая дальше сама
+    перезапускается раз в час (start_all_tasks делает то же).
+    """
+
+    help = "Refreshes the MarketSummary snapshot used by market_overview."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--schedule",
+            action="store_true",
+            help="Поставить ежечасный пересчёт в очередь задач",
+        )
+
+    def handle(self, *args, **options):
+        if options["schedule"]:
+            refresh_market_summary_task.enqueue()
+            self.stdout.write(self.style.SUCCESS("Hourly refresh scheduled."))
+            return
+        summary = refresh_market_summary()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Market summary: {summary.total_transactions} sales, "
+                f"{summary.total_rental_transactions} rentals "
+                f"in {summary.duration_seconds:.1f}s"
+            )
+        )
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from realty.main.cache_warmer import request_full_warm
+from realty.main.data_generation import bump_data_generation
+from realty.main.market_summary import refresh_market_summary
+from realty.main.models import MergedRentalTransaction
+from realty.main.models import MergedTransaction
+from realty.main.rollups import rebuild_rollups
+from realty.main.table_swap import rollback_generation
+from realty.main.transactions_loader import rebuild_liquidity
+
+MODELS = {
+    "sales": MergedTransaction,
+    "rental": MergedRentalTransaction,
+}
+
+
+class Command(BaseCommand):
+    """
+    Откат полной перезаливки (populate_db_2 / populate_db_rents с --shadow):
+        python manage.py rollback_transactions --transaction-type=sales
+    Живая таблица и "<table>__prev" меняются местами, так что повторный
+    запуск возвращает откатанное поколение обратно.
+    """
+
+    help = "Swaps the live transactions table with its previous generation."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--transaction-type",
+            choices=list(MODELS),
+            required=True,
+            help="Какую таблицу сделок откатить",
+        )
+
+    def handle(self, *args, **options):
+        transaction_type = options["transaction_type"]
+        try:
+            rollback_generation(MODELS[transaction_type])
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f"{transaction_type}: rolled back."))
+
+        # производные данные - по вернувшимся сделкам
+        if transaction_type == "sales":
+            rebuild_liquidity()
+        rebuild_rollups(transaction_type)
+        request_full_warm(f"rollback_transactions {transaction_type}")
+        refresh_market_summary()
+        bump_data_generation(transaction_type)
+        self.stdout.write(self.style.SUCCESS("Rollups and market summary rebuilt."))
@@ -0,0 +1,66 @@
+"""
+Снимок общей статистики рынка (MarketSummary) для Query.market_overview.
+
+refresh_market_summary считает счётчики и средние по всем сделкам (полный
+проход по двум самым большим таблицам) и перезаписывает единственную строку
+снимка. Вызывается импортами (populate_db, populate_db_2, populate_db_rents,
+rollback_transactions) и задачей refresh_market_summary_task по расписанию;
+get_market_summary только читает строку.
+"""
+
+import logging
+import time
+
+from django.db.models import Avg
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import Area
+from .models import Building
+from .models import MarketSummary
+from .models import MergedRentalTransaction
+from .models import MergedTransaction
+from .models import Project
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PK = 1
+
+
+def refresh_market_summary() -> MarketSummary:
+    """Пересчитывает снимок и возвращает его."""
+    t0 = time.monotonic()
+    transaction_stats = MergedTransaction.objects.aggregate(
+        total=Count("id"), avg_price=Avg("transaction_price"), avg_sqm=Avg("sqm")
+    )
+    rental_stats = MergedRentalTransaction.objects.aggregate(
+        total=Count("id"), avg_rent=Avg("annual_amount")
+    )
+    summary, _ = MarketSummary.objects.update_or_create(
+        pk=SUMMARY_PK,
+        defaults=dict(
+            total_areas=Area.objects.count(),
+            total_buildings=Building.objects.count(),
+            total_projects=Project.objects.count(),
+            total_transactions=transaction_stats["total"] or 0,
+            total_rental_transactions=rental_stats["total"] or 0,
+            avg_price=float(transaction_stats["avg_price"] or 0),
+            avg_rent=float(rental_stats["avg_rent"] or 0),
+            avg_sqm=float(transaction_stats["avg_sqm"] or 0),
+            # Упрощенные тренды (можно заменить на реальную логику)
+            price_trend="stable",  # placeholder
+            rent_trend="stable",  # placeholder
+            generated_at=timezone.now(),
+            duration_seconds=time.monotonic() - t0,
+        ),
+    )
+    logger.info("Market summary refreshed in %.1fs", summary.duration_seconds)
+    return summary
+
+
+def get_market_summary() -> MarketSummary:
+    """Текущий снимок; если его ещё нет (первый запуск) - считается сразу."""
+    summary = MarketSummary.objects.filter(pk=SUMMARY_PK).first()
+    if summary is None:
+        summary = refresh_market_summary()
+    return summary
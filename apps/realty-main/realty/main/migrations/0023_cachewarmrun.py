@@ -0,0 +1,70 @@
+# Generated by Django 5.1.7 on 2025-06-02 10:14
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0022_csvrentimport"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CacheWarmRun",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "started_at",
+                    models.DateTimeField(
+                        db_index=True, default=django.utils.timezone.now
+                    ),
+                ),
+                ("finished_at", models.DateTimeField(blank=True, null=True)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("running", "Running"),
+                            ("completed", "Completed"),
+                            ("failed", "Failed"),
+                        ],
+                        default="running",
+                        max_length=12,
+                    ),
+                ),
+                (
+                    "full",
+                    models.BooleanField(
+                        default=False, help_text="Full warm-up of all keys"
+                    ),
+                ),
+                (
+                    "changed_since",
+                    models.DateTimeField(
+                        blank=True,
+                        help_text="Transactions updated after this moment",
+                        null=True,
+                    ),
+                ),
+                ("workers", models.PositiveSmallIntegerField(default=1)),
+                ("total_keys", models.PositiveIntegerField(default=0)),
+                ("done_keys", models.PositiveIntegerField(default=0)),
+                ("failed_keys", models.PositiveIntegerField(default=0)),
+                ("duration_seconds", models.FloatField(blank=True, null=True)),
+                ("log", models.TextField(blank=True)),
+            ],
+            options={
+                "ordering": ("-started_at",),
+            },
+        ),
+    ]
@@ -0,0 +1,92 @@
+# Generated by Django 5.1.7 on 2025-06-04 12:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0023_cachewarmrun"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TransactionMonthlyRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("transaction_type", models.CharField(db_index=True, max_length=10)),
+                (
+                    "number_of_rooms",
+                    models.CharField(blank=True, max_length=255, null=True),
+                ),
+                ("year", models.PositiveSmallIntegerField()),
+                ("month", models.PositiveSmallIntegerField()),
+                ("deals_count", models.PositiveIntegerField(default=0)),
+                ("sum_price", models.FloatField(default=0)),
+                (
+                    "sum_price_sq",
+                    models.FloatField(default=0, help_text="Sum of squared prices"),
+                ),
+                ("sum_sqm", models.FloatField(default=0)),
+                ("min_price", models.FloatField(default=0)),
+                ("max_price", models.FloatField(default=0)),
+                (
+                    "price_sketch",
+                    models.BinaryField(
+                        blank=True,
+                        help_text="QuantileSketch of prices (sketch.py)",
+                        null=True,
+                    ),
+                ),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "area",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        to="main.area",
+                    ),
+                ),
+                (
+                    "building",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        to="main.building",
+                    ),
+                ),
+                (
+                    "project",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        to="main.project",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["transaction_type", "year", "month"],
+                        name="main_transa_transac_b6adf4_idx",
+                    ),
+                    models.Index(
+                        fields=["building", "year", "month"],
+                        name="main_transa_buildin_73a6d2_idx",
+                    ),
+                ],
+            },
+        ),
+    ]
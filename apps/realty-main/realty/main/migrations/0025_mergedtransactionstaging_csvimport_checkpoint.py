@@ -0,0 +1,91 @@
+# Generated by Django 5.1.7 on 2025-06-06 09:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0024_transactionmonthlyrollup"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MergedTransactionStaging",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "row_number",
+                    models.BigIntegerField(db_index=True, help_text="CSV row number"),
+                ),
+                ("building_id", models.BigIntegerField(blank=True, null=True)),
+                ("area_id", models.BigIntegerField(blank=True, null=True)),
+                ("date_of_transaction", models.DateField()),
+                (
+                    "building_name",
+                    models.CharField(blank=True, max_length=255, null=True),
+                ),
+                (
+                    "location_name",
+                    models.CharField(blank=True, max_length=255, null=True),
+                ),
+                (
+                    "number_of_rooms",
+                    models.CharField(blank=True, max_length=255, null=True),
+                ),
+                ("sqm", models.FloatField(blank=True, null=True)),
+                (
+                    "transaction_price",
+                    models.DecimalField(
+                        blank=True, decimal_places=2, max_digits=15, null=True
+                    ),
+                ),
+                (
+                    "meter_sale_price",
+                    models.DecimalField(
+                        blank=True, decimal_places=2, max_digits=15, null=True
+                    ),
+                ),
+                ("deal_year", models.PositiveIntegerField(blank=True, null=True)),
+                (
+                    "building_rooms_count",
+                    models.PositiveIntegerField(blank=True, null=True),
+                ),
+                (
+                    "same_rooms_count_in_building",
+                    models.PositiveIntegerField(blank=True, null=True),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name="csvimport",
+            name="checkpoint_offset",
+            field=models.BigIntegerField(
+                default=0, help_text="Byte offset in tr_*.csv already staged"
+            ),
+        ),
+        migrations.AddField(
+            model_name="csvimport",
+            name="checkpoint_rows",
+            field=models.BigIntegerField(
+                default=0, help_text="CSV rows already staged"
+            ),
+        ),
+        migrations.AddField(
+            model_name="csvimport",
+            name="source_size",
+            field=models.BigIntegerField(
+                blank=True,
+                help_text="Size of tr_*.csv the checkpoint refers to",
+                null=True,
+            ),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.7 on 2025-06-07 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0025_mergedtransactionstaging_csvimport_checkpoint"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="csvimport",
+            name="use_shadow_tables",
+            field=models.BooleanField(
+                default=True,
+                help_text="Load into a shadow table and swap it in after validation",
+            ),
+        ),
+        migrations.AddField(
+            model_name="csvrentimport",
+            name="use_shadow_tables",
+            field=models.BooleanField(
+                default=True,
+                help_text="Load into a shadow table and swap it in after validation",
+            ),
+        ),
+    ]
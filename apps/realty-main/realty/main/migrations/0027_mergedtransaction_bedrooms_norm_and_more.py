@@ -0,0 +1,41 @@
+# Generated by Django 5.1.7 on 2025-06-16 10:42
+
+import realty.main.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0026_csvimport_use_shadow_tables_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="mergedtransaction",
+            name="bedrooms_norm",
+            field=realty.main.models.BedroomsNormField(
+                blank=True,
+                db_index=True,
+                editable=False,
+                null=True,
+                source="number_of_rooms",
+            ),
+        ),
+        migrations.AddField(
+            model_name="mergedrentaltransaction",
+            name="bedrooms_norm",
+            field=realty.main.models.BedroomsNormField(
+                blank=True,
+                db_index=True,
+                editable=False,
+                null=True,
+                source="number_of_rooms",
+            ),
+        ),
+        migrations.AddField(
+            model_name="mergedtransactionstaging",
+            name="bedrooms_norm",
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+    ]
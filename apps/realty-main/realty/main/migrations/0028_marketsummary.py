@@ -0,0 +1,43 @@
+# Generated by Django 5.1.7 on 2025-06-18 09:40
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0027_mergedtransaction_bedrooms_norm_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MarketSummary",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("total_areas", models.PositiveIntegerField(default=0)),
+                ("total_buildings", models.PositiveIntegerField(default=0)),
+                ("total_projects", models.PositiveIntegerField(default=0)),
+                ("total_transactions", models.PositiveIntegerField(default=0)),
+                ("total_rental_transactions", models.PositiveIntegerField(default=0)),
+                ("avg_price", models.FloatField(default=0)),
+                ("avg_rent", models.FloatField(default=0)),
+                ("avg_sqm", models.FloatField(default=0)),
+                ("price_trend", models.CharField(default="stable", max_length=20)),
+                ("rent_trend", models.CharField(default="stable", max_length=20)),
+                (
+                    "generated_at",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                ("duration_seconds", models.FloatField(blank=True, null=True)),
+            ],
+        ),
+    ]
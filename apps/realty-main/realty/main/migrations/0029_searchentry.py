@@ -0,0 +1,167 @@
+# Generated by Django 5.1.7 on 2025-06-20 12:05
+
+from django.db import migrations, models
+
+from realty.main.search_index import normalize_search_text
+
+TABLE = "main_searchentry"
+
+POSTGRES_SQL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    f"CREATE INDEX {TABLE}_en_trgm ON {TABLE} USING gin (search_en gin_trgm_ops)",
+    f"CREATE INDEX {TABLE}_ar_trgm ON {TABLE} USING gin (search_ar gin_trgm_ops)",
+]
+POSTGRES_REVERSE_SQL = [
+    f"DROP INDEX IF EXISTS {TABLE}_en_trgm",
+    f"DROP INDEX IF EXISTS {TABLE}_ar_trgm",
+]
+
+# FTS5 с внешним содержимым: строки берутся из main_searchentry,
+# триггеры держат индекс в синхроне при INSERT / UPDATE / DELETE
+SQLITE_SQL = [
+    f"""CREATE VIRTUAL TABLE {TABLE}_fts USING fts5(
+        search_en, search_ar,
+        content='{TABLE}', content_rowid='id', tokenize='trigram'
+    )""",
+    f"""CREATE TRIGGER {TABLE}_fts_ai AFTER INSERT ON {TABLE} BEGIN
+        INSERT INTO {TABLE}_fts(rowid, search_en, search_ar)
+        VALUES (new.id, new.search_en, new.search_ar);
+    END""",
+    f"""CREATE TRIGGER {TABLE}_fts_ad AFTER DELETE ON {TABLE} BEGIN
+        INSERT INTO {TABLE}_fts({TABLE}_fts, rowid, search_en, search_ar)
+        VALUES ('delete', old.id, old.search_en, old.search_ar);
+    END""",
+    f"""CREATE TRIGGER {TABLE}_fts_au AFTER UPDATE ON {TABLE} BEGIN
+        INSERT INTO {TABLE}_fts({TABLE}_fts, rowid, search_en, search_ar)
+        VALUES ('delete', old.id, old.search_en, old.search_ar);
+        INSERT INTO {TABLE}_fts(rowid, search_en, search_ar)
+        VALUES (new.id, new.search_en, new.search_ar);
+    END""",
+]
+SQLITE_REVERSE_SQL = [
+    f"DROP TRIGGER IF EXISTS {TABLE}_fts_ai",
+    f"DROP TRIGGER IF EXISTS {TABLE}_fts_ad",
+    f"DROP TRIGGER IF EXISTS {TABLE}_fts_au",
+    f"DROP TABLE IF EXISTS {TABLE}_fts",
+]
+
+
+def _sqlite_has_trigram(schema_editor) -> bool:
+    # токенайзер trigram - SQLite >= 3.34
+    return schema_editor.connection.Database.sqlite_version_info >= (3, 34, 0)
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        statements = POSTGRES_SQL
+    elif vendor == "sqlite" and _sqlite_has_trigram(schema_editor):
+        statements = SQLITE_SQL
+    else:
+        statements = []  # поиск работает через LIKE (search_index._LIKE_MATCHES)
+    for sql in statements:
+        schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        statements = POSTGRES_REVERSE_SQL
+    elif vendor == "sqlite":
+        statements = SQLITE_REVERSE_SQL
+    else:
+        statements = []
+    for sql in statements:
+        schema_editor.execute(sql)
+
+
+def fill_search_index(apps, schema_editor):
+    SearchEntry = apps.get_model("main", "SearchEntry")
+    sources = [
+        ("area", apps.get_model("main", "Area"), "name_en", "name_ar", None),
+        (
+            "building",
+            apps.get_model("main", "Building"),
+            "english_name",
+            "arabic_name",
+            "number",
+        ),
+        (
+            "project",
+            apps.get_model("main", "Project"),
+            "english_name",
+            "arabic_name",
+            "project_number",
+        ),
+    ]
+    entries = []
+    for entity_type, model, en_field, ar_field, number_field in sources:
+        fields = ["pk", en_field, ar_field] + ([number_field] if number_field else [])
+        for row in model.objects.values_list(*fields).iterator():
+            search_en = normalize_search_text(row[1])
+            search_ar = normalize_search_text(row[2])
+            if search_en or search_ar:
+                entries.append(
+                    SearchEntry(
+                        entity_type=entity_type,
+                        entity_id=row[0],
+                        name_en=row[1],
+                        name_ar=row[2],
+                        number=row[3] if number_field else None,
+                        search_en=search_en,
+                        search_ar=search_ar,
+                    )
+                )
+    SearchEntry.objects.bulk_create(entries, batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0028_marketsummary"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SearchEntry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "entity_type",
+                    models.CharField(
+                        choices=[
+                            ("area", "Area"),
+                            ("building", "Building"),
+                            ("project", "Project"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                ("entity_id", models.BigIntegerField()),
+                ("name_en", models.CharField(blank=True, max_length=255, null=True)),
+                ("name_ar", models.CharField(blank=True, max_length=255, null=True)),
+                ("number", models.CharField(blank=True, max_length=50, null=True)),
+                (
+                    "search_en",
+                    models.CharField(blank=True, default="", max_length=255),
+                ),
+                (
+                    "search_ar",
+                    models.CharField(blank=True, default="", max_length=255),
+                ),
+            ],
+            options={
+                "unique_together": {("entity_type", "entity_id")},
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+        migrations.RunPython(fill_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.1.7 on 2025-06-21 09:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("main", "0029_searchentry"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="cachewarmrun",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("requested", "Full warm requested"),
+                    ("running", "Running"),
+                    ("completed", "Completed"),
+                    ("failed", "Failed"),
+                ],
+                default="running",
+                max_length=12,
+            ),
+        ),
+    ]
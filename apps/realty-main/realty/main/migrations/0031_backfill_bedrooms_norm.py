@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2025-06-21 10:15
+
+from django.db import migrations
+
+from realty.main.models import backfill_bedrooms_norm
+
+
+def fill_bedrooms_norm(apps, schema_editor):
+    # отчёты и rollup фильтруют по bedrooms_norm - NULL у старых строк
+    # давал бы пустые результаты до ручного backfill_bedrooms_norm
+    for model_name in ("MergedTransaction", "MergedRentalTransaction"):
+        backfill_bedrooms_norm(apps.get_model("main", model_name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0030_alter_cachewarmrun_status"),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_bedrooms_norm, migrations.RunPython.noop),
+    ]
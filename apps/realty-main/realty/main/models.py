@@ -1,16 +1,22 @@
 # realty/main/models.py:
 import logging
 import os
+import re
+from collections import defaultdict
 from pathlib import Path
+from typing import Optional
 
 from django.core.management import call_command
 from django.db import models
+from django.db import transaction
+from django.db.models import Q
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django_lifecycle import AFTER_CREATE
 from django_lifecycle import hook
 from django_lifecycle import LifecycleModel
 from django_tasks import task
+from realty.main.data_generation import bump_data_generation
 
 
 import tempfile
@@ -30,6 +36,75 @@ class BaseModel(models.Model):
         abstract = True
 
 
+_DIGITS_RE = re.compile(r"\d+")
+
+
+def normalize_bedrooms(value) -> Optional[int]:
+    """
+    Комнатность числом: 'Studio' / 'studio' → 0; '1 B/R', '1', '1br' → 1 …
+    None, если распарсить не удалось ('PENTHOUSE', пусто).
+    """
+    if value is None:
+        return None
+    text = str(value).lower().strip()
+    if "studio" in text:
+        return 0
+    match = _DIGITS_RE.search(text)
+    return int(match.group()) if match else None
+
+
+class BedroomsNormField(models.PositiveSmallIntegerField):
+    """
+    Индексированная комнатность числом, считается из текстового поля source
+    (normalize_bedrooms) при save() и bulk_create. bulk_update / update()
+    и сырой SQL её не пересчитывают - см. команду backfill_bedrooms_norm.
+    """
+
+    def __init__(self, *args, source="number_of_rooms", **kwargs):
+        self.source = source
+        kwargs.setdefault("blank", True)
+        kwargs.setdefault("null", True)
+        kwargs.setdefault("db_index", True)
+        kwargs.setdefault("editable", False)
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs["source"] = self.source
+        return name, path, args, kwargs
+
+    def pre_save(self, model_instance, add):
+        value = normalize_bedrooms(getattr(model_instance, self.source))
+        setattr(model_instance, self.attname, value)
+        return value
+
+
+def backfill_bedrooms_norm(model) -> int:
+    """
+    Заполняет bedrooms_norm по текстовому полю: различных значений
+    комнатности единицы, поэтому по одному UPDATE на получившееся число.
+    Работает и с историческими моделями миграций.
+    """
+    source = model._meta.get_field("bedrooms_norm").source
+    values = model.objects.order_by().values_list(source, flat=True).distinct()
+    by_norm = defaultdict(list)
+    for value in values:
+        by_norm[normalize_bedrooms(value)].append(value)
+
+    updated = 0
+    with transaction.atomic():
+        for norm, group in by_norm.items():
+            condition = Q(**{f"{source}__in": [v for v in group if v]})
+            if None in group or "" in group:
+                condition |= Q(**{f"{source}__isnull": True}) | Q(**{source: ""})
+            updated += (
+                model.objects.filter(condition)
+                .exclude(bedrooms_norm=norm)
+                .update(bedrooms_norm=norm)
+            )
+    return updated
+
+
 class MasterProject(BaseModel):
     english_name = models.CharField(max_length=255, unique=True, db_index=True)
     arabic_name = models.CharField(max_length=255, blank=True, null=True)
@@ -232,6 +307,7 @@ class MergedTransaction(BaseModel):
     number_of_rooms = models.CharField(
         max_length=255, blank=True, null=True, db_index=True
     )
+    bedrooms_norm = BedroomsNormField()
     sqm = models.FloatField(
         blank=True,
         null=True,
@@ -310,6 +386,7 @@ class MergedRentalTransaction(BaseModel):
     number_of_rooms = models.CharField(
         max_length=255, blank=True, null=True, db_index=True
     )
+    bedrooms_norm = BedroomsNormField()
     sqm = models.FloatField(
         blank=True,
         null=True,
@@ -429,9 +506,86 @@ class MergedRentalTransaction(BaseModel):
         return f"Rental {self.contract_id} [{self.date_of_transaction}]"
 
 
+class TransactionMonthlyRollup(models.Model):
+    """
+    Помесячные агрегаты сделок (sales из MergedTransaction, rental из
+    MergedRentalTransaction) в разрезе building × area × project × rooms.
+    Цена NULL считается как 0 (как в stats.py).
+
+    Пересчитывается через realty.main.rollups.rebuild_rollups после импортов;
+    периоды из целых месяцев считаются по этим строкам, а не по сделкам.
+    """
+
+    transaction_type = models.CharField(max_length=10, db_index=True)
+    building = models.ForeignKey(
+        Building, on_delete=models.SET_NULL, null=True, blank=True
+    )
+    # area - из самой сделки (area_id), project - проект здания
+    area = models.ForeignKey(Area, on_delete=models.SET_NULL, null=True, blank=True)
+    project = models.ForeignKey(
+        Project, on_delete=models.SET_NULL, null=True, blank=True
+    )
+    number_of_rooms = models.CharField(max_length=255, blank=True, null=True)
+    year = models.PositiveSmallIntegerField()
+    month = models.PositiveSmallIntegerField()
+
+    deals_count = models.PositiveIntegerField(default=0)
+    sum_price = models.FloatField(default=0)
+    sum_price_sq = models.FloatField(default=0, help_text="Sum of squared prices")
+    sum_sqm = models.FloatField(default=0)
+    min_price = models.FloatField(default=0)
+    max_price = models.FloatField(default=0)
+    price_sketch = models.BinaryField(
+        blank=True, null=True, help_text="QuantileSketch of prices (sketch.py)"
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["transaction_type", "year", "month"]),
+            models.Index(fields=["building", "year", "month"]),
+        ]
+
+    def __str__(self):
+        return (
+            f"{self.transaction_type} {self.building_id}/{self.number_of_rooms} "
+            f"{self.year}-{self.month:02d}: {self.deals_count}"
+        )
+
+
 # --- Импорт данных и служебные модели ---
 
 
+class MergedTransactionStaging(models.Model):
+    """
+    Staging для потоковой загрузки tr_*.csv (realty.main.transactions_loader).
+    Строки пишутся пачками (COPY / executemany), затем одной транзакцией
+    переносятся в MergedTransaction. FK хранятся как числа, без ограничений.
+    """
+
+    row_number = models.BigIntegerField(db_index=True, help_text="CSV row number")
+    building_id = models.BigIntegerField(blank=True, null=True)
+    area_id = models.BigIntegerField(blank=True, null=True)
+    date_of_transaction = models.DateField()
+    building_name = models.CharField(max_length=255, blank=True, null=True)
+    location_name = models.CharField(max_length=255, blank=True, null=True)
+    number_of_rooms = models.CharField(max_length=255, blank=True, null=True)
+    bedrooms_norm = models.PositiveSmallIntegerField(blank=True, null=True)
+    sqm = models.FloatField(blank=True, null=True)
+    transaction_price = models.DecimalField(
+        max_digits=15, decimal_places=2, blank=True, null=True
+    )
+    meter_sale_price = models.DecimalField(
+        max_digits=15, decimal_places=2, blank=True, null=True
+    )
+    deal_year = models.PositiveIntegerField(blank=True, null=True)
+    building_rooms_count = models.PositiveIntegerField(blank=True, null=True)
+    same_rooms_count_in_building = models.PositiveIntegerField(blank=True, null=True)
+
+    def __str__(self):
+        return f"Staged row {self.row_number} [{self.date_of_transaction}]"
+
+
 class CsvImport(LifecycleModel):
     """
     Импорт данных из двух CSV-файлов, задаваемых URL-ами.
@@ -454,6 +608,22 @@ class CsvImport(LifecycleModel):
     status = models.CharField(max_length=12, choices=STATUS_CHOICES, default="created")
     log = models.TextField(blank=True)
 
+    # checkpoint загрузки tr_*.csv: после падения populate_db_2 продолжает
+    # с этого места (если размер файла тот же)
+    checkpoint_offset = models.BigIntegerField(
+        default=0, help_text="Byte offset in tr_*.csv already staged"
+    )
+    checkpoint_rows = models.BigIntegerField(
+        default=0, help_text="CSV rows already staged"
+    )
+    source_size = models.BigIntegerField(
+        blank=True, null=True, help_text="Size of tr_*.csv the checkpoint refers to"
+    )
+    use_shadow_tables = models.BooleanField(
+        default=True,
+        help_text="Load into a shadow table and swap it in after validation",
+    )
+
     class Meta:
         ordering = ("-created_at",)
 
@@ -486,11 +656,12 @@ def run_csv_import(import_id: int):
     imp.save()
 
     def _download(url: str) -> Path:
-        r = requests.get(url, timeout=30)
-        r.raise_for_status()
-        tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".csv")
-        tmp.write(r.content)
-        tmp.close()
+        # tr_*.csv - несколько ГБ, в память целиком не читаем
+        with requests.get(url, timeout=30, stream=True) as r:
+            r.raise_for_status()
+            with tempfile.NamedTemporaryFile(delete=False, suffix=".csv") as tmp:
+                for chunk in r.iter_content(chunk_size=1024 * 1024):
+                    tmp.write(chunk)
         return Path(tmp.name)
 
     tmp_giper = tmp_tr = None
@@ -504,7 +675,10 @@ def run_csv_import(import_id: int):
             f"--giper_csv={tmp_giper}",
             f"--transactions_csv={tmp_tr}",
             f"--chunk-size={imp.chunk_size}",
+            f"--import-id={imp.pk}",
         ]
+        if imp.use_shadow_tables:
+            cmd_args.append("--shadow")
         imp.log += f"Calling: python manage.py {' '.join(cmd_args)}\n"
         call_command(*cmd_args)
 
@@ -519,7 +693,11 @@ def run_csv_import(import_id: int):
             if p and p.exists():
                 p.unlink(missing_ok=True)
         imp.finished_at = timezone.now()
-        imp.save()
+        # checkpoint_* пишет populate_db_2 - не затираем их старыми значениями
+        imp.save(update_fields=("status", "log", "finished_at"))
+        if imp.status == "failed":
+            # без shadow-таблиц часть сделок могла уже записаться
+            bump_data_generation("sales")
 
 
 @task()
@@ -559,8 +737,12 @@ def run_csv_rent_import(import_id: int):
             "populate_db_rents",
             str(tmp_file),
             f"--start-line={imp.start_line}",
-            "--clean-first",
         ]
+        # blue/green только для полной перезаливки (с первой строки)
+        if imp.use_shadow_tables and imp.start_line <= 1:
+            cmd.append("--shadow")
+        else:
+            cmd.append("--clean-first")
         imp.log += f"Calling: python manage.py {' '.join(cmd)}\n"
         call_command(*cmd)
 
@@ -573,6 +755,9 @@ def run_csv_rent_import(import_id: int):
             tmp_file.unlink(missing_ok=True)
         imp.finished_at, imp.log = timezone.now(), imp.log + msg
         imp.save()
+        if imp.status == "failed":
+            # без shadow-таблиц часть сделок могла уже записаться
+            bump_data_generation("rental")
         gc.collect()  # на всякий случай
 
 
@@ -584,6 +769,10 @@ class CsvRentImport(LifecycleModel):
 
     rents_csv_url = models.URLField("URL CSV-файла аренды")
     start_line = models.PositiveIntegerField(default=1)
+    use_shadow_tables = models.BooleanField(
+        default=True,
+        help_text="Load into a shadow table and swap it in after validation",
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     started_at = models.DateTimeField(blank=True, null=True)
     finished_at = models.DateTimeField(blank=True, null=True)
@@ -694,3 +883,93 @@ class SearchTransactionsLog(models.Model):
 
     def __str__(self):
         return f"SearchLog {self.id} at {self.requested_at}"
+
+
+class CacheWarmRun(models.Model):
+    """
+    Журнал прогрева кэша статистики (realty.main.cache_warmer.warm_cache).
+    started_at последнего успешного запуска - точка отсчёта для следующего:
+    пересчитываются только здания/районы с новыми сделками. Строка "requested"
+    - заявка на полный прогрев после удаления / подмены таблицы сделок.
+    """
+
+    STATUS_CHOICES = [
+        ("requested", "Full warm requested"),
+        ("running", "Running"),
+        ("completed", "Completed"),
+        ("failed", "Failed"),
+    ]
+
+    started_at = models.DateTimeField(default=timezone.now, db_index=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    status = models.CharField(max_length=12, choices=STATUS_CHOICES, default="running")
+    full = models.BooleanField(default=False, help_text="Full warm-up of all keys")
+    changed_since = models.DateTimeField(
+        blank=True, null=True, help_text="Transactions updated after this moment"
+    )
+    workers = models.PositiveSmallIntegerField(default=1)
+    total_keys = models.PositiveIntegerField(default=0)
+    done_keys = models.PositiveIntegerField(default=0)
+    failed_keys = models.PositiveIntegerField(default=0)
+    duration_seconds = models.FloatField(blank=True, null=True)
+    log = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ("-started_at",)
+
+    def __str__(self):
+        return f"Cache warm #{self.pk} ({self.status}, {self.done_keys}/{self.total_keys})"
+
+
+class MarketSummary(models.Model):
+    """
+    Снимок общей статистики рынка для Query.market_overview: счётчики и
+    средние по всем сделкам считаются здесь один раз (после импортов и по
+    расписанию, см. realty.main.market_summary), а не на каждый запрос.
+    Хранится одна строка; generated_at - насколько свежи цифры.
+    """
+
+    total_areas = models.PositiveIntegerField(default=0)
+    total_buildings = models.PositiveIntegerField(default=0)
+    total_projects = models.PositiveIntegerField(default=0)
+    total_transactions = models.PositiveIntegerField(default=0)
+    total_rental_transactions = models.PositiveIntegerField(default=0)
+    avg_price = models.FloatField(default=0)
+    avg_rent = models.FloatField(default=0)
+    avg_sqm = models.FloatField(default=0)
+    price_trend = models.CharField(max_length=20, default="stable")
+    rent_trend = models.CharField(max_length=20, default="stable")
+    generated_at = models.DateTimeField(default=timezone.now)
+    duration_seconds = models.FloatField(blank=True, null=True)
+
+    def __str__(self):
+        return f"Market summary at {self.generated_at:%Y-%m-%d %H:%M}"
+
+
+class SearchEntry(models.Model):
+    """
+    Индекс автокомплита: по строке на Area / Building / Project с
+    нормализованными названиями (search_en / search_ar) и полями для показа.
+    Поверх таблицы - GIN pg_trgm (PostgreSQL) или FTS5 trigram (SQLite),
+    создаются миграцией. Заполняется realty.main.search_index.rebuild_search_index.
+    """
+
+    ENTITY_CHOICES = [
+        ("area", "Area"),
+        ("building", "Building"),
+        ("project", "Project"),
+    ]
+
+    entity_type = models.CharField(max_length=10, choices=ENTITY_CHOICES)
+    entity_id = models.BigIntegerField()
+    name_en = models.CharField(max_length=255, blank=True, null=True)
+    name_ar = models.CharField(max_length=255, blank=True, null=True)
+    number = models.CharField(max_length=50, blank=True, null=True)
+    search_en = models.CharField(max_length=255, blank=True, default="")
+    search_ar = models.CharField(max_length=255, blank=True, default="")
+
+    class Meta:
+        unique_together = ("entity_type", "entity_id")
+
+    def __str__(self):
+        return f"{self.entity_type} {self.entity_id}: {self.name_en or self.name_ar}"
@@ -0,0 +1,306 @@
+"""
+Помесячные агрегаты сделок (TransactionMonthlyRollup).
+
+rebuild_rollups пересчитывает строки для выбранных месяцев из сырых сделок
+(один потоковый проход на месяц); импорты вызывают его для затронутых месяцев.
+
+aggregate_periods_with_rollups отвечает на запрос за период так:
+целые месяцы - сумма строк rollup, неполные месяцы по краям периода -
+обычный aggregator.aggregate_periods по сделкам. Медиана - слияние
+QuantileSketch (погрешность <= 1%, см. sketch.py).
+"""
+
+import datetime
+import logging
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.db.models import Max
+from django.db.models import Min
+from django.db.models import Q
+from django.db.models import Sum
+from django.db.models.functions import ExtractMonth
+from django.db.models.functions import ExtractYear
+
+from .aggregator import aggregate_periods
+from .models import TransactionMonthlyRollup
+from .sketch import merge_serialized
+from .sketch import QuantileSketch
+from .utils import _apply_search_filters
+from .utils import _search_filter_q
+from .utils import _transactions_queryset
+from .utils import ResolvedEntity
+
+logger = logging.getLogger(__name__)
+
+YearMonth = Tuple[int, int]
+
+BULK_BATCH_SIZE = 1000
+
+
+def _month_bounds(yy: int, mm: int) -> Tuple[datetime.date, datetime.date]:
+    """Первый день месяца и первый день следующего."""
+    start = datetime.date(yy, mm, 1)
+    if mm == 12:
+        return start, datetime.date(yy + 1, 1, 1)
+    return start, datetime.date(yy, mm + 1, 1)
+
+
+def transaction_months(qs) -> List[YearMonth]:
+    """Все (year, month), в которых есть сделки qs."""
+    return sorted(
+        qs.annotate(
+            _year=ExtractYear("date_of_transaction"),
+            _month=ExtractMonth("date_of_transaction"),
+        )
+        .order_by()
+        .values_list("_year", "_month")
+        .distinct()
+    )
+
+
+def _rebuild_month(transaction_type: str, yy: int, mm: int) -> int:
+    start, next_start = _month_bounds(yy, mm)
+    rows = (
+        _transactions_queryset(transaction_type)
+        .filter(date_of_transaction__gte=start, date_of_transaction__lt=next_start)
+        .order_by()
+        .values_list(
+            "building_id",
+            "area_id",
+            "building__project_id",
+            "number_of_rooms",
+            "transaction_price",
+            "sqm",
+        )
+    )
+
+    # key -> [count, sum_price, sum_price_sq, sum_sqm, min, max, sketch]
+    groups: Dict[tuple, list] = {}
+    for b_id, a_id, p_id, rooms, price, sqm in rows.iterator(chunk_size=5000):
+        price = float(price or 0)  # NULL как 0 - так же, как в stats.py
+        key = (b_id, a_id, p_id, rooms)
+        acc = groups.get(key)
+        if acc is None:
+            acc = groups[key] = [0, 0.0, 0.0, 0.0, price, price, QuantileSketch()]
+        acc[0] += 1
+        acc[1] += price
+        acc[2] += price * price
+        acc[3] += float(sqm or 0)
+        acc[4] = min(acc[4], price)
+        acc[5] = max(acc[5], price)
+        acc[6].add(price)
+
+    objs = [
+        TransactionMonthlyRollup(
+            transaction_type=transaction_type,
+            building_id=b_id,
+            area_id=a_id,
+            project_id=p_id,
+            number_of_rooms=rooms,
+            year=yy,
+            month=mm,
+            deals_count=acc[0],
+            sum_price=acc[1],
+            sum_price_sq=acc[2],
+            sum_sqm=acc[3],
+            min_price=acc[4],
+            max_price=acc[5],
+            price_sketch=acc[6].to_bytes(),
+        )
+        for (b_id, a_id, p_id, rooms), acc in groups.items()
+    ]
+    with transaction.atomic():
+        TransactionMonthlyRollup.objects.filter(
+            transaction_type=transaction_type, year=yy, month=mm
+        ).delete()
+        TransactionMonthlyRollup.objects.bulk_create(objs, batch_size=BULK_BATCH_SIZE)
+    return len(objs)
+
+
+def rebuild_rollups(
+    transaction_type: str, months: Optional[Iterable[YearMonth]] = None
+) -> int:
+    """
+    Пересчитывает rollup для transaction_type ("sales" / "rental").
+    months=None - полный пересчёт (включая удаление месяцев, где сделок больше нет).
+    Возвращает число записанных строк.
+    """
+    if months is None:
+        months = transaction_months(_transactions_queryset(transaction_type))
+        # месяцы, где сделок больше нет, удаляем целиком
+        existing = set(
+            TransactionMonthlyRollup.objects.filter(transaction_type=transaction_type)
+            .order_by()
+            .values_list("year", "month")
+            .distinct()
+        )
+        for yy, mm in existing - set(months):
+            TransactionMonthlyRollup.objects.filter(
+                transaction_type=transaction_type, year=yy, month=mm
+            ).delete()
+
+    total = 0
+    for yy, mm in sorted(set(months)):
+        total += _rebuild_month(transaction_type, yy, mm)
+    logger.info("Rebuilt %s %s rollup rows", total, transaction_type)
+    return total
+
+
+def rollups_enabled(transaction_type: str) -> bool:
+    """Считать ли статистику по rollup (настройка + rollup уже построены)."""
+    return (
+        getattr(settings, "STATS_USE_ROLLUPS", False)
+        and TransactionMonthlyRollup.objects.filter(
+            transaction_type=transaction_type
+        ).exists()
+    )
+
+
+def build_querysets(
+    transaction_type: str,
+    search_substring: Optional[str],
+    property_components: Optional[List[str]],
+    entity: Optional[ResolvedEntity] = None,
+):
+    """
+    (сделки, rollup) с одинаковыми фильтрами поиска - поиск делается один раз
+    (или не делается вовсе, если передан уже разрешённый entity).
+    """
+    search_q = _search_filter_q(search_substring, entity)
+    qs = _apply_search_filters(
+        _transactions_queryset(transaction_type), search_q, property_components
+    )
+    rollup_qs = _apply_search_filters(
+        TransactionMonthlyRollup.objects.filter(transaction_type=transaction_type),
+        search_q,
+        property_components,
+    )
+    return qs, rollup_qs
+
+
+def split_period(start: datetime.date, end: datetime.date):
+    """
+    [start, end] -> (первый и последний целый месяц или None, неполные края).
+    Края - список диапазонов дат (включительно), которые считаем по сделкам.
+    """
+    one_day = datetime.timedelta(days=1)
+    first_full = start if start.day == 1 else _month_bounds(start.year, start.month)[1]
+    if (end + one_day).day == 1:
+        last_full_end = end
+    else:
+        last_full_end = datetime.date(end.year, end.month, 1) - one_day
+    if first_full > last_full_end:
+        return None, [(start, end)]
+
+    edges = []
+    if start < first_full:
+        edges.append((start, first_full - one_day))
+    if last_full_end < end:
+        edges.append((last_full_end + one_day, end))
+    months = (
+        (first_full.year, first_full.month),
+        (last_full_end.year, last_full_end.month),
+    )
+    return months, edges
+
+
+def _months_q(first: YearMonth, last: YearMonth) -> Q:
+    (y0, m0), (y1, m1) = first, last
+    return (Q(year__gt=y0) | Q(year=y0, month__gte=m0)) & (
+        Q(year__lt=y1) | Q(year=y1, month__lte=m1)
+    )
+
+
+def aggregate_periods_with_rollups(
+    qs, rollup_qs, periods: Dict[str, tuple]
+) -> Dict[str, dict]:
+    """
+    То же, что aggregator.aggregate_periods (тот же формат periods и
+    результата), но целые месяцы берутся из rollup_qs.
+    Доп. Q в periods должен ссылаться на поля, общие для сделок и rollup
+    (area_id, building_id, number_of_rooms, building__*).
+    """
+    month_filters = {}
+    edge_periods = {}
+    for key, (start, end, *extra) in periods.items():
+        extra_q = extra[0] if extra and extra[0] is not None else Q()
+        months, edges = split_period(start, end)
+        if months:
+            month_filters[key] = _months_q(*months) & extra_q
+        for i, (e_start, e_end) in enumerate(edges):
+            edge_periods[f"{key}__edge{i}"] = (e_start, e_end, extra_q)
+
+    rollup_agg = {}
+    if month_filters:
+        aggregates = {}
+        for key, q in month_filters.items():
+            aggregates[f"{key}__count"] = Sum("deals_count", filter=q)
+            aggregates[f"{key}__sum_price"] = Sum("sum_price", filter=q)
+            aggregates[f"{key}__sum_sqm"] = Sum("sum_sqm", filter=q)
+            aggregates[f"{key}__min_price"] = Min("min_price", filter=q)
+            aggregates[f"{key}__max_price"] = Max("max_price", filter=q)
+            aggregates[f"{key}__rows"] = Count("pk", filter=q)
+        rollup_agg = rollup_qs.aggregate(**aggregates)
+    edge_metrics = (
+        aggregate_periods(qs, edge_periods, with_median=False) if edge_periods else {}
+    )
+
+    result = {}
+    for key in periods:
+        count = 0
+        sum_price = 0.0
+        sum_sqm = 0.0
+        mins, maxs = [], []
+        sketch = QuantileSketch()
+
+        if key in month_filters and rollup_agg.get(f"{key}__rows"):
+            count += rollup_agg[f"{key}__count"] or 0
+            sum_price += rollup_agg[f"{key}__sum_price"] or 0.0
+            sum_sqm += rollup_agg[f"{key}__sum_sqm"] or 0.0
+            mins.append(rollup_agg[f"{key}__min_price"] or 0.0)
+            maxs.append(rollup_agg[f"{key}__max_price"] or 0.0)
+            sketch.merge(
+                merge_serialized(
+                    rollup_qs.filter(month_filters[key]).values_list(
+                        "price_sketch", flat=True
+                    )
+                )
+            )
+
+        for edge_key, (e_start, e_end, extra_q) in edge_periods.items():
+            if not edge_key.startswith(f"{key}__edge"):
+                continue
+            edge = edge_metrics[edge_key]
+            if not edge["count"]:
+                continue
+            count += edge["count"]
+            sum_price += edge["sum_price"]
+            sum_sqm += edge["sum_sqm"]
+            mins.append(edge["min_price"])
+            maxs.append(edge["max_price"])
+            sketch.update(
+                qs.filter(
+                    extra_q,
+                    date_of_transaction__gte=e_start,
+                    date_of_transaction__lte=e_end,
+                ).values_list("transaction_price", flat=True)
+            )
+
+        result[key] = {
+            "count": count,
+            "sum_price": sum_price,
+            "avg_price": sum_price / count if count else 0.0,
+            "median": sketch.quantile(0.5),
+            "sum_sqm": sum_sqm,
+            "avg_area": sum_sqm / count if count else 0.0,
+            "min_price": min(mins) if mins else 0.0,
+            "max_price": max(maxs) if maxs else 0.0,
+        }
+    return result
@@ -1,11 +1,98 @@
+"""
+GraphQL-схема аналитики (strawberry).
+
+Резолверы асинхронные: связи (building/area/project) грузятся через
+DataLoader'ы, общие на запрос (get_loaders), поэтому список из N сделок
+даёт по одному запросу на каждую связь, а не N. Схему нужно исполнять
+асинхронно (strawberry.django.views.AsyncGraphQLView / schema.execute).
+
+Списки отдаются страницами по курсору (first/after, keyset по pk),
+глубина и «стоимость» запроса ограничены (GRAPHQL_MAX_DEPTH,
+GRAPHQL_MAX_COST). Аналитика считается сгруппированными агрегатами сразу
+по всем id (analytics(ids: [...])) - число запросов не зависит от числа id.
+"""
+
+import base64
+import binascii
+import datetime
+from typing import Dict, Generic, List, Optional, TypeVar
+
 import strawberry
-from strawberry_django import auto
-from typing import List, Optional
-from django.db.models import Avg, Count, Sum, Min, Max
-from .models import Area, Building, Project, MergedTransaction, MergedRentalTransaction
+import strawberry_django
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Avg, Case, Count, IntegerField, Value, When
+from graphql import GraphQLError
+from graphql.language import FieldNode, FragmentSpreadNode, IntValueNode
+from graphql.language import InlineFragmentNode, ListValueNode, VariableNode
+from graphql.validation import ValidationRule
+from strawberry.dataloader import DataLoader
+from strawberry.extensions import AddValidationRules, QueryDepthLimiter
+from strawberry.types import Info
+from strawberry import auto
+
+from realty.reports.models import _PERIOD_TO_DAYS
+
+from .market_summary import get_market_summary
+from .models import Area, Building, MergedRentalTransaction, MergedTransaction, Project
+from .search_index import search_entities
+from .types import (
+    AreaSuggestion,
+    AutocompleteResult,
+    BuildingSuggestion,
+    ProjectSuggestion,
+)
+
+MAX_DEPTH = getattr(settings, "GRAPHQL_MAX_DEPTH", 8)
+MAX_COST = getattr(settings, "GRAPHQL_MAX_COST", 20000)
+MAX_PAGE_SIZE = getattr(settings, "GRAPHQL_MAX_PAGE_SIZE", 200)
+MAX_ANALYTICS_IDS = getattr(settings, "GRAPHQL_MAX_ANALYTICS_IDS", 100)
+DEFAULT_PAGE_SIZE = 50
+
+# Поля-страницы: без first считаем, что вернётся DEFAULT_PAGE_SIZE строк
+PAGINATED_FIELDS = {"transactions", "rentalTransactions", "buildings", "projects"}
+
+
+# --- DataLoader'ы ------------------------------------------------------------
+
+
+def _model_loader(model) -> DataLoader:
+    """DataLoader объектов model по pk: один in_bulk на пачку ключей."""
+
+    async def load(keys):
+        objects = await sync_to_async(model.objects.in_bulk)(list(set(keys)))
+        return [objects.get(key) for key in keys]
+
+    return DataLoader(load_fn=load)
+
+
+class Loaders:
+    def __init__(self):
+        self.area = _model_loader(Area)
+        self.building = _model_loader(Building)
+        self.project = _model_loader(Project)
+
+
+def get_loaders(info: Info) -> Loaders:
+    """Loaders текущего запроса (создаются при первом обращении)."""
+    context = info.context
+    if isinstance(context, dict):
+        return context.setdefault("loaders", Loaders())
+    loaders = getattr(context, "loaders", None)
+    if loaders is None:
+        loaders = Loaders()
+        context.loaders = loaders
+    return loaders
 
 
-@strawberry.django.type(Area)
+async def _load(loader: DataLoader, pk):
+    return await loader.load(pk) if pk is not None else None
+
+
+# --- Типы --------------------------------------------------------------------
+
+
+@strawberry_django.type(Area)
 class AreaType:
     id: auto
     name_en: auto
@@ -13,18 +100,7 @@ class AreaType:
     area_idx: auto
 
 
-@strawberry.django.type(Building)
-class BuildingType:
-    id: auto
-    english_name: auto
-    arabic_name: auto
-    latitude: auto
-    longitude: auto
-    area: AreaType
-    project: auto
-
-
-@strawberry.django.type(Project)
+@strawberry_django.type(Project)
 class ProjectType:
     id: auto
     english_name: auto
@@ -35,30 +111,84 @@ class ProjectType:
     developer: auto
 
 
-@strawberry.django.type(MergedTransaction)
+@strawberry_django.type(Building)
+class BuildingType:
+    id: auto
+    english_name: auto
+    arabic_name: auto
+    latitude: auto
+    longitude: auto
+
+    @strawberry.field
+    async def area(self, info: Info) -> Optional[AreaType]:
+        return await _load(get_loaders(info).area, self.area_id)
+
+    @strawberry.field
+    async def project(self, info: Info) -> Optional[ProjectType]:
+        return await _load(get_loaders(info).project, self.project_id)
+
+
+@strawberry_django.type(MergedTransaction)
 class TransactionType:
     id: auto
-    contract_amount: auto
-    contract_date: auto
-    building: BuildingType
-    project: ProjectType
-    area: AreaType
+    transaction_price: auto
+    date_of_transaction: auto
     number_of_rooms: auto
     sqm: auto
     meter_sale_price: auto
 
+    @strawberry.field
+    async def building(self, info: Info) -> Optional[BuildingType]:
+        return await _load(get_loaders(info).building, self.building_id)
+
+    @strawberry.field
+    async def project(self, info: Info) -> Optional[ProjectType]:
+        # у продаж нет своего project - берём проект здания
+        building = await _load(get_loaders(info).building, self.building_id)
+        if building is None:
+            return None
+        return await _load(get_loaders(info).project, building.project_id)
 
-@strawberry.django.type(MergedRentalTransaction)
+    @strawberry.field
+    async def area(self, info: Info) -> Optional[AreaType]:
+        return await _load(get_loaders(info).area, self.area_id)
+
+
+@strawberry_django.type(MergedRentalTransaction)
 class RentalTransactionType:
     id: auto
     annual_amount: auto
     contract_start_date: auto
-    building: BuildingType
-    project: ProjectType
-    area: AreaType
     number_of_rooms: auto
     sqm: auto
 
+    @strawberry.field
+    async def building(self, info: Info) -> Optional[BuildingType]:
+        return await _load(get_loaders(info).building, self.building_id)
+
+    @strawberry.field
+    async def project(self, info: Info) -> Optional[ProjectType]:
+        return await _load(get_loaders(info).project, self.project_id)
+
+    @strawberry.field
+    async def area(self, info: Info) -> Optional[AreaType]:
+        return await _load(get_loaders(info).area, self.area_id)
+
+
+T = TypeVar("T")
+
+
+@strawberry.type
+class PageInfo:
+    has_next_page: bool
+    end_cursor: Optional[str]
+
+
+@strawberry.type
+class Page(Generic[T]):
+    items: List[T]
+    page_info: PageInfo
+
 
 @strawberry.type
 class AreaAnalytics:
@@ -108,174 +238,354 @@ class MarketOverview:
     avg_sqm: float
     price_trend: str
     rent_trend: str
+    generated_at: datetime.datetime
+
+
+# --- Пагинация ---------------------------------------------------------------
+
+
+def _encode_cursor(pk: int) -> str:
+    return base64.urlsafe_b64encode(f"pk:{pk}".encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> int:
+    try:
+        prefix, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split(":")
+        if prefix != "pk":
+            raise ValueError(prefix)
+        return int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise GraphQLError(f"Invalid cursor: {cursor!r}") from None
+
+
+def _page_size(first: Optional[int]) -> int:
+    if first is None:
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(first, MAX_PAGE_SIZE))
+
+
+async def _paginate(queryset, first: Optional[int], after: Optional[str]) -> Page:
+    """Keyset-страница по pk: first+1 строка, чтобы узнать has_next_page."""
+    size = _page_size(first)
+    if after:
+        queryset = queryset.filter(pk__gt=_decode_cursor(after))
+    rows = await sync_to_async(list)(queryset.order_by("pk")[: size + 1])
+    items = rows[:size]
+    return Page(
+        items=items,
+        page_info=PageInfo(
+            has_next_page=len(rows) > size,
+            end_cursor=_encode_cursor(items[-1].pk) if items else None,
+        ),
+    )
+
+
+# --- Аналитика (сгруппированные агрегаты) -------------------------------------
+
+# средняя «экспозиция» сделки в днях по полю period
+_EXPOSURE_DAYS = Case(
+    *[When(period=p, then=Value(days)) for p, days in _PERIOD_TO_DAYS.items()],
+    output_field=IntegerField(),
+)
+
+
+def _grouped(queryset, key: str, **aggregates) -> Dict[int, dict]:
+    """Агрегаты queryset по значению key одним запросом: {key: row}."""
+    rows = queryset.order_by().values(key).annotate(**aggregates)
+    return {row[key]: row for row in rows}
+
+
+def _sales_rent_stats(key: str, ids: List[int], **extra):
+    sales = _grouped(
+        MergedTransaction.objects.filter(**{f"{key}__in": ids}),
+        key,
+        total=Count("id"),
+        avg_price=Avg("transaction_price"),
+        avg_sqm=Avg("sqm"),
+        **extra,
+    )
+    rents = _grouped(
+        MergedRentalTransaction.objects.filter(**{f"{key}__in": ids}),
+        key,
+        total=Count("id"),
+        avg_rent=Avg("annual_amount"),
+    )
+    return sales, rents
+
+
+def _ordered(objects: dict, ids: List[int]) -> list:
+    """Объекты в порядке ids, без дублей и отсутствующих."""
+    return [objects[pk] for pk in dict.fromkeys(ids) if pk in objects]
+
+
+def _area_analytics(ids: List[int]) -> List[AreaAnalytics]:
+    areas = _ordered(Area.objects.in_bulk(ids), ids)
+    sales, rents = _sales_rent_stats("building__area", ids)
+    counts = _grouped(
+        Building.objects.filter(area_id__in=ids),
+        "area",
+        buildings=Count("id"),
+        projects=Count("project", distinct=True),
+    )
+    result = []
+    for area in areas:
+        s, r = sales.get(area.pk, {}), rents.get(area.pk, {})
+        c = counts.get(area.pk, {})
+        result.append(
+            AreaAnalytics(
+                area=area,
+                total_transactions=s.get("total") or 0,
+                total_rental_transactions=r.get("total") or 0,
+                avg_price=float(s.get("avg_price") or 0),
+                avg_rent=float(r.get("avg_rent") or 0),
+                avg_sqm=float(s.get("avg_sqm") or 0),
+                building_count=c.get("buildings") or 0,
+                project_count=c.get("projects") or 0,
+            )
+        )
+    return result
+
+
+def _building_analytics(ids: List[int]) -> List[BuildingAnalytics]:
+    buildings = _ordered(Building.objects.in_bulk(ids), ids)
+    sales, rents = _sales_rent_stats("building", ids, avg_days=Avg(_EXPOSURE_DAYS))
+    result = []
+    for building in buildings:
+        s, r = sales.get(building.pk, {}), rents.get(building.pk, {})
+        # Расчет ROI (упрощенный)
+        avg_price = s.get("avg_price") or 0
+        avg_rent = r.get("avg_rent") or 0
+        roi = (avg_rent * 12 / float(avg_price) * 100) if avg_price > 0 else 0
+        result.append(
+            BuildingAnalytics(
+                building=building,
+                total_transactions=s.get("total") or 0,
+                total_rental_transactions=r.get("total") or 0,
+                avg_price=float(avg_price),
+                avg_rent=float(avg_rent),
+                avg_sqm=float(s.get("avg_sqm") or 0),
+                days_on_market=int(s.get("avg_days") or 0),
+                roi=float(roi),
+            )
+        )
+    return result
+
+
+def _project_analytics(ids: List[int]) -> List[ProjectAnalytics]:
+    projects = _ordered(Project.objects.in_bulk(ids), ids)
+    sales, rents = _sales_rent_stats("building__project", ids)
+    counts = _grouped(
+        Building.objects.filter(project_id__in=ids), "project", buildings=Count("id")
+    )
+    result = []
+    for project in projects:
+        s, r = sales.get(project.pk, {}), rents.get(project.pk, {})
+        total = s.get("total") or 0
+        total_units = project.total_units or 0
+        occupancy_rate = (total / total_units * 100) if total_units > 0 else 0
+        result.append(
+            ProjectAnalytics(
+                project=project,
+                total_transactions=total,
+                total_rental_transactions=r.get("total") or 0,
+                avg_price=float(s.get("avg_price") or 0),
+                avg_rent=float(r.get("avg_rent") or 0),
+                avg_sqm=float(s.get("avg_sqm") or 0),
+                building_count=counts.get(project.pk, {}).get("buildings") or 0,
+                occupancy_rate=float(occupancy_rate),
+            )
+        )
+    return result
+
+
+def _market_overview() -> MarketOverview:
+    """Читает готовый снимок MarketSummary - без проходов по сделкам."""
+    summary = get_market_summary()
+    return MarketOverview(
+        total_areas=summary.total_areas,
+        total_buildings=summary.total_buildings,
+        total_projects=summary.total_projects,
+        total_transactions=summary.total_transactions,
+        total_rental_transactions=summary.total_rental_transactions,
+        avg_price=summary.avg_price,
+        avg_rent=summary.avg_rent,
+        avg_sqm=summary.avg_sqm,
+        price_trend=summary.price_trend,
+        rent_trend=summary.rent_trend,
+        generated_at=summary.generated_at,
+    )
+
+
+def _autocomplete(query: str, limit: int) -> AutocompleteResult:
+    hits = search_entities(query, limit=min(max(limit, 1), DEFAULT_PAGE_SIZE))
+    return AutocompleteResult(
+        areas=[
+            AreaSuggestion(id=h.entity_id, nameEn=h.name_en, nameAr=h.name_ar)
+            for h in hits["area"]
+        ],
+        buildings=[
+            BuildingSuggestion(
+                id=h.entity_id,
+                nameEn=h.name_en,
+                nameAr=h.name_ar,
+                buildingNumber=h.number,
+            )
+            for h in hits["building"]
+        ],
+        projects=[
+            ProjectSuggestion(
+                id=h.entity_id,
+                englishName=h.name_en,
+                arabicName=h.name_ar,
+                nameEn=h.name_en,
+                nameAr=h.name_ar,
+                projectNumber=h.number,
+            )
+            for h in hits["project"]
+        ],
+    )
+
+
+def _check_ids(ids: List[int]):
+    if len(ids) > MAX_ANALYTICS_IDS:
+        raise GraphQLError(f"Too many ids: {len(ids)} > {MAX_ANALYTICS_IDS}")
+
+
+# --- Query -------------------------------------------------------------------
 
 
 @strawberry.type
 class Query:
     @strawberry.field
-    def areas(self, info) -> List[AreaType]:
-        return Area.objects.all()
-    
+    async def areas(self, info: Info) -> List[AreaType]:
+        return await sync_to_async(list)(Area.objects.all())
+
     @strawberry.field
-    def buildings(self, info) -> List[BuildingType]:
-        return Building.objects.select_related('area', 'project').all()
-    
+    async def buildings(
+        self, info: Info, first: Optional[int] = None, after: Optional[str] = None
+    ) -> Page[BuildingType]:
+        return await _paginate(Building.objects.all(), first, after)
+
     @strawberry.field
-    def projects(self, info) -> List[ProjectType]:
-        return Project.objects.all()
-    
+    async def projects(
+        self, info: Info, first: Optional[int] = None, after: Optional[str] = None
+    ) -> Page[ProjectType]:
+        return await _paginate(Project.objects.all(), first, after)
+
     @strawberry.field
-    def transactions(self, info) -> List[TransactionType]:
-        return MergedTransaction.objects.select_related('building', 'project', 'area').all()
-    
+    async def transactions(
+        self, info: Info, first: Optional[int] = None, after: Optional[str] = None
+    ) -> Page[TransactionType]:
+        return await _paginate(MergedTransaction.objects.all(), first, after)
+
     @strawberry.field
-    def rental_transactions(self, info) -> List[RentalTransactionType]:
-        return MergedRentalTransaction.objects.select_related('building', 'project', 'area').all()
-    
+    async def rental_transactions(
+        self, info: Info, first: Optional[int] = None, after: Optional[str] = None
+    ) -> Page[RentalTransactionType]:
+        return await _paginate(MergedRentalTransaction.objects.all(), first, after)
+
     @strawberry.field
-    def area_analytics(self, info, area_id: int) -> AreaAnalytics:
-        area = Area.objects.get(id=area_id)
-        
-        # Аналитика по сделкам
-        transactions = MergedTransaction.objects.filter(building__area=area)
-        rental_transactions = MergedRentalTransaction.objects.filter(building__area=area)
-        
-        # Агрегированные метрики
-        transaction_stats = transactions.aggregate(
-            total=Count('id'),
-            avg_price=Avg('contract_amount'),
-            avg_sqm=Avg('sqm')
-        )
-        
-        rental_stats = rental_transactions.aggregate(
-            total=Count('id'),
-            avg_rent=Avg('annual_amount')
-        )
-        
-        building_count = Building.objects.filter(area=area).count()
-        project_count = Project.objects.filter(buildings__area=area).distinct().count()
-        
-        return AreaAnalytics(
-            area=area,
-            total_transactions=transaction_stats['total'] or 0,
-            total_rental_transactions=rental_stats['total'] or 0,
-            avg_price=float(transaction_stats['avg_price'] or 0),
-            avg_rent=float(rental_stats['avg_rent'] or 0),
-            avg_sqm=float(transaction_stats['avg_sqm'] or 0),
-            building_count=building_count,
-            project_count=project_count
-        )
-    
+    async def analytics(self, info: Info, ids: List[int]) -> List[BuildingAnalytics]:
+        """Аналитика сразу по списку зданий (порядок как в ids)."""
+        _check_ids(ids)
+        return await sync_to_async(_building_analytics)(ids)
+
     @strawberry.field
-    def building_analytics(self, info, building_id: int) -> BuildingAnalytics:
-        building = Building.objects.get(id=building_id)
-        
-        # Аналитика по сделкам
-        transactions = MergedTransaction.objects.filter(building=building)
-        rental_transactions = MergedRentalTransaction.objects.filter(building=building)
-        
-        # Агрегированные метрики
-        transaction_stats = transactions.aggregate(
-            total=Count('id'),
-            avg_price=Avg('contract_amount'),
-            avg_sqm=Avg('sqm'),
-            avg_days=Avg('days_on_market')
-        )
-        
-        rental_stats = rental_transactions.aggregate(
-            total=Count('id'),
-            avg_rent=Avg('annual_amount')
-        )
-        
-        # Расчет ROI (упрощенный)
-        avg_price = transaction_stats['avg_price'] or 0
-        avg_rent = rental_stats['avg_rent'] or 0
-        roi = (avg_rent * 12 / avg_price * 100) if avg_price > 0 else 0
-        
-        return BuildingAnalytics(
-            building=building,
-            total_transactions=transaction_stats['total'] or 0,
-            total_rental_transactions=rental_stats['total'] or 0,
-            avg_price=float(avg_price),
-            avg_rent=float(avg_rent),
-            avg_sqm=float(transaction_stats['avg_sqm'] or 0),
-            days_on_market=int(transaction_stats['avg_days'] or 0),
-            roi=float(roi)
-        )
+    async def area_analytics(self, info: Info, area_id: int) -> AreaAnalytics:
+        result = await sync_to_async(_area_analytics)([area_id])
+        if not result:
+            raise GraphQLError(f"Area {area_id} does not exist")
+        return result[0]
 
     @strawberry.field
-    def project_analytics(self, info, project_id: int) -> ProjectAnalytics:
-        project = Project.objects.get(id=project_id)
-        
-        # Аналитика по сделкам
-        transactions = MergedTransaction.objects.filter(building__project=project)
-        rental_transactions = MergedRentalTransaction.objects.filter(building__project=project)
-        
-        # Агрегированные метрики
-        transaction_stats = transactions.aggregate(
-            total=Count('id'),
-            avg_price=Avg('contract_amount'),
-            avg_sqm=Avg('sqm')
-        )
-        
-        rental_stats = rental_transactions.aggregate(
-            total=Count('id'),
-            avg_rent=Avg('annual_amount')
-        )
-        
-        building_count = Building.objects.filter(project=project).count()
-        total_units = project.total_units or 0
-        occupancy_rate = (transaction_stats['total'] / total_units * 100) if total_units > 0 else 0
-        
-        return ProjectAnalytics(
-            project=project,
-            total_transactions=transaction_stats['total'] or 0,
-            total_rental_transactions=rental_stats['total'] or 0,
-            avg_price=float(transaction_stats['avg_price'] or 0),
-            avg_rent=float(rental_stats['avg_rent'] or 0),
-            avg_sqm=float(transaction_stats['avg_sqm'] or 0),
-            building_count=building_count,
-            occupancy_rate=float(occupancy_rate)
-        )
+    async def building_analytics(
+        self, info: Info, building_id: int
+    ) -> BuildingAnalytics:
+        result = await sync_to_async(_building_analytics)([building_id])
+        if not result:
+            raise GraphQLError(f"Building {building_id} does not exist")
+        return result[0]
 
     @strawberry.field
-    def market_overview(self, info) -> MarketOverview:
-        # Общая статистика рынка
-        total_areas = Area.objects.count()
-        total_buildings = Building.objects.count()
-        total_projects = Project.objects.count()
-        
-        # Статистика по сделкам
-        transactions = MergedTransaction.objects.all()
-        rental_transactions = MergedRentalTransaction.objects.all()
-        
-        transaction_stats = transactions.aggregate(
-            total=Count('id'),
-            avg_price=Avg('contract_amount'),
-            avg_sqm=Avg('sqm')
-        )
-        
-        rental_stats = rental_transactions.aggregate(
-            total=Count('id'),
-            avg_rent=Avg('annual_amount')
-        )
-        
-        # Упрощенные тренды (можно заменить на реальную логику)
-        price_trend = "stable"  # placeholder
-        rent_trend = "stable"   # placeholder
-        
-        return MarketOverview(
-            total_areas=total_areas,
-            total_buildings=total_buildings,
-            total_projects=total_projects,
-            total_transactions=transaction_stats['total'] or 0,
-            total_rental_transactions=rental_stats['total'] or 0,
-            avg_price=float(transaction_stats['avg_price'] or 0),
-            avg_rent=float(rental_stats['avg_rent'] or 0),
-            avg_sqm=float(transaction_stats['avg_sqm'] or 0),
-            price_trend=price_trend,
-            rent_trend=rent_trend
-        )
+    async def project_analytics(self, info: Info, project_id: int) -> ProjectAnalytics:
+        result = await sync_to_async(_project_analytics)([project_id])
+        if not result:
+            raise GraphQLError(f"Project {project_id} does not exist")
+        return result[0]
+
+    @strawberry.field
+    async def autocomplete(
+        self, info: Info, query: str, limit: int = 5
+    ) -> AutocompleteResult:
+        """Подсказки по районам, зданиям и проектам (индекс SearchEntry)."""
+        return await sync_to_async(_autocomplete)(query, limit)
+
+    @strawberry.field
+    async def market_overview(self, info: Info) -> MarketOverview:
+        return await sync_to_async(_market_overview)()
+
+
+# --- Ограничение стоимости запроса --------------------------------------------
+
+
+def _multiplier(field: FieldNode) -> int:
+    """Сколько объектов может вернуть поле: first, число ids или 1."""
+    args = {arg.name.value: arg.value for arg in field.arguments or ()}
+    if "first" in args:
+        value = args["first"]
+        if isinstance(value, IntValueNode):
+            return _page_size(int(value.value))
+        return MAX_PAGE_SIZE  # переменная - считаем по максимуму
+    if "ids" in args:
+        value = args["ids"]
+        if isinstance(value, ListValueNode):
+            return len(value.values)
+        if isinstance(value, VariableNode):
+            return MAX_ANALYTICS_IDS
+    if field.name.value in PAGINATED_FIELDS:
+        return DEFAULT_PAGE_SIZE
+    return 1
+
+
+class QueryCostRule(ValidationRule):
+    """
+    Оценка «стоимости» операции до исполнения: каждое поле стоит 1, стоимость
+    вложенных полей умножается на размер списка (first / ids). Операции
+    дороже GRAPHQL_MAX_COST отклоняются.
+    """
+
+    def _cost(self, selection_set, visited) -> int:
+        if selection_set is None:
+            return 0
+        cost = 0
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                cost += 1 + _multiplier(selection) * self._cost(
+                    selection.selection_set, visited
+                )
+            elif isinstance(selection, InlineFragmentNode):
+                cost += self._cost(selection.selection_set, visited)
+            elif isinstance(selection, FragmentSpreadNode):
+                name = selection.name.value
+                fragment = self.context.get_fragment(name)
+                if fragment is not None and name not in visited:
+                    cost += self._cost(fragment.selection_set, visited | {name})
+        return cost
+
+    def enter_operation_definition(self, node, *_args):
+        cost = self._cost(node.selection_set, frozenset())
+        if cost > MAX_COST:
+            self.report_error(
+                GraphQLError(
+                    f"Query cost {cost} exceeds the limit of {MAX_COST}", node
+                )
+            )
 
 
-schema = strawberry.Schema(query=Query)
+schema = strawberry.Schema(
+    query=Query,
+    extensions=[
+        QueryDepthLimiter(max_depth=MAX_DEPTH),
+        AddValidationRules([QueryCostRule]),
+    ],
+)
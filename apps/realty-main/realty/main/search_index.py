@@ -0,0 +1,222 @@
+"""
+Индекс автокомплита по районам, зданиям и проектам (SearchEntry).
+
+Вместо трёх icontains-запросов (seq scan LIKE '%q%' по каждой таблице) -
+один запрос к SearchEntry, который возвращает тип и id сущности:
+  - PostgreSQL: GIN pg_trgm по search_en / search_ar, совпадения по
+    подстроке (LIKE) и нечёткие (оператор %), ранжирование по similarity;
+  - SQLite (dev): FTS5-таблица с токенайзером trigram, запрос - OR по
+    триграммам строки, ранжирование по bm25.
+Совпадения по префиксу всегда выше; по каждому типу - limit лучших
+(ROW_NUMBER() по entity_type). Запросы короче 3 символов - только префикс.
+
+Названия нормализуются одинаково при индексации и поиске
+(normalize_search_text): регистр, огласовки и варианты алифа в арабском.
+Горячие префиксы кэшируются в LRU процесса на SEARCH_LRU_TTL секунд.
+Индекс пересобирает rebuild_search_index (после импортов и командой
+rebuild_search_index).
+"""
+
+import logging
+import re
+import time
+import unicodedata
+from functools import lru_cache
+from typing import Dict
+from typing import List
+from typing import NamedTuple
+from typing import Tuple
+
+from django.db import connection
+from django.db import transaction
+
+from .models import Area
+from .models import Building
+from .models import Project
+from .models import SearchEntry
+
+logger = logging.getLogger(__name__)
+
+ENTITY_TYPES = ("area", "building", "project")
+
+# тип -> (модель, поле en, поле ar, поле номера или None)
+SOURCES = {
+    "area": (Area, "name_en", "name_ar", None),
+    "building": (Building, "english_name", "arabic_name", "number"),
+    "project": (Project, "english_name", "arabic_name", "project_number"),
+}
+
+BULK_BATCH_SIZE = 2000
+MIN_TRIGRAM_QUERY = 3
+MAX_MATCH_TRIGRAMS = 32
+SEARCH_LRU_SIZE = 2048
+SEARCH_LRU_TTL = 60  # секунд: другие процессы увидят пересборку индекса не позже
+
+_ARABIC_MARKS_RE = re.compile("[\u0610-\u061a\u0640\u064b-\u065f\u0670]")
+_ARABIC_LETTERS = str.maketrans(
+    {"أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا", "ى": "ي", "ئ": "ي", "ؤ": "و", "ة": "ه"}
+)
+_SPACES_RE = re.compile(r"\s+")
+
+
+class SearchHit(NamedTuple):
+    entity_type: str
+    entity_id: int
+    name_en: str
+    name_ar: str
+    number: str
+    score: float
+
+
+def normalize_search_text(value) -> str:
+    """
+    Строка для индекса и запроса: NFKC, casefold, без огласовок и татвиля,
+    алиф/я/та марбута приведены к одной форме, пробелы схлопнуты.
+    """
+    if not value:
+        return ""
+    value = unicodedata.normalize("NFKC", str(value)).casefold()
+    value = _ARABIC_MARKS_RE.sub("", value).translate(_ARABIC_LETTERS)
+    return _SPACES_RE.sub(" ", value).strip()[:255]
+
+
+def rebuild_search_index() -> int:
+    """Пересобирает SearchEntry целиком, возвращает число записей."""
+    entries = []
+    for entity_type, (model, en_field, ar_field, number_field) in SOURCES.items():
+        fields = ["pk", en_field, ar_field]
+        if number_field:
+            fields.append(number_field)
+        for row in model.objects.values_list(*fields).iterator():
+            pk, name_en, name_ar = row[:3]
+            search_en = normalize_search_text(name_en)
+            search_ar = normalize_search_text(name_ar)
+            if not (search_en or search_ar):
+                continue
+            entries.append(
+                SearchEntry(
+                    entity_type=entity_type,
+                    entity_id=pk,
+                    name_en=name_en,
+                    name_ar=name_ar,
+                    number=row[3] if number_field else None,
+                    search_en=search_en,
+                    search_ar=search_ar,
+                )
+            )
+
+    with transaction.atomic():
+        SearchEntry.objects.all().delete()
+        SearchEntry.objects.bulk_create(entries, batch_size=BULK_BATCH_SIZE)
+    _cached_search.cache_clear()
+    logger.info("Search index rebuilt: %s entries", len(entries))
+    return len(entries)
+
+
+# --- Поиск -------------------------------------------------------------------
+
+_RANKED_SQL = """
+SELECT entity_type, entity_id, name_en, name_ar, number, score FROM (
+    SELECT m.*, ROW_NUMBER() OVER (
+        PARTITION BY entity_type
+        ORDER BY is_prefix DESC, score DESC, LENGTH(search_en), entity_id
+    ) AS rn
+    FROM ({matches}) m
+) ranked
+WHERE rn <= %(limit)s
+ORDER BY entity_type, rn
+"""
+
+_COLUMNS = "e.entity_type, e.entity_id, e.name_en, e.name_ar, e.number, e.search_en"
+
+_PREFIX = (
+    "(e.search_en LIKE %(prefix)s ESCAPE '\\' "
+    "OR e.search_ar LIKE %(prefix)s ESCAPE '\\')"
+)
+
+_PG_TRGM_MATCHES = f"""
+SELECT {_COLUMNS}, {_PREFIX} AS is_prefix,
+    GREATEST(similarity(e.search_en, %(query)s), similarity(e.search_ar, %(query)s))
+        AS score
+FROM {{table}} e
+WHERE e.search_en LIKE %(contains)s ESCAPE '\\'
+    OR e.search_ar LIKE %(contains)s ESCAPE '\\'
+    OR e.search_en %% %(query)s OR e.search_ar %% %(query)s
+"""
+
+_FTS5_MATCHES = f"""
+SELECT {_COLUMNS}, {_PREFIX} AS is_prefix, -bm25({{table}}_fts) AS score
+FROM {{table}}_fts JOIN {{table}} e ON e.id = {{table}}_fts.rowid
+WHERE {{table}}_fts MATCH %(match)s
+"""
+
+_LIKE_MATCHES = f"""
+SELECT {_COLUMNS}, {_PREFIX} AS is_prefix, 0 AS score
+FROM {{table}} e
+WHERE e.search_en LIKE %(pattern)s ESCAPE '\\'
+    OR e.search_ar LIKE %(pattern)s ESCAPE '\\'
+"""
+
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _fts_match(query: str) -> str:
+    """FTS5-запрос: OR по триграммам строки (больше общих - выше bm25)."""
+    trigrams = dict.fromkeys(query[i : i + 3] for i in range(len(query) - 2))
+    quoted = ['"' + t.replace('"', '""') + '"' for t in trigrams]
+    return " OR ".join(quoted[:MAX_MATCH_TRIGRAMS])
+
+
+@lru_cache(maxsize=1)
+def _fts5_available() -> bool:
+    table = SearchEntry._meta.db_table + "_fts"
+    return table in connection.introspection.table_names()
+
+
+def _matches_sql(query: str, params: dict) -> str:
+    short = len(query) < MIN_TRIGRAM_QUERY
+    if connection.vendor == "postgresql" and not short:
+        return _PG_TRGM_MATCHES
+    if connection.vendor == "sqlite" and not short and _fts5_available():
+        params["match"] = _fts_match(query)
+        return _FTS5_MATCHES
+    # короткий запрос или нет триграммного индекса
+    params["pattern"] = params["prefix"] if short else params["contains"]
+    return _LIKE_MATCHES
+
+
+def _search(query: str, limit: int) -> Tuple[SearchHit, ...]:
+    params = {
+        "query": query,
+        "prefix": _escape_like(query) + "%",
+        "contains": "%" + _escape_like(query) + "%",
+        "limit": limit,
+    }
+    matches = _matches_sql(query, params).format(table=SearchEntry._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(_RANKED_SQL.format(matches=matches), params)
+        return tuple(
+            SearchHit(*row[:5], float(row[5] or 0)) for row in cursor.fetchall()
+        )
+
+
+@lru_cache(maxsize=SEARCH_LRU_SIZE)
+def _cached_search(query: str, limit: int, ttl_bucket: int) -> Tuple[SearchHit, ...]:
+    return _search(query, limit)
+
+
+def search_entities(query: str, limit: int = 5) -> Dict[str, List[SearchHit]]:
+    """
+    Подсказки по строке query: {"area": [...], "building": [...],
+    "project": [...]}, до limit лучших на тип, одним запросом.
+    """
+    result = {entity_type: [] for entity_type in ENTITY_TYPES}
+    query = normalize_search_text(query)
+    if not query:
+        return result
+    ttl_bucket = int(time.monotonic() // SEARCH_LRU_TTL)
+    for hit in _cached_search(query, limit, ttl_bucket):
+        result[hit.entity_type].append(hit)
+    return result
@@ -0,0 +1,145 @@
+"""
+Защита кэша статистики от одновременного пересчёта (cache stampede).
+
+get_or_compute(key, compute, timeout):
+  - значение хранится в обёртке _Envelope с мягким сроком (timeout) и
+    временем расчёта; в самом кэше оно живёт ещё STATS_CACHE_STALE_TTL;
+  - пересчитывает только держатель аренды (cache.add на lease:<key>),
+    остальные в это время получают старое значение (stale-while-revalidate),
+    а если значения нет совсем - ждут его до STATS_CACHE_LEASE_WAIT секунд;
+  - аренда снимается атомарно (compare-and-delete скриптом в Redis), чтобы
+    не удалить аренду, которую уже взял другой процесс; в остальных
+    бэкендах атомарной проверки нет - аренда истекает сама через
+    STATS_CACHE_LEASE_TIMEOUT;
+  - вероятностное раннее обновление (XFetch): чем ближе мягкий срок и чем
+    дольше шёл прошлый расчёт, тем выше шанс, что запрос обновит ключ
+    заранее - ночное истечение TTL не совпадает у всех ключей сразу.
+Значения старого формата (без обёртки) считаются устаревшими.
+"""
+
+import logging
+import math
+import random
+import time
+import uuid
+from typing import Any
+from typing import Callable
+from typing import NamedTuple
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS
+from django.core.cache import cache
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+
+logger = logging.getLogger(__name__)
+
+EARLY_REFRESH_BETA = 1.0  # > 1 - обновлять раньше, < 1 - позже
+WAIT_POLL_INTERVAL = 0.1
+WAIT_POLL_MAX_INTERVAL = 1.0
+
+# удалить KEYS[1], только если там всё ещё наш токен
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class _Envelope(NamedTuple):
+    value: Any
+    expires_at: float  # мягкий срок, time.time()
+    delta: float  # длительность расчёта, секунд
+
+
+def _lease_key(key: str) -> str:
+    # без префикса ключа статистики: аренда не должна попадать в LRU процесса
+    return f"lease:{key}"
+
+
+def _release(lease_key: str, token: str):
+    """Снимает аренду, если она всё ещё наша; иначе оставляет до истечения."""
+    backend = caches[DEFAULT_CACHE_ALIAS]
+    backend = getattr(backend, "shared", backend)  # TwoTierCache: общий кэш
+    if not isinstance(backend, RedisCache):
+        return
+    key = backend.make_and_validate_key(lease_key)
+    client = backend._cache.get_client(key, write=True)
+    client.eval(_RELEASE_SCRIPT, 1, key, backend._cache._serializer.dumps(token))
+
+
+def _unwrap(raw) -> Optional[_Envelope]:
+    if raw is None:
+        return None
+    if isinstance(raw, _Envelope):
+        return raw
+    return _Envelope(raw, 0.0, 0.0)
+
+
+def _should_refresh(envelope: _Envelope, now: float) -> bool:
+    # 1 - random() в (0, 1], log <= 0: сдвиг "сейчас" вперёд на delta * beta * ...
+    jitter = envelope.delta * EARLY_REFRESH_BETA * math.log(1.0 - random.random())
+    return now - jitter >= envelope.expires_at
+
+
+def store(key: str, value, timeout: int, delta: float = 0.0):
+    """Записывает значение в обёртке (для прогрева и пересчёта)."""
+    envelope = _Envelope(value, time.time() + timeout, delta)
+    cache.set(key, envelope, timeout + settings.STATS_CACHE_STALE_TTL)
+
+
+def _compute_and_store(key: str, compute: Callable[[], Any], timeout: int):
+    t0 = time.monotonic()
+    value = compute()
+    store(key, value, timeout, time.monotonic() - t0)
+    return value
+
+
+def _wait_for(key: str) -> Optional[_Envelope]:
+    """Ждёт значение, пока держатель аренды считает его."""
+    deadline = time.monotonic() + settings.STATS_CACHE_LEASE_WAIT
+    interval = WAIT_POLL_INTERVAL
+    while time.monotonic() < deadline:
+        time.sleep(interval)
+        envelope = _unwrap(cache.get(key))
+        if envelope is not None:
+            return envelope
+        if cache.get(_lease_key(key)) is None:
+            return None  # держатель упал, не записав значение
+        interval = min(interval * 2, WAIT_POLL_MAX_INTERVAL)
+    return None
+
+
+def get_or_compute(
+    key: str, compute: Callable[[], Any], timeout: int, refresh: bool = False
+):
+    """
+    Значение key из кэша; при промахе, истечении или раннем обновлении
+    compute() вызывает только один процесс. refresh=True - пересчитать и
+    записать без чтения (прогрев кэша).
+    """
+    if refresh:
+        return _compute_and_store(key, compute, timeout)
+
+    envelope = _unwrap(cache.get(key))
+    if envelope is not None and not _should_refresh(envelope, time.time()):
+        return envelope.value
+
+    lease_key = _lease_key(key)
+    token = uuid.uuid4().hex
+    if not cache.add(lease_key, token, settings.STATS_CACHE_LEASE_TIMEOUT):
+        # пересчитывает другой процесс
+        if envelope is not None:
+            return envelope.value
+        envelope = _wait_for(key)
+        if envelope is not None:
+            return envelope.value
+        logger.warning("No value for %s after waiting for the lease, computing", key)
+        return _compute_and_store(key, compute, timeout)
+
+    try:
+        return _compute_and_store(key, compute, timeout)
+    finally:
+        _release(lease_key, token)
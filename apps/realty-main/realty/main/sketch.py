@@ -0,0 +1,170 @@
+"""
+Сливаемый (mergeable) скетч квантилей для цен.
+
+Логарифмические корзины (как в DDSketch): значение x > 0 попадает в корзину
+ceil(log(x) / log(gamma)), gamma = (1 + alpha) / (1 - alpha). Нули и
+отрицательные значения считаются отдельно (zero_count) - цена NULL у нас 0.
+
+Гарантия: любой квантиль отличается от точного (percentile_cont /
+statistics.median для медианы) не более чем на alpha (1%) относительно -
+значения двух соседних рангов приближены с этой точностью, а интерполяция
+между ними её сохраняет. Слияние - сложение счётчиков корзин, поэтому
+скетчи месяцев/зданий/районов можно складывать без потери точности.
+
+Сериализация компактная: varint-счётчики и дельты номеров корзин,
+для цен от 1e3 до 1e9 это максимум ~700 корзин (обычно десятки байт).
+
+Где хранится: TransactionMonthlyRollup.price_sketch (месяц), BuildingReport /
+AreaReport.*_price_sketch (объявления PF за год). Медиана района и города -
+слияние скетчей уровнем ниже, а не повторный проход по всем объявлениям.
+Если сами значения уже в памяти (отчёт здания), медиана считается точно,
+скетч только сохраняется для уровней выше.
+"""
+
+import math
+from typing import Dict
+from typing import Iterable
+from typing import Optional
+
+SKETCH_VERSION = 1
+DEFAULT_ALPHA = 0.01
+
+
+def _write_varint(out: bytearray, value: int):
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return
+
+
+def _read_varint(data: bytes, pos: int):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _zigzag(value: int) -> int:
+    return (value << 1) ^ (value >> 63)
+
+
+def _unzigzag(value: int) -> int:
+    return (value >> 1) ^ -(value & 1)
+
+
+class QuantileSketch:
+    def __init__(self, alpha: float = DEFAULT_ALPHA):
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self._log_gamma = math.log(self.gamma)
+        self.buckets: Dict[int, int] = {}
+        self.zero_count = 0
+
+    @property
+    def count(self) -> int:
+        return self.zero_count + sum(self.buckets.values())
+
+    def add(self, value, count: int = 1):
+        value = float(value or 0)
+        if value <= 0:
+            self.zero_count += count
+            return
+        key = math.ceil(math.log(value) / self._log_gamma)
+        self.buckets[key] = self.buckets.get(key, 0) + count
+
+    def update(self, values: Iterable):
+        for value in values:
+            self.add(value)
+        return self
+
+    @classmethod
+    def from_values(cls, values: Iterable) -> "QuantileSketch":
+        return cls().update(values)
+
+    def merge(self, other: "QuantileSketch"):
+        if other.alpha != self.alpha:
+            raise ValueError("Cannot merge sketches with different alpha")
+        self.zero_count += other.zero_count
+        for key, cnt in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + cnt
+        return self
+
+    def quantile(self, q: float) -> float:
+        """
+        Приближённый q-квантиль (0..1); 0.0 для пустого скетча. Как
+        percentile_cont и statistics.median: линейная интерполяция между
+        соседними рангами floor / ceil от q * (n - 1).
+        """
+        total = self.count
+        if not total:
+            return 0.0
+        rank = q * (total - 1)
+        lo = math.floor(rank)
+        hi = min(lo + 1, total - 1)
+        # значения с рангами lo и hi: 0 или представитель корзины
+        lo_value = hi_value = 0.0 if hi < self.zero_count else None
+        if lo < self.zero_count:
+            lo_value = 0.0
+        seen = self.zero_count
+        for key in sorted(self.buckets):
+            if hi_value is not None:
+                break
+            seen += self.buckets[key]
+            value = 2.0 * self.gamma**key / (self.gamma + 1)
+            if lo_value is None and lo < seen:
+                lo_value = value
+            if hi < seen:
+                hi_value = value
+        return lo_value + (hi_value - lo_value) * (rank - lo)
+
+    def median(self) -> Optional[float]:
+        """Медиана; None для пустого скетча (для nullable полей отчётов)."""
+        return self.quantile(0.5) if self.count else None
+
+    def to_bytes(self) -> bytes:
+        out = bytearray([SKETCH_VERSION])
+        _write_varint(out, self.zero_count)
+        _write_varint(out, len(self.buckets))
+        prev = 0
+        for key in sorted(self.buckets):
+            _write_varint(out, _zigzag(key - prev))
+            _write_varint(out, self.buckets[key])
+            prev = key
+        return bytes(out)
+
+    @classmethod
+    def from_bytes(cls, data: Optional[bytes]) -> "QuantileSketch":
+        sketch = cls()
+        if not data:
+            return sketch
+        data = bytes(data)  # memoryview из BinaryField
+        if data[0] != SKETCH_VERSION:
+            raise ValueError(f"Unsupported sketch version {data[0]}")
+        pos = 1
+        sketch.zero_count, pos = _read_varint(data, pos)
+        n_buckets, pos = _read_varint(data, pos)
+        key = 0
+        for _ in range(n_buckets):
+            delta, pos = _read_varint(data, pos)
+            cnt, pos = _read_varint(data, pos)
+            key += _unzigzag(delta)
+            sketch.buckets[key] = cnt
+        return sketch
+
+
+def merge_serialized(blobs: Iterable[Optional[bytes]]) -> QuantileSketch:
+    """Сливает сериализованные скетчи (None / b"" пропускаются)."""
+    sketch = QuantileSketch()
+    for data in blobs:
+        if data:
+            sketch.merge(QuantileSketch.from_bytes(data))
+    return sketch
@@ -0,0 +1,447 @@
+"""
+Blue/green замена таблиц сделок при полной перезаливке DLD.
+
+Вместо DELETE + загрузки в живую таблицу (минуты, когда дашборды и прогрев
+кэша видят нули):
+  1) create_shadow - пустая копия таблицы "<table>__shadow" (та же схема);
+  2) импорт пишет в неё (insert_objects / INSERT ... SELECT);
+  3) validate_shadow - число строк, адекватность цен, целостность FK;
+  4) swap_in_shadow - одной транзакцией меняет таблицы местами по именам;
+     прошлое поколение остаётся как "<table>__prev";
+  5) rollback_generation - так же мгновенно возвращает "<table>__prev".
+
+PostgreSQL: копия через LIKE ... INCLUDING ALL, FK добавляются NOT VALID и
+проверяются VALIDATE CONSTRAINT; при обмене имена индексов тоже меняются
+местами, чтобы миграции Django находили их по прежним именам. LIKE копирует
+DEFAULT nextval(...) serial-ключа - последовательность общая, и при каждом
+обмене она переходит во владение живой таблицы (OWNED BY), иначе DROP
+"__prev" удалил бы её вместе с default живой.
+SQLite: копия по DDL из sqlite_master, индексы пересоздаются при обмене
+(для dev-базы это приемлемо), FK проверяет PRAGMA foreign_key_check.
+
+На таблицы сделок никто не ссылается по FK, поэтому переименование безопасно.
+Но сами они ссылаются на Building / Area / Project: "__prev" остаётся без FK
+(на SQLite - пересоздаётся по DDL без REFERENCES), иначе его строки мешали бы
+удалять здания и районы. rollback_generation перед возвратом поколения
+обнуляет (SET_NULL) или удаляет ссылки на удалённые за это время записи и
+восстанавливает FK.
+"""
+
+import logging
+import re
+from collections import defaultdict
+from typing import List
+from typing import Tuple
+
+from django.conf import settings
+from django.db import connection
+from django.db import DatabaseError
+from django.db import transaction
+from django.db.models import SET_NULL
+
+logger = logging.getLogger(__name__)
+
+SHADOW_SUFFIX = "__shadow"
+PREV_SUFFIX = "__prev"
+
+
+class ShadowValidationError(Exception):
+    """Теневая таблица не прошла проверку - живые данные не тронуты."""
+
+    def __init__(self, table: str, errors: List[str]):
+        self.table = table
+        self.errors = errors
+        super().__init__(f"{table}: " + "; ".join(errors))
+
+
+def shadow_table_name(model) -> str:
+    return model._meta.db_table + SHADOW_SUFFIX
+
+
+def prev_table_name(model) -> str:
+    return model._meta.db_table + PREV_SUFFIX
+
+
+def _qn(name: str) -> str:
+    return connection.ops.quote_name(name)
+
+
+def _table_exists(name: str) -> bool:
+    with connection.cursor() as cursor:
+        return name in connection.introspection.table_names(cursor)
+
+
+def _drop_table(cursor, name: str):
+    cursor.execute(f"DROP TABLE IF EXISTS {_qn(name)}")
+
+
+# ──────────────────────────  FK и последовательности  ──────────────────────────
+
+# ссылка в DDL, который Django создаёт для ForeignKey на SQLite
+_SQLITE_REFERENCES_RE = re.compile(
+    r'\s+REFERENCES\s+"[^"]+"\s*\("[^"]+"\)(?:\s+DEFERRABLE INITIALLY DEFERRED)?',
+    re.IGNORECASE,
+)
+
+
+def _sqlite_ddl(cursor, source: str, name: str, fks: bool = True) -> str:
+    """CREATE TABLE name по DDL таблицы source (fks=False - без REFERENCES)."""
+    cursor.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = %s",
+        [source],
+    )
+    ddl = cursor.fetchone()[0]
+    ddl = re.sub(
+        r'^CREATE TABLE\s+("?)' + re.escape(source) + r"\1",
+        f'CREATE TABLE "{name}"',
+        ddl,
+        count=1,
+    )
+    return ddl if fks else _SQLITE_REFERENCES_RE.sub("", ddl)
+
+
+def _sqlite_rebuild(cursor, table: str, ddl_source: str, fks: bool):
+    """SQLite не умеет ADD/DROP CONSTRAINT - таблица пересоздаётся со строками."""
+    tmp = f"{table}__rebuild"
+    _drop_table(cursor, tmp)
+    cursor.execute(_sqlite_ddl(cursor, ddl_source, tmp, fks))
+    columns = ", ".join(
+        _qn(column.name)
+        for column in connection.introspection.get_table_description(cursor, table)
+    )
+    cursor.execute(
+        f"INSERT INTO {_qn(tmp)} ({columns}) SELECT {columns} FROM {_qn(table)}"
+    )
+    _drop_table(cursor, table)
+    cursor.execute(f"ALTER TABLE {_qn(tmp)} RENAME TO {_qn(table)}")
+
+
+def _pg_foreign_keys(cursor, table: str) -> List[Tuple[str, str]]:
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = %s::regclass AND contype = 'f'",
+        [table],
+    )
+    return cursor.fetchall()
+
+
+def _add_foreign_keys(cursor, table: str, source: str):
+    """
+    FK как у source вместо прежних; на PostgreSQL - NOT VALID, их проверяет
+    _fk_errors.
+    """
+    if connection.vendor == "postgresql":
+        _drop_foreign_keys(cursor, table)
+        for i, (_name, definition) in enumerate(_pg_foreign_keys(cursor, source)):
+            cursor.execute(
+                f"ALTER TABLE {_qn(table)} ADD CONSTRAINT "
+                f"{_qn(f'{table}_fk{i}')} {definition} NOT VALID"
+            )
+    else:
+        _sqlite_rebuild(cursor, table, source, fks=True)
+
+
+def _drop_foreign_keys(cursor, table: str):
+    if connection.vendor == "postgresql":
+        for name, _definition in _pg_foreign_keys(cursor, table):
+            cursor.execute(f"ALTER TABLE {_qn(table)} DROP CONSTRAINT {_qn(name)}")
+    else:
+        _sqlite_rebuild(cursor, table, table, fks=False)
+
+
+def _resolve_orphans(cursor, model, table: str) -> int:
+    """
+    Ссылки table на удалённые записи (пока таблица была без FK) - как
+    on_delete модели: SET_NULL обнуляет ссылку, иначе строка удаляется.
+    """
+    resolved = 0
+    for field in model._meta.concrete_fields:
+        if not field.many_to_one or not field.db_constraint:
+            continue
+        column = f"{_qn(table)}.{_qn(field.column)}"
+        orphan = (
+            f"{column} IS NOT NULL AND NOT EXISTS (SELECT 1 FROM "
+            f"{_qn(field.related_model._meta.db_table)} parent WHERE "
+            f"parent.{_qn(field.target_field.column)} = {column})"
+        )
+        if field.remote_field.on_delete is SET_NULL:
+            cursor.execute(
+                f"UPDATE {_qn(table)} SET {_qn(field.column)} = NULL WHERE {orphan}"
+            )
+        else:
+            cursor.execute(f"DELETE FROM {_qn(table)} WHERE {orphan}")
+        resolved += cursor.rowcount
+    return resolved
+
+
+def _pg_claim_sequence(cursor, model, table: str):
+    """serial-последовательность из DEFAULT ключа table - во владение table."""
+    if connection.vendor != "postgresql":
+        return
+    column = model._meta.pk.column
+    cursor.execute(
+        "SELECT dep.refobjid::regclass::text FROM pg_attrdef def "
+        "JOIN pg_attribute att "
+        "ON att.attrelid = def.adrelid AND att.attnum = def.adnum "
+        "JOIN pg_depend dep ON dep.classid = 'pg_attrdef'::regclass "
+        "AND dep.objid = def.oid AND dep.refclassid = 'pg_class'::regclass "
+        "JOIN pg_class seq ON seq.oid = dep.refobjid AND seq.relkind = 'S' "
+        "WHERE def.adrelid = %s::regclass AND att.attname = %s",
+        [table, column],
+    )
+    for (sequence,) in cursor.fetchall():
+        cursor.execute(f"ALTER SEQUENCE {sequence} OWNED BY {_qn(table)}.{_qn(column)}")
+
+
+# ──────────────────────────  создание shadow  ──────────────────────────
+
+
+def create_shadow(model) -> str:
+    """(Пере)создаёт пустую теневую таблицу для model, возвращает её имя."""
+    live = model._meta.db_table
+    shadow = shadow_table_name(model)
+    with transaction.atomic(), connection.cursor() as cursor:
+        _drop_table(cursor, shadow)
+        if connection.vendor == "postgresql":
+            cursor.execute(
+                f"CREATE TABLE {_qn(shadow)} (LIKE {_qn(live)} INCLUDING ALL)"
+            )
+            # identity-ключ получает свою последовательность - id продолжают
+            # живую таблицу, как с общей serial-последовательностью
+            pk = model._meta.pk.column
+            cursor.execute("SELECT pg_get_serial_sequence(%s, %s)", [shadow, pk])
+            (sequence,) = cursor.fetchone()
+            if sequence:
+                cursor.execute(
+                    f"SELECT setval(%s, COALESCE(MAX({_qn(pk)}), 0) + 1, false) "
+                    f"FROM {_qn(live)}",
+                    [sequence],
+                )
+            # LIKE не копирует FK - добавляем без проверки, проверит validate_shadow
+            _add_foreign_keys(cursor, shadow, live)
+        else:
+            cursor.execute(_sqlite_ddl(cursor, live, shadow))
+    logger.info("Created shadow table %s", shadow)
+    return shadow
+
+
+def insert_objects(model, table: str, objs) -> int:
+    """
+    Вставляет несохранённые экземпляры model в таблицу table (shadow).
+    Значения готовятся так же, как в ORM (pre_save + get_db_prep_save).
+    """
+    objs = list(objs)
+    if not objs:
+        return 0
+    fields = [f for f in model._meta.concrete_fields if not f.primary_key]
+    columns = ", ".join(_qn(f.column) for f in fields)
+    placeholders = ", ".join(["%s"] * len(fields))
+    rows = [
+        [f.get_db_prep_save(f.pre_save(obj, True), connection) for f in fields]
+        for obj in objs
+    ]
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"INSERT INTO {_qn(table)} ({columns}) VALUES ({placeholders})", rows
+        )
+    return len(rows)
+
+
+# ──────────────────────────  проверка  ──────────────────────────
+
+
+def _price_stats(cursor, table: str) -> Tuple[int, float, int]:
+    cursor.execute(
+        "SELECT COUNT(*), AVG(transaction_price), "
+        "SUM(CASE WHEN transaction_price < 0 THEN 1 ELSE 0 END) "
+        f"FROM {_qn(table)}"
+    )
+    count, avg_price, negative = cursor.fetchone()
+    return count or 0, float(avg_price or 0), negative or 0
+
+
+def _fk_errors(cursor, shadow: str) -> List[str]:
+    errors = []
+    if connection.vendor == "postgresql":
+        cursor.execute(
+            "SELECT conname FROM pg_constraint "
+            "WHERE conrelid = %s::regclass AND contype = 'f' AND NOT convalidated",
+            [shadow],
+        )
+        for (name,) in cursor.fetchall():
+            try:
+                with transaction.atomic():
+                    cursor.execute(
+                        f"ALTER TABLE {_qn(shadow)} VALIDATE CONSTRAINT {_qn(name)}"
+                    )
+            except DatabaseError as e:
+                errors.append(f"FK {name}: {e}")
+    else:
+        cursor.execute(f"PRAGMA foreign_key_check({_qn(shadow)})")
+        broken = defaultdict(int)
+        for _table, _rowid, parent, _fkid in cursor.fetchall():
+            broken[parent] += 1
+        errors.extend(f"{cnt} rows reference missing {t}" for t, cnt in broken.items())
+    return errors
+
+
+def validate_shadow(model) -> List[str]:
+    """
+    Проверки перед обменом, возвращает список ошибок (пустой - можно менять):
+      - в shadow есть строки и их не меньше TABLE_SWAP_MIN_ROW_RATIO от живой;
+      - нет отрицательных цен, средняя цена не ушла дальше чем в
+        TABLE_SWAP_MAX_PRICE_SHIFT раз от живой;
+      - все FK указывают на существующие строки.
+    """
+    min_ratio = getattr(settings, "TABLE_SWAP_MIN_ROW_RATIO", 0.9)
+    max_shift = getattr(settings, "TABLE_SWAP_MAX_PRICE_SHIFT", 3.0)
+    shadow = shadow_table_name(model)
+    errors = []
+    with connection.cursor() as cursor:
+        live_count, live_avg, _ = _price_stats(cursor, model._meta.db_table)
+        count, avg_price, negative = _price_stats(cursor, shadow)
+
+        if not count:
+            errors.append("shadow table is empty")
+        elif count < live_count * min_ratio:
+            errors.append(
+                f"row count dropped: {count} < {min_ratio:.0%} of {live_count}"
+            )
+        if negative:
+            errors.append(f"{negative} rows with negative transaction_price")
+        if live_avg > 0 and avg_price > 0:
+            shift = max(avg_price / live_avg, live_avg / avg_price)
+            if shift > max_shift:
+                errors.append(
+                    f"average price shifted x{shift:.1f} "
+                    f"({live_avg:.0f} -> {avg_price:.0f})"
+                )
+        errors.extend(_fk_errors(cursor, shadow))
+
+    logger.info(
+        "Validated %s: %s rows (live %s), %s errors",
+        shadow,
+        count,
+        live_count,
+        len(errors),
+    )
+    return errors
+
+
+# ──────────────────────────  обмен  ──────────────────────────
+
+
+_PG_INDEX_RE = re.compile(r"^CREATE (UNIQUE )?INDEX \S+ ON (?:ONLY )?\S+ (.*)$")
+
+
+def _pg_indexes(cursor, table: str) -> List[Tuple[str, str]]:
+    """[(определение без имени и таблицы, имя индекса)]"""
+    cursor.execute(
+        "SELECT indexname, indexdef FROM pg_indexes "
+        "WHERE schemaname = current_schema() AND tablename = %s ORDER BY indexname",
+        [table],
+    )
+    result = []
+    for name, definition in cursor.fetchall():
+        match = _PG_INDEX_RE.match(definition)
+        if match:
+            result.append(((match.group(1) or "") + match.group(2), name))
+    return result
+
+
+def _pg_exchange(cursor, a: str, b: str):
+    # индексы с одинаковым определением меняются именами вместе с таблицами
+    pool = defaultdict(list)
+    for key, name in _pg_indexes(cursor, b):
+        pool[key].append(name)
+    pairs = [
+        (name, pool[key].pop(0)) for key, name in _pg_indexes(cursor, a) if pool[key]
+    ]
+    for i, (name_a, name_b) in enumerate(pairs):
+        tmp = _qn(f"{a[:40]}_swap{i}")
+        cursor.execute(f"ALTER INDEX {_qn(name_a)} RENAME TO {tmp}")
+        cursor.execute(f"ALTER INDEX {_qn(name_b)} RENAME TO {_qn(name_a)}")
+        cursor.execute(f"ALTER INDEX {tmp} RENAME TO {_qn(name_b)}")
+
+    tmp = f"{a}__swap"
+    cursor.execute(f"ALTER TABLE {_qn(a)} RENAME TO {_qn(tmp)}")
+    cursor.execute(f"ALTER TABLE {_qn(b)} RENAME TO {_qn(a)}")
+    cursor.execute(f"ALTER TABLE {_qn(tmp)} RENAME TO {_qn(b)}")
+
+
+def _sqlite_exchange(cursor, a: str, b: str):
+    # индексы живой таблицы снимаем и создаём заново на новой живой
+    cursor.execute(
+        "SELECT name, sql FROM sqlite_master "
+        "WHERE type = 'index' AND tbl_name = %s AND sql IS NOT NULL",
+        [a],
+    )
+    indexes = cursor.fetchall()
+    for name, _sql in indexes:
+        cursor.execute(f"DROP INDEX {_qn(name)}")
+    # не переписывать ссылки в других таблицах на переименованную
+    cursor.execute("PRAGMA legacy_alter_table = ON")
+    try:
+        tmp = f"{a}__swap"
+        cursor.execute(f"ALTER TABLE {_qn(a)} RENAME TO {_qn(tmp)}")
+        cursor.execute(f"ALTER TABLE {_qn(b)} RENAME TO {_qn(a)}")
+        cursor.execute(f"ALTER TABLE {_qn(tmp)} RENAME TO {_qn(b)}")
+    finally:
+        cursor.execute("PRAGMA legacy_alter_table = OFF")
+    for _name, sql in indexes:
+        cursor.execute(sql)
+
+
+def _exchange(cursor, a: str, b: str):
+    if connection.vendor == "postgresql":
+        _pg_exchange(cursor, a, b)
+    else:
+        _sqlite_exchange(cursor, a, b)
+
+
+def swap_in_shadow(model, validate: bool = True):
+    """
+    Проверяет shadow и одной транзакцией делает её живой таблицей;
+    бывшая живая становится "<table>__prev" (старый __prev удаляется).
+    При ошибках проверки - ShadowValidationError, живая таблица не меняется.
+    """
+    live = model._meta.db_table
+    shadow = shadow_table_name(model)
+    prev = prev_table_name(model)
+    if validate:
+        errors = validate_shadow(model)
+        if errors:
+            raise ShadowValidationError(shadow, errors)
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        _pg_claim_sequence(cursor, model, live)
+        _drop_table(cursor, prev)
+        _exchange(cursor, live, shadow)
+        cursor.execute(f"ALTER TABLE {_qn(shadow)} RENAME TO {_qn(prev)}")
+        _pg_claim_sequence(cursor, model, live)
+        _drop_foreign_keys(cursor, prev)
+    logger.info("Swapped %s into %s (previous generation in %s)", shadow, live, prev)
+
+
+def rollback_generation(model):
+    """
+    Возвращает предыдущее поколение (<table>__prev) на место живой таблицы:
+    ссылки на удалённые с тех пор записи разрешаются по on_delete, FK
+    восстанавливаются; бывшая живая становится "__prev" без FK.
+    """
+    live = model._meta.db_table
+    prev = prev_table_name(model)
+    if not _table_exists(prev):
+        raise ValueError(f"No previous generation for {live}")
+    with transaction.atomic(), connection.cursor() as cursor:
+        resolved = _resolve_orphans(cursor, model, prev)
+        if resolved:
+            logger.info("%s: %s references to deleted rows resolved", prev, resolved)
+        _add_foreign_keys(cursor, prev, live)
+        errors = _fk_errors(cursor, prev)
+        if errors:
+            raise ValueError(f"{prev}: " + "; ".join(errors))
+        _exchange(cursor, live, prev)
+        _pg_claim_sequence(cursor, model, live)
+        _drop_foreign_keys(cursor, prev)
+    logger.info("Rolled back %s to previous generation", live)
@@ -0,0 +1,327 @@
+import datetime
+import random
+import statistics
+from decimal import Decimal
+
+from django.db import connection
+from django.db.models import Q
+from django.test import SimpleTestCase
+from django.test import TestCase
+from django.test import TransactionTestCase
+
+from .aggregator import aggregate_periods
+from .models import Area
+from .models import Building
+from .models import MergedTransaction
+from .models import Project
+from .rollups import aggregate_periods_with_rollups
+from .rollups import build_querysets
+from .rollups import rebuild_rollups
+from .rollups import split_period
+from .sketch import merge_serialized
+from .sketch import QuantileSketch
+from .table_swap import create_shadow
+from .table_swap import insert_objects
+from .table_swap import prev_table_name
+from .table_swap import rollback_generation
+from .table_swap import shadow_table_name
+from .table_swap import ShadowValidationError
+from .table_swap import swap_in_shadow
+
+d = datetime.date
+
+
+class SplitPeriodTests(TestCase):
+    def test_whole_months_and_edges(self):
+        months, edges = split_period(d(2025, 1, 15), d(2025, 4, 10))
+        self.assertEqual(months, ((2025, 2), (2025, 3)))
+        self.assertEqual(
+            edges,
+            [(d(2025, 1, 15), d(2025, 1, 31)), (d(2025, 4, 1), d(2025, 4, 10))],
+        )
+
+    def test_period_inside_one_month(self):
+        months, edges = split_period(d(2025, 2, 3), d(2025, 2, 20))
+        self.assertIsNone(months)
+        self.assertEqual(edges, [(d(2025, 2, 3), d(2025, 2, 20))])
+
+    def test_exact_months_have_no_edges(self):
+        months, edges = split_period(d(2024, 12, 1), d(2025, 2, 28))
+        self.assertEqual(months, ((2024, 12), (2025, 2)))
+        self.assertEqual(edges, [])
+
+
+class RollupEquivalenceTests(TestCase):
+    """aggregate_periods_with_rollups == aggregate_periods по сырым сделкам."""
+
+    @classmethod
+    def setUpTestData(cls):
+        rnd = random.Random(7)
+        project = Project.objects.create(english_name="P")
+        cls.areas = [Area.objects.create(name_en=f"Area {i}") for i in range(2)]
+        buildings = [
+            Building.objects.create(project=project, english_name=f"B{i}", area=area)
+            for i, area in enumerate(cls.areas * 2)
+        ]
+        rows = []
+        for _ in range(400):
+            building = rnd.choice(buildings)
+            price = rnd.choice([None, 0, rnd.randint(300, 9000) * 1000])
+            rows.append(
+                MergedTransaction(
+                    transaction_type="sales",
+                    building=building,
+                    area=building.area,
+                    number_of_rooms=rnd.choice(["Studio", "1 B/R", "2 B/R", None]),
+                    date_of_transaction=d(2024, 1, 1)
+                    + datetime.timedelta(days=rnd.randint(0, 500)),
+                    transaction_price=None if price is None else Decimal(price),
+                    sqm=rnd.choice([None, rnd.uniform(30, 300)]),
+                )
+            )
+        # аренда и сделки другого типа в rollup продаж не попадают
+        rows.append(
+            MergedTransaction(
+                transaction_type="rental",
+                date_of_transaction=d(2024, 3, 3),
+                transaction_price=Decimal(10**9),
+            )
+        )
+        MergedTransaction.objects.bulk_create(rows)
+        rebuild_rollups("sales")
+
+    def assertSamePeriods(self, periods):
+        qs, rollup_qs = build_querysets("sales", None, None)
+        raw = aggregate_periods(qs, periods)
+        rolled = aggregate_periods_with_rollups(qs, rollup_qs, periods)
+        self.assertEqual(set(raw), set(rolled))
+        for key, expected in raw.items():
+            actual = rolled[key]
+            self.assertEqual(actual["count"], expected["count"], key)
+            for field in (
+                "sum_price",
+                "avg_price",
+                "sum_sqm",
+                "avg_area",
+                "min_price",
+                "max_price",
+            ):
+                self.assertAlmostEqual(
+                    actual[field], expected[field], places=4, msg=(key, field)
+                )
+            # медиана из слитых скетчей - в пределах 1%
+            self.assertLessEqual(
+                abs(actual["median"] - expected["median"]),
+                0.01 * expected["median"] + 1e-9,
+                key,
+            )
+
+    def test_whole_months(self):
+        self.assertSamePeriods(
+            {
+                "year": (d(2024, 1, 1), d(2024, 12, 31)),
+                "q": (d(2025, 1, 1), d(2025, 3, 31)),
+            }
+        )
+
+    def test_partial_months_at_edges(self):
+        self.assertSamePeriods(
+            {
+                "current": (d(2024, 6, 17), d(2025, 2, 9)),
+                "previous": (d(2024, 1, 5), d(2024, 6, 16)),
+                "short": (d(2024, 8, 3), d(2024, 8, 20)),
+            }
+        )
+
+    def test_extra_filter(self):
+        area = self.areas[0]
+        self.assertSamePeriods(
+            {
+                "area": (d(2024, 2, 10), d(2025, 1, 20), Q(area_id=area.pk)),
+                "rooms": (d(2024, 1, 1), d(2024, 9, 30), Q(number_of_rooms="1 B/R")),
+            }
+        )
+
+    def test_empty_period(self):
+        self.assertSamePeriods({"future": (d(2030, 1, 1), d(2030, 6, 30))})
+
+    def test_rebuild_after_delete(self):
+        MergedTransaction.objects.filter(date_of_transaction__month=5).delete()
+        rebuild_rollups("sales")
+        self.assertSamePeriods({"year": (d(2024, 1, 1), d(2024, 12, 31))})
+
+
+class QuantileSketchTests(SimpleTestCase):
+    """Скетч против точных квантилей (statistics.median / percentile_cont)."""
+
+    def assertClose(self, actual, expected, rel=0.01):
+        self.assertLessEqual(abs(actual - expected), rel * abs(expected) + 1e-9)
+
+    def test_median_interpolates_between_ranks(self):
+        self.assertClose(QuantileSketch.from_values([1e6, 2e6]).median(), 1.5e6)
+        self.assertClose(
+            QuantileSketch.from_values([1e6, 2e6, 3e6, 4e6]).median(), 2.5e6
+        )
+
+    def test_random_quantiles_within_alpha(self):
+        rnd = random.Random(1)
+        for n in (1, 2, 3, 10, 101, 1000):
+            values = [rnd.lognormvariate(14, 1) for _ in range(n)]
+            sketch = QuantileSketch.from_values(values)
+            self.assertClose(sketch.median(), statistics.median(values))
+            exact = sorted(values)
+            for q in (0, 0.1, 0.25, 0.75, 0.9, 1):
+                rank = q * (n - 1)
+                lo = int(rank)
+                hi = min(lo + 1, n - 1)
+                expected = exact[lo] + (exact[hi] - exact[lo]) * (rank - lo)
+                self.assertClose(sketch.quantile(q), expected)
+
+    def test_zeros_and_nulls(self):
+        sketch = QuantileSketch.from_values([None, 0, 0, 5e5])
+        self.assertEqual(sketch.zero_count, 3)
+        self.assertEqual(sketch.median(), 0.0)
+        self.assertClose(QuantileSketch.from_values([0, 1e6]).median(), 5e5)
+
+    def test_empty(self):
+        sketch = QuantileSketch()
+        self.assertIsNone(sketch.median())
+        self.assertEqual(sketch.quantile(0.5), 0.0)
+        self.assertEqual(merge_serialized([None, b""]).count, 0)
+
+    def test_merge_equals_sketch_of_union(self):
+        rnd = random.Random(2)
+        left = [rnd.randint(1, 10**7) for _ in range(300)] + [0] * 5
+        right = [rnd.randint(1, 10**7) for _ in range(200)]
+        merged = QuantileSketch.from_values(left).merge(
+            QuantileSketch.from_values(right)
+        )
+        whole = QuantileSketch.from_values(left + right)
+        self.assertEqual(merged.buckets, whole.buckets)
+        self.assertEqual(merged.zero_count, whole.zero_count)
+        with self.assertRaises(ValueError):
+            merged.merge(QuantileSketch(alpha=0.02))
+
+    def test_bytes_round_trip(self):
+        rnd = random.Random(3)
+        sketch = QuantileSketch.from_values(
+            [0, 0.5, 1e9] + [rnd.randint(1000, 10**8) for _ in range(500)]
+        )
+        restored = QuantileSketch.from_bytes(memoryview(sketch.to_bytes()))
+        self.assertEqual(restored.buckets, sketch.buckets)
+        self.assertEqual(restored.zero_count, sketch.zero_count)
+        self.assertEqual(
+            merge_serialized([sketch.to_bytes(), None]).median(), sketch.median()
+        )
+        with self.assertRaises(ValueError):
+            QuantileSketch.from_bytes(b"\x09")
+
+
+class TableSwapTests(TransactionTestCase):
+    """Blue/green-обмен на SQLite с включёнными FK (PRAGMA foreign_keys)."""
+
+    def setUp(self):
+        project = Project.objects.create(english_name="P")
+        self.area = Area.objects.create(name_en="Marina")
+        self.old_building = Building.objects.create(
+            project=project, english_name="Old", area=self.area
+        )
+        self.new_building = Building.objects.create(
+            project=project, english_name="New", area=self.area
+        )
+        MergedTransaction.objects.bulk_create(
+            self.rows(self.old_building, 1_000_000, count=10)
+        )
+
+    def tearDown(self):
+        with connection.cursor() as cursor:
+            for name in (
+                shadow_table_name(MergedTransaction),
+                prev_table_name(MergedTransaction),
+            ):
+                cursor.execute(f'DROP TABLE IF EXISTS "{name}"')
+
+    def rows(self, building, price, count):
+        return [
+            MergedTransaction(
+                transaction_type="sales",
+                building=building,
+                area=building.area,
+                date_of_transaction=d(2025, 1, 1),
+                transaction_price=Decimal(price),
+            )
+            for _ in range(count)
+        ]
+
+    def swap(self, building, price, count=10):
+        shadow = create_shadow(MergedTransaction)
+        insert_objects(MergedTransaction, shadow, self.rows(building, price, count))
+        swap_in_shadow(MergedTransaction)
+
+    def foreign_keys(self, table):
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA foreign_key_list("{table}")')
+            return {row[2] for row in cursor.fetchall()}
+
+    def prices(self):
+        return set(
+            MergedTransaction.objects.values_list("transaction_price", flat=True)
+        )
+
+    def test_swap_keeps_fks_on_live_only(self):
+        self.swap(self.new_building, 1_100_000)
+        self.assertEqual(self.prices(), {Decimal(1_100_000)})
+        live = MergedTransaction._meta.db_table
+        self.assertIn("main_building", self.foreign_keys(live))
+        self.assertEqual(self.foreign_keys(prev_table_name(MergedTransaction)), set())
+        self.assertEqual(
+            MergedTransaction.objects.filter(building=self.new_building).count(), 10
+        )
+
+    def test_delete_after_swap_and_rollback(self):
+        self.swap(self.new_building, 1_100_000)
+        # __prev ссылается на старое здание - удаление не должно падать
+        self.old_building.delete()
+        connection.check_constraints()
+
+        rollback_generation(MergedTransaction)
+        self.assertEqual(self.prices(), {Decimal(1_000_000)})
+        # ссылки на удалённое здание обнулены (on_delete=SET_NULL)
+        self.assertFalse(
+            MergedTransaction.objects.filter(building__isnull=False).exists()
+        )
+        self.assertEqual(MergedTransaction.objects.filter(area=self.area).count(), 10)
+        self.assertIn(
+            "main_building", self.foreign_keys(MergedTransaction._meta.db_table)
+        )
+        # теперь в __prev - откатанное поколение, и оно тоже ничего не держит
+        self.new_building.delete()
+        self.area.delete()
+        connection.check_constraints()
+
+        rollback_generation(MergedTransaction)
+        self.assertEqual(self.prices(), {Decimal(1_100_000)})
+        self.assertFalse(
+            MergedTransaction.objects.filter(
+                Q(building__isnull=False) | Q(area__isnull=False)
+            ).exists()
+        )
+
+    def test_second_swap_replaces_prev(self):
+        self.swap(self.new_building, 1_100_000)
+        self.swap(self.old_building, 1_200_000)
+        self.new_building.delete()
+        rollback_generation(MergedTransaction)
+        self.assertEqual(self.prices(), {Decimal(1_100_000)})
+
+    def test_failed_validation_keeps_live(self):
+        shadow = create_shadow(MergedTransaction)
+        insert_objects(
+            MergedTransaction, shadow, self.rows(self.new_building, 1_000_000, 2)
+        )
+        with self.assertRaises(ShadowValidationError):
+            swap_in_shadow(MergedTransaction)
+        self.assertEqual(self.prices(), {Decimal(1_000_000)})
+        self.assertEqual(MergedTransaction.objects.count(), 10)
+        with self.assertRaises(ValueError):
+            rollback_generation(MergedTransaction)
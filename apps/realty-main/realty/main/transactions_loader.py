@@ -0,0 +1,269 @@
+"""
+Потоковая загрузка tr_*.csv (populate_db_2) через staging-таблицу.
+
+1) CSV читается потоково; строки пачками по chunk_size пишутся в
+   MergedTransactionStaging. Каждая пачка - отдельная транзакция вместе с
+   checkpoint в CsvImport (байтовый offset + число строк), поэтому после
+   падения загрузка продолжается с checkpoint, а не с начала файла.
+2) PostgreSQL - COPY FROM STDIN, остальные БД (SQLite) - executemany.
+3) Когда файл прочитан целиком, replace_sales_from_staging одной транзакцией
+   заменяет сделки (DELETE + INSERT ... SELECT) и BuildingLiquidityParameterOne.
+   До коммита читатели видят старые данные, после - новые; пустых таблиц нет.
+   shadow=True - вместо DELETE + INSERT данные идут в теневую таблицу,
+   проверяются и подменяют живую переименованием (см. table_swap).
+
+Staging одна на все импорты, поэтому populate_db_2 держит staging_lock() от
+start_staging до replace_sales_from_staging: второй импорт не перемешает
+свои строки с чужими, а получит ValueError.
+"""
+
+import csv
+import logging
+from contextlib import contextmanager
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from django.db import connection
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import ExtractMonth
+from django.db.models.functions import ExtractYear
+from django.utils import timezone
+
+from .models import BuildingLiquidityParameterOne
+from .models import CsvImport
+from .models import MergedTransaction
+from .models import MergedTransactionStaging
+from .table_swap import create_shadow
+from .table_swap import swap_in_shadow
+
+logger = logging.getLogger(__name__)
+
+# Порядок колонок в кортежах строк staging (см. populate_db_2._staging_row)
+STAGING_COLUMNS = [
+    "row_number",
+    "building_id",
+    "area_id",
+    "date_of_transaction",
+    "building_name",
+    "location_name",
+    "number_of_rooms",
+    "bedrooms_norm",
+    "sqm",
+    "transaction_price",
+    "meter_sale_price",
+    "deal_year",
+    "building_rooms_count",
+    "same_rooms_count_in_building",
+]
+
+# Колонки, которые переносятся из staging в MergedTransaction как есть
+_COPIED_COLUMNS = STAGING_COLUMNS[1:]
+
+
+def iter_csv_rows(path, offset: int = 0) -> Iterator[Tuple[dict, int]]:
+    """
+    Строки CSV как dict (как csv.DictReader) + байтовый offset конца строки.
+    offset > 0 - продолжить с этого места (заголовок читается всегда).
+    csv.reader забирает строки файла по одной и не читает вперёд, поэтому
+    offset после каждой записи точный, даже для многострочных полей.
+    """
+    with open(path, mode="rb") as f:
+        fieldnames = next(csv.reader([f.readline().decode("utf-8-sig")]))
+        pos = max(offset, f.tell())
+        f.seek(pos)
+
+        def lines():
+            nonlocal pos
+            for raw in f:
+                pos += len(raw)
+                yield raw.decode("utf-8")
+
+        for values in csv.reader(lines()):
+            if not values:
+                continue
+            yield dict(zip(fieldnames, values)), pos
+
+
+def _table(model) -> str:
+    return connection.ops.quote_name(model._meta.db_table)
+
+
+def _clear_staging(cursor, after_row: Optional[int] = None):
+    table = _table(MergedTransactionStaging)
+    if after_row is not None:
+        cursor.execute(f"DELETE FROM {table} WHERE row_number > %s", [after_row])
+    elif connection.vendor == "postgresql":
+        cursor.execute(f"TRUNCATE {table}")
+    else:
+        cursor.execute(f"DELETE FROM {table}")
+
+
+@contextmanager
+def staging_lock():
+    """
+    Один импорт в staging за раз. PostgreSQL - сессионный advisory lock: он
+    держится через транзакции пачек и снимается сам, если процесс упал.
+    SQLite (dev) - без блокировки.
+    """
+    if connection.vendor != "postgresql":
+        yield
+        return
+    key = MergedTransactionStaging._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_try_advisory_lock(hashtext(%s))", [key])
+        if not cursor.fetchone()[0]:
+            raise ValueError("Another import is already staging transactions")
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_unlock(hashtext(%s))", [key])
+
+
+def write_staging(rows: List[tuple]):
+    """Пишет пачку строк (порядок - STAGING_COLUMNS) в staging."""
+    if not rows:
+        return
+    table = _table(MergedTransactionStaging)
+    columns = ", ".join(STAGING_COLUMNS)
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            # psycopg 3: COPY в разы быстрее INSERT
+            with cursor.copy(f"COPY {table} ({columns}) FROM STDIN") as copy:
+                for row in rows:
+                    copy.write_row(row)
+        else:
+            placeholders = ", ".join(["%s"] * len(STAGING_COLUMNS))
+            cursor.executemany(
+                f"INSERT INTO {table} ({columns}) VALUES ({placeholders})", rows
+            )
+
+
+def start_staging(
+    csv_import: Optional[CsvImport], source_size: int
+) -> Tuple[int, int]:
+    """
+    Готовит staging и возвращает (offset, rows), с которых читать CSV.
+    Продолжаем, только если есть checkpoint для файла того же размера,
+    иначе staging очищается и загрузка идёт с начала.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        if (
+            csv_import is not None
+            and csv_import.checkpoint_offset
+            and csv_import.source_size == source_size
+        ):
+            # строки после checkpoint могли остаться от чужого запуска
+            _clear_staging(cursor, after_row=csv_import.checkpoint_rows)
+            return csv_import.checkpoint_offset, csv_import.checkpoint_rows
+
+        _clear_staging(cursor)
+        if csv_import is not None:
+            CsvImport.objects.filter(pk=csv_import.pk).update(
+                checkpoint_offset=0, checkpoint_rows=0, source_size=source_size
+            )
+    return 0, 0
+
+
+def commit_chunk(
+    rows: List[tuple], csv_import: Optional[CsvImport], offset: int, row_count: int
+):
+    """Пачка строк + checkpoint - одной транзакцией."""
+    with transaction.atomic():
+        write_staging(rows)
+        if csv_import is not None:
+            CsvImport.objects.filter(pk=csv_import.pk).update(
+                checkpoint_offset=offset, checkpoint_rows=row_count
+            )
+
+
+def _liquidity_records(qs) -> List[BuildingLiquidityParameterOne]:
+    """Число сделок здания в (год, месяц) по qs - одним GROUP BY."""
+    rows = (
+        qs.filter(building_id__isnull=False)
+        .annotate(
+            _year=ExtractYear("date_of_transaction"),
+            _month=ExtractMonth("date_of_transaction"),
+        )
+        .order_by()
+        .values_list("building_id", "_year", "_month")
+        .annotate(cnt=Count("pk"))
+    )
+    return [
+        BuildingLiquidityParameterOne(
+            building_id=building_id,
+            year=year,
+            month=month,
+            liquidity_parameter_one=cnt,
+        )
+        for building_id, year, month, cnt in rows.iterator()
+    ]
+
+
+def replace_liquidity(records: List[BuildingLiquidityParameterOne]):
+    BuildingLiquidityParameterOne.objects.all().delete()
+    BuildingLiquidityParameterOne.objects.bulk_create(records, batch_size=5000)
+
+
+def rebuild_liquidity():
+    """BuildingLiquidityParameterOne заново по живым сделкам (после отката)."""
+    sales = MergedTransaction.objects.filter(transaction_type="sales")
+    with transaction.atomic():
+        replace_liquidity(_liquidity_records(sales))
+
+
+def _insert_from_staging(cursor, target: str):
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    columns = ", ".join(_COPIED_COLUMNS)
+    cursor.execute(
+        f"INSERT INTO {connection.ops.quote_name(target)} "
+        f"(created_at, updated_at, transaction_type, {columns}) "
+        f"SELECT %s, %s, 'sales', {columns} "
+        f"FROM {_table(MergedTransactionStaging)} ORDER BY row_number",
+        [now, now],
+    )
+
+
+def replace_sales_from_staging(
+    csv_import: Optional[CsvImport] = None, shadow: bool = False
+) -> int:
+    """
+    Одной транзакцией заменяет MergedTransaction и
+    BuildingLiquidityParameterOne данными из staging, затем очищает staging
+    и checkpoint. Возвращает число перенесённых сделок.
+
+    shadow=True - сделки грузятся в теневую таблицу и после проверки
+    подменяют живую (table_swap.swap_in_shadow); если проверка не прошла -
+    ShadowValidationError, живые данные и staging остаются как были.
+    """
+    staged = MergedTransactionStaging.objects.count()
+    if not staged:
+        raise ValueError("Staging is empty - refusing to replace transactions")
+
+    liquidity = _liquidity_records(MergedTransactionStaging.objects.all())
+    if shadow:
+        shadow_table = create_shadow(MergedTransaction)
+        with transaction.atomic(), connection.cursor() as cursor:
+            _insert_from_staging(cursor, shadow_table)
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        if shadow:
+            swap_in_shadow(MergedTransaction)
+        else:
+            cursor.execute(f"DELETE FROM {_table(MergedTransaction)}")
+            _insert_from_staging(cursor, MergedTransaction._meta.db_table)
+        replace_liquidity(liquidity)
+        _clear_staging(cursor)
+        if csv_import is not None:
+            CsvImport.objects.filter(pk=csv_import.pk).update(
+                checkpoint_offset=0, checkpoint_rows=0, source_size=None
+            )
+    logger.info(
+        "Replaced sales transactions: %s rows, %s liquidity records",
+        staged,
+        len(liquidity),
+    )
+    return staged
@@ -1,5 +1,5 @@
 from django.urls import path
-from django.views.decorators.cache import cache_page
+from realty.main.data_generation import cache_page_for_generation
 from realty.pfimport.views import pf_listings_rent_view
 from realty.pfimport.views import pf_listings_sale_view
 
@@ -24,27 +24,27 @@ urlpatterns = [
     # path('details/<str:metric>/', views.rental_transaction_metric_detail, name='rental_transaction_metric_detail'),
     path(
         "pf-listings/sale/",
-        cache_page(3600)(pf_listings_sale_view),
+        cache_page_for_generation(3600, "listings")(pf_listings_sale_view),
         name="pf_listings_sale_view",
     ),
     path(
         "pf-listings/rent/",
-        cache_page(3600)(pf_listings_rent_view),
+        cache_page_for_generation(3600, "listings")(pf_listings_rent_view),
         name="pf_listings_rent_view",
     ),
     path(
         "pf-listings/creative_sale/",
-        cache_page(360)(creative_pf_listings_sale_view),
+        cache_page_for_generation(360, "listings")(creative_pf_listings_sale_view),
         name="creative_pf_listings_sale_view",
     ),
     path(
         "pf-listings/creative_rent/",
-        cache_page(360)(creative_pf_listings_rent_view),
+        cache_page_for_generation(360, "listings")(creative_pf_listings_rent_view),
         name="creative_pf_listings_rent_view",
     ),
     path(
         "pf-listings/creative_sale_2/",
-        cache_page(3600)(creative_pf_listings_sale_view_2),
+        cache_page_for_generation(3600, "listings")(creative_pf_listings_sale_view_2),
         name="creative_pf_listings_sale_view_2",
     ),
 ]
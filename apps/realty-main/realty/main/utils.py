@@ -1,12 +1,19 @@
 # utils.py
+import hashlib
 from datetime import datetime
 from enum import Enum
 from typing import List
+from typing import NamedTuple
 from typing import Optional
+from typing import Tuple
 from typing import Union
 
 import strawberry
 from dateutil.relativedelta import relativedelta
+from django.core.cache import cache
+from django.db.models import Q
+from django.db.models import QuerySet
+from realty.main.data_generation import data_generation
 from realty.main.models import Area
 from realty.main.models import Building
 from realty.main.models import MergedRentalTransaction
@@ -88,11 +95,171 @@ class FakeQuerySet:
         return self
 
 
+ENTITY_RESOLUTION_TIMEOUT = 60 * 10  # 10 minutes
+
+
+class ResolvedEntity(NamedTuple):
+    """
+    search_substring, разрешённый в сущность: kind - "all" (поиска нет),
+    "area" / "building" / "project" или "none" (ничего не нашли).
+    area_ids - районы сущности (reference для VERSUS у здания/проекта).
+    """
+
+    kind: str
+    id: Optional[int] = None
+    area_ids: Tuple[int, ...] = ()
+
+    @property
+    def found(self) -> bool:
+        return self.kind != "none"
+
+    @property
+    def is_building_or_project(self) -> bool:
+        return self.kind in ("building", "project")
+
+    def filter_q(self) -> Optional[Q]:
+        """
+        Q() - поиска нет; None - ничего не нашли (результат должен быть пустым).
+        Лукапы building__* одинаково работают для сделок и TransactionMonthlyRollup.
+        """
+        if self.kind == "area":
+            return Q(building__area_id=self.id)
+        if self.kind == "building":
+            return Q(building_id=self.id)
+        if self.kind == "project":
+            return Q(building__project_id=self.id)
+        return Q() if self.kind == "all" else None
+
+
+ALL_ENTITIES = ResolvedEntity("all")
+
+
+def _lookup_entity(search_str: str) -> ResolvedEntity:
+    """
+    Первое совпадение (по pk): Area.name_en / name_ar, затем
+    Building.english_name, затем Project.english_name.
+    """
+    area_id = (
+        Area.objects.filter(
+            Q(name_en__icontains=search_str) | Q(name_ar__icontains=search_str)
+        )
+        .order_by("pk")
+        .values_list("pk", flat=True)
+        .first()
+    )
+    if area_id is not None:
+        return ResolvedEntity("area", area_id, (area_id,))
+    building = (
+        Building.objects.filter(english_name__icontains=search_str)
+        .order_by("pk")
+        .values_list("pk", "area_id")
+        .first()
+    )
+    if building is not None:
+        pk, area_id = building
+        return ResolvedEntity("building", pk, (area_id,) if area_id else ())
+    project_id = (
+        Project.objects.filter(english_name__icontains=search_str)
+        .order_by("pk")
+        .values_list("pk", flat=True)
+        .first()
+    )
+    if project_id is not None:
+        area_ids = (
+            Building.objects.filter(project_id=project_id, area_id__isnull=False)
+            .order_by("area_id")
+            .values_list("area_id", flat=True)
+            .distinct()
+        )
+        return ResolvedEntity("project", project_id, tuple(area_ids))
+    return ResolvedEntity("none")
+
+
+def resolve_search_entity(search_substring: Optional[str]) -> ResolvedEntity:
+    """
+    Разрешает search_substring в сущность один раз на запрос; результат
+    кэшируется на ENTITY_RESOLUTION_TIMEOUT в пределах поколения данных sales
+    (регистр и пробелы по краям не важны - поиск icontains).
+    """
+    if not (search_substring and search_substring.strip()):
+        return ALL_ENTITIES
+    search_str = search_substring.strip()
+    digest = hashlib.md5(search_str.casefold().encode()).hexdigest()
+    # сущности меняют импорты продаж (здания, проекты, районы)
+    cache_key = f"entity_resolution_{data_generation('sales')}_{digest}"
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return ResolvedEntity(*cached)
+    entity = _lookup_entity(search_str)
+    cache.set(cache_key, tuple(entity), ENTITY_RESOLUTION_TIMEOUT)
+    return entity
+
+
+def _search_filter_q(
+    search_substring: Optional[str], entity: Optional[ResolvedEntity] = None
+) -> Optional[Q]:
+    """
+    Поиск по search_substring (см. resolve_search_entity).
+    Q() - поиска нет; None - ничего не нашли (результат должен быть пустым).
+    """
+    if entity is None:
+        entity = resolve_search_entity(search_substring)
+    return entity.filter_q()
+
+
+def _apply_search_filters(
+    qs: QuerySet,
+    search_q: Optional[Q],
+    property_components: Optional[List[str]],
+) -> QuerySet:
+    if search_q is None:
+        return qs.none()
+    qs = qs.filter(search_q)
+    if property_components and len(property_components) > 0:
+        qs = qs.filter(number_of_rooms__in=property_components)
+    return qs
+
+
+def _transactions_queryset(transaction_type: str) -> QuerySet:
+    if transaction_type == "rental":
+        return MergedRentalTransaction.objects.all()
+    return MergedTransaction.objects.filter(transaction_type="sales")
+
+
+def _build_base_queryset(
+    transaction_type: str,
+    search_substring: Optional[str],
+    property_components: Optional[List[str]],
+    periods: Optional[str] = None,
+    entity: Optional[ResolvedEntity] = None,
+) -> QuerySet:
+    """
+    Настоящий QuerySet по сделкам без обёрток:
+      - "rental" -> MergedRentalTransaction
+      - иначе   -> MergedTransaction(transaction_type="sales")
+
+    Фильтры поиска - см. _search_filter_q (entity - уже разрешённый
+    search_substring). Если ничего не нашли - пустой QuerySet.
+    Используется агрегатором (см. aggregator.aggregate_periods), чтобы
+    считать статистику в SQL, а не по списку объектов.
+    """
+    qs = _apply_search_filters(
+        _transactions_queryset(transaction_type),
+        _search_filter_q(search_substring, entity),
+        property_components,
+    )
+    if periods:
+        start_date, end_date = _get_period_range(periods)
+        qs = qs.filter(date_of_transaction__range=(start_date, end_date))
+    return qs
+
+
 def _build_transactions_queryset(
     transaction_type: str,
     search_substring: Optional[str],
     property_components: Optional[List[str]],
     periods: Optional[str],
+    entity: Optional[ResolvedEntity] = None,
 ) -> Union[List[MergedTransaction], FakeQuerySet]:
     """
     Если transaction_type == "rental", берём объекты MergedRentalTransaction,
@@ -102,70 +269,25 @@ def _build_transactions_queryset(
 
     Иначе (sales) – возвращаем обычный QuerySet MergedTransaction.
     """
-    if transaction_type == "rental":
-        qs_r = MergedRentalTransaction.objects.all()
-        if search_substring and search_substring.strip():
-            area = Area.objects.filter(name_en__icontains=search_substring).first()
-            if area:
-                qs_r = qs_r.filter(building__area=area)
-            else:
-                building = Building.objects.filter(
-                    english_name__icontains=search_substring
-                ).first()
-                if building:
-                    qs_r = qs_r.filter(building=building)
-                else:
-                    project = Project.objects.filter(
-                        english_name__icontains=search_substring
-                    ).first()
-                    if project:
-                        qs_r = qs_r.filter(building__project=project)
-                    else:
-                        return FakeQuerySet([], model=MergedTransaction)
-        if property_components and len(property_components) > 0:
-            qs_r = qs_r.filter(number_of_rooms__in=property_components)
-        if periods:
-            start_date, end_date = _get_period_range(periods)
-            qs_r = qs_r.filter(date_of_transaction__range=(start_date, end_date))
-        fake_list = []
-        for rent_obj in qs_r:
-            fake_obj = MergedTransaction(
-                transaction_type="rental",
-                building=rent_obj.building,
-                date_of_transaction=rent_obj.date_of_transaction,
-                building_name=rent_obj.building_name,
-                location_name=rent_obj.location_name,
-                number_of_rooms=rent_obj.number_of_rooms,
-                sqm=rent_obj.sqm,
-                period=rent_obj.period,
-                meter_sale_price=rent_obj.meter_sale_price,
-            )
-            fake_obj._rental_data = rent_obj
-            fake_list.append(fake_obj)
-        return FakeQuerySet(fake_list, model=MergedTransaction)
-    else:
-        qs = MergedTransaction.objects.filter(transaction_type="sales")
-        if search_substring and search_substring.strip():
-            area = Area.objects.filter(name_en__icontains=search_substring).first()
-            if area:
-                qs = qs.filter(building__area=area)
-            else:
-                building = Building.objects.filter(
-                    english_name__icontains=search_substring
-                ).first()
-                if building:
-                    qs = qs.filter(building=building)
-                else:
-                    project = Project.objects.filter(
-                        english_name__icontains=search_substring
-                    ).first()
-                    if project:
-                        qs = qs.filter(building__project=project)
-                    else:
-                        return qs.none()
-        if property_components and len(property_components) > 0:
-            qs = qs.filter(number_of_rooms__in=property_components)
-        if periods:
-            start_date, end_date = _get_period_range(periods)
-            qs = qs.filter(date_of_transaction__range=(start_date, end_date))
+    qs = _build_base_queryset(
+        transaction_type, search_substring, property_components, periods, entity
+    )
+    if transaction_type != "rental":
         return qs
+
+    fake_list = []
+    for rent_obj in qs:
+        fake_obj = MergedTransaction(
+            transaction_type="rental",
+            building=rent_obj.building,
+            date_of_transaction=rent_obj.date_of_transaction,
+            building_name=rent_obj.building_name,
+            location_name=rent_obj.location_name,
+            number_of_rooms=rent_obj.number_of_rooms,
+            sqm=rent_obj.sqm,
+            period=rent_obj.period,
+            meter_sale_price=rent_obj.meter_sale_price,
+        )
+        fake_obj._rental_data = rent_obj
+        fake_list.append(fake_obj)
+    return FakeQuerySet(fake_list, model=MergedTransaction)
@@ -15,6 +15,7 @@ from .models import Building
 from .models import MergedRentalTransaction
 from .models import MergedTransaction
 from .models import Project
+from .search_index import search_entities
 
 
 def rental_transactions_list(request):
@@ -425,16 +426,11 @@ def rental_transactions_list(request):
 def autocomplete_suggestions(request):
     """Возвращает JSON с подсказками для автокомплита: Areas, Buildings, Projects."""
     query = request.GET.get("q", "").strip()
-    suggestions = {"areas": [], "buildings": [], "projects": []}
-    if query:
-        areas = Area.objects.filter(name_en__icontains=query)[:5]
-        suggestions["areas"] = [{"id": a.id, "name": a.name_en} for a in areas]
-        buildings = Building.objects.filter(english_name__icontains=query)[:5]
-        suggestions["buildings"] = [
-            {"id": b.id, "name": b.english_name} for b in buildings
-        ]
-        projects = Project.objects.filter(english_name__icontains=query)[:5]
-        suggestions["projects"] = [
-            {"id": p.id, "name": p.english_name} for p in projects
+    hits = search_entities(query, limit=5)
+    suggestions = {
+        f"{entity_type}s": [
+            {"id": hit.entity_id, "name": hit.name_en or hit.name_ar} for hit in found
         ]
+        for entity_type, found in hits.items()
+    }
     return JsonResponse(suggestions)
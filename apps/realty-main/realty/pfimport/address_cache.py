@@ -0,0 +1,213 @@
+"""
+Разрешение displayAddress объявлений PF в район и здание при импорте.
+
+Строка адреса разбирается один раз за всё время жизни базы:
+  - AddressAlias (адрес -> area_id, building_id) хранит результат между
+    импортами и процессами;
+  - LRU процесса (ALIAS_LRU_SIZE записей) - поверх него, общий для всех
+    импортов в процессе; новые алиасы попадают в него только после commit,
+    чтобы откат импорта не оставил в LRU ссылок на несохранённые записи.
+AddressResolver.prefetch(addresses) на пачку: известные адреса - один запрос
+алиасов (только промахи LRU) и in_bulk районов / зданий по id; новые
+разбираются правилом импорта, их районы и здания ищутся по именам одним
+запросом на модель. Всех Area / Building заранее не грузим.
+
+Ключ - адрес со схлопнутыми пробелами; имена из разбора интернируются
+(пачка повторяет одни и те же районы и здания).
+"""
+
+import re
+import sys
+import threading
+from collections import OrderedDict
+from functools import partial
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from django.db import transaction
+
+from .models import AddressAlias, Area, Building
+
+ALIAS_LRU_SIZE = 100_000
+ADDRESS_MAX_LENGTH = AddressAlias._meta.get_field("address").max_length
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# (parser, адрес) -> (area_id, building_id)
+_aliases = OrderedDict()
+_aliases_lock = threading.Lock()
+
+
+def normalize_address(address: str) -> str:
+    return sys.intern(_WHITESPACE_RE.sub(" ", address or "").strip())
+
+
+def _lru_get(key) -> Optional[Tuple[int, Optional[int]]]:
+    with _aliases_lock:
+        ids = _aliases.get(key)
+        if ids is not None:
+            _aliases.move_to_end(key)
+        return ids
+
+
+def _lru_set(key, ids: Tuple[int, Optional[int]]):
+    with _aliases_lock:
+        _aliases[key] = ids
+        _aliases.move_to_end(key)
+        while len(_aliases) > ALIAS_LRU_SIZE:
+            _aliases.popitem(last=False)
+
+
+def _lru_update(parser: str, aliases: Dict[str, Tuple[int, Optional[int]]]):
+    for key, ids in aliases.items():
+        _lru_set((parser, key), ids)
+
+
+class AddressResolver:
+    """
+    Кэш адресов на один импорт:
+
+        resolver = AddressResolver("pfjson", parse)
+        names = resolver.prefetch(addresses)     # {адрес: (здание, район)}
+        area = resolver.areas.get(area_name)     # район по имени
+        building = resolver.buildings.get((building_name, area_name))
+        ...                                      # создание недостающих
+        resolver.remember(address, area, building)
+        resolver.flush()                         # новые алиасы - в базу
+
+    parse(address) -> (имя здания, имя района) - правило разбора импорта,
+    parser - его имя: алиасы разных правил не смешиваются.
+    """
+
+    def __init__(self, parser: str, parse: Callable[[str], Tuple[str, str]]):
+        self.parser = parser
+        self.parse = parse
+        # объекты живут весь импорт: на них копятся счётчики
+        self.areas: Dict[str, Area] = {}
+        self.buildings: Dict[Tuple[str, str], Building] = {}
+        self._areas_by_id: Dict[int, Area] = {}
+        self._buildings_by_id: Dict[int, Building] = {}
+        self._known = set()  # ключи, алиасы которых уже в базе
+        self._new_aliases: Dict[str, Tuple[int, Optional[int]]] = {}
+
+    def _parse(self, address: str) -> Tuple[str, str]:
+        building_name, area_name = self.parse(address)
+        return sys.intern(building_name), sys.intern(area_name)
+
+    def _alias_ids(self, keys: Iterable[str]) -> Dict[str, Tuple[int, Optional[int]]]:
+        ids, missing = {}, []
+        for key in keys:
+            hit = _lru_get((self.parser, key))
+            if hit is None:
+                missing.append(key)
+            else:
+                ids[key] = hit
+        if missing:
+            rows = AddressAlias.objects.filter(
+                parser=self.parser, address__in=missing
+            ).values_list("address", "area_id", "building_id")
+            for key, area_id, building_id in rows:
+                ids[key] = (area_id, building_id)
+                _lru_set((self.parser, key), (area_id, building_id))
+        return ids
+
+    def _load_by_id(self, ids: Iterable[Tuple[int, Optional[int]]]):
+        area_ids, building_ids = set(), set()
+        for area_id, building_id in ids:
+            area_ids.add(area_id)
+            if building_id is not None:
+                building_ids.add(building_id)
+        area_ids -= self._areas_by_id.keys()
+        building_ids -= self._buildings_by_id.keys()
+        for area in Area.objects.in_bulk(area_ids).values():
+            self._areas_by_id[area.pk] = self.areas.setdefault(area.name, area)
+        for building in Building.objects.in_bulk(building_ids).values():
+            area = self._areas_by_id.get(building.area_id)
+            if area is None:
+                continue
+            key = (building.name, area.name)
+            self._buildings_by_id[building.pk] = self.buildings.setdefault(
+                key, building
+            )
+
+    def _load_by_name(self, names: Iterable[Tuple[str, str]]):
+        area_names = {area for _, area in names if area} - self.areas.keys()
+        for area in Area.objects.filter(name__in=area_names):
+            self.areas.setdefault(area.name, area)
+            self._areas_by_id.setdefault(area.pk, area)
+        keys = {
+            (building, area)
+            for building, area in names
+            if building and area in self.areas
+        } - self.buildings.keys()
+        if not keys:
+            return
+        candidates = Building.objects.filter(
+            name__in={building for building, _ in keys},
+            area__name__in={area for _, area in keys},
+        ).select_related("area")
+        for building in candidates:
+            key = (building.name, building.area.name)
+            if key in keys:
+                self.buildings.setdefault(key, building)
+                self._buildings_by_id.setdefault(building.pk, building)
+
+    def prefetch(self, addresses: Iterable[str]) -> Dict[str, Tuple[str, str]]:
+        """
+        {адрес: (имя здания, имя района)} для пачки; районы и здания этих
+        адресов, которые уже есть в базе, - в self.areas / self.buildings.
+        """
+        keys = {address: normalize_address(address) for address in set(addresses)}
+        alias_ids = self._alias_ids(set(keys.values()))
+        self._load_by_id(alias_ids.values())
+
+        names, parsed = {}, {}
+        for address, key in keys.items():
+            ids = alias_ids.get(key)
+            if ids is not None:
+                area = self._areas_by_id.get(ids[0])
+                building = self._buildings_by_id.get(ids[1]) if ids[1] else None
+                # алиас ведёт на удалённую запись - разбираем заново
+                if area is not None and (
+                    not ids[1] or building is not None and building.area_id == area.pk
+                ):
+                    self._known.add(key)
+                    names[address] = (building.name if building else "", area.name)
+                    continue
+            parsed[address] = self._parse(address)
+        self._load_by_name(parsed.values())
+        names.update(parsed)
+        return names
+
+    def remember(
+        self, address: str, area: Optional[Area], building: Optional[Building]
+    ):
+        """Адрес разрешён в сохранённые area / building - алиас для flush()."""
+        if area is None or area.pk is None or (building and building.pk is None):
+            return
+        key = normalize_address(address)
+        if key in self._known or not key or len(key) > ADDRESS_MAX_LENGTH:
+            return
+        self._areas_by_id.setdefault(area.pk, area)
+        if building is not None:
+            self._buildings_by_id.setdefault(building.pk, building)
+        self._new_aliases[key] = (area.pk, building.pk if building else None)
+
+    def flush(self):
+        """Новые алиасы - в AddressAlias, в LRU процесса - после commit."""
+        if not self._new_aliases:
+            return
+        AddressAlias.objects.bulk_create(
+            [
+                AddressAlias(
+                    parser=self.parser,
+                    address=key,
+                    area_id=area_id,
+                    building_id=building_id,
+                )
+                for key, (area_id, building_id) in self._new_aliases.items()
+            ],
+            ignore_conflicts=True,
+        )
+        transaction.on_commit(partial(_lru_update, self.parser, self._new_aliases))
+        self._known.update(self._new_aliases)
+        self._new_aliases = {}
@@ -0,0 +1,240 @@
+"""
+Асинхронная загрузка страниц PF для скраперов (httpx.AsyncClient).
+
+FetchEngine держит один пул соединений и дозирует нагрузку на сайт:
+  - rate / burst - token bucket на хост: в среднем не больше rate запросов
+    в секунду, до burst подряд;
+  - concurrency - не больше стольких запросов в полёте (и соединений в пуле);
+  - 429 / 5xx / сетевые ошибки - повтор с экспоненциальной задержкой со
+    случайным разбросом (full jitter), Retry-After учитывается; на 429 и
+    страницу блокировки пауза ставится всему хосту, а не одному запросу.
+Скорость задаёт rate, а не число потоков: concurrency нужна только чтобы
+перекрыть время ответа (хватает rate × среднее время ответа).
+
+    stats = fetch_pages(urls, on_response, rate=2, concurrency=8)
+
+extract_first_script(html) достаёт JSON из первого <script> в <body> без
+построения дерева BeautifulSoup.
+"""
+
+import asyncio
+import logging
+import random
+import re
+import time
+from email.utils import parsedate_to_datetime
+from itertools import islice
+from typing import AsyncIterator, Callable, Dict, Iterable, Optional, Tuple
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+_BODY_RE = re.compile(r"<body\b", re.IGNORECASE)
+_SCRIPT_RE = re.compile(r"<script\b[^>]*>(.*?)</script\s*>", re.IGNORECASE | re.DOTALL)
+
+
+def extract_first_script(html: str) -> str:
+    """
+    Текст первого <script> внутри <body> начиная с первой "{" ("" - нет),
+    как soup.body.find("script").string, но без разбора всей страницы.
+    """
+    body = _BODY_RE.search(html)
+    script = _SCRIPT_RE.search(html, body.end() if body else 0)
+    if not script:
+        return ""
+    text = script.group(1)
+    idx = text.find("{")
+    return text[idx:] if idx >= 0 else ""
+
+
+def _retry_after(response: httpx.Response) -> float:
+    """Retry-After в секундах (число или HTTP-дата), 0 - заголовка нет."""
+    value = response.headers.get("retry-after")
+    if not value:
+        return 0.0
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class TokenBucket:
+    """rate токенов в секунду, в запасе не больше burst; rate <= 0 - без лимита."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        # ожидающие встают в очередь на lock - токены выдаются по порядку
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                elapsed = now - self.updated
+                self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Ни одного токена ближайшие seconds секунд (429, блокировка)."""
+        if self.rate > 0:
+            self.tokens = min(self.tokens, 0.0)
+            self.updated = max(self.updated, time.monotonic() + seconds)
+
+
+class FetchEngine:
+    """
+    Пул соединений + лимиты на хост + повторы:
+
+        async with FetchEngine(rate=2, concurrency=8, headers=...) as engine:
+            async for url, response in engine.fetch_many(urls):
+                ...
+
+    fetch() отдаёт ответ с любым статусом вне RETRY_STATUSES (404 и т.п.
+    проверяет вызывающий) или None, если попытки кончились.
+    """
+
+    def __init__(
+        self,
+        rate: float = 1.0,
+        burst: int = 1,
+        concurrency: int = 4,
+        retries: int = 3,
+        backoff: float = 1.0,
+        max_backoff: float = 60.0,
+        timeout: float = 30.0,
+        headers: Optional[Dict[str, str]] = None,
+        cookies: Optional[Dict[str, str]] = None,
+        is_blocked: Optional[Callable[[httpx.Response], bool]] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = max(concurrency, 1)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.is_blocked = is_blocked
+        self._client_options = {
+            "headers": headers,
+            "cookies": cookies,
+            "timeout": timeout,
+            "follow_redirects": True,
+            "limits": httpx.Limits(
+                max_connections=self.concurrency,
+                max_keepalive_connections=self.concurrency,
+            ),
+            "transport": transport,
+        }
+        self.client: Optional[httpx.AsyncClient] = None
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.stats = {"requests": 0, "retries": 0, "errors": 0}
+
+    async def __aenter__(self):
+        self.client = httpx.AsyncClient(**self._client_options)
+        self._slots = asyncio.Semaphore(self.concurrency)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.client.aclose()
+
+    def _bucket(self, url: str) -> TokenBucket:
+        host = httpx.URL(url).host
+        if host not in self._buckets:
+            self._buckets[host] = TokenBucket(self.rate, self.burst)
+        return self._buckets[host]
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+
+    async def fetch(self, url: str) -> Optional[httpx.Response]:
+        bucket = self._bucket(url)
+        for attempt in range(self.retries + 1):
+            await bucket.acquire()
+            self.stats["requests"] += 1
+            try:
+                async with self._slots:
+                    response = await self.client.get(url)
+            except httpx.TransportError as e:  # в т.ч. таймауты
+                reason, delay = repr(e), self._backoff(attempt)
+            else:
+                blocked = self.is_blocked is not None and self.is_blocked(response)
+                if response.status_code not in RETRY_STATUSES and not blocked:
+                    return response
+                reason = "blocked" if blocked else f"HTTP {response.status_code}"
+                delay = max(_retry_after(response), self._backoff(attempt))
+                if blocked or response.status_code == 429:
+                    bucket.pause(delay)
+            if attempt == self.retries:
+                break
+            self.stats["retries"] += 1
+            logger.warning(
+                "%s for %s, retry %s in %.1fs", reason, url, attempt + 1, delay
+            )
+            await asyncio.sleep(delay)
+        self.stats["errors"] += 1
+        logger.error("Failed to fetch %s after %s attempts", url, self.retries + 1)
+        return None
+
+    async def _fetch_pair(self, url: str):
+        return url, await self.fetch(url)
+
+    async def fetch_many(
+        self, urls: Iterable[str]
+    ) -> AsyncIterator[Tuple[str, Optional[httpx.Response]]]:
+        """
+        (url, ответ) в порядке готовности. urls читаются лениво, не больше
+        concurrency наперёд - генератор urls может остановиться по ходу
+        (например, после пустой страницы поиска).
+        """
+        urls = iter(urls)
+        pending = set()
+        try:
+            while True:
+                for url in islice(urls, self.concurrency - len(pending)):
+                    pending.add(asyncio.ensure_future(self._fetch_pair(url)))
+                if not pending:
+                    return
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+def fetch_pages(
+    urls: Iterable[str],
+    on_response: Callable[[str, Optional[httpx.Response]], None],
+    **engine_options,
+) -> Dict[str, int]:
+    """
+    Синхронная обёртка для management-команд: on_response(url, ответ) для
+    каждой страницы в порядке готовности; возвращает engine.stats.
+    """
+
+    async def run():
+        async with FetchEngine(**engine_options) as engine:
+            async for url, response in engine.fetch_many(urls):
+                on_response(url, response)
+            return engine.stats
+
+    return asyncio.run(run())
@@ -0,0 +1,193 @@
+"""
+Инкрементальный скрапинг PF по отпечаткам карточек выдачи.
+
+Страница поиска уже содержит (в JSON первого <script>) цену, дату
+обновления и share_url каждого объявления. По ним считается отпечаток
+(card_fingerprint), и страница объявления качается только если объявление
+новое, изменилось или вернулось после снятия:
+
+    cards = extract_search_cards(html)              # со всех страниц поиска
+    todo = plan_detail_fetches("rent", cards, started)
+    ...                                             # качаем todo
+    remember_fetched(fetched_cards)                 # ждут импорта
+    mark_delisted("rent", started)                  # только после полного обхода
+    ...
+    confirm_imported(listing_ids)                   # PFJsonUpload после записи
+
+Отпечаток скачанной страницы становится текущим только когда объявление
+записано импортом: если импорт упал или файл потерялся, изменившиеся
+объявления скачиваются снова при следующем запуске.
+
+Объявления, которых не было в полном обходе поиска, получают delisted_at
+(ListingFingerprint и PFListSale / PFListRent) - days_on_market считается
+до снятия, а не до сегодня.
+"""
+
+import hashlib
+import json
+from datetime import datetime
+from typing import Dict, List
+from urllib.parse import parse_qs, urlparse
+
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery
+
+from .fetch import extract_first_script
+from .json_stream import batched
+from .models import ListingFingerprint, PFListRent, PFListSale
+
+LOOKUP_BATCH_SIZE = 1000
+
+# параметр c= поиска PF: 1 - продажа, 2 - аренда
+SEARCH_SCOPES = {"1": "sale", "2": "rent"}
+SCOPE_MODELS = {"sale": PFListSale, "rent": PFListRent}
+
+
+def search_scope(search_url: str) -> str:
+    """sale / rent по URL поиска PF."""
+    category = parse_qs(urlparse(search_url).query).get("c", [""])[0]
+    return SEARCH_SCOPES.get(category, "rent")
+
+
+def card_fingerprint(prop: dict) -> str:
+    """Хэш цены, даты обновления и share_url объявления из выдачи."""
+    price = (prop.get("price") or {}).get("value")
+    updated = prop.get("last_refreshed_at") or prop.get("listed_date")
+    url_hash = hashlib.sha1((prop.get("share_url") or "").encode()).hexdigest()
+    key = f"{price}|{updated}|{url_hash}"
+    return hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
+
+def extract_search_cards(html: str) -> List[dict]:
+    """
+    Карточки страницы поиска [{id, url, fingerprint}]; [] - JSON выдачи не
+    нашёлся (тогда страницы объявлений качаются по ссылкам, как раньше).
+    """
+    text = extract_first_script(html)
+    if not text:
+        return []
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        return []
+    listings = (
+        data.get("props", {})
+        .get("pageProps", {})
+        .get("searchResult", {})
+        .get("listings", [])
+    )
+    cards = []
+    for listing in listings:
+        prop = (listing or {}).get("property") or {}
+        listing_id, url = prop.get("id"), prop.get("share_url")
+        if listing_id and url:
+            cards.append(
+                {
+                    "id": str(listing_id),
+                    "url": url,
+                    "fingerprint": card_fingerprint(prop),
+                }
+            )
+    return cards
+
+
+def _stored(listing_ids: List[str]) -> Dict[str, ListingFingerprint]:
+    stored = {}
+    for batch in batched(listing_ids, LOOKUP_BATCH_SIZE):
+        stored.update(
+            ListingFingerprint.objects.in_bulk(batch, field_name="listing_id")
+        )
+    return stored
+
+
+def plan_detail_fetches(scope: str, cards: List[dict], seen_at: datetime) -> List[dict]:
+    """
+    Отмечает все карточки увиденными (last_seen = seen_at) и возвращает те,
+    чьи страницы нужно скачать: новые, изменившиеся и снятые ранее.
+    """
+    cards = list({card["id"]: card for card in cards}.values())
+    stored = _stored([card["id"] for card in cards])
+    todo, rows = [], []
+    for card in cards:
+        known = stored.get(card["id"])
+        if (
+            known is None
+            or known.fingerprint != card["fingerprint"]
+            or known.delisted_at is not None
+        ):
+            todo.append(card)
+        rows.append(
+            ListingFingerprint(
+                listing_id=card["id"],
+                scope=scope,
+                fingerprint=known.fingerprint if known else "",
+                first_seen=known.first_seen if known else seen_at,
+                last_seen=seen_at,
+            )
+        )
+    # delisted_at снимется, когда объявление импортируется заново
+    for batch in batched(rows, LOOKUP_BATCH_SIZE):
+        ListingFingerprint.objects.bulk_create(
+            batch,
+            update_conflicts=True,
+            unique_fields=["listing_id"],
+            update_fields=["scope", "last_seen"],
+        )
+    return todo
+
+
+def remember_fetched(cards: List[dict]):
+    """
+    Страницы cards скачаны: их отпечатки ждут импорта (pending_fingerprint),
+    текущими их делает confirm_imported.
+    """
+    fingerprints = {card["id"]: card["fingerprint"] for card in cards}
+    stored = _stored(list(fingerprints))
+    for known in stored.values():
+        known.pending_fingerprint = fingerprints[known.listing_id]
+    ListingFingerprint.objects.bulk_update(
+        stored.values(), ["pending_fingerprint"], batch_size=LOOKUP_BATCH_SIZE
+    )
+
+
+def confirm_imported(listing_ids: List[str]) -> int:
+    """
+    Объявления listing_ids записаны импортом: скачанные отпечатки становятся
+    текущими, снятые с публикации - снова в выдаче. Возвращает их число.
+    """
+    confirmed = 0
+    for batch in batched(listing_ids, LOOKUP_BATCH_SIZE):
+        confirmed += (
+            ListingFingerprint.objects.filter(listing_id__in=batch)
+            .exclude(pending_fingerprint="")
+            .update(
+                fingerprint=F("pending_fingerprint"),
+                pending_fingerprint="",
+                delisted_at=None,
+            )
+        )
+    return confirmed
+
+
+def mark_delisted(scope: str, seen_since: datetime) -> int:
+    """
+    Объявления scope, не попавшиеся с seen_since, сняты с публикации (дата
+    снятия - когда их видели последний раз). Вызывать только после полного
+    обхода поиска. Возвращает их число.
+    """
+    gone = ListingFingerprint.objects.filter(
+        scope=scope, last_seen__lt=seen_since, delisted_at__isnull=True
+    )
+    listing_ids = list(gone.values_list("listing_id", flat=True))
+    last_seen = ListingFingerprint.objects.filter(
+        listing_id=OuterRef("listing_id")
+    ).values("last_seen")[:1]
+    with transaction.atomic():
+        for batch in batched(listing_ids, LOOKUP_BATCH_SIZE):
+            ListingFingerprint.objects.filter(listing_id__in=batch).update(
+                delisted_at=F("last_seen")
+            )
+            SCOPE_MODELS[scope].objects.filter(
+                listing_id__in=batch, delisted_at__isnull=True
+            ).update(delisted_at=Subquery(last_seen))
+    return len(listing_ids)
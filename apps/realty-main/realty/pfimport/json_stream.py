@@ -0,0 +1,250 @@
+"""
+Потоковое чтение и запись выгрузок PF (scrape_properties, take_all).
+
+iter_json_items(path) отдаёт объявления по одному, не держа файл в памяти:
+  - JSON-массив "[{...}, {...}]" разбирается инкрементально (json.JSONDecoder
+    .raw_decode по буферу, который дочитывается кусками CHUNK_SIZE);
+  - NDJSON (один объект на строку) - построчно.
+Формат определяется по первому непробельному символу ("[" - массив), сжатие
+(.gz / .zst) - по расширению. batched(items, size) режет поток на пачки.
+
+ShardedNDJSONWriter пишет NDJSON-шарды {prefix}-00001.ndjson[.gz|.zst] и
+манифест {prefix}.manifest.json. Шард появляется под своим именем и в
+манифесте только дописанным, поэтому каждый шард можно импортировать
+отдельно и параллельно, не дожидаясь конца скрапинга; повторный запуск с
+тем же prefix дописывает новые шарды к манифесту.
+"""
+
+import gzip
+import io
+import json
+import os
+from itertools import chain, islice
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, TextIO, Union
+
+try:
+    import zstandard
+except ImportError:  # zstd - только если пакет установлен
+    zstandard = None
+
+CHUNK_SIZE = 1 << 20  # символов за одно чтение
+
+# сжатие шардов: имя -> расширение
+COMPRESSIONS = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+LISTING_SUFFIXES = (".json", ".ndjson", ".jsonl")
+MANIFEST_SUFFIX = ".manifest.json"
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+_AFTER_ITEM = ",]" + _WHITESPACE
+
+
+def batched(items: Iterable, size: int) -> Iterator[List]:
+    """Пачки по size элементов (последняя - короче)."""
+    it = iter(items)
+    while batch := list(islice(it, size)):
+        yield batch
+
+
+def _compression_of(path: Path) -> str:
+    for name, suffix in COMPRESSIONS.items():
+        if suffix and path.name.endswith(suffix):
+            return name
+    return "none"
+
+
+def open_text(
+    path: Union[str, Path], mode: str = "r", compression: Optional[str] = None
+):
+    """Текстовый файл utf-8; .gz / .zst (или compression) - со сжатием."""
+    path = Path(path)
+    compression = compression or _compression_of(path)
+    if compression == "gzip":
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    if compression == "zstd":
+        if zstandard is None:
+            raise ImportError("zstd shards need the 'zstandard' package")
+        raw = open(path, mode + "b")
+        if mode == "w":
+            stream = zstandard.ZstdCompressor().stream_writer(raw)
+        else:
+            stream = zstandard.ZstdDecompressor().stream_reader(raw)
+        return io.TextIOWrapper(stream, encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def is_listing_file(path: Union[str, Path]) -> bool:
+    """Выгрузка объявлений (.json / .ndjson / .jsonl, в т.ч. сжатая), не манифест."""
+    name = Path(path).name.lower()
+    if name.endswith(MANIFEST_SUFFIX):
+        return False
+    suffix = COMPRESSIONS[_compression_of(Path(name))]
+    return name[: len(name) - len(suffix)].endswith(LISTING_SUFFIXES)
+
+
+def manifest_shards(path: Union[str, Path]) -> List[Path]:
+    """Готовые шарды из манифеста ShardedNDJSONWriter."""
+    path = Path(path)
+    with open(path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    return [path.parent / shard["file"] for shard in manifest["shards"]]
+
+
+def iter_json_items(source: Union[str, Path, TextIO]) -> Iterator:
+    """Элементы JSON-массива или строки NDJSON из файла (путь или открытый)."""
+    if isinstance(source, (str, Path)):
+        with open_text(source) as f:
+            yield from iter_json_items(f)
+        return
+
+    head = source.read(CHUNK_SIZE)
+    # формат - по первому непробельному символу, пробелы перед ним могут
+    # занять целый кусок
+    while head and not head.strip(_WHITESPACE):
+        head = source.read(CHUNK_SIZE)
+    stripped = head.lstrip(_WHITESPACE)
+    if stripped.startswith("["):
+        yield from _iter_array(source, stripped[1:])
+    else:
+        yield from _iter_lines(source, head)
+
+
+def _iter_lines(f: TextIO, head: str) -> Iterator:
+    # head обрывается посреди строки - дочитываем её readline()
+    for line in chain((head + f.readline()).split("\n"), f):
+        if line.strip():
+            yield json.loads(line)
+
+
+def _iter_array(f: TextIO, buf: str) -> Iterator:
+    pos, eof, after_item = 0, False, False
+    while True:
+        while pos < len(buf) and buf[pos] in _WHITESPACE:
+            pos += 1
+        if pos == len(buf):
+            if eof:
+                raise json.JSONDecodeError("Unterminated JSON array", buf, pos)
+            buf, pos = f.read(CHUNK_SIZE), 0
+            eof = not buf
+            continue
+        if buf[pos] == "]":
+            return
+        if after_item:
+            if buf[pos] != ",":
+                raise json.JSONDecodeError("Expecting ',' delimiter", buf, pos)
+            pos, after_item = pos + 1, False
+            continue
+        try:
+            item, end = _decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            end = None
+        # элемент оборван концом буфера ("12" из "1234", "1" из "1e5") - за ним
+        # в буфере нет ",", "]" или пробела; дочитываем не меньше уже
+        # накопленного: длинный элемент не разбирается заново на каждом куске
+        complete = end is not None and (
+            eof or (end < len(buf) and buf[end] in _AFTER_ITEM)
+        )
+        if not complete:
+            chunk = f.read(max(CHUNK_SIZE, len(buf) - pos))
+            eof = not chunk
+            buf, pos = buf[pos:] + chunk, 0
+            continue
+        yield item
+        pos, after_item = end, True
+
+
+class ShardedNDJSONWriter:
+    """
+    Объявления -> NDJSON-шарды по shard_size строк + манифест:
+
+        with ShardedNDJSONWriter("/shared-data", "pf", compression="gzip") as out:
+            for item in items:
+                out.write(item)
+
+    Шард пишется в *.part и переименовывается, когда дописан; манифест
+    (format, compression, items, complete, shards: [{file, items, bytes}])
+    перезаписывается атомарно после каждого шарда. complete=True - только
+    после выхода из with без исключения.
+    """
+
+    def __init__(
+        self,
+        output_dir: Union[str, Path],
+        prefix: str,
+        shard_size: int = 5000,
+        compression: str = "none",
+    ):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression: {compression}")
+        if compression == "zstd" and zstandard is None:
+            raise ImportError("zstd shards need the 'zstandard' package")
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.prefix = prefix
+        self.shard_size = shard_size
+        self.compression = compression
+        self.manifest_path = self.output_dir / f"{prefix}{MANIFEST_SUFFIX}"
+        self.shards = []
+        if self.manifest_path.exists():  # дописываем к прошлому запуску
+            with open(self.manifest_path, encoding="utf-8") as f:
+                self.shards = json.load(f)["shards"]
+        self.count = sum(shard["items"] for shard in self.shards)
+        self._file: Optional[TextIO] = None
+        self._path: Optional[Path] = None
+        self._in_shard = 0
+        self._write_manifest(complete=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(complete=exc_type is None)
+
+    def write(self, item: dict):
+        if self._file is None:
+            number = len(self.shards) + 1
+            suffix = COMPRESSIONS[self.compression]
+            self._path = self.output_dir / f"{self.prefix}-{number:05d}.ndjson{suffix}"
+            part = self._path.with_name(self._path.name + ".part")
+            self._file = open_text(part, "w", self.compression)
+        self._file.write(json.dumps(item, ensure_ascii=False))
+        self._file.write("\n")
+        self._in_shard += 1
+        self.count += 1
+        if self._in_shard >= self.shard_size:
+            self._close_shard()
+
+    def close(self, complete: bool = True):
+        self._close_shard()
+        self._write_manifest(complete=complete)
+
+    def _close_shard(self):
+        if self._file is None:
+            return
+        self._file.close()
+        os.replace(self._path.with_name(self._path.name + ".part"), self._path)
+        self.shards.append(
+            {
+                "file": self._path.name,
+                "items": self._in_shard,
+                "bytes": self._path.stat().st_size,
+            }
+        )
+        self._file, self._in_shard = None, 0
+        self._write_manifest(complete=False)
+
+    def _write_manifest(self, complete: bool):
+        manifest = {
+            "format": "ndjson",
+            "compression": self.compression,
+            "items": self.count,
+            "complete": complete,
+            "shards": self.shards,
+        }
+        tmp = self.manifest_path.with_name(self.manifest_path.name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.manifest_path)
@@ -8,7 +8,11 @@ from django.db import transaction, connection
 from django.utils import timezone
 from decimal import Decimal, InvalidOperation
 
-from realty.pfimport.models import PFListSale, PFListRent, Building, Area
+from realty.pfimport.address_cache import AddressResolver
+from realty.pfimport.json_stream import (
+    MANIFEST_SUFFIX, batched, is_listing_file, iter_json_items, manifest_shards,
+)
+from realty.pfimport.models import PFJsonUpload, PFListSale, PFListRent, Building, Area
 
 
 class Command(BaseCommand):
@@ -25,12 +29,14 @@ class Command(BaseCommand):
             'properties_skipped': 0,
             'errors': 0
         }
+        # районы / здания на весь запуск, уже виденные адреса - по алиасам
+        self.resolver = AddressResolver("enhanced", self.parse_address)
 
     def add_arguments(self, parser):
         parser.add_argument(
             'source',
             type=str,
-            help='JSON file or directory containing JSON files to import'
+            help='JSON / NDJSON file (.gz / .zst too), shard manifest or directory to import'
         )
         parser.add_argument(
             '--batch-size',
@@ -114,14 +120,17 @@ class Command(BaseCommand):
             raise
 
     def get_json_files(self, source: Path) -> List[Path]:
-        """Get list of JSON files to process."""
+        """Get list of JSON / NDJSON files (or manifest shards) to process."""
         if source.is_file():
-            if source.suffix.lower() == '.json':
+            if source.name.endswith(MANIFEST_SUFFIX):
+                # only finished shards are listed - safe while scraping goes on
+                return manifest_shards(source)
+            if is_listing_file(source):
                 return [source]
             else:
                 raise CommandError(f'File {source} is not a JSON file')
         
-        return list(source.glob('*.json'))
+        return sorted(path for path in source.iterdir() if is_listing_file(path))
 
     def clear_data_if_requested(self, options: Dict[str, Any]):
         """Clear existing data if requested."""
@@ -150,32 +159,23 @@ class Command(BaseCommand):
         self.stdout.write(f"📄 Processing {json_file.name}...")
         
         try:
-            with open(json_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
-            if not isinstance(data, list):
-                self.stdout.write(
-                    self.style.ERROR(f"❌ {json_file.name}: Expected list, got {type(data)}")
-                )
-                return
-            
-            self.stdout.write(f"📊 Found {len(data)} properties in {json_file.name}")
-            self.stats['files_processed'] += 1
-            self.stats['total_properties'] += len(data)
-            
-            # Process in batches
-            for i in range(0, len(data), batch_size):
-                batch = data[i:i + batch_size]
-                batch_num = (i // batch_size) + 1
-                total_batches = (len(data) + batch_size - 1) // batch_size
+            # Stream the file (JSON array or NDJSON) - it is never fully loaded
+            items = iter_json_items(json_file)
+            found = 0
+            for batch_num, batch in enumerate(batched(items, batch_size), 1):
+                found += len(batch)
+                self.stats['total_properties'] += len(batch)
                 
-                self.stdout.write(f"📦 Processing batch {batch_num}/{total_batches} ({len(batch)} items)")
+                self.stdout.write(f"📦 Processing batch {batch_num} ({len(batch)} items)")
                 
                 if not options['dry_run']:
                     self.process_batch(batch, options['update'])
                 else:
                     # In dry run, just validate data
                     self.validate_batch(batch)
+            
+            self.stdout.write(f"📊 Found {found} properties in {json_file.name}")
+            self.stats['files_processed'] += 1
                 
         except json.JSONDecodeError as e:
             self.stats['errors'] += 1
@@ -190,16 +190,14 @@ class Command(BaseCommand):
 
     def process_batch(self, batch: List[Dict], update_existing: bool):
         """Process a batch of properties."""
-        areas_to_create = {}
-        buildings_to_create = {}
         sale_properties = []
         rent_properties = []
+        addresses = (item.get('displayAddress') or '' for item in batch)
+        names = self.resolver.prefetch(addresses)
         
         for item in batch:
             try:
-                processed = self.process_property_item(
-                    item, areas_to_create, buildings_to_create
-                )
+                processed = self.process_property_item(item, names)
                 
                 if processed:
                     if processed['listing_type'] == 'sale':
@@ -216,10 +214,7 @@ class Command(BaseCommand):
         # Save to database in transaction
         try:
             with transaction.atomic():
-                # Create areas and buildings first
-                self.bulk_create_areas(areas_to_create.values())
-                self.bulk_create_buildings(buildings_to_create.values())
-                
+                # Areas and buildings are already saved by get_or_create
                 # Create properties
                 self.bulk_create_properties(sale_properties, PFListSale, update_existing)
                 self.bulk_create_properties(rent_properties, PFListRent, update_existing)
@@ -228,9 +223,12 @@ class Command(BaseCommand):
             self.stats['errors'] += 1
             self.logger.error(f"Error saving batch: {e}")
             self.stdout.write(self.style.ERROR(f"❌ Error saving batch: {e}"))
+        
+        # areas and buildings are saved by get_or_create even if listings failed
+        self.resolver.flush()
 
-    def process_property_item(self, item: Dict, areas_cache: Dict, buildings_cache: Dict) -> Dict:
-        """Process a single property item."""
+    def process_property_item(self, item: Dict, names: Dict) -> Dict:
+        """Process a single property item (names - resolver.prefetch of the batch)."""
         # Extract required fields
         listing_id = item.get('id')
         if not listing_id:
@@ -245,8 +243,9 @@ class Command(BaseCommand):
         listing_type = 'rent' if price_duration == 'rent' else 'sale'
         
         # Extract location data
-        display_address = item.get('displayAddress', '')
-        area_name = self.extract_area_from_address(display_address)
+        display_address = item.get('displayAddress') or ''
+        building_name, area_name = names[display_address]
+        areas_cache, buildings_cache = self.resolver.areas, self.resolver.buildings
         
         # Get or create area
         area_obj = None
@@ -260,12 +259,11 @@ class Command(BaseCommand):
             else:
                 area_obj = areas_cache[area_name]
         
-        # Extract building data
-        building_name = self.extract_building_from_address(display_address)
+        # Get or create building
         building_obj = None
         
         if building_name and area_obj:
-            building_key = f"{building_name}_{area_name}"
+            building_key = (building_name, area_name)
             if building_key not in buildings_cache:
                 coordinates = item.get('coordinates', {})
                 lat = self.safe_decimal(coordinates.get('latitude'))
@@ -283,6 +281,8 @@ class Command(BaseCommand):
             else:
                 building_obj = buildings_cache[building_key]
         
+        self.resolver.remember(display_address, area_obj, building_obj)
+        
         # Prepare property data
         coordinates = item.get('coordinates', {})
         
@@ -315,35 +315,36 @@ class Command(BaseCommand):
             'description_html': item.get('descriptionHTML', ''),
         }
 
-    def bulk_create_areas(self, areas: List[Area]):
-        """Bulk create areas."""
-        if areas:
-            Area.objects.bulk_create(areas, ignore_conflicts=True)
-
-    def bulk_create_buildings(self, buildings: List[Building]):
-        """Bulk create buildings."""
-        if buildings:
-            Building.objects.bulk_create(buildings, ignore_conflicts=True)
-
     def bulk_create_properties(self, properties: List[Dict], model_class, update_existing: bool):
         """Bulk create properties."""
         if not properties:
             return
         
-        objects_to_create = []
-        
+        # one object per listing_id (the last one wins) - an upsert must not
+        # touch the same row twice
+        objects = {}
         for prop_data in properties:
-            obj = model_class(**prop_data)
-            objects_to_create.append(obj)
+            objects[prop_data['listing_id']] = model_class(**prop_data)
+        
+        # one query for the whole batch instead of a lookup per listing
+        existing = set(
+            model_class.objects.filter(listing_id__in=list(objects))
+            .values_list('listing_id', flat=True)
+        )
+        new_count = len(objects) - len(existing)
         
         if update_existing:
-            # For updates, we'd need to implement upsert logic
-            # For now, just create
-            model_class.objects.bulk_create(objects_to_create, ignore_conflicts=True)
-            self.stats['properties_updated'] += len(objects_to_create)
+            model_class.objects.bulk_create(
+                list(objects.values()),
+                update_conflicts=True,
+                unique_fields=['listing_id'],
+                update_fields=PFJsonUpload.LISTING_UPDATE_FIELDS,
+            )
+            self.stats['properties_updated'] += len(existing)
         else:
-            model_class.objects.bulk_create(objects_to_create, ignore_conflicts=True)
-            self.stats['properties_imported'] += len(objects_to_create)
+            model_class.objects.bulk_create(list(objects.values()), ignore_conflicts=True)
+            self.stats['properties_skipped'] += len(existing)
+        self.stats['properties_imported'] += new_count
 
     def validate_batch(self, batch: List[Dict]):
         """Validate batch data without saving (dry run)."""
@@ -356,6 +357,13 @@ class Command(BaseCommand):
         
         self.stats['properties_imported'] += valid_count
 
+    def parse_address(self, address: str):
+        """(building, area) names from displayAddress."""
+        return (
+            self.extract_building_from_address(address),
+            self.extract_area_from_address(address),
+        )
+
     def extract_area_from_address(self, address: str) -> str:
         """Extract area name from address."""
         if not address:
@@ -1,11 +1,20 @@
 import os
 import re
-import time
 import json
 import datetime
-import requests
+from pathlib import Path
 from bs4 import BeautifulSoup
 from django.core.management.base import BaseCommand
+from django.utils import timezone
+from realty.pfimport.fetch import extract_first_script, fetch_pages
+from realty.pfimport.fingerprints import (
+    extract_search_cards,
+    mark_delisted,
+    plan_detail_fetches,
+    remember_fetched,
+    search_scope,
+)
+from realty.pfimport.json_stream import COMPRESSIONS, ShardedNDJSONWriter
 
 
 class Command(BaseCommand):
@@ -18,11 +27,47 @@ class Command(BaseCommand):
             "--sleep",
             type=int,
             default=1,
-            help="Sleep time between iterations in seconds",
+            help="Sleep time between iterations in seconds (without --rate)",
+        )
+        parser.add_argument(
+            "--rate",
+            type=float,
+            default=None,
+            help="Requests per second to the site (default: 1 / --sleep)",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=4,
+            help="Requests in flight at once",
         )
         parser.add_argument(
             "--output", type=str, help="Output file path for the final JSON"
         )
+        parser.add_argument(
+            "--format",
+            choices=["json", "ndjson"],
+            default="json",
+            help="json - one JSON array; ndjson - shards + manifest next to --output",
+        )
+        parser.add_argument(
+            "--compress",
+            choices=list(COMPRESSIONS),
+            default="none",
+            help="Compression of NDJSON shards",
+        )
+        parser.add_argument(
+            "--shard-size",
+            type=int,
+            default=5000,
+            help="Properties per NDJSON shard",
+        )
+        parser.add_argument(
+            "--incremental",
+            action="store_true",
+            help="Fetch only new or changed listings (search card fingerprints) "
+            "and mark listings missing from a complete search crawl as delisted",
+        )
 
     def handle(self, *args, **options):
         start_value = options["start_value"]
@@ -38,10 +83,10 @@ class Command(BaseCommand):
 
         base_search = "https://www.propertyfinder.ae/en/search?l=1&c=2&t=1&fu=0&rp=y&ob=nd&page=220"
 
-        # Setup session with headers and cookies
-        session = requests.Session()
-        session.headers.update(PF_PARSER_CONFIG.get("headers", {}))
-        session.cookies.update(PF_PARSER_CONFIG.get("cookies", {}))
+        # Requests per second to the site; concurrency only has to cover latency
+        rate = options["rate"]
+        if rate is None:
+            rate = 1 / sleep_time if sleep_time > 0 else 0
 
         self.stdout.write(
             self.style.SUCCESS(
@@ -51,12 +96,16 @@ class Command(BaseCommand):
 
         # Process everything in one go directly to output file
         self.extract_and_process_to_file(
-            session=session,
             base_url=base_search,
             start_page=start_value,
             end_page=end_value,
             output_file=output_file,
-            sleep_time=sleep_time,
+            rate=rate,
+            concurrency=options["concurrency"],
+            output_format=options["format"],
+            compression=options["compress"],
+            shard_size=options["shard_size"],
+            incremental=options["incremental"],
         )
 
         self.stdout.write(
@@ -84,11 +133,7 @@ class Command(BaseCommand):
 
     def extract_first_script(self, html):
         """Extract JSON data from the first script tag."""
-        soup = BeautifulSoup(html, "lxml")
-        script = soup.body.find("script")
-        text = script.string or ""
-        idx = text.find("{")
-        return text[idx:] if idx >= 0 else ""
+        return extract_first_script(html)
 
     def transform_property(self, data):
         """Transform raw property data to structured format."""
@@ -209,62 +254,140 @@ class Command(BaseCommand):
         }
 
     def extract_and_process_to_file(
-        self, session, base_url, start_page, end_page, output_file, sleep_time
+        self,
+        base_url,
+        start_page,
+        end_page,
+        output_file,
+        rate,
+        concurrency=4,
+        output_format="json",
+        compression="none",
+        shard_size=5000,
+        incremental=False,
     ):
         """
         Streamlined process: Extract property links, scrape data, transform, and
         write directly to final JSON file all in one process without temp files.
+
+        Pages are fetched concurrently (realty.pfimport.fetch): at most rate
+        requests per second and concurrency requests in flight.
+
+        output_format="ndjson" writes each property straight into NDJSON shards
+        (<output name>-00001.ndjson[.gz|.zst]) with a manifest next to
+        output_file; finished shards can be imported while scraping goes on.
+
+        incremental=True fingerprints the search cards (realty.pfimport
+        .fingerprints) and fetches only new or changed listings. Their new
+        fingerprints count only once PFJsonUpload imports the output; until
+        then the same listings are fetched again. When the search is crawled
+        to its last page without errors, listings that were not seen are
+        marked as delisted.
         """
+        started = timezone.now()
         # Use a set to track unique property IDs
         seen_ids = set()
-        # A list to store all processed properties
+        # A list to store all processed properties (JSON array output only)
         all_properties = []
+        added = 0
+        writer = None
+        if output_format == "ndjson":
+            output_path = Path(output_file)
+            writer = ShardedNDJSONWriter(
+                output_path.parent,
+                output_path.name.split(".", 1)[0],
+                shard_size=shard_size,
+                compression=compression,
+            )
+
+        fetch_options = {
+            "rate": rate,
+            "concurrency": concurrency,
+            "headers": PF_PARSER_CONFIG.get("headers", {}),
+            "cookies": PF_PARSER_CONFIG.get("cookies", {}),
+        }
 
         # First gather all property links from search pages
         self.stdout.write("Gathering property links...")
         all_links = set()
-
-        for page in range(start_page, end_page + 1):
-            url = self.build_page_url(base_url, page)
-            self.stdout.write(f"Fetching page {page}: {url}")
-
+        pages = {}
+        cards = {}  # url -> search card (incremental only)
+        failed_pages = 0
+        stop = False
+
+        def page_urls():
+            for page in range(start_page, end_page + 1):
+                if stop:
+                    return
+                url = self.build_page_url(base_url, page)
+                self.stdout.write(f"Fetching page {page}: {url}")
+                pages[url] = page
+                yield url
+
+        def on_page(url, response):
+            nonlocal failed_pages, stop
+            page = pages[url]
             try:
-                response = session.get(url)
+                if response is None:
+                    raise ValueError("no response after retries")
                 response.raise_for_status()
 
                 links = self.extract_links_from_page(response.text)
+                if incremental:
+                    page_cards = extract_search_cards(response.text)
+                    if page_cards:
+                        links = [card["url"] for card in page_cards]
+                        cards.update((card["url"], card) for card in page_cards)
                 if not links:
-                    self.stdout.write(
-                        self.style.WARNING(
-                            f"No links found on page {page}, stopping link collection."
+                    # pages already in flight are still collected
+                    if not stop:
+                        self.stdout.write(
+                            self.style.WARNING(
+                                f"No links found on page {page}, stopping link collection."
+                            )
                         )
-                    )
-                    break
+                    stop = True
+                    return
 
                 all_links.update(links)
                 self.stdout.write(
                     f"Found {len(links)} links on page {page}, total unique links: {len(all_links)}"
                 )
 
-                # Sleep to avoid rate limiting
-                time.sleep(sleep_time)
-
             except Exception as e:
+                failed_pages += 1
                 self.stdout.write(self.style.ERROR(f"Error accessing page {page}: {e}"))
 
+        fetch_pages(page_urls(), on_page, **fetch_options)
+
+        links_to_fetch = all_links
+        if incremental:
+            scope = search_scope(base_url)
+            todo = plan_detail_fetches(scope, list(cards.values()), started)
+            # links without a search card cannot be fingerprinted - always fetched
+            links_to_fetch = {card["url"] for card in todo} | (all_links - cards.keys())
+            self.stdout.write(
+                f"{len(todo)} of {len(cards)} listings are new or changed"
+            )
+        fetched_cards = []
+
         # Process each property link directly
         self.stdout.write(
             self.style.SUCCESS(
-                f"Starting to process {len(all_links)} property pages..."
+                f"Starting to process {len(links_to_fetch)} property pages..."
             )
         )
+        fetched = 0
 
-        for idx, link in enumerate(sorted(all_links), 1):
-            self.stdout.write(f"Processing ({idx}/{len(all_links)}): {link}")
+        def on_property(link, response):
+            nonlocal added, fetched
+            fetched += 1
+            self.stdout.write(f"Processing ({fetched}/{len(links_to_fetch)}): {link}")
 
             try:
                 # Get property page
-                response = session.get(link)
+                if response is None:
+                    raise ValueError("no response after retries")
                 response.raise_for_status()
 
                 # Extract JSON data
@@ -273,7 +396,7 @@ class Command(BaseCommand):
                     self.stdout.write(
                         self.style.WARNING(f"No data found for {link}, skipping")
                     )
-                    continue
+                    return
 
                 # Parse JSON data
                 try:
@@ -282,7 +405,7 @@ class Command(BaseCommand):
                     self.stdout.write(
                         self.style.ERROR(f"Invalid JSON data from {link}, skipping")
                     )
-                    continue
+                    return
 
                 # Transform data to structured format
                 property_data = self.transform_property(data)
@@ -292,41 +415,64 @@ class Command(BaseCommand):
                             f"Could not transform data from {link}, skipping"
                         )
                     )
-                    continue
+                    return
+
+                if link in cards:
+                    fetched_cards.append(cards[link])
 
                 # Check for duplicate property IDs
                 property_id = property_data.get("id")
                 if property_id and property_id in seen_ids:
                     self.stdout.write(f"Skipping duplicate property ID: {property_id}")
-                    continue
+                    return
 
                 if property_id:
                     seen_ids.add(property_id)
 
                 # Add to our collection
-                all_properties.append(property_data)
+                if writer is not None:
+                    writer.write(property_data)
+                else:
+                    all_properties.append(property_data)
+                added += 1
                 self.stdout.write(
                     self.style.SUCCESS(
-                        f"Added property '{property_data.get('title')}' ({len(all_properties)} total)"
+                        f"Added property '{property_data.get('title')}' ({added} total)"
                     )
                 )
 
             except Exception as e:
                 self.stdout.write(self.style.ERROR(f"Error processing {link}: {e}"))
 
-            # Sleep to avoid rate limiting
-            time.sleep(sleep_time)
+        fetch_pages(sorted(links_to_fetch), on_property, **fetch_options)
+
+        if incremental:
+            remember_fetched(fetched_cards)
+            if stop and not failed_pages:
+                delisted = mark_delisted(scope, started)
+                self.stdout.write(f"Marked {delisted} listings as delisted")
+            else:
+                self.stdout.write(
+                    self.style.WARNING(
+                        "Search not crawled to the end, delisted listings not marked"
+                    )
+                )
 
         # Write all properties to the final JSON file
-        self.stdout.write(f"Writing {len(all_properties)} properties to {output_file}")
+        if writer is not None:
+            writer.close()
+            self.stdout.write(
+                f"Wrote {added} properties in {len(writer.shards)} shards, "
+                f"manifest: {writer.manifest_path}"
+            )
+        else:
+            self.stdout.write(f"Writing {added} properties to {output_file}")
 
-        with open(output_file, "w", encoding="utf-8") as f:
-            json.dump(all_properties, f, ensure_ascii=False, indent=2)
+            with open(output_file, "w", encoding="utf-8") as f:
+                json.dump(all_properties, f, ensure_ascii=False, indent=2)
 
         self.stdout.write(
-            self.style.SUCCESS(
-                f"Successfully processed {len(all_properties)} unique properties"
-            )
+            self.style.SUCCESS(f"Successfully processed {added} unique properties")
         )
 
 
@@ -3,25 +3,41 @@ import re
 import time
 import json
 import datetime
-import requests
+import httpx
 import logging
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
 from bs4 import BeautifulSoup
 from django.core.management.base import BaseCommand
 from django.conf import settings
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from realty.pfimport.fetch import extract_first_script, fetch_pages
+from realty.pfimport.json_stream import COMPRESSIONS, ShardedNDJSONWriter
 
 
 class PropertyFinderScraper:
     """Enhanced PropertyFinder scraper with robust error handling and logging."""
     
-    def __init__(self, output_dir: str = "/shared-data", log_level: str = "INFO"):
+    def __init__(
+        self,
+        output_dir: str = "/shared-data",
+        log_level: str = "INFO",
+        output_format: str = "json",
+        compression: str = "none",
+        shard_size: int = 5000,
+        rate: Optional[float] = None,
+        concurrency: int = 4,
+    ):
         self.output_dir = Path(output_dir)
+        # requests per second to the site (None - one per --sleep seconds);
+        # concurrency only has to cover response latency
+        self.rate = rate
+        self.concurrency = concurrency
+        # "json" - batch files + final JSON array; "ndjson" - shards + manifest
+        self.output_format = output_format
+        self.compression = compression
+        self.shard_size = shard_size
         self.output_dir.mkdir(parents=True, exist_ok=True)
         self.setup_logging(log_level)
-        self.setup_session()
         self.stats = {
             'pages_processed': 0,
             'links_found': 0,
@@ -52,27 +68,6 @@ class PropertyFinderScraper:
         file_handler.setFormatter(formatter)
         self.logger.addHandler(file_handler)
     
-    def setup_session(self):
-        """Setup requests session with retry strategy and robust configuration."""
-        self.session = requests.Session()
-        
-        # Retry strategy
-        retry_strategy = Retry(
-            total=5,
-            status_forcelist=[429, 500, 502, 503, 504],
-            method_whitelist=["HEAD", "GET", "OPTIONS"],
-            backoff_factor=2,
-            raise_on_status=False
-        )
-        
-        adapter = HTTPAdapter(max_retries=retry_strategy)
-        self.session.mount("http://", adapter)
-        self.session.mount("https://", adapter)
-        
-        # Set headers and cookies
-        self.session.headers.update(self.get_headers())
-        self.session.cookies.update(self.get_cookies())
-    
     def get_headers(self) -> Dict[str, str]:
         """Get randomized headers to avoid detection."""
         return {
@@ -98,64 +93,26 @@ class PropertyFinderScraper:
             "anonymous_user_id": f"scraper_{int(time.time())}",
         }
     
-    def safe_request(self, url: str, max_retries: int = 3, timeout: int = 30) -> Optional[requests.Response]:
-        """Make a safe HTTP request with comprehensive error handling."""
-        for attempt in range(max_retries):
-            try:
-                self.logger.debug(f"Attempting request to {url} (attempt {attempt + 1})")
-                
-                response = self.session.get(url, timeout=timeout)
-                
-                # Check for various error conditions
-                if response.status_code == 429:
-                    wait_time = (attempt + 1) * 10
-                    self.logger.warning(f"Rate limited. Waiting {wait_time} seconds...")
-                    time.sleep(wait_time)
-                    self.stats['retries'] += 1
-                    continue
-                
-                if response.status_code >= 400:
-                    self.logger.error(f"HTTP {response.status_code} for {url}")
-                    if attempt < max_retries - 1:
-                        time.sleep((attempt + 1) * 2)
-                        continue
-                    return None
-                
-                # Check for captcha or blocking
-                if self.is_blocked(response):
-                    self.logger.error(f"Detected blocking/captcha for {url}")
-                    wait_time = (attempt + 1) * 30
-                    self.logger.info(f"Waiting {wait_time} seconds before retry...")
-                    time.sleep(wait_time)
-                    continue
-                
-                return response
-                
-            except requests.exceptions.Timeout:
-                self.logger.error(f"Timeout for {url} (attempt {attempt + 1})")
-                self.stats['errors'] += 1
-                if attempt < max_retries - 1:
-                    time.sleep((attempt + 1) * 5)
-                    continue
-            
-            except requests.exceptions.ConnectionError:
-                self.logger.error(f"Connection error for {url} (attempt {attempt + 1})")
-                self.stats['errors'] += 1
-                if attempt < max_retries - 1:
-                    time.sleep((attempt + 1) * 10)
-                    continue
-            
-            except Exception as e:
-                self.logger.error(f"Unexpected error for {url}: {e}")
-                self.stats['errors'] += 1
-                if attempt < max_retries - 1:
-                    time.sleep((attempt + 1) * 2)
-                    continue
-        
-        self.logger.error(f"Failed to fetch {url} after {max_retries} attempts")
-        return None
-    
-    def is_blocked(self, response: requests.Response) -> bool:
+    def fetch(
+        self,
+        urls: Iterable[str],
+        on_response: Callable[[str, Optional[httpx.Response]], None],
+    ):
+        """Fetch urls within the rate budget (realty.pfimport.fetch)."""
+        stats = fetch_pages(
+            urls,
+            on_response,
+            rate=self.rate,
+            concurrency=self.concurrency,
+            retries=4,
+            backoff=2.0,
+            headers=self.get_headers(),
+            cookies=self.get_cookies(),
+            is_blocked=self.is_blocked,
+        )
+        self.stats['retries'] += stats['retries']
+
+    def is_blocked(self, response: httpx.Response) -> bool:
         """Check if the response indicates we're being blocked."""
         text = response.text.lower()
         blocking_indicators = [
@@ -201,17 +158,11 @@ class PropertyFinderScraper:
     def extract_property_data(self, html: str, url: str) -> Optional[Dict]:
         """Extract property data from individual property page."""
         try:
-            soup = BeautifulSoup(html, "lxml")
-            script = soup.body.find("script")
-            if not script or not script.string:
-                return None
-            
-            text = script.string
-            idx = text.find("{")
-            if idx < 0:
+            text = extract_first_script(html)
+            if not text:
                 return None
             
-            json_data = json.loads(text[idx:])
+            json_data = json.loads(text)
             return self.transform_property(json_data, url)
             
         except json.JSONDecodeError as e:
@@ -300,36 +251,51 @@ class PropertyFinderScraper:
         """Main scraping method with comprehensive error handling."""
         base_url = "https://www.propertyfinder.ae/en/search?l=1&c=2&t=1&fu=0&rp=y&ob=nd&page=220"
         
-        self.logger.info(f"Starting scrape: pages {start_page}-{end_page}, sleep={sleep_time}s")
+        if self.rate is None:
+            self.rate = 1 / sleep_time if sleep_time > 0 else 0
+        self.logger.info(
+            f"Starting scrape: pages {start_page}-{end_page}, "
+            f"rate={self.rate:g}/s, concurrency={self.concurrency}"
+        )
         
         all_links = set()
         all_properties = []
         
-        # Phase 1: Collect all property links
-        for page in range(start_page, end_page + 1):
-            url = self.build_page_url(base_url, page)
-            self.logger.info(f"Processing page {page}/{end_page}: {url}")
-            
-            response = self.safe_request(url)
-            if not response:
+        # Phase 1: Collect all property links. Pages are fetched concurrently,
+        # so after a run of empty pages we only stop queueing new ones
+        pages = {}
+        stop = False
+        
+        def page_urls():
+            for page in range(start_page, end_page + 1):
+                if stop:
+                    return
+                url = self.build_page_url(base_url, page)
+                pages[url] = page
+                yield url
+        
+        def on_page(url: str, response: Optional[httpx.Response]):
+            nonlocal stop
+            page = pages[url]
+            if response is None or response.status_code >= 400:
                 self.logger.error(f"Failed to fetch page {page}")
-                continue
+                return
             
             links = self.extract_links_from_page(response.text)
             if not links:
                 self.logger.warning(f"No links found on page {page}")
-                if page > start_page + 5:  # Allow some pages without results, then stop
+                if page > start_page + 5 and not stop:  # Allow some pages without results, then stop
                     self.logger.info("Multiple pages without results, stopping link collection")
-                    break
-                continue
+                    stop = True
+                return
             
             all_links.update(links)
             self.stats['pages_processed'] += 1
             self.stats['links_found'] += len(links)
             
             self.logger.info(f"Found {len(links)} links on page {page}, total unique: {len(all_links)}")
-            
-            time.sleep(sleep_time)
+        
+        self.fetch(page_urls(), on_page)
         
         # Phase 2: Process all property pages
         self.logger.info(f"Starting to process {len(all_links)} property pages...")
@@ -337,23 +303,43 @@ class PropertyFinderScraper:
         batch_size = 50
         batch_properties = []
         batch_num = 1
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        
+        # NDJSON: every property goes straight into the current shard; finished
+        # shards are listed in the manifest and can be imported right away
+        writer = None
+        if self.output_format == "ndjson":
+            writer = ShardedNDJSONWriter(
+                self.output_dir,
+                f"properties_{timestamp}",
+                shard_size=self.shard_size,
+                compression=self.compression,
+            )
+        
+        fetched = 0
         
-        for idx, link in enumerate(sorted(all_links), 1):
-            self.logger.debug(f"Processing property {idx}/{len(all_links)}: {link}")
+        def on_property(link: str, response: Optional[httpx.Response]):
+            nonlocal batch_properties, batch_num, fetched
+            fetched += 1
+            self.logger.debug(f"Processing property {fetched}/{len(all_links)}: {link}")
             
-            response = self.safe_request(link)
-            if not response:
+            if response is None or response.status_code >= 400:
+                if response is not None:
+                    self.logger.error(f"HTTP {response.status_code} for {link}")
                 self.stats['errors'] += 1
-                continue
+                return
             
             property_data = self.extract_property_data(response.text, link)
             if property_data:
-                batch_properties.append(property_data)
-                all_properties.append(property_data)
+                if writer is not None:
+                    writer.write(property_data)
+                else:
+                    batch_properties.append(property_data)
+                    all_properties.append(property_data)
                 self.stats['properties_processed'] += 1
                 
-                if idx % 10 == 0:
-                    self.logger.info(f"Processed {idx}/{len(all_links)} properties, found {len(all_properties)} valid")
+                if fetched % 10 == 0:
+                    self.logger.info(f"Processed {fetched}/{len(all_links)} properties, found {self.stats['properties_processed']} valid")
             else:
                 self.stats['errors'] += 1
             
@@ -363,8 +349,22 @@ class PropertyFinderScraper:
                 self.stats['properties_saved'] += len(batch_properties)
                 batch_properties = []
                 batch_num += 1
-            
-            time.sleep(sleep_time)
+        
+        self.fetch(sorted(all_links), on_property)
+        
+        if writer is not None:
+            writer.close()
+            self.stats['properties_saved'] += writer.count
+            self.logger.info(
+                f"Saved {writer.count} properties in {len(writer.shards)} shards, "
+                f"manifest: {writer.manifest_path.name}"
+            )
+            return {
+                'status': 'completed',
+                'final_file': str(writer.manifest_path),
+                'properties_count': writer.count,
+                'stats': self.stats
+            }
         
         # Save remaining properties
         if batch_properties:
@@ -372,7 +372,6 @@ class PropertyFinderScraper:
             self.stats['properties_saved'] += len(batch_properties)
         
         # Save final consolidated file
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
         final_filename = f"properties_final_{timestamp}.json"
         final_filepath = self.output_dir / final_filename
         
@@ -399,7 +398,19 @@ class Command(BaseCommand):
             "--sleep",
             type=int,
             default=2,
-            help="Sleep time between requests in seconds",
+            help="Sleep time between requests in seconds (without --rate)",
+        )
+        parser.add_argument(
+            "--rate",
+            type=float,
+            default=None,
+            help="Requests per second to the site (default: 1 / --sleep)",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=4,
+            help="Requests in flight at once",
         )
         parser.add_argument(
             "--output-dir",
@@ -407,6 +418,24 @@ class Command(BaseCommand):
             default="/shared-data",
             help="Output directory for JSON files",
         )
+        parser.add_argument(
+            "--format",
+            choices=["json", "ndjson"],
+            default="json",
+            help="json - batch files + final JSON array; ndjson - shards + manifest",
+        )
+        parser.add_argument(
+            "--compress",
+            choices=list(COMPRESSIONS),
+            default="none",
+            help="Compression of NDJSON shards",
+        )
+        parser.add_argument(
+            "--shard-size",
+            type=int,
+            default=5000,
+            help="Properties per NDJSON shard",
+        )
         parser.add_argument(
             "--log-level",
             type=str,
@@ -429,10 +458,21 @@ class Command(BaseCommand):
         )
         self.stdout.write(f"📄 Pages: {start_value} - {end_value}")
         self.stdout.write(f"⏱️ Sleep time: {sleep_time}s")
+        if options["rate"] is not None:
+            self.stdout.write(f"⏱️ Rate: {options['rate']:g} requests/s")
+        self.stdout.write(f"🔀 Concurrency: {options['concurrency']}")
         self.stdout.write(f"📁 Output directory: {output_dir}")
         self.stdout.write(f"📝 Log level: {log_level}")
 
-        scraper = PropertyFinderScraper(output_dir=output_dir, log_level=log_level)
+        scraper = PropertyFinderScraper(
+            output_dir=output_dir,
+            log_level=log_level,
+            output_format=options["format"],
+            compression=options["compress"],
+            shard_size=options["shard_size"],
+            rate=options["rate"],
+            concurrency=options["concurrency"],
+        )
         
         try:
             result = scraper.scrape_properties(start_value, end_value, sleep_time)
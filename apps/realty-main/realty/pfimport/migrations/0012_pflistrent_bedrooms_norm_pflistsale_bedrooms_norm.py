@@ -0,0 +1,37 @@
+# Generated by Django 5.1.7 on 2025-06-16 10:42
+
+import realty.main.models
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0027_mergedtransaction_bedrooms_norm_and_more"),
+        ("pfimport", "0011_pflistrent_building_avg_roi_pflistrent_roi_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="pflistrent",
+            name="bedrooms_norm",
+            field=realty.main.models.BedroomsNormField(
+                blank=True,
+                db_index=True,
+                editable=False,
+                null=True,
+                source="bedrooms",
+            ),
+        ),
+        migrations.AddField(
+            model_name="pflistsale",
+            name="bedrooms_norm",
+            field=realty.main.models.BedroomsNormField(
+                blank=True,
+                db_index=True,
+                editable=False,
+                null=True,
+                source="bedrooms",
+            ),
+        ),
+    ]
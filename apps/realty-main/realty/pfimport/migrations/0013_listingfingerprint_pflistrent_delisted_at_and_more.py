@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pfimport", "0012_pflistrent_bedrooms_norm_pflistsale_bedrooms_norm"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ListingFingerprint",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("listing_id", models.CharField(max_length=50, unique=True)),
+                ("scope", models.CharField(db_index=True, max_length=10)),
+                (
+                    "fingerprint",
+                    models.CharField(blank=True, default="", max_length=32),
+                ),
+                ("first_seen", models.DateTimeField()),
+                ("last_seen", models.DateTimeField(db_index=True)),
+                ("delisted_at", models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="pflistrent",
+            name="delisted_at",
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="pflistsale",
+            name="delisted_at",
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pfimport", "0013_listingfingerprint_pflistrent_delisted_at_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AddressAlias",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("parser", models.CharField(max_length=20)),
+                ("address", models.CharField(max_length=255)),
+                (
+                    "area",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="pfimport.area",
+                    ),
+                ),
+                (
+                    "building",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="pfimport.building",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("parser", "address"),
+                        name="pfimport_address_alias_unique",
+                    )
+                ],
+            },
+        ),
+    ]
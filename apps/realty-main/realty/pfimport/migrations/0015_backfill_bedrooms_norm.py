@@ -0,0 +1,22 @@
+# Generated by Django 5.1.7 on 2025-06-21 10:15
+
+from django.db import migrations
+
+from realty.main.models import backfill_bedrooms_norm
+
+
+def fill_bedrooms_norm(apps, schema_editor):
+    # отчёты фильтруют объявления по bedrooms_norm - заполняем старые строки
+    for model_name in ("PFListSale", "PFListRent"):
+        backfill_bedrooms_norm(apps.get_model("pfimport", model_name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pfimport", "0014_addressalias"),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_bedrooms_norm, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pfimport", "0015_backfill_bedrooms_norm"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="listingfingerprint",
+            name="pending_fingerprint",
+            field=models.CharField(blank=True, default="", max_length=32),
+        ),
+    ]
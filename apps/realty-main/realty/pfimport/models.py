@@ -1,18 +1,22 @@
 # -------------------------------- pfimport/models.py --------------------------------
-import datetime, json, logging, shlex, tempfile, gc
+import datetime, logging, shlex, tempfile, gc
 from decimal import Decimal
 from io import StringIO
 from pathlib import Path
+from urllib.parse import urlparse
 
 import requests
 from django.core.files.base import File
 from django.core.management import call_command
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 from django_tasks import task
 from django_lifecycle import LifecycleModel, AFTER_CREATE, AFTER_SAVE, hook
 
+from realty.main.data_generation import bump_data_generation
 from realty.main.models import Building as DldBuilding
+from realty.main.models import BedroomsNormField
+from .json_stream import batched, iter_json_items
 
 # Added this constant with all allowed areas
 AREAS_WITH_PROPERTY = {
@@ -226,11 +230,14 @@ def run_pfjson_import(job_id: int):
     job.save(update_fields=("status", "started_at", "log"))
 
     def _download(url: str) -> Path:
-        r = requests.get(url, timeout=60)
-        r.raise_for_status()
-        tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".json")
-        tmp.write(r.content)
-        tmp.close()
+        # потоково в файл - выгрузка не держится в памяти целиком;
+        # расширение из URL (.ndjson.gz и т.п.) - по нему выбирается разбор
+        suffix = "".join(Path(urlparse(url).path).suffixes) or ".json"
+        with requests.get(url, timeout=60, stream=True) as r:
+            r.raise_for_status()
+            with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+                for chunk in r.iter_content(chunk_size=1 << 20):
+                    tmp.write(chunk)
         return Path(tmp.name)
 
     tmp_path, tail = None, ""
@@ -255,6 +262,9 @@ def run_pfjson_import(job_id: int):
             tmp_path.unlink(missing_ok=True)
         job.finished_at, job.log = timezone.now(), job.log + tail
         job.save()
+        if job.status == "failed":
+            # часть данных (и очистка wipe_*) могла уже пройти
+            bump_data_generation("listings")
         gc.collect()
 
 
@@ -474,6 +484,7 @@ class PFBase(models.Model):
     bedrooms = models.CharField(
         max_length=10, blank=True, null=True
     )  # "studio" / "1" / …
+    bedrooms_norm = BedroomsNormField(source="bedrooms")  # 0 = studio, 1, 2 …
     bathrooms = models.CharField(max_length=10, blank=True, null=True)
     added_on = models.DateTimeField(blank=True, null=True)
 
@@ -508,6 +519,8 @@ class PFBase(models.Model):
     description_html = models.TextField(blank=True, null=True)
 
     created_at = models.DateTimeField(auto_now_add=True)
+    # снято с публикации: не найдено при полном обходе поиска (ListingFingerprint)
+    delisted_at = models.DateTimeField(blank=True, null=True, db_index=True)
 
     roi = models.FloatField(
         null=True, blank=True, db_index=True, verbose_name="ROI объявления"
@@ -528,6 +541,14 @@ class PFBase(models.Model):
             models.Index(fields=["bedrooms", "price"]),
         ]
 
+    @property
+    def days_on_market(self):
+        """Дней от публикации до снятия (или до сегодня, если ещё висит)."""
+        if not self.added_on:
+            return None
+        end = self.delisted_at or timezone.now()
+        return (end.date() - self.added_on.date()).days
+
 
 class DisplayQuerySet(models.QuerySet):
     def __str__(self):
@@ -566,6 +587,58 @@ class PFListRent(PFBase):
         )
 
 
+class ListingFingerprint(models.Model):
+    """
+    Отпечаток объявления по карточке выдачи поиска (цена, дата обновления,
+    share_url) - инкрементальный scrape_properties качает страницу объявления
+    только для новых и изменившихся (см. pfimport/fingerprints.py).
+    fingerprint = "" - карточку видели, но страницу ещё не скачали.
+    pending_fingerprint - страница скачана, но ещё не импортирована:
+    в fingerprint он переходит только после записи объявления импортом.
+    """
+
+    listing_id = models.CharField(max_length=50, unique=True)
+    scope = models.CharField(max_length=10, db_index=True)  # sale / rent
+    fingerprint = models.CharField(max_length=32, blank=True, default="")
+    pending_fingerprint = models.CharField(max_length=32, blank=True, default="")
+    first_seen = models.DateTimeField()
+    last_seen = models.DateTimeField(db_index=True)
+    delisted_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.scope} {self.listing_id}"
+
+    @property
+    def days_on_market(self) -> int:
+        return ((self.delisted_at or self.last_seen) - self.first_seen).days
+
+
+class AddressAlias(models.Model):
+    """
+    Разобранный displayAddress -> район и здание (pfimport/address_cache.py).
+    parser - правило разбора импорта (у PFJsonUpload и
+    import_properties_enhanced они разные). Алиасы удаляются вместе с
+    районом / зданием.
+    """
+
+    parser = models.CharField(max_length=20)
+    address = models.CharField(max_length=255)
+    area = models.ForeignKey(Area, on_delete=models.CASCADE, related_name="+")
+    building = models.ForeignKey(
+        Building, on_delete=models.CASCADE, null=True, blank=True, related_name="+"
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["parser", "address"], name="pfimport_address_alias_unique"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.parser}: {self.address}"
+
+
 # ──────────────────────────────── JSON Upload ─────────────────────────────────
 class PFJsonUpload(models.Model):
     upload_file = models.FileField(upload_to="pfjson")
@@ -580,6 +653,20 @@ class PFJsonUpload(models.Model):
         return f"PFJsonUpload {self.id}"
 
     # --------------------------- helpers ------------------------------------
+    IMPORT_BATCH_SIZE = 1000  # объявлений на пачку (один upsert на модель)
+
+    # поля объявления, которые перезаписывает повторный импорт
+    LISTING_UPDATE_FIELDS = [
+        'area', 'building', 'url', 'title', 'display_address',
+        'bedrooms', 'bedrooms_norm', 'bathrooms', 'added_on',
+        'broker', 'agent',
+        'agent_phone', 'verified', 'reference', 'broker_license_number',
+        'property_type', 'price_duration', 'listing_type', 'price',
+        'price_currency', 'latitude', 'longitude', 'size_min',
+        'numeric_area', 'furnishing', 'description', 'description_html',
+        'delisted_at',
+    ]
+
     BEDROOM_KEYS = {
         "studio": "studio",
         "0": "studio",
@@ -595,6 +682,13 @@ class PFJsonUpload(models.Model):
         val = str(bedrooms_value).lower().strip()
         return self.BEDROOM_KEYS.get(val, "4br")  # всё >=4 считаем как 4br
 
+    @staticmethod
+    def bedroom_key_from_norm(bedrooms_norm: int | None) -> str:
+        """То же по уже посчитанному PFBase.bedrooms_norm, без разбора строки."""
+        if not bedrooms_norm:
+            return "studio"
+        return f"{min(bedrooms_norm, 4)}br"
+
     # ---------------------------- parser ------------------------------------
     def save(self, *args, **kwargs):
         """Перехватываем save, чтобы сначала сохранить файл, а затем распарсить"""
@@ -613,34 +707,50 @@ class PFJsonUpload(models.Model):
         self.process_json()
 
     def process_json(self):
-        """Разбор загруженного JSON‑файла и сохранение объявлений + обновление агрегатов"""
-        from .models import (
-            PFListSale,
-            PFListRent,
-        )  # локальный импорт во избежание циклов
-
-        file_path = self.upload_file.path
-        with open(file_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        """
+        Разбор загруженного JSON / NDJSON (в т.ч. шарда .ndjson.gz / .zst) и
+        сохранение объявлений + обновление агрегатов. Файл читается потоково
+        (json_stream) пачками по IMPORT_BATCH_SIZE - память не зависит от
+        размера выгрузки.
+        """
+        from .address_cache import AddressResolver  # address_cache импортирует модели
 
         today = timezone.now().date()
-        
-        # Подготавливаем списки для bulk операций
+
+        # Районы и здания - через кэш адресов (address_cache): уже виденные
+        # адреса резолвятся по алиасам, в память попадают только районы и
+        # здания из выгрузки. Здание - по имени района: у новых районов id
+        # появляется только при записи пачки
+        resolver = AddressResolver("pfjson", self._parse_address)
+
+        items = iter_json_items(self.upload_file.path)
+        for batch in batched(items, self.IMPORT_BATCH_SIZE):
+            with transaction.atomic():
+                self._process_batch(batch, today, resolver)
+
+        # новые объявления - новое поколение ключей кэша (страницы, GeoJSON)
+        bump_data_generation("listings")
+
+    @staticmethod
+    def _parse_address(address: str):
+        """displayAddress "здание, ..., район, ..." -> (здание, район)."""
+        parts = [x.strip() for x in address.split(",", 3)]
+        while len(parts) < 4:
+            parts.append("")
+        return parts[0], parts[2]
+
+    def _process_batch(self, batch, today, resolver):
+        """Одна пачка: районы и здания, затем upsert объявлений по listing_id."""
+        names = resolver.prefetch(item.get("displayAddress") or "" for item in batch)
+        existing_areas, existing_buildings = resolver.areas, resolver.buildings
+        resolved = {}  # адрес -> (район, здание) для алиасов
         areas_to_create = []
-        areas_to_update = []
+        areas_to_update = {}
         buildings_to_create = []
-        buildings_to_update = []
-        listings_to_create = []
-        listings_to_update = []
-        
-        # Кэшируем существующие объекты для избежания повторных запросов
-        existing_areas = {area.name: area for area in Area.objects.all()}
-        existing_buildings = {}
-        for building in Building.objects.select_related('area').all():
-            key = (building.name, building.area_id)
-            existing_buildings[key] = building
-
-        for item in data:
+        buildings_to_update = {}
+        listings = {PFListSale: {}, PFListRent: {}}
+
+        for item in batch:
             listing_id = item.get("id")
             if not listing_id:
                 continue  # без id бессмысленно
@@ -681,12 +791,9 @@ class PFJsonUpload(models.Model):
                 except Exception:
                     numeric_area_val = None
 
-            # адрес (building / area)
-            disp_addr = item.get("displayAddress", "")
-            parts = [x.strip() for x in disp_addr.split(",", 3)]
-            while len(parts) < 4:
-                parts.append("")
-            address1, _, address3, _ = parts
+            # адрес (building / area) - разобран в resolver.prefetch
+            disp_addr = item.get("displayAddress") or ""
+            address1, address3 = names[disp_addr]
 
             # ---------------- Area ----------------
             area_obj = None
@@ -705,7 +812,7 @@ class PFJsonUpload(models.Model):
                         area_obj.verified_value = (
                             f"{area_obj.name} ({area_obj.numbers_of_main_page_ads:,})"
                         )
-                    areas_to_update.append(area_obj)
+                    areas_to_update[address3] = area_obj
                 else:
                     # Создаем новый район
                     area_obj = Area(
@@ -726,7 +833,7 @@ class PFJsonUpload(models.Model):
             # ---------------- Building ----------------
             building_obj = None
             if address1 and area_obj:
-                building_key = (address1, area_obj.id)
+                building_key = (address1, area_obj.name)
                 if building_key in existing_buildings:
                     building_obj = existing_buildings[building_key]
                     # Обновляем существующее здание
@@ -776,7 +883,7 @@ class PFJsonUpload(models.Model):
                         )
                         building_obj.sum_exposure_sale_days += days_on_market
                     
-                    buildings_to_update.append(building_obj)
+                    buildings_to_update[building_key] = building_obj
                 else:
                     # Создаем новое здание
                     building_obj = Building(
@@ -808,6 +915,9 @@ class PFJsonUpload(models.Model):
                     buildings_to_create.append(building_obj)
                     existing_buildings[building_key] = building_obj
 
+            if area_obj:
+                resolved[disp_addr] = (area_obj, building_obj)
+
             # ------------------------------------------------------------------
             # Теперь САМЫЕ ГЛАВНЫЕ изменения — сохраняем само объявление
             # ------------------------------------------------------------------
@@ -852,19 +962,8 @@ class PFJsonUpload(models.Model):
                 "description": _clean_str(item.get("description")),
                 "description_html": _clean_str(item.get("descriptionHtml")),
             }
-            
-            # Проверяем, существует ли уже объявление
-            try:
-                existing_listing = model_class.objects.get(listing_id=listing_id)
-                # Обновляем существующее объявление
-                for field, value in listing_data.items():
-                    if value is not None:
-                        setattr(existing_listing, field, value)
-                listings_to_update.append(existing_listing)
-            except model_class.DoesNotExist:
-                # Создаем новое объявление
-                new_listing = model_class(listing_id=listing_id, **listing_data)
-                listings_to_create.append(new_listing)
+            # повтор listing_id в пачке - берём последний
+            listings[model_class][listing_id] = listing_data
 
         # Выполняем bulk операции
         if areas_to_create:
@@ -872,7 +971,7 @@ class PFJsonUpload(models.Model):
         
         if areas_to_update:
             Area.objects.bulk_update(
-                areas_to_update,
+                list(areas_to_update.values()),
                 fields=[
                     'sum_number_of_days_for_all_ads',
                     'numbers_of_processed_ads',
@@ -885,7 +984,7 @@ class PFJsonUpload(models.Model):
         
         if buildings_to_update:
             Building.objects.bulk_update(
-                buildings_to_update,
+                list(buildings_to_update.values()),
                 fields=[
                     'latitude', 'longitude', 'numbers_of_processed_rent_ads',
                     'numbers_of_processed_sale_ads', 'sum_exposure_rent_days',
@@ -896,18 +995,40 @@ class PFJsonUpload(models.Model):
                      [f'sale_sum_{key}' for key in self.BEDROOM_KEYS.values()]
             )
         
-        if listings_to_create:
-            model_class.objects.bulk_create(listings_to_create)
-        
-        if listings_to_update:
-            model_class.objects.bulk_update(
-                listings_to_update,
-                fields=[
-                    'area', 'building', 'url', 'title', 'display_address',
-                    'bedrooms', 'bathrooms', 'added_on', 'broker', 'agent',
-                    'agent_phone', 'verified', 'reference', 'broker_license_number',
-                    'property_type', 'price_duration', 'listing_type', 'price',
-                    'price_currency', 'latitude', 'longitude', 'size_min',
-                    'numeric_area', 'furnishing', 'description', 'description_html'
-                ]
-            )
+        for model_class, rows in listings.items():
+            if rows:
+                self._upsert_listings(model_class, rows)
+
+        for address, (area_obj, building_obj) in resolved.items():
+            resolver.remember(address, area_obj, building_obj)
+        resolver.flush()
+
+    def _upsert_listings(self, model_class, rows):
+        """
+        Один запрос существующих объявлений по listing_id и один upsert
+        (bulk_create update_conflicts). Пустые значения не затирают
+        сохранённые; bedrooms_norm считает pre_save в bulk_create.
+        """
+        from .fingerprints import confirm_imported  # fingerprints импортирует модели
+
+        existing = model_class.objects.in_bulk(list(rows), field_name="listing_id")
+        listings = []
+        for listing_id, listing_data in rows.items():
+            listing = existing.get(listing_id)
+            if listing is None:
+                listing = model_class(listing_id=listing_id, **listing_data)
+            else:
+                for field, value in listing_data.items():
+                    if value is not None:
+                        setattr(listing, field, value)
+                listing.delisted_at = None  # снова в выдаче
+                listing.pk = None  # конфликт только по listing_id
+            listings.append(listing)
+        model_class.objects.bulk_create(
+            listings,
+            update_conflicts=True,
+            unique_fields=["listing_id"],
+            update_fields=self.LISTING_UPDATE_FIELDS,
+        )
+        # объявления в базе - отпечатки инкрементального скрапинга подтверждены
+        confirm_imported(list(rows))
@@ -12,7 +12,9 @@ from .models import PFJsonUpload
 
 logger = logging.getLogger(__name__)
 START_PAGE = 1
-END_PAGE = 10
+# инкрементальный обход идёт по всему поиску (до пустой страницы): страницы
+# поиска дешёвые, качаются только новые и изменившиеся объявления
+END_PAGE = 3000
 
 
 @task()
@@ -20,8 +22,9 @@ def scrape_property_finder():
     """
     Daily task to scrape property listings from PropertyFinder.
 
-    Runs every day at 8 AM, scrapes the first 20 pages of property listings,
-    processes the data, and imports it into the database system.
+    Runs every day at 8 AM, crawls the search pages, scrapes only new or
+    changed listings (--incremental), marks vanished ones as delisted and
+    imports the data into the database system.
     """
     import os
     from django.core.management import call_command
@@ -34,9 +37,14 @@ def scrape_property_finder():
 
     try:
         # Call our Django management command to scrape properties and generate the JSON file
-        # Start from page 1 and scrape 20 pages by default
         logger.info("Running property scraper command")
-        call_command("scrape_properties", START_PAGE, END_PAGE, output=output_filename)
+        call_command(
+            "scrape_properties",
+            START_PAGE,
+            END_PAGE,
+            output=output_filename,
+            incremental=True,
+        )
 
         # Load the generated file into the PFJsonUpload model
         # This will trigger the save() method which processes the data
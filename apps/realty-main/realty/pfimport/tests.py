@@ -0,0 +1,523 @@
+import asyncio
+import gzip
+import io
+import json
+import tempfile
+import time
+from datetime import timedelta
+from email.utils import formatdate
+from pathlib import Path
+from unittest import mock
+
+import httpx
+from django.db import DatabaseError, transaction
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from . import address_cache, json_stream
+from .address_cache import AddressResolver, normalize_address
+from .fetch import TokenBucket, _retry_after, extract_first_script, fetch_pages
+from .fingerprints import (
+    card_fingerprint,
+    confirm_imported,
+    extract_search_cards,
+    mark_delisted,
+    plan_detail_fetches,
+    remember_fetched,
+    search_scope,
+)
+from .json_stream import (
+    ShardedNDJSONWriter,
+    batched,
+    is_listing_file,
+    iter_json_items,
+    manifest_shards,
+)
+from .models import (
+    AddressAlias,
+    Area,
+    Building,
+    ListingFingerprint,
+    PFJsonUpload,
+    PFListRent,
+)
+
+DOCUMENTS = [
+    "[]",
+    " [ ] ",
+    '[{"a": 1}, {"b": [1, 2, {"c": "]"}]}]',
+    '[1234, 1e5, -0.5, true, null, "x, y", 12]',
+    '\n[\n  {"id": "1", "price": 1500000},\n  {"id": "2", "price": null}\n]\n',
+    '[{"name": "Марина \\"Дубай\\""}, 7]',
+]
+
+
+class IterJsonItemsTests(SimpleTestCase):
+    """Массив и NDJSON при любых границах кусков чтения."""
+
+    def read(self, text, chunk_size):
+        with mock.patch.object(json_stream, "CHUNK_SIZE", chunk_size):
+            return list(iter_json_items(io.StringIO(text)))
+
+    def test_array_at_every_chunk_size(self):
+        for text in DOCUMENTS:
+            expected = json.loads(text)
+            for chunk_size in range(1, len(text) + 2):
+                with self.subTest(text=text, chunk_size=chunk_size):
+                    self.assertEqual(self.read(text, chunk_size), expected)
+
+    def test_scalar_split_at_chunk_boundary(self):
+        # "1" из "1e5" / "12" из "1234" - валидный JSON, но ещё не элемент
+        for chunk_size in range(1, 8):
+            self.assertEqual(self.read("[1e5,1234]", chunk_size), [1e5, 1234])
+            self.assertEqual(self.read("[1234]", chunk_size), [1234])
+
+    def test_ndjson(self):
+        items = [{"id": i, "text": "x" * i} for i in range(20)]
+        text = "\n".join(json.dumps(item) for item in items) + "\n\n"
+        for chunk_size in (1, 7, 64, 1 << 20):
+            self.assertEqual(self.read(text, chunk_size), items)
+
+    def test_invalid_arrays_raise(self):
+        for text in ("[1 2]", "[1,", "[{}", '[{"a": }]'):
+            for chunk_size in (1, 3, 1 << 20):
+                with self.subTest(text=text, chunk_size=chunk_size):
+                    with self.assertRaises(json.JSONDecodeError):
+                        self.read(text, chunk_size)
+
+    def test_batched(self):
+        self.assertEqual(list(batched(range(7), 3)), [[0, 1, 2], [3, 4, 5], [6]])
+        self.assertEqual(list(batched([], 3)), [])
+
+
+class ShardedNDJSONWriterTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name)
+        self.items = [{"id": str(i), "address": "Марина"} for i in range(7)]
+
+    def manifest(self):
+        with open(self.dir / "pf.manifest.json", encoding="utf-8") as f:
+            return json.load(f)
+
+    def read_shards(self):
+        items = []
+        for path in manifest_shards(self.dir / "pf.manifest.json"):
+            items.extend(iter_json_items(path))
+        return items
+
+    def test_shards_and_manifest(self):
+        with ShardedNDJSONWriter(self.dir, "pf", shard_size=3) as out:
+            for item in self.items:
+                out.write(item)
+            # дописанные шарды уже в манифесте, текущий - только *.part
+            self.assertEqual(len(self.manifest()["shards"]), 2)
+            self.assertFalse(self.manifest()["complete"])
+            self.assertTrue((self.dir / "pf-00003.ndjson.part").exists())
+
+        manifest = self.manifest()
+        self.assertTrue(manifest["complete"])
+        self.assertEqual(manifest["items"], 7)
+        self.assertEqual(
+            [(s["file"], s["items"]) for s in manifest["shards"]],
+            [("pf-00001.ndjson", 3), ("pf-00002.ndjson", 3), ("pf-00003.ndjson", 1)],
+        )
+        self.assertEqual(self.read_shards(), self.items)
+        self.assertEqual(list(self.dir.glob("*.part")), [])
+
+    def test_gzip_and_append_to_previous_run(self):
+        with ShardedNDJSONWriter(
+            self.dir, "pf", shard_size=5, compression="gzip"
+        ) as out:
+            for item in self.items[:4]:
+                out.write(item)
+        with ShardedNDJSONWriter(
+            self.dir, "pf", shard_size=5, compression="gzip"
+        ) as out:
+            for item in self.items[4:]:
+                out.write(item)
+
+        manifest = self.manifest()
+        self.assertEqual(manifest["items"], 7)
+        self.assertEqual(
+            [s["file"] for s in manifest["shards"]],
+            ["pf-00001.ndjson.gz", "pf-00002.ndjson.gz"],
+        )
+        with gzip.open(self.dir / "pf-00001.ndjson.gz", "rt", encoding="utf-8") as f:
+            self.assertEqual(len(f.readlines()), 4)
+        self.assertEqual(self.read_shards(), self.items)
+
+    def test_error_leaves_manifest_incomplete(self):
+        with self.assertRaises(RuntimeError):
+            with ShardedNDJSONWriter(self.dir, "pf", shard_size=10) as out:
+                out.write(self.items[0])
+                raise RuntimeError
+        self.assertFalse(self.manifest()["complete"])
+        self.assertEqual(self.read_shards(), self.items[:1])
+
+    def test_unknown_compression(self):
+        with self.assertRaises(ValueError):
+            ShardedNDJSONWriter(self.dir, "pf", compression="bz2")
+
+    def test_is_listing_file(self):
+        for name in ("pf.json", "pf-00001.ndjson.gz", "X.JSONL", "a.ndjson.zst"):
+            self.assertTrue(is_listing_file(name), name)
+        for name in ("pf.manifest.json", "pf-00001.ndjson.part", "notes.txt", "a.gz"):
+            self.assertFalse(is_listing_file(name), name)
+
+
+class RetryAfterTests(SimpleTestCase):
+    def retry_after(self, value):
+        headers = {} if value is None else {"Retry-After": value}
+        return _retry_after(httpx.Response(429, headers=headers))
+
+    def test_seconds(self):
+        self.assertEqual(self.retry_after("7"), 7.0)
+        self.assertEqual(self.retry_after("1.5"), 1.5)
+        self.assertEqual(self.retry_after("-3"), 0.0)
+
+    def test_http_date(self):
+        delay = self.retry_after(formatdate(time.time() + 120, usegmt=True))
+        self.assertTrue(100 < delay <= 120, delay)
+        self.assertEqual(self.retry_after(formatdate(time.time() - 60, usegmt=True)), 0)
+
+    def test_missing_or_garbage(self):
+        self.assertEqual(self.retry_after(None), 0.0)
+        self.assertEqual(self.retry_after("soon"), 0.0)
+
+
+class TokenBucketTests(SimpleTestCase):
+    def acquire_times(self, bucket, n):
+        async def run():
+            start = time.monotonic()
+            times = []
+            for _ in range(n):
+                await bucket.acquire()
+                times.append(time.monotonic() - start)
+            return times
+
+        return asyncio.run(run())
+
+    def test_burst_then_rate(self):
+        times = self.acquire_times(TokenBucket(rate=20, burst=3), 6)
+        # три токена в запасе, дальше - по одному в 1/20 с
+        self.assertLess(times[2], 0.02)
+        self.assertGreaterEqual(times[5], 0.14)
+        self.assertLess(times[5], 0.5)
+
+    def test_pause(self):
+        bucket = TokenBucket(rate=50, burst=5)
+        bucket.pause(0.1)
+        self.assertGreaterEqual(self.acquire_times(bucket, 1)[0], 0.1)
+
+    def test_unlimited(self):
+        bucket = TokenBucket(rate=0)
+        bucket.pause(10)
+        self.assertLess(self.acquire_times(bucket, 100)[-1], 0.05)
+
+
+class FetchPagesTests(SimpleTestCase):
+    def test_retries_and_blocking(self):
+        attempts = {}
+
+        def handler(request):
+            path = request.url.path
+            attempts[path] = attempts.get(path, 0) + 1
+            if path == "/flaky" and attempts[path] < 3:
+                return httpx.Response(503)
+            if path == "/limited" and attempts[path] < 2:
+                return httpx.Response(429, headers={"Retry-After": "0"})
+            if path == "/captcha":
+                return httpx.Response(200, text="blocked")
+            if path == "/down":
+                return httpx.Response(500)
+            return httpx.Response(404 if path == "/missing" else 200, text=path)
+
+        results = {}
+        with self.assertLogs("realty.pfimport.fetch", "WARNING"):
+            stats = fetch_pages(
+                [
+                    f"https://pf.test/{p}"
+                    for p in ("ok", "flaky", "limited", "missing", "captcha", "down")
+                ],
+                lambda url, response: results.update({url.rsplit("/", 1)[1]: response}),
+                rate=0,
+                retries=2,
+                backoff=0,
+                is_blocked=lambda response: response.text == "blocked",
+                transport=httpx.MockTransport(handler),
+            )
+        self.assertEqual(results["ok"].text, "/ok")
+        self.assertEqual(results["flaky"].status_code, 200)
+        self.assertEqual(results["limited"].status_code, 200)
+        self.assertEqual(results["missing"].status_code, 404)
+        self.assertIsNone(results["captcha"])
+        self.assertIsNone(results["down"])
+        self.assertEqual(attempts["/flaky"], 3)
+        self.assertEqual(attempts["/down"], 3)
+        self.assertEqual(stats, {"requests": 13, "retries": 7, "errors": 2})
+
+    def test_extract_first_script(self):
+        html = (
+            "<html><head><script>var head = {};</script></head>"
+            '<BODY><div>x</div><script id="d">window.x = {"a": 1}</script>'
+            "<script>{}</script></body></html>"
+        )
+        self.assertEqual(extract_first_script(html), '{"a": 1}')
+        self.assertEqual(extract_first_script("<body><p>no</p></body>"), "")
+
+
+def search_card(listing_id, price, refreshed="2025-01-01T10:00:00Z"):
+    prop = {
+        "id": listing_id,
+        "share_url": f"https://pf.test/plp/{listing_id}.html",
+        "price": {"value": price},
+        "last_refreshed_at": refreshed,
+    }
+    return {"id": listing_id, "url": prop["share_url"], "prop": prop}
+
+
+class FingerprintTests(TestCase):
+    def cards(self, *cards):
+        return [
+            {"id": c["id"], "url": c["url"], "fingerprint": card_fingerprint(c["prop"])}
+            for c in cards
+        ]
+
+    def fetched_ids(self, cards, seen_at):
+        todo = plan_detail_fetches("rent", cards, seen_at)
+        return sorted(card["id"] for card in todo)
+
+    def test_card_fingerprint(self):
+        prop = search_card("1", 100000)["prop"]
+        self.assertEqual(len(card_fingerprint(prop)), 32)
+        self.assertEqual(card_fingerprint(prop), card_fingerprint(dict(prop)))
+        for changed in (
+            search_card("1", 95000)["prop"],
+            search_card("1", 100000, refreshed="2025-02-01")["prop"],
+            dict(prop, share_url="https://pf.test/plp/other.html"),
+        ):
+            self.assertNotEqual(card_fingerprint(changed), card_fingerprint(prop))
+        # без цены и даты - всё равно отпечаток, а не ошибка
+        self.assertEqual(len(card_fingerprint({"listed_date": "2025-01-01"})), 32)
+
+    def test_extract_search_cards(self):
+        prop = search_card("7", 5)["prop"]
+        data = {
+            "props": {
+                "pageProps": {
+                    "searchResult": {
+                        "listings": [{"property": prop}, {"property": {"id": "8"}}]
+                    }
+                }
+            }
+        }
+        html = f"<body><script>{json.dumps(data)}</script></body>"
+        self.assertEqual(
+            extract_search_cards(html),
+            [
+                {
+                    "id": "7",
+                    "url": prop["share_url"],
+                    "fingerprint": card_fingerprint(prop),
+                }
+            ],
+        )
+        self.assertEqual(extract_search_cards("<body><script>{oops</script>"), [])
+        self.assertEqual(search_scope("https://pf.test/search?c=1&l=50"), "sale")
+        self.assertEqual(search_scope("https://pf.test/search?c=2"), "rent")
+
+    def test_only_new_changed_and_relisted_are_fetched(self):
+        t0 = timezone.now()
+        a, b, c = search_card("a", 100), search_card("b", 200), search_card("c", 300)
+        cards = self.cards(a, b, c)
+        self.assertEqual(self.fetched_ids(cards, t0), ["a", "b", "c"])
+        remember_fetched(cards)
+        self.assertEqual(confirm_imported(["a", "b", "c"]), 3)
+
+        t1 = t0 + timedelta(days=1)
+        b2 = search_card("b", 150)
+        self.assertEqual(self.fetched_ids(self.cards(a, b2), t1), ["b"])
+        remember_fetched(self.cards(b2))
+        confirm_imported(["b"])
+
+        # c пропала из полного обхода - снята с публикации
+        self.assertEqual(mark_delisted("rent", t1), 1)
+        c_row = ListingFingerprint.objects.get(listing_id="c")
+        self.assertEqual(c_row.delisted_at, t0)
+        self.assertEqual(c_row.days_on_market, 0)
+
+        # вернулась - качается снова, даже с тем же отпечатком
+        t2 = t1 + timedelta(days=1)
+        self.assertEqual(self.fetched_ids(self.cards(a, b2, c), t2), ["c"])
+        remember_fetched(self.cards(c))
+        confirm_imported(["c"])
+        self.assertIsNone(ListingFingerprint.objects.get(listing_id="c").delisted_at)
+        self.assertEqual(self.fetched_ids(self.cards(a, b2, c), t2), [])
+
+    def test_not_imported_is_fetched_again(self):
+        t0 = timezone.now()
+        cards = self.cards(search_card("a", 100))
+        self.fetched_ids(cards, t0)
+        remember_fetched(cards)
+        # импорт не дошёл - отпечаток не текущий, страница качается снова
+        self.assertEqual(self.fetched_ids(cards, t0 + timedelta(hours=1)), ["a"])
+        self.assertEqual(confirm_imported(["a", "unknown"]), 1)
+        self.assertEqual(confirm_imported(["a"]), 0)  # повторный импорт
+        self.assertEqual(self.fetched_ids(cards, t0 + timedelta(hours=2)), [])
+
+    def test_mark_delisted_updates_listings(self):
+        t0 = timezone.now()
+        cards = self.cards(search_card("a", 1), search_card("b", 2))
+        self.fetched_ids(cards, t0)
+        PFListRent.objects.create(listing_id="a")
+        PFListRent.objects.create(listing_id="b")
+        t1 = t0 + timedelta(days=3)
+        self.fetched_ids(cards[1:], t1)
+
+        self.assertEqual(mark_delisted("sale", t1), 0)  # другой scope
+        self.assertEqual(mark_delisted("rent", t1), 1)
+        self.assertEqual(mark_delisted("rent", t1), 0)
+        self.assertEqual(PFListRent.objects.get(listing_id="a").delisted_at, t0)
+        self.assertIsNone(PFListRent.objects.get(listing_id="b").delisted_at)
+
+    def test_upsert_listings_confirms_fingerprints(self):
+        cards = self.cards(search_card("a", 100))
+        self.fetched_ids(cards, timezone.now())
+        remember_fetched(cards)
+        PFJsonUpload()._upsert_listings(PFListRent, {"a": {"title": "Flat"}})
+        row = ListingFingerprint.objects.get(listing_id="a")
+        self.assertEqual(row.fingerprint, cards[0]["fingerprint"])
+        self.assertEqual(row.pending_fingerprint, "")
+        self.assertEqual(PFListRent.objects.get(listing_id="a").title, "Flat")
+
+
+def parse_address(address):
+    """ "Здание, Район" -> (здание, район), как правило импорта."""
+    parts = [part.strip() for part in address.split(",")]
+    return (parts[0] if len(parts) > 1 else ""), parts[-1]
+
+
+class AddressResolverTests(TestCase):
+    def setUp(self):
+        address_cache._aliases.clear()
+        self.addCleanup(address_cache._aliases.clear)
+        self.parsed = []
+
+    def resolver(self, parser="test"):
+        def parse(address):
+            self.parsed.append(address)
+            return parse_address(address)
+
+        return AddressResolver(parser, parse)
+
+    def resolve(self, resolver, addresses):
+        """Как импорт: недостающие районы / здания создаются, алиасы - в flush."""
+        names = resolver.prefetch(addresses)
+        for address, (building_name, area_name) in names.items():
+            area = resolver.areas.get(area_name)
+            if area is None:
+                area = resolver.areas[area_name] = Area.objects.create(name=area_name)
+            building = None
+            if building_name:
+                building = resolver.buildings.get((building_name, area_name))
+                if building is None:
+                    building = Building.objects.create(name=building_name, area=area)
+                    resolver.buildings[(building_name, area_name)] = building
+            resolver.remember(address, area, building)
+        resolver.flush()
+        return names
+
+    def test_aliases_are_reused_across_imports(self):
+        addresses = [
+            "Marina Gate 1,  Dubai Marina",
+            "JBR",
+            "Marina Gate 1, Dubai Marina",
+        ]
+        names = self.resolve(self.resolver(), addresses)
+        self.assertEqual(names[addresses[0]], ("Marina Gate 1", "Dubai Marina"))
+        self.assertEqual(names["JBR"], ("", "JBR"))
+        self.assertEqual(AddressAlias.objects.count(), 2)  # адреса нормализуются
+
+        # новый импорт в другом процессе: алиасы из базы, без разбора
+        address_cache._aliases.clear()
+        self.parsed.clear()
+        resolver = self.resolver()
+        self.assertEqual(
+            resolver.prefetch(addresses[:2]), {a: names[a] for a in addresses[:2]}
+        )
+        self.assertEqual(self.parsed, [])
+        self.assertEqual(resolver.areas["Dubai Marina"].name, "Dubai Marina")
+        self.assertIn(("Marina Gate 1", "Dubai Marina"), resolver.buildings)
+
+        # тот же процесс: LRU, запросов к алиасам нет - только in_bulk по id
+        with self.assertNumQueries(2):
+            self.resolver().prefetch(addresses)
+        self.assertEqual(self.parsed, [])
+
+    def test_parsers_do_not_mix(self):
+        self.resolve(self.resolver("a"), ["Tower, Area 1"])
+        self.parsed.clear()
+        self.resolver("b").prefetch(["Tower, Area 1"])
+        self.assertEqual(self.parsed, ["Tower, Area 1"])
+
+    def test_existing_records_are_found_by_name(self):
+        area = Area.objects.create(name="Downtown")
+        building = Building.objects.create(name="Burj Vista", area=area)
+        resolver = self.resolver()
+        resolver.prefetch(["Burj Vista, Downtown", "Other, Downtown"])
+        self.assertEqual(resolver.areas["Downtown"].pk, area.pk)
+        self.assertEqual(resolver.buildings[("Burj Vista", "Downtown")].pk, building.pk)
+        self.assertNotIn(("Other", "Downtown"), resolver.buildings)
+
+    def test_alias_to_deleted_building_is_parsed_again(self):
+        self.resolve(self.resolver(), ["Tower, Area 1"])
+        Building.objects.filter(name="Tower").delete()  # алиас удаляется каскадом
+        address_cache._lru_set(
+            ("test", "Tower, Area 1"), (Area.objects.get().pk, 10**6)
+        )
+        self.parsed.clear()
+        names = self.resolver().prefetch(["Tower, Area 1"])
+        self.assertEqual(names, {"Tower, Area 1": ("Tower", "Area 1")})
+        self.assertEqual(self.parsed, ["Tower, Area 1"])
+
+    def test_lru_is_filled_on_commit(self):
+        resolver = self.resolver()
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.resolve(resolver, ["Tower, Area 1"])
+        self.assertEqual(address_cache._aliases, {})  # до commit LRU не трогаем
+        for callback in callbacks:
+            callback()
+        area, building = Area.objects.get(), Building.objects.get()
+        self.assertEqual(
+            address_cache._aliases,
+            {("test", "Tower, Area 1"): (area.pk, building.pk)},
+        )
+
+    def test_rolled_back_aliases_stay_out_of_lru(self):
+        with self.assertRaises(DatabaseError):
+            with transaction.atomic():
+                self.resolve(self.resolver(), ["Tower, Area 1"])
+                raise DatabaseError("import failed")
+        self.assertFalse(AddressAlias.objects.exists())
+        self.parsed.clear()
+        self.resolver().prefetch(["Tower, Area 1"])
+        self.assertEqual(self.parsed, ["Tower, Area 1"])
+        self.assertEqual(address_cache._aliases, {})
+
+    def test_remember_skips_unsaved_and_blank(self):
+        resolver = self.resolver()
+        area = Area.objects.create(name="A")
+        resolver.remember("x, A", Area(name="unsaved"), None)
+        resolver.remember("  ", area, None)
+        resolver.remember("y, A", area, Building(name="unsaved", area=area))
+        resolver.flush()
+        self.assertFalse(AddressAlias.objects.exists())
+
+    def test_lru_is_bounded(self):
+        with mock.patch.object(address_cache, "ALIAS_LRU_SIZE", 2):
+            for key in ("a", "b", "a", "c"):
+                address_cache._lru_set(("p", key), (1, None))
+        self.assertEqual(list(address_cache._aliases), [("p", "a"), ("p", "c")])
+        self.assertEqual(normalize_address("  Marina\n Gate\t1 "), "Marina Gate 1")
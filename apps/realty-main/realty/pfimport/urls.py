@@ -1,5 +1,5 @@
 from django.urls import path
-from django.views.decorators.cache import cache_page
+from realty.main.data_generation import cache_page_for_generation
 
 from .reports_views import building_full_metrics_view
 from .reports_views import building_report_view as new_building_report_view
@@ -18,10 +18,14 @@ app_name = "pfimport"
 
 urlpatterns = [
     path(
-        "sale/", cache_page(3600)(pf_listings_sale_view), name="pf_listings_sale_view"
+        "sale/",
+        cache_page_for_generation(3600, "listings")(pf_listings_sale_view),
+        name="pf_listings_sale_view",
     ),
     path(
-        "rent/", cache_page(3600)(pf_listings_rent_view), name="pf_listings_rent_view"
+        "rent/",
+        cache_page_for_generation(3600, "listings")(pf_listings_rent_view),
+        name="pf_listings_rent_view",
     ),
     # path(
     #     'building/<int:building_id>/report/',
@@ -36,5 +40,10 @@ urlpatterns = [
     path("api/pf_buildings/", pf_buildings_json, name="pf_buildings_json"),  # НОВОЕ
     path("api/buildings/", main_buildings_json, name="main_buildings_json"),
     path("api/link/", link_buildings, name="link_buildings"),  # НОВОЕ
-    path("api/buildings.geojson", buildings_geojson, name="buildings_geojson"),
+    path(
+        "api/buildings.geojson",
+        # здания - из импортов продаж, районы PF - из импорта объявлений
+        cache_page_for_generation(3600, "sales", "listings")(buildings_geojson),
+        name="buildings_geojson",
+    ),
 ]
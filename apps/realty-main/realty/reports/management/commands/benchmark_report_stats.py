@@ -0,0 +1,143 @@
+import math
+import random
+import statistics
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from realty.main.sketch import QuantileSketch
+from realty.reports.stats_kernel import (
+    date_array,
+    describe,
+    grouped_describe,
+    price_sketch,
+)
+
+
+def _python_stats(rows):
+    """Прежний расчёт по списку (price, sqm, date) - эталон для сравнения."""
+    prices = [r[0] for r in rows]
+    sqms = [r[1] for r in rows]
+    return {
+        "avg_price": sum(prices) / len(prices),
+        "median_price": statistics.median(prices),
+        "min_price": min(prices),
+        "max_price": max(prices),
+        "avg_sqm": sum(sqms) / len(sqms),
+        "avg_ppsqm": sum(prices) / sum(sqms),
+        "count": len(prices),
+        "last": [
+            {"price": p, "sqm": s, "date": d.isoformat()}
+            for p, s, d in sorted(rows, key=lambda r: r[2], reverse=True)[:3]
+        ],
+    }
+
+
+def _same(python, numpy) -> bool:
+    for key, value in python.items():
+        other = numpy[key]
+        if isinstance(value, float):
+            if not math.isclose(value, other, rel_tol=1e-9):
+                return False
+        elif value != other:
+            return False
+    return True
+
+
+class Command(BaseCommand):
+    """
+    Сравнение расчёта статистик отчётов на списках Python и в stats_kernel
+    на синтетических данных (без БД):
+
+        python manage.py benchmark_report_stats
+        python manage.py benchmark_report_stats --rows 500000 --groups 20000
+    """
+
+    help = "Benchmarks the NumPy report stats kernel against the list-based code."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=200_000)
+        parser.add_argument(
+            "--groups",
+            type=int,
+            default=10_000,
+            help="Групп здание × комнатность × год для сгруппированного расчёта",
+        )
+        parser.add_argument("--seed", type=int, default=1)
+
+    def _timed(self, label, python, kernel):
+        t0 = time.perf_counter()
+        expected = python()
+        t1 = time.perf_counter()
+        actual = kernel()
+        t2 = time.perf_counter()
+        self.stdout.write(
+            f"{label:<28} python {t1 - t0:8.3f}s   numpy {t2 - t1:8.3f}s   "
+            f"x{(t1 - t0) / max(t2 - t1, 1e-9):.1f}"
+        )
+        return expected, actual
+
+    def handle(self, *args, **opts):
+        rnd = random.Random(opts["seed"])
+        n, n_groups = opts["rows"], opts["groups"]
+        start = date(2024, 1, 1)
+        # values_list отдаёт Decimal, Cast в SQL - сразу float
+        decimals = [Decimal(rnd.randint(30_000, 5_000_000)) for _ in range(n)]
+        prices = [float(p) for p in decimals]
+        sqms = [rnd.uniform(25, 400) for _ in range(n)]
+        days = [start + timedelta(days=rnd.randint(0, 729)) for _ in range(n)]
+        groups = [rnd.randrange(n_groups) for _ in range(n)]
+
+        # 1) один набор цен: avg / median / min / max / count
+        def python_single():
+            values = [float(p) for p in decimals if p]
+            stats = _python_stats(list(zip(values, sqms, days)))
+            stats.pop("last")
+            return stats
+
+        def kernel_single():
+            return describe(np.array(prices), sqm=np.array(sqms))
+
+        expected, actual = self._timed(
+            "describe (one group)", python_single, kernel_single
+        )
+        ok = _same(expected, actual)
+
+        # 2) по группам, как DldBuildingReport.calculate_bulk
+        def python_grouped():
+            buckets = defaultdict(list)
+            for g, p, s, d in zip(groups, prices, sqms, days):
+                buckets[g].append((p, s, d))
+            return {g: _python_stats(rows) for g, rows in buckets.items()}
+
+        def kernel_grouped():
+            return grouped_describe(
+                np.array(groups),
+                n_groups,
+                np.array(prices),
+                sqm=np.array(sqms),
+                dates=date_array(days),
+                last=3,
+            )
+
+        expected, actual = self._timed(
+            "grouped_describe", python_grouped, kernel_grouped
+        )
+        ok &= all(_same(stats, actual[g]) for g, stats in expected.items())
+
+        # 3) скетч медианы BuildingReport / AreaReport
+        expected, actual = self._timed(
+            "price sketch",
+            lambda: QuantileSketch.from_values(prices),
+            lambda: price_sketch(np.array(prices)),
+        )
+        ok &= expected.to_bytes() == actual.to_bytes()
+
+        if ok:
+            self.stdout.write(self.style.SUCCESS("Results match."))
+        else:
+            self.stdout.write(self.style.ERROR("Results differ!"))
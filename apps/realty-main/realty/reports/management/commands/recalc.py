@@ -0,0 +1,107 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from realty.reports.recalc import BR_CHOICES, TARGETS, recalculate
+
+
+class Command(BaseCommand):
+    """
+    Параллельный пересчёт отчётов вместо последовательных recalculate_reports
+    и recalc_*_3. Несколько моделей считаются по очереди, в указанном порядке
+    (отчёты уровнем выше берут данные у уровня ниже):
+
+        python manage.py recalc --model building,area,citypf
+        python manage.py recalc --model dldbuilding --workers 8
+        python manage.py recalc --model dldbuilding --resume
+    """
+
+    help = "Пересчитывает отчёты в пуле процессов с bulk-записью и resume."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--model",
+            required=True,
+            help=f"Тип отчёта или несколько через запятую: {' | '.join(TARGETS)}",
+        )
+        parser.add_argument(
+            "--id",
+            type=str,
+            help="Один pk или список pk через запятую (кроме citypf/citydld).",
+        )
+        parser.add_argument(
+            "--bedrooms",
+            type=str,
+            help="Перечень типов спален через запятую "
+            f"(допустимые: {', '.join(BR_CHOICES)}). По-умолчанию все.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            help="Число процессов (по умолчанию REPORT_RECALC_WORKERS / ядра)",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            help="Пар (объект, комнатность) в одной партиции",
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Продолжить последний незавершённый запуск с готовой партиции",
+        )
+
+    def handle(self, *args, **opts):
+        model_keys = [x.strip() for x in opts["model"].split(",") if x.strip()]
+        unknown = [key for key in model_keys if key not in TARGETS]
+        if unknown:
+            raise CommandError(f"Неизвестные модели: {', '.join(unknown)}")
+
+        ids = [int(x) for x in opts["id"].split(",")] if opts.get("id") else None
+        city_wide = [key for key in model_keys if TARGETS[key][1] is None]
+        if ids and city_wide:
+            raise CommandError(
+                f"--id не применим к {', '.join(city_wide)}: отчёт по всему городу"
+            )
+        bedrooms = (
+            [x.strip() for x in opts["bedrooms"].split(",")]
+            if opts.get("bedrooms")
+            else None
+        )
+        unknown = [br for br in bedrooms or [] if br not in BR_CHOICES]
+        if unknown:
+            raise CommandError(f"Неизвестные bedrooms: {', '.join(unknown)}")
+
+        def on_progress(run, index, written, skipped, errors):
+            for error in errors:
+                self.stdout.write(self.style.ERROR(f"ERR {error}"))
+            self.stdout.write(
+                f"{run.model}: {len(run.completed_partitions)}/"
+                f"{run.total_partitions} partitions",
+                ending="\r",
+            )
+
+        for model_key in model_keys:
+            try:
+                run = recalculate(
+                    model_key,
+                    object_ids=ids,
+                    bedrooms=bedrooms,
+                    workers=opts["workers"],
+                    chunk_size=opts["chunk_size"],
+                    resume=opts["resume"],
+                    on_progress=on_progress,
+                )
+            except ValueError as e:
+                raise CommandError(str(e)) from e
+            rate = (
+                run.reports_written / run.duration_seconds
+                if run.duration_seconds
+                else 0
+            )
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"✓ {model_key}: written {run.reports_written}, "
+                    f"skipped {run.reports_skipped}, errors {run.errors} "
+                    f"in {run.duration_seconds:.1f}s ({rate:.1f} reports/sec, "
+                    f"{run.workers} workers)"
+                )
+            )
@@ -88,7 +88,7 @@ class Command(BaseCommand):
             float(p)
             for p in PFListSale.objects.filter(
                 building__area=area,
-                bedrooms__iexact=str(bed_int),
+                bedrooms_norm=bed_int,
                 added_on__gte=one_year_ago,
             ).values_list("price", flat=True)
             if p
@@ -97,7 +97,7 @@ class Command(BaseCommand):
             float(p)
             for p in PFListRent.objects.filter(
                 building__area=area,
-                bedrooms__iexact=str(bed_int),
+                bedrooms_norm=bed_int,
                 added_on__gte=one_year_ago,
             ).values_list("price", flat=True)
             if p
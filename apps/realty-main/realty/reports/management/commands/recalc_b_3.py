@@ -147,7 +147,7 @@ class Command(BaseCommand):
             float(p)
             for p in PFListSale.objects.filter(
                 building=building,
-                bedrooms__iexact=str(bed_int),
+                bedrooms_norm=bed_int,
                 added_on__gte=one_year_ago,
             ).values_list("price", flat=True)
             if p
@@ -169,7 +169,7 @@ class Command(BaseCommand):
             float(p)
             for p in PFListRent.objects.filter(
                 building=building,
-                bedrooms__iexact=str(bed_int),
+                bedrooms_norm=bed_int,
                 added_on__gte=one_year_ago,
             ).values_list("price", flat=True)
             if p
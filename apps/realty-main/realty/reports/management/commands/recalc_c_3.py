@@ -85,14 +85,14 @@ class Command(BaseCommand):
         sale_ly = [
             float(p)
             for p in PFListSale.objects.filter(
-                bedrooms__iexact=str(bed_int), added_on__range=(start_ly, today)
+                bedrooms_norm=bed_int, added_on__range=(start_ly, today)
             ).values_list("price", flat=True)
             if p
         ]
         sale_py = [
             float(p)
             for p in PFListSale.objects.filter(
-                bedrooms__iexact=str(bed_int), added_on__range=(start_py, end_py)
+                bedrooms_norm=bed_int, added_on__range=(start_py, end_py)
             ).values_list("price", flat=True)
             if p
         ]
@@ -116,14 +116,14 @@ class Command(BaseCommand):
         rent_ly = [
             float(p)
             for p in PFListRent.objects.filter(
-                bedrooms__iexact=str(bed_int), added_on__range=(start_ly, today)
+                bedrooms_norm=bed_int, added_on__range=(start_ly, today)
             ).values_list("price", flat=True)
             if p
         ]
         rent_py = [
             float(p)
             for p in PFListRent.objects.filter(
-                bedrooms__iexact=str(bed_int), added_on__range=(start_py, end_py)
+                bedrooms_norm=bed_int, added_on__range=(start_py, end_py)
             ).values_list("price", flat=True)
             if p
         ]
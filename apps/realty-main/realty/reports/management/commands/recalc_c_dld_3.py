@@ -76,7 +76,7 @@ class Command(BaseCommand):
         sale_ly = [
             float(p)
             for p in PFListSale.objects.filter(
-                bedrooms__iexact=str(bed_int),
+                bedrooms_norm=bed_int,
                 added_on__gte=one_year_ago,
             ).values_list("price", flat=True)
             if p
@@ -84,7 +84,7 @@ class Command(BaseCommand):
         rent_ly = [
             float(p)
             for p in PFListRent.objects.filter(
-                bedrooms__iexact=str(bed_int),
+                bedrooms_norm=bed_int,
                 added_on__gte=one_year_ago,
             ).values_list("price", flat=True)
             if p
@@ -116,7 +116,7 @@ class Command(BaseCommand):
         sale_py = [
             float(p)
             for p in PFListSale.objects.filter(
-                bedrooms__iexact=str(bed_int),
+                bedrooms_norm=bed_int,
                 added_on__range=(start_py, end_py),
             ).values_list("price", flat=True)
             if p
@@ -124,7 +124,7 @@ class Command(BaseCommand):
         rent_py = [
             float(p)
             for p in PFListRent.objects.filter(
-                bedrooms__iexact=str(bed_int),
+                bedrooms_norm=bed_int,
                 added_on__range=(start_py, end_py),
             ).values_list("price", flat=True)
             if p
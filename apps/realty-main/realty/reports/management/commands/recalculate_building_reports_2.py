@@ -115,7 +115,7 @@ class Command(BaseCommand):
                     None,
                     PFListSale.objects.filter(
                         building=building,
-                        bedrooms__iexact=str(bed_int),
+                        bedrooms_norm=bed_int,
                         added_on__gte=one_year_ago,
                     ).values_list("price", flat=True),
                 ),
@@ -141,7 +141,7 @@ class Command(BaseCommand):
                     None,
                     PFListRent.objects.filter(
                         building=building,
-                        bedrooms__iexact=str(bed_int),
+                        bedrooms_norm=bed_int,
                         added_on__gte=one_year_ago,
                     ).values_list("price", flat=True),
                 ),
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.7 on 2025-06-05 10:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("reports", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="areareport",
+            name="rent_price_sketch",
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="areareport",
+            name="sale_price_sketch",
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="buildingreport",
+            name="rent_price_sketch",
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="buildingreport",
+            name="sale_price_sketch",
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
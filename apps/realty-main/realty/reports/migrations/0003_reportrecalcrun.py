@@ -0,0 +1,63 @@
+# Generated by Django 5.1.7 on 2025-06-06 09:14
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("reports", "0002_areareport_rent_price_sketch_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ReportRecalcRun",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("model", models.CharField(db_index=True, max_length=20)),
+                ("bedrooms", models.JSONField(default=list)),
+                (
+                    "object_ids",
+                    models.JSONField(default=list, help_text="Снимок pk объектов"),
+                ),
+                ("chunk_size", models.PositiveIntegerField(default=50)),
+                ("workers", models.PositiveSmallIntegerField(default=1)),
+                (
+                    "started_at",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                ("finished_at", models.DateTimeField(blank=True, null=True)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("running", "Running"),
+                            ("completed", "Completed"),
+                            ("failed", "Failed"),
+                        ],
+                        default="running",
+                        max_length=12,
+                    ),
+                ),
+                ("total_partitions", models.PositiveIntegerField(default=0)),
+                ("completed_partitions", models.JSONField(default=list)),
+                ("reports_written", models.PositiveIntegerField(default=0)),
+                ("reports_skipped", models.PositiveIntegerField(default=0)),
+                ("errors", models.PositiveIntegerField(default=0)),
+                ("duration_seconds", models.FloatField(blank=True, null=True)),
+                ("log", models.TextField(blank=True)),
+            ],
+            options={
+                "ordering": ("-started_at",),
+            },
+        ),
+    ]
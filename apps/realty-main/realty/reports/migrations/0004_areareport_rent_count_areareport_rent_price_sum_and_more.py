@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("reports", "0003_reportrecalcrun"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="areareport",
+            name="rent_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="areareport",
+            name="rent_price_sum",
+            field=models.DecimalField(
+                blank=True, decimal_places=2, max_digits=20, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="areareport",
+            name="sale_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="areareport",
+            name="sale_price_sum",
+            field=models.DecimalField(
+                blank=True, decimal_places=2, max_digits=20, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="buildingreport",
+            name="rent_price_sum",
+            field=models.DecimalField(
+                blank=True, decimal_places=2, max_digits=20, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="buildingreport",
+            name="sale_price_sum",
+            field=models.DecimalField(
+                blank=True, decimal_places=2, max_digits=20, null=True
+            ),
+        ),
+    ]
@@ -1,14 +1,19 @@
 # realty/reports/models.py
 
 import json
-import statistics
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import timedelta, date
 
 from typing import Optional
 
+import numpy as np
 from django.db import models, transaction
 
 from django.db.models import JSONField
+from django.db.models import Avg, Count, Max, Min
+from django.db.models import Case, DecimalField, FloatField, Value, When
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 
@@ -23,15 +28,19 @@ from realty.main.models import (
     Building as DldBuilding,
     MergedTransaction,
     MergedRentalTransaction,
+    normalize_bedrooms,
 )
 from realty.main.models import Area as DldArea
-import re
-
-
-from typing import Callable, Iterable, TypeVar
-
-
-T = TypeVar("T")
+from realty.main.sketch import merge_serialized
+from .stats_kernel import (
+    describe,
+    group_means,
+    grouped_describe,
+    load_columns,
+    nan_mean,
+    nan_median,
+    price_sketch,
+)
 
 
 BEDROOM_CHOICES = [
@@ -43,6 +52,121 @@ BEDROOM_CHOICES = [
 ]
 
 
+def _price_median(listing_qs) -> Optional[float]:
+    """Точная медиана цен объявлений одним запросом (0 и NULL пропускаем)."""
+    return nan_median(
+        load_columns(listing_qs.filter(price__gt=0).order_by(), "price")["price"]
+    )
+
+
+def _merged_price_stats(
+    listing_qs, reports_qs, kind: str, report_key: str, listing_key: str
+) -> dict:
+    """
+    avg / median / min / max / count цен listing_qs из частичных агрегатов
+    отчётов уровнем ниже (BuildingReport для района, AreaReport для города):
+    число и сумма цен складываются, min / max - по отчётам, медиана - из
+    слитых скетчей. Объявления, которые эти отчёты не покрывают (здание без
+    отчёта, объявление без здания / района), добираются одним проходом.
+    kind - "sale" / "rent" (поля {kind}_count, {kind}_price_sum, ...).
+
+    Отчёты уровнем ниже должны быть пересчитаны раньше -
+    recalculate_reports так и делает (здания -> районы -> город).
+    """
+    sketch_field, sum_field = f"{kind}_price_sketch", f"{kind}_price_sum"
+    rows = list(
+        reports_qs.filter(
+            **{f"{sketch_field}__isnull": False, f"{sum_field}__isnull": False}
+        ).values_list(
+            report_key,
+            f"{kind}_count",
+            sum_field,
+            f"min_{kind}_price",
+            f"max_{kind}_price",
+            sketch_field,
+        )
+    )
+    covered = [row[0] for row in rows]
+    rest = load_columns(
+        listing_qs.exclude(**{f"{listing_key}__in": covered})
+        .filter(price__gt=0)
+        .order_by(),
+        "price",
+    )["price"]
+
+    sketch = merge_serialized(row[5] for row in rows)
+    sketch.merge(price_sketch(rest))
+    filled = [row for row in rows if row[1]]
+    count = sum(row[1] for row in filled) + len(rest)
+    total = sum(float(row[2]) for row in filled) + float(rest.sum())
+    lows = [float(row[3]) for row in filled]
+    highs = [float(row[4]) for row in filled]
+    if len(rest):
+        lows.append(float(rest.min()))
+        highs.append(float(rest.max()))
+    return {
+        "count": count,
+        "sum": total,
+        "avg": total / count if count else None,
+        "median": sketch.median(),
+        "min": min(lows, default=None),
+        "max": max(highs, default=None),
+        "sketch": sketch,
+    }
+
+
+# Буфер отчётов: внутри buffer_reports() calculate() не пишет в БД, а
+# складывает несохранённые отчёты сюда (см. realty.reports.recalc).
+_report_buffer: ContextVar[Optional[list]] = ContextVar("report_buffer", default=None)
+
+
+@contextmanager
+def buffer_reports():
+    """Собирает [(отчёт, сохраняемые поля)] вместо update_or_create."""
+    buffer = []
+    token = _report_buffer.set(buffer)
+    try:
+        yield buffer
+    finally:
+        _report_buffer.reset(token)
+
+
+def _save_report(model, defaults: dict, **lookup):
+    """update_or_create(**lookup, defaults=defaults) или запись в буфер."""
+    buffer = _report_buffer.get()
+    if buffer is None:
+        report, _ = model.objects.update_or_create(defaults=defaults, **lookup)
+        return report
+    report = model(**lookup, **defaults)
+    buffer.append((report, list(defaults)))
+    return report
+
+
+def flush_reports(buffer) -> int:
+    """
+    Сохраняет отчёты из buffer_reports() пачками bulk_create с
+    update_conflicts по уникальному ключу отчёта (как update_or_create).
+    """
+    groups = defaultdict(list)
+    for report, fields in buffer:
+        groups[(type(report), tuple(fields))].append(report)
+
+    for (model, fields), reports in groups.items():
+        unique_fields = (
+            list(model._meta.unique_together[0])
+            if model._meta.unique_together
+            else ["bedrooms"]
+        )
+        model.objects.bulk_create(
+            reports,
+            batch_size=500,
+            update_conflicts=True,
+            unique_fields=unique_fields,
+            update_fields=[*fields, "calculated_at"],
+        )
+    return len(buffer)
+
+
 class BuildingReport(models.Model):
     building = models.ForeignKey(
         Building, on_delete=models.CASCADE, related_name="reports"
@@ -64,6 +188,9 @@ class BuildingReport(models.Model):
         max_digits=12, decimal_places=2, null=True, blank=True
     )
     sale_count = models.PositiveIntegerField(default=0)
+    sale_price_sum = models.DecimalField(
+        max_digits=20, decimal_places=2, null=True, blank=True
+    )
     avg_exposure_sale_days = models.FloatField(null=True, blank=True)
     sale_per_unit_ratio = models.FloatField(null=True, blank=True)
 
@@ -81,9 +208,16 @@ class BuildingReport(models.Model):
         max_digits=12, decimal_places=2, null=True, blank=True
     )
     rent_count = models.PositiveIntegerField(default=0)
+    rent_price_sum = models.DecimalField(
+        max_digits=20, decimal_places=2, null=True, blank=True
+    )
     avg_exposure_rent_days = models.FloatField(null=True, blank=True)
     rent_per_unit_ratio = models.FloatField(null=True, blank=True)
 
+    # ── QuantileSketch цен (main/sketch.py) – для медиан района / города ─────
+    sale_price_sketch = models.BinaryField(null=True, blank=True)
+    rent_price_sketch = models.BinaryField(null=True, blank=True)
+
     # ── JSON from DLD ──────────────────────────────────────────────────────────
     type_of_rooms_in = JSONField(blank=True, null=True)
 
@@ -153,25 +287,27 @@ class BuildingReport(models.Model):
         except (TypeError, ValueError):
             rooms_count_json = {}
 
-        # ── 3. Утилита для «безопасной» статистики ────────────────────────────
-        def safe(fn: Callable[[Iterable[T]], T], seq: list[T]) -> T | None:  # noqa: ANN401
-            return fn(seq) if seq else None
+        # ── 3. Цены объявлений за год (0 и NULL пропускаем) ──────────────────
+        def listing_prices(model):
+            prices = load_columns(
+                model.objects.filter(
+                    building=building,
+                    bedrooms_norm=bed_int,
+                    added_on__gte=one_year_ago,
+                ),
+                "price",
+            )["price"]
+            return prices[(prices != 0) & ~np.isnan(prices)]
 
         # ── 4. SALE ───────────────────────────────────────────────────────────
-        sale_prices = [
-            float(p)
-            for p in PFListSale.objects.filter(
-                building=building,
-                bedrooms__iexact=bed_int,
-                added_on__gte=one_year_ago,
-            ).values_list("price", flat=True)
-            if p
-        ]
-        sale_count = len(sale_prices)
-        avg_sale = safe(statistics.fmean, sale_prices)
-        median_sale = safe(statistics.median, sale_prices)
-        min_sale = safe(min, sale_prices)
-        max_sale = safe(max, sale_prices)
+        sale_prices = listing_prices(PFListSale)
+        sale = describe(sale_prices)
+        sale_count = sale["count"]
+        sale_sketch = price_sketch(sale_prices)  # для медианы района
+        avg_sale = sale["avg_price"]
+        median_sale = sale["median_price"]
+        min_sale = sale["min_price"]
+        max_sale = sale["max_price"]
         avg_expo_sale = (
             building.sum_exposure_sale_days / building.numbers_of_processed_sale_ads
             if building.numbers_of_processed_sale_ads
@@ -180,20 +316,14 @@ class BuildingReport(models.Model):
         sale_per_unit = sale_count / units if units else None  # ★ исправлено
 
         # ── 5. RENT ───────────────────────────────────────────────────────────
-        rent_prices = [
-            float(p)
-            for p in PFListRent.objects.filter(
-                building=building,
-                bedrooms__iexact=bed_int,
-                added_on__gte=one_year_ago,
-            ).values_list("price", flat=True)
-            if p
-        ]
-        rent_count = len(rent_prices)
-        avg_rent = safe(statistics.fmean, rent_prices)
-        median_rent = safe(statistics.median, rent_prices)
-        min_rent = safe(min, rent_prices)
-        max_rent = safe(max, rent_prices)
+        rent_prices = listing_prices(PFListRent)
+        rent = describe(rent_prices)
+        rent_count = rent["count"]
+        rent_sketch = price_sketch(rent_prices)
+        avg_rent = rent["avg_price"]
+        median_rent = rent["median_price"]
+        min_rent = rent["min_price"]
+        max_rent = rent["max_price"]
         avg_expo_rent = (
             building.sum_exposure_rent_days / building.numbers_of_processed_rent_ads
             if building.numbers_of_processed_rent_ads
@@ -206,7 +336,8 @@ class BuildingReport(models.Model):
 
         # ── 7. Запись в БД ────────────────────────────────────────────────────
         with transaction.atomic():
-            report, _ = cls.objects.update_or_create(
+            report = _save_report(
+                cls,
                 building=building,
                 bedrooms=bedrooms,
                 defaults={
@@ -216,6 +347,7 @@ class BuildingReport(models.Model):
                     "min_sale_price": min_sale,
                     "max_sale_price": max_sale,
                     "sale_count": sale_count,
+                    "sale_price_sum": float(sale_prices.sum()),
                     "avg_exposure_sale_days": avg_expo_sale,
                     "sale_per_unit_ratio": sale_per_unit,
                     # ---- rent ----
@@ -224,8 +356,12 @@ class BuildingReport(models.Model):
                     "min_rent_price": min_rent,
                     "max_rent_price": max_rent,
                     "rent_count": rent_count,
+                    "rent_price_sum": float(rent_prices.sum()),
                     "avg_exposure_rent_days": avg_expo_rent,
                     "rent_per_unit_ratio": rent_per_unit,
+                    # ---- sketches ----
+                    "sale_price_sketch": sale_sketch.to_bytes(),
+                    "rent_price_sketch": rent_sketch.to_bytes(),
                     # ---- misc ----
                     "type_of_rooms_in": rooms_count_json,
                     "total_units": total_units,
@@ -295,6 +431,20 @@ class AreaReport(models.Model):
     avg_rent_per_unit_ratio = models.FloatField(null=True, blank=True)
     avg_roi = models.FloatField(null=True, blank=True)
 
+    # частичные агрегаты цен (число, сумма) – город складывает их по районам
+    sale_count = models.PositiveIntegerField(default=0)
+    rent_count = models.PositiveIntegerField(default=0)
+    sale_price_sum = models.DecimalField(
+        max_digits=20, decimal_places=2, null=True, blank=True
+    )
+    rent_price_sum = models.DecimalField(
+        max_digits=20, decimal_places=2, null=True, blank=True
+    )
+
+    # QuantileSketch цен района (слияние скетчей BuildingReport) – для города
+    sale_price_sketch = models.BinaryField(null=True, blank=True)
+    rent_price_sketch = models.BinaryField(null=True, blank=True)
+
     class Meta:
         unique_together = ("area", "bedrooms")
 
@@ -306,27 +456,18 @@ class AreaReport(models.Model):
         one_year_ago = timezone.now() - timedelta(days=365)
 
         # 1) определяем DLD-ключ для sale и normalize bedrooms
-        print(bedrooms)
         dld_key = ROOM_MAPPING.get(bedrooms, [bedrooms])[0]
         bed_int = _bedrooms_to_int(bedrooms)
         if bed_int is None:
             return None
 
-        # 2) все объявления sale в этом районе
+        # 2) все объявления sale / rent в этом районе
         sale_qs = PFListSale.objects.filter(
-            building__area=area, bedrooms__iexact=bed_int, added_on__gte=one_year_ago
-        ).values_list("price", flat=True)
-        sale_prices = [p for p in sale_qs if p is not None]
-
-        # 3) все объявления rent в этом районе
+            building__area=area, bedrooms_norm=bed_int, added_on__gte=one_year_ago
+        )
         rent_qs = PFListRent.objects.filter(
-            building__area=area, bedrooms__iexact=bed_int, added_on__gte=one_year_ago
-        ).values_list("price", flat=True)
-        rent_prices = [p for p in rent_qs if p is not None]
-
-        # 4) средние по всем объявлениям
-        avg_sale_all = sum(sale_prices) / len(sale_prices) if sale_prices else None
-        avg_rent_all = sum(rent_prices) / len(rent_prices) if rent_prices else None
+            building__area=area, bedrooms_norm=bed_int, added_on__gte=one_year_ago
+        )
 
         # -------------------------------------------------------------------------
         # единый QuerySet с объектами BuildingReport для данного area + bedrooms
@@ -336,102 +477,91 @@ class AreaReport(models.Model):
             bedrooms=bedrooms,
         )
 
-        # -- средние цены по зданиям ----------------------------------------------
-        sale_build_avgs = [
-            r.avg_sale_price for r in br_qs if r.avg_sale_price is not None
-        ]
-        rent_build_avgs = [
-            r.avg_rent_price for r in br_qs if r.avg_rent_price is not None
-        ]
-
-        avg_sale_by_build = (
-            sum(sale_build_avgs) / len(sale_build_avgs) if sale_build_avgs else None
-        )
-        avg_rent_by_build = (
-            sum(rent_build_avgs) / len(rent_build_avgs) if rent_build_avgs else None
+        # -- средние по зданиям: колонки BuildingReport одним запросом ----------
+        br_cols = load_columns(
+            br_qs.order_by(),
+            "avg_sale_price",
+            "avg_rent_price",
+            "rent_per_unit_ratio",
+            "roi",
+            "avg_exposure_sale_days",
+            "avg_exposure_rent_days",
+            "sale_per_unit_ratio",
         )
+        avg_sale_by_build = nan_mean(br_cols["avg_sale_price"])
+        avg_rent_by_build = nan_mean(br_cols["avg_rent_price"])
 
-        # 6) медианы / мин / макс
-        med_sale = statistics.median(sale_prices) if sale_prices else None
-        med_rent = statistics.median(rent_prices) if rent_prices else None
-        min_sale = min(sale_prices) if sale_prices else None
-        max_sale = max(sale_prices) if sale_prices else None
-        min_rent = min(rent_prices) if rent_prices else None
-        max_rent = max(rent_prices) if rent_prices else None
+        # 3) avg / медиана / мин / макс по всем объявлениям – слияние частичных
+        # агрегатов BuildingReport (без прохода по району)
+        sale = _merged_price_stats(sale_qs, br_qs, "sale", "building_id", "building_id")
+        rent = _merged_price_stats(rent_qs, br_qs, "rent", "building_id", "building_id")
 
         # -- коэффициенты ----------------------------------------------------------
-        ratios = [
-            r.rent_per_unit_ratio for r in br_qs if r.rent_per_unit_ratio is not None
-        ]
-        rois = [r.roi for r in br_qs if r.roi is not None]
-
-        avg_ratio = sum(ratios) / len(ratios) if ratios else None
-        avg_roi = sum(rois) / len(rois) if rois else None
+        avg_ratio = nan_mean(br_cols["rent_per_unit_ratio"])
+        avg_roi = nan_mean(br_cols["roi"])
 
         # -- НОВОЕ: экспозиция и sale_per_unit_ratio -------------------------------
-        expo_sale_vals = [
-            r.avg_exposure_sale_days
-            for r in br_qs
-            if r.avg_exposure_sale_days is not None
-        ]
-        expo_rent_vals = [
-            r.avg_exposure_rent_days
-            for r in br_qs
-            if r.avg_exposure_rent_days is not None
-        ]
-        # print(r, br_qs)
-        avg_expo_sale = (
-            sum(expo_sale_vals) / len(expo_sale_vals) if expo_sale_vals else None
-        )
-        avg_expo_rent = (
-            sum(expo_rent_vals) / len(expo_rent_vals) if expo_rent_vals else None
-        )
-
-        sale_ratio_vals = [
-            r.sale_per_unit_ratio for r in br_qs if r.sale_per_unit_ratio is not None
-        ]
-        avg_sale_ratio = (
-            sum(sale_ratio_vals) / len(sale_ratio_vals) if sale_ratio_vals else None
-        )
+        avg_expo_sale = nan_mean(br_cols["avg_exposure_sale_days"])
+        avg_expo_rent = nan_mean(br_cols["avg_exposure_rent_days"])
+        avg_sale_ratio = nan_mean(br_cols["sale_per_unit_ratio"])
 
         # 8) создаём или обновляем отчёт
-        report, _ = cls.objects.update_or_create(
+        report = _save_report(
+            cls,
             area=area,
             bedrooms=bedrooms,
             defaults={
-                "avg_sale_price": avg_sale_all,
-                "avg_rent_price": avg_rent_all,
+                "avg_sale_price": sale["avg"],
+                "avg_rent_price": rent["avg"],
                 "avg_sale_price_by_building": avg_sale_by_build,
                 "avg_rent_price_by_building": avg_rent_by_build,
-                "median_sale_price": med_sale,
-                "median_rent_price": med_rent,
-                "min_sale_price": min_sale,
-                "max_sale_price": max_sale,
-                "min_rent_price": min_rent,
-                "max_rent_price": max_rent,
+                "median_sale_price": sale["median"],
+                "median_rent_price": rent["median"],
+                "min_sale_price": sale["min"],
+                "max_sale_price": sale["max"],
+                "min_rent_price": rent["min"],
+                "max_rent_price": rent["max"],
                 "avg_rent_per_unit_ratio": avg_ratio,
                 "avg_roi": avg_roi,
                 # ── новые поля ───────────────────────────────────────────────
                 "avg_exposure_sale_days": avg_expo_sale,
                 "avg_exposure_rent_days": avg_expo_rent,
                 "avg_sale_per_unit_ratio": avg_sale_ratio,
+                "sale_count": sale["count"],
+                "rent_count": rent["count"],
+                "sale_price_sum": sale["sum"],
+                "rent_price_sum": rent["sum"],
+                "sale_price_sketch": sale["sketch"].to_bytes(),
+                "rent_price_sketch": rent["sketch"].to_bytes(),
             },
         )
         return report
 
 
-import statistics  # === NEW ===
-from datetime import timedelta, date  # === NEW ===
-from decimal import Decimal  # === NEW ===
-
-from django.db import models, transaction
-from django.utils import timezone
-
 # здесь BEDROOM_CHOICES, _bedrooms_to_int, ROOM_MAPPING
 # и модели PFListSale/Rent, BuildingReport должны быть уже импортированы
 # ---------------------------------------------------------------------
 
 
+def _city_listing_stats(bedrooms: str, bed_int: int, since: date):
+    """
+    Цены объявлений sale / rent по городу с since: слияние частичных
+    агрегатов AreaReport, без выгрузки всех объявлений (CityReportPF и
+    CityReport используют одни и те же числа).
+    """
+    area_reports = AreaReport.objects.filter(bedrooms=bedrooms)
+    return [
+        _merged_price_stats(
+            model.objects.filter(bedrooms_norm=bed_int, added_on__gte=since),
+            area_reports,
+            kind,
+            "area_id",
+            "building__area_id",
+        )
+        for model, kind in ((PFListSale, "sale"), (PFListRent, "rent"))
+    ]
+
+
 class CityReportPF(models.Model):
     bedrooms = models.CharField(max_length=10, choices=BEDROOM_CHOICES, unique=True)
     calculated_at = models.DateTimeField(auto_now=True)
@@ -562,67 +692,57 @@ class CityReportPF(models.Model):
         if bed_int is None:
             return None
 
-        # helper: статистика над списком чисел --------------------------
-        def stat(nums):
-            if not nums:
+        # helper: avg / median / min / max / count ----------------------
+        # PY: avg/min/max/count – агрегатом в БД, медиана – по ценам (точно)
+        def stat(qs):
+            agg = qs.filter(price__gt=0).aggregate(
+                avg=Avg("price"), min=Min("price"), max=Max("price"), cnt=Count("pk")
+            )
+            if not agg["cnt"]:
                 return (None, None, None, None, 0)
             return (
-                sum(nums) / len(nums),
-                statistics.median(nums),
-                min(nums),
-                max(nums),
-                len(nums),
+                float(agg["avg"]),
+                _price_median(qs),
+                float(agg["min"]),
+                float(agg["max"]),
+                agg["cnt"],
             )
 
-        # =========================  SALE  ==============================
-        sale_prices_ly = list(
-            PFListSale.objects.filter(
-                bedrooms__iexact=bed_int, added_on__range=(start_ly, today)
-            ).values_list("price", flat=True)
-        )
-        sale_prices_ly = [float(p) for p in sale_prices_ly if p]
-        (avg_price, median_price, min_price, max_price, cnt_sale_ly) = stat(
-            sale_prices_ly
-        )
+        # LY: слияние частичных агрегатов AreaReport + объявления вне районов
+        sale_ly, rent_ly = _city_listing_stats(bedrooms, bed_int, start_ly)
 
-        sale_prices_py = list(
-            PFListSale.objects.filter(
-                bedrooms__iexact=bed_int, added_on__range=(start_py, end_py)
-            ).values_list("price", flat=True)
+        # =========================  SALE  ==============================
+        avg_price = sale_ly["avg"]
+        median_price = sale_ly["median"]
+        min_price = sale_ly["min"]
+        max_price = sale_ly["max"]
+        cnt_sale_ly = sale_ly["count"]
+
+        # PY: сохранённых агрегатов нет – один проход по объявлениям
+        sale_py_qs = PFListSale.objects.filter(
+            bedrooms_norm=bed_int, added_on__range=(start_py, end_py)
         )
-        sale_prices_py = [float(p) for p in sale_prices_py if p]
         (avg_price_py, median_price_py, min_price_py, max_price_py, cnt_sale_py) = stat(
-            sale_prices_py
+            sale_py_qs
         )
 
         # =========================  RENT  ==============================
-        rent_prices_ly = list(
-            PFListRent.objects.filter(
-                bedrooms__iexact=bed_int, added_on__range=(start_ly, today)
-            ).values_list("price", flat=True)
+        avg_rent_price = rent_ly["avg"]
+        median_rent_price = rent_ly["median"]
+        min_rent_price = rent_ly["min"]
+        max_rent_price = rent_ly["max"]
+        cnt_rent_ly = rent_ly["count"]
+
+        rent_py_qs = PFListRent.objects.filter(
+            bedrooms_norm=bed_int, added_on__range=(start_py, end_py)
         )
-        rent_prices_ly = [float(p) for p in rent_prices_ly if p]
-        (
-            avg_rent_price,
-            median_rent_price,
-            min_rent_price,
-            max_rent_price,
-            cnt_rent_ly,
-        ) = stat(rent_prices_ly)
-
-        rent_prices_py = list(
-            PFListRent.objects.filter(
-                bedrooms__iexact=bed_int, added_on__range=(start_py, end_py)
-            ).values_list("price", flat=True)
-        )
-        rent_prices_py = [float(p) for p in rent_prices_py if p]
         (
             avg_rent_price_py,
             median_rent_price_py,
             min_rent_price_py,
             max_rent_price_py,
             cnt_rent_py,
-        ) = stat(rent_prices_py)
+        ) = stat(rent_py_qs)
 
         # если за LY нет совсем ни продаж ни аренды – отчёт не создаём
         if cnt_sale_ly == 0 and cnt_rent_ly == 0:
@@ -631,73 +751,43 @@ class CityReportPF(models.Model):
         # =================  METRICS FROM BuildingReport  ================
         br_qs = BuildingReport.objects.filter(bedrooms=bedrooms)
 
-        # цены «по зданиям»
-        sale_build_avgs = [float(b.avg_sale_price) for b in br_qs if b.avg_sale_price]
-        avg_price_by_building = (
-            (sum(sale_build_avgs) / len(sale_build_avgs)) if sale_build_avgs else None
+        br_cols = load_columns(
+            br_qs.order_by(),
+            "avg_sale_price",
+            "avg_rent_price",
+            "avg_exposure_sale_days",
+            "avg_exposure_rent_days",
+            "rent_per_unit_ratio",
+            "sale_per_unit_ratio",
         )
 
-        rent_build_avgs = [float(b.avg_rent_price) for b in br_qs if b.avg_rent_price]
-        avg_rent_price_by_building = (
-            (sum(rent_build_avgs) / len(rent_build_avgs)) if rent_build_avgs else None
-        )
+        # цены «по зданиям» (пустые и нулевые не учитываются)
+        avg_price_by_building = nan_mean(br_cols["avg_sale_price"], nonzero=True)
+        avg_rent_price_by_building = nan_mean(br_cols["avg_rent_price"], nonzero=True)
 
         # экспозиция
-        expos_sale = [
-            b.avg_exposure_sale_days for b in br_qs if b.avg_exposure_sale_days
-        ]
-        avg_exposure = (sum(expos_sale) / len(expos_sale)) if expos_sale else None
-
-        expos_rent = [
-            b.avg_exposure_rent_days for b in br_qs if b.avg_exposure_rent_days
-        ]
-        avg_exposure_rent = (sum(expos_rent) / len(expos_rent)) if expos_rent else None
+        avg_exposure = nan_mean(br_cols["avg_exposure_sale_days"], nonzero=True)
+        avg_exposure_rent = nan_mean(br_cols["avg_exposure_rent_days"], nonzero=True)
 
         # ratios
-        rent_ratios = [
-            b.rent_per_unit_ratio for b in br_qs if b.rent_per_unit_ratio is not None
-        ]  # === NEW ===
-        avg_rent_ratio = (sum(rent_ratios) / len(rent_ratios)) if rent_ratios else None
-
-        sale_ratios = [
-            b.sale_per_unit_ratio for b in br_qs if b.sale_per_unit_ratio is not None
-        ]  # === NEW ===
-        avg_sale_ratio = (sum(sale_ratios) / len(sale_ratios)) if sale_ratios else None
+        avg_rent_ratio = nan_mean(br_cols["rent_per_unit_ratio"])  # === NEW ===
+        avg_sale_ratio = nan_mean(br_cols["sale_per_unit_ratio"])  # === NEW ===
 
         # ROI
         rois = 0.0  # [b.roi_ly for b in br_qs if b.roi_ly is not None]  # подразумеваем roi_ly в BuildingReport
         avg_roi = 0.0  # (sum(rois) / len(rois)) if rois else None
 
         # -------- LY / PY ratios --------------------------------------
-        rent_ratios_ly = [
-            b.rent_per_unit_ratio for b in br_qs if b.rent_per_unit_ratio is not None
-        ]
-        rent_ratios_py = [
-            b.rent_per_unit_ratio for b in br_qs if b.rent_per_unit_ratio is not None
-        ]
-        sale_ratios_ly = [
-            b.sale_per_unit_ratio for b in br_qs if b.sale_per_unit_ratio is not None
-        ]
-        sale_ratios_py = [
-            b.sale_per_unit_ratio for b in br_qs if b.sale_per_unit_ratio is not None
-        ]
-
-        avg_rent_ratio_ly = (
-            (sum(rent_ratios_ly) / len(rent_ratios_ly)) if rent_ratios_ly else None
-        )  # === NEW ===
-        avg_rent_ratio_py = (
-            (sum(rent_ratios_py) / len(rent_ratios_py)) if rent_ratios_py else None
-        )  # === NEW ===
-        avg_sale_ratio_ly = (
-            (sum(sale_ratios_ly) / len(sale_ratios_ly)) if sale_ratios_ly else None
-        )  # === NEW ===
-        avg_sale_ratio_py = (
-            (sum(sale_ratios_py) / len(sale_ratios_py)) if sale_ratios_py else None
-        )  # === NEW ===
+        # BuildingReport не делит коэффициенты по годам – LY и PY совпадают
+        avg_rent_ratio_ly = avg_rent_ratio  # === NEW ===
+        avg_rent_ratio_py = avg_rent_ratio  # === NEW ===
+        avg_sale_ratio_ly = avg_sale_ratio  # === NEW ===
+        avg_sale_ratio_py = avg_sale_ratio  # === NEW ===
 
         # =======================  SAVE  ================================
         with transaction.atomic():
-            report, _ = cls.objects.update_or_create(
+            report = _save_report(
+                cls,
                 bedrooms=bedrooms,
                 defaults={
                     # --- SALE current ---
@@ -899,7 +989,8 @@ class CityReport(models.Model):
         """
         Полный пересчёт всех метрик по Дубаю для одной комнатности.
 
-        • «Текущий год» (LY) – по *сырым* объявлениям PFListSale / PFListRent
+        • «Текущий год» (LY) – по объявлениям PFListSale / PFListRent: слияние
+          частичных агрегатов AreaReport (число, сумма, min / max, скетч)
         • «Прошлый год» (PY)   – по агрегатам DldBuildingReport
         • Все «по-зданиям» метрики (avg_*_by_building, avg_*_per_unit_ratio, ROI,
           экспозиция) берутся из **DldBuildingReport**, усредняя по всем зданиям.
@@ -910,8 +1001,7 @@ class CityReport(models.Model):
         # ──────────────────────────────────────────────────────────────
         from datetime import timedelta
         from django.utils import timezone
-        import statistics
-        from .models import PFListSale, PFListRent, DldBuildingReport  # ★ NEW
+        from .models import DldBuildingReport  # ★ NEW
 
         today = timezone.now().date()
         one_year_ago = today - timedelta(days=365)
@@ -923,136 +1013,98 @@ class CityReport(models.Model):
         if bed_int is None:
             return None
 
-        # ──────────────────────────────────────────────────────────────
-        #           HELPERS
-        # ──────────────────────────────────────────────────────────────
-        def _stat(values):
-            """avg, median, min, max, count  for a list of floats"""
-            if not values:
-                return None, None, None, None, 0
-            return (
-                sum(values) / len(values),
-                statistics.median(values),
-                min(values),
-                max(values),
-                len(values),
-            )
-
-        def _fmean_attr(qs, attr):  # ★ NEW
-            vals = [
-                float(getattr(r, attr, None))
-                for r in qs
-                if getattr(r, attr, None) is not None
-            ]
-            return sum(vals) / len(vals) if vals else None
-
-        def _fmedian_attr(qs, attr):  # ★ NEW
-            vals = [
-                float(getattr(r, attr, None))
-                for r in qs
-                if getattr(r, attr, None) is not None
-            ]
-            return statistics.median(vals) if vals else None
-
         # ──────────────────────────────────────────────────────────────
         #           RAW ADS  (LY)
         # ──────────────────────────────────────────────────────────────
-        sale_vals_ly = list(
-            PFListSale.objects.filter(
-                bedrooms__iexact=bed_int, added_on__gte=one_year_ago
-            ).values_list("price", flat=True)
-        )
-        sale_vals_ly = [float(p) for p in sale_vals_ly if p]
-
-        rent_vals_ly = list(
-            PFListRent.objects.filter(
-                bedrooms__iexact=bed_int, added_on__gte=one_year_ago
-            ).values_list("price", flat=True)
-        )
-        rent_vals_ly = [float(p) for p in rent_vals_ly if p]
+        sale_ly, rent_ly = _city_listing_stats(bedrooms, bed_int, one_year_ago)
 
         # если совсем нет сделок – отчёт не создаём
-        if not sale_vals_ly and not rent_vals_ly:
+        if not sale_ly["count"] and not rent_ly["count"]:
             return None
 
-        (avg_price, median_price, min_price, max_price, cnt_sale_ly) = _stat(
-            sale_vals_ly
-        )
-
-        (
-            avg_rent_price,
-            median_rent_price,
-            min_rent_price,
-            max_rent_price,
-            cnt_rent_ly,
-        ) = _stat(rent_vals_ly)
+        avg_price = sale_ly["avg"]
+        median_price = sale_ly["median"]
+        min_price = sale_ly["min"]
+        max_price = sale_ly["max"]
+        cnt_sale_ly = sale_ly["count"]
+        avg_rent_price = rent_ly["avg"]
+        median_rent_price = rent_ly["median"]
+        min_rent_price = rent_ly["min"]
+        max_rent_price = rent_ly["max"]
+        cnt_rent_ly = rent_ly["count"]
 
         # ──────────────────────────────────────────────────────────────
         #           BUILDING-LEVEL АГРЕГАТЫ  (LY / PY)
         # ──────────────────────────────────────────────────────────────
-        br_qs = DldBuildingReport.objects.filter(bedrooms=bedrooms)  # ★ NEW
-
-        # # --- LY -------------------------------------------------------
-        # avg_price_by_building          = _fmean_attr(br_qs, "avg_sale_price_ly")   # ★ NEW
-        # avg_rent_price_by_building     = _fmean_attr(br_qs, "avg_rent_price_ly")   # ★ NEW
-        avg_exposure_days = _fmean_attr(br_qs, "avg_exposure_sale_days")  # ★ NEW
-        # avg_exposure_rent_days         = _fmean_attr(br_qs, "avg_exposure_rent_days")  # ★ NEW
-        # avg_sale_per_unit_ratio        = _fmean_attr(br_qs, "avg_sale_per_unit_ratio") # ★ NEW
+        # колонки DldBuildingReport одним запросом, NULL не учитываются
+        br = load_columns(
+            DldBuildingReport.objects.filter(bedrooms=bedrooms).order_by(),
+            "avg_sale_price_ly",
+            "avg_rent_price_ly",
+            "avg_exposure_sale_days",
+            "avg_exposure_rent_days",
+            "avg_sale_per_unit_ratio",
+            "avg_sqm_sale_ly",
+            "avg_ppsqm_sale_ly",
+            "avg_ppsqm_rent_ly",
+            "tx_per_unit_pm_ly_rent",
+            "roi_ly",
+            "avg_sale_price_py",
+            "min_sale_price_py",
+            "max_sale_price_py",
+            "count_sale_py",
+            "avg_rent_price_py",
+            "min_rent_price_py",
+            "max_rent_price_py",
+            "count_rent_py",
+            "avg_sqm_sale_py",
+            "avg_ppsqm_sale_py",
+            "avg_ppsqm_rent_py",
+            "roi_py",
+        )
 
         # ====== LY (усредняем по билдингу) ============================
-        avg_price_by_building = _fmean_attr(br_qs, "avg_sale_price_ly")
-        avg_rent_price_by_building = _fmean_attr(br_qs, "avg_rent_price_ly")
-        # avg_exposure_days          = _fmean_attr(br_qs, "avg_exposure_sale_days")
-        avg_exposure_rent_days = _fmean_attr(br_qs, "avg_exposure_rent_days")
-        avg_sale_per_unit_ratio = _fmean_attr(br_qs, "avg_sale_per_unit_ratio")
-
-        # ★ NEW:
-        avg_sqm_by_building = _fmean_attr(br_qs, "avg_sqm_sale_ly")  # ★ NEW
-        avg_ppsqm_by_building = _fmean_attr(br_qs, "avg_ppsqm_sale_ly")  # ★ NEW
+        avg_price_by_building = nan_mean(br["avg_sale_price_ly"])
+        avg_rent_price_by_building = nan_mean(br["avg_rent_price_ly"])
+        avg_exposure_days = nan_mean(br["avg_exposure_sale_days"])
+        avg_exposure_rent_days = nan_mean(br["avg_exposure_rent_days"])
+        avg_sale_per_unit_ratio = nan_mean(br["avg_sale_per_unit_ratio"])
+
         # rent-per-unit ratio: берём годовую частоту сделок аренды на юнит
-        rent_ratio_vals = [
-            (r.tx_per_unit_pm_ly_rent or 0) * 12
-            for r in br_qs
-            if r.tx_per_unit_pm_ly_rent is not None
-        ]  # ★ NEW
-        avg_rent_per_unit_ratio = (
-            (sum(rent_ratio_vals) / len(rent_ratio_vals)) if rent_ratio_vals else None
-        )  # ★ NEW
+        avg_rent_per_unit_ratio = nan_mean(br["tx_per_unit_pm_ly_rent"] * 12)
 
-        avg_roi = _fmean_attr(br_qs, "roi_ly")  # ★ NEW
+        avg_roi = nan_mean(br["roi_ly"])
 
         # --- PY -------------------------------------------------------
-        avg_price_py = _fmean_attr(br_qs, "avg_sale_price_py")  # ★ NEW
-        median_price_py = _fmedian_attr(br_qs, "avg_sale_price_py")  # ★ NEW
-        min_price_py = _fmean_attr(br_qs, "min_sale_price_py")  # ★ NEW
-        max_price_py = _fmean_attr(br_qs, "max_sale_price_py")  # ★ NEW
-        count_sale_py = _fmean_attr(br_qs, "count_sale_py")  # ★ NEW
-
-        avg_rent_price_py = _fmean_attr(br_qs, "avg_rent_price_py")  # ★ NEW
-        median_rent_price_py = _fmedian_attr(br_qs, "avg_rent_price_py")  # ★ NEW
-        min_rent_price_py = _fmean_attr(br_qs, "min_rent_price_py")  # ★ NEW
-        max_rent_price_py = _fmean_attr(br_qs, "max_rent_price_py")  # ★ NEW
-        count_rent_py = _fmean_attr(br_qs, "count_rent_py")  # ★ NEW
-
-        avg_price_by_building_py = _fmean_attr(br_qs, "avg_sale_price_py")  # ★ NEW
-        avg_rent_price_by_building_py = _fmean_attr(br_qs, "avg_rent_price_py")  # ★ NEW
+        avg_price_py = nan_mean(br["avg_sale_price_py"])
+        median_price_py = nan_median(br["avg_sale_price_py"])
+        min_price_py = nan_mean(br["min_sale_price_py"])
+        max_price_py = nan_mean(br["max_sale_price_py"])
+        count_sale_py = nan_mean(br["count_sale_py"])
+
+        avg_rent_price_py = nan_mean(br["avg_rent_price_py"])
+        median_rent_price_py = nan_median(br["avg_rent_price_py"])
+        min_rent_price_py = nan_mean(br["min_rent_price_py"])
+        max_rent_price_py = nan_mean(br["max_rent_price_py"])
+        count_rent_py = nan_mean(br["count_rent_py"])
 
         # per-unit ratios PY (не храним отдельно – повторяем LY значения)
-        avg_sale_per_unit_ratio_py = avg_sale_per_unit_ratio  # ★ NEW
-        avg_rent_per_unit_ratio_py = avg_rent_per_unit_ratio  # ★ NEW
-        avg_sqm_by_building = _fmean_attr(br_qs, "avg_sqm_sale_ly")  # ★ NEW
-        avg_ppsqm_by_building = _fmean_attr(br_qs, "avg_ppsqm_sale_ly")  # ★ NEW
-        avg_ppsqm_rent_by_building = _fmean_attr(br_qs, "avg_ppsqm_rent_ly")  # ★ NEW
-
-        avg_sqm_by_building_py = _fmean_attr(br_qs, "avg_sqm_sale_py")  # ★ NEW
-        avg_ppsqm_by_building_py = _fmean_attr(br_qs, "avg_ppsqm_sale_py")  # ★ NEW
-        avg_ppsqm_rent_by_building_py = _fmean_attr(br_qs, "avg_ppsqm_rent_py")  # ★ NEW
-        avg_roi_py = _fmean_attr(br_qs, "roi_py")  # ★ NEW
+        avg_sale_per_unit_ratio_py = avg_sale_per_unit_ratio
+        avg_rent_per_unit_ratio_py = avg_rent_per_unit_ratio
+        avg_sqm_by_building = nan_mean(br["avg_sqm_sale_ly"])
+        avg_ppsqm_by_building = nan_mean(br["avg_ppsqm_sale_ly"])
+        avg_ppsqm_rent_by_building = nan_mean(br["avg_ppsqm_rent_ly"])
+
+        avg_sqm_by_building_py = nan_mean(br["avg_sqm_sale_py"])
+        avg_ppsqm_by_building_py = nan_mean(br["avg_ppsqm_sale_py"])
+        avg_ppsqm_rent_by_building_py = nan_mean(br["avg_ppsqm_rent_py"])
+        avg_roi_py = nan_mean(br["roi_py"])
         # ──────────────────────────────────────────────────────────────
         #           SAVE
         # ──────────────────────────────────────────────────────────────
         with transaction.atomic():
-            report, _ = cls.objects.update_or_create(
+            report = _save_report(
+                cls,
                 bedrooms=bedrooms,
                 defaults={
                     # ---------- SALE current (LY raw) ----------------
@@ -1068,7 +1120,7 @@ class CityReport(models.Model):
                     "min_rent_price": min_rent_price,
                     "max_rent_price": max_rent_price,
                     "avg_rent_price_by_building": avg_rent_price_by_building,
-                    "avg_exposure_rent_days": avg_exposure_rent,
+                    "avg_exposure_rent_days": avg_exposure_rent_days,
                     # ---------- RATIOS current (LY) ------------------
                     "avg_rent_per_unit_ratio": avg_rent_per_unit_ratio,
                     "avg_sale_per_unit_ratio": avg_sale_per_unit_ratio,
@@ -1117,11 +1169,49 @@ class CityReport(models.Model):
         return f"Городской отчёт / {self.get_bedrooms_display()}"
 
 
-from datetime import timedelta
+# средняя «экспозиция» через поле period
+_PERIOD_TO_DAYS = {
+    "1 week": 7,
+    "1 month": 30,
+    "3 month": 90,
+    "6 month": 180,
+    "1 year": 365,
+    "2 years": 730,
+    "older than 2 years": 1095,
+}
 
 
-from django.db.models import DecimalField, FloatField
-from django.utils import timezone
+# дни экспозиции сделки по её period (NULL - период неизвестен)
+_EXPOSURE_DAYS = Case(
+    *[When(period=p, then=Value(float(days))) for p, days in _PERIOD_TO_DAYS.items()],
+    default=Value(None),
+    output_field=FloatField(),
+)
+
+# сколько зданий calculate_bulk читает и считает за раз
+BULK_BUILDINGS = 2000
+
+# поля DldBuildingReport, которые AreaReportDLD усредняет по зданиям района
+_AREA_PY_FIELDS = (
+    "avg_exposure_sale_days",
+    "avg_exposure_rent_days",
+    "avg_sale_per_unit_ratio",
+    "avg_sale_price_py",
+    "median_sale_price_py",
+    "min_sale_price_py",
+    "max_sale_price_py",
+    "avg_sqm_sale_py",
+    "avg_ppsqm_sale_py",
+    "count_sale_py",
+    "roi_py",
+    "avg_rent_price_py",
+    "median_rent_price_py",
+    "min_rent_price_py",
+    "max_rent_price_py",
+    "avg_sqm_rent_py",
+    "avg_ppsqm_rent_py",
+    "count_rent_py",
+)
 
 
 class DldBuildingReport(models.Model):
@@ -1233,148 +1323,126 @@ class DldBuildingReport(models.Model):
         """
         Пересчитывает ВСЕ метрики для одного здания + комнатности.
         """
-        # локальные импорты (чтобы не создавать циклических)
-        from .models import MergedTransaction, MergedRentalTransaction
-
-        # === NEW ===  грубый helper (бывший _bedrooms_to_int отсутствовал → None)
-        def _bedrooms_to_int(text: str | None) -> int | None:
-            """
-            'studio' → 0, '1', '1 B/R', '1B/R', '1 bed' → 1  и т. д.
-            Возвращает None, если распарсить не удалось.
-            """
-            if not text:
-                return None
-            text = str(text).lower().strip()
-            if "studio" in text:
-                return 0
-            match = re.search(r"\d+", text)
-            return int(match.group()) if match else None
+        if normalize_bedrooms(bedrooms) is None:
+            return None
+        reports = cls.calculate_bulk(buildings=[dld], bedrooms=[bedrooms])
+        return reports[0] if reports else None
 
+    @classmethod
+    def calculate_bulk(cls, buildings=None, bedrooms=None) -> list:
+        """
+        Отчёты здание × комнатность пачками по BULK_BUILDINGS зданий: сделки
+        продажи и аренды за два года читаются в массивы (stats_kernel) двумя
+        запросами на пачку, статистика считается сразу для всех групп
+        здание × комнатность × год. Комнатность фильтруется в SQL по
+        bedrooms_norm.
+
+        buildings - здания или их pk (None - все), bedrooms - ключи
+        BEDROOM_CHOICES (None - все). Отчёты пишутся bulk_create пачками,
+        внутри buffer_reports() - в общий буфер (realty.reports.recalc).
+        """
         # границы дат
         today = timezone.now().date()
         one_year_ago = today - timedelta(days=365)
         two_years_ago = today - timedelta(days=730)
 
-        # нормализуем bedrooms
-        bed_int = _bedrooms_to_int(bedrooms)
-        if bed_int is None:
-            return None
+        keys = [
+            (key, normalize_bedrooms(key))
+            for key in (bedrooms or [key for key, _ in BEDROOM_CHOICES])
+        ]
+        keys = [(key, bed_int) for key, bed_int in keys if bed_int is not None]
+        wanted = sorted({bed_int for _, bed_int in keys})
 
-        # -------------------------------------------------------------- #
-        #         БЫСТРАЯ ВЫБОРКА + фильтр по комнатности                #
-        # -------------------------------------------------------------- #
-        def fetch_tx(model, start: date, end: date):
+        building_qs = DldBuilding.objects.all()
+        if buildings is not None:
+            building_qs = building_qs.filter(
+                pk__in=[getattr(b, "pk", b) for b in buildings]
+            )
+        total_units = dict(building_qs.order_by("pk").values_list("pk", "total_units"))
+        pks = list(total_units)
+        if not pks or not keys:
+            return []
+
+        # bedrooms_norm -> номер комнатности в группе
+        bed_index = np.zeros(max(wanted) + 1, dtype=np.intp)
+        bed_index[wanted] = np.arange(len(wanted))
+        ly_start = np.datetime64(one_year_ago, "D")
+
+        def load(model, chunk):
+            """Статистика сделок пачки: группа (здание, комнатность, LY / PY)."""
+            chunk = np.array(chunk, dtype=np.float64)
             qs = model.objects.filter(
-                building=dld, date_of_transaction__range=(start, end)
-            ).values(
-                "pk",
+                building_id__gte=int(chunk[0]),
+                building_id__lte=int(chunk[-1]),
+                bedrooms_norm__in=wanted,
+                date_of_transaction__range=(two_years_ago, today),
+                transaction_price__isnull=False,
+                sqm__isnull=False,
+            ).exclude(sqm=0)
+            cols = load_columns(
+                qs.order_by("pk"),
+                "building_id",
+                "bedrooms_norm",
                 "transaction_price",
                 "sqm",
-                "date_of_transaction",
-                "period",
-                "number_of_rooms",
+                dates=["date_of_transaction"],
+                exposure=_EXPOSURE_DAYS,
+            )
+            # в диапазон pk пачки попадают и здания вне buildings
+            position = np.searchsorted(chunk, cols["building_id"])
+            position = np.minimum(position, len(chunk) - 1)
+            keep = chunk[position] == cols["building_id"]
+            bed = bed_index[cols["bedrooms_norm"].astype(np.intp)]
+            is_py = cols["date_of_transaction"] < ly_start
+            group = (position * len(wanted) + bed) * 2 + is_py
+            return grouped_describe(
+                group[keep],
+                len(chunk) * len(wanted) * 2,
+                cols["transaction_price"][keep],
+                sqm=cols["sqm"][keep],
+                dates=cols["date_of_transaction"][keep],
+                exposure=cols["exposure"][keep],
+                last=3,
             )
-            out = []
-            for rec in qs:
-                if rec["transaction_price"] is None or not rec["sqm"]:
-                    continue
-                if _bedrooms_to_int(rec["number_of_rooms"]) != bed_int:
-                    continue
-                # ★ FIX: price → float, sqm → float
-                rec["transaction_price"] = float(rec["transaction_price"])
-                rec["sqm"] = float(rec["sqm"])
-                out.append(rec)
-
-            return out
-
-        sale_ly = fetch_tx(MergedTransaction, one_year_ago, today)
-        rent_ly = fetch_tx(MergedRentalTransaction, one_year_ago, today)
-        sale_py = fetch_tx(
-            MergedTransaction, two_years_ago, one_year_ago - timedelta(days=1)
-        )
-        rent_py = fetch_tx(
-            MergedRentalTransaction, two_years_ago, one_year_ago - timedelta(days=1)
-        )
-
-        # -------------------------------------------------------------- #
-        #           Статистика для любой выборки rows[]                 #
-        # -------------------------------------------------------------- #
-        def stats(rows):
-            if not rows:
-                return {
-                    "avg_price": None,
-                    "median_price": None,
-                    "min_price": None,
-                    "max_price": None,
-                    "avg_sqm": None,
-                    "avg_ppsqm": None,
-                    "count": 0,
-                    "last_3": [],
-                    "avg_exposure": None,  # === NEW ===
-                }
-
-            prices = [float(r["transaction_price"]) for r in rows]
-            sqms = [float(r["sqm"]) for r in rows]
-
-            # --- NEW --- средняя «экспозиция» через поле period ----------
-            _period_to_days = {
-                "1 week": 7,
-                "1 month": 30,
-                "3 month": 90,
-                "6 month": 180,
-                "1 year": 365,
-                "2 years": 730,
-                "older than 2 years": 1095,
-            }
-            expos = [
-                _period_to_days.get(r["period"], None)
-                for r in rows
-                if r["period"] in _period_to_days
-            ]
-            expos = [d for d in expos if d is not None]
-            # -------------------------------------------------------------
-
-            return {
-                "avg_price": sum(prices) / len(prices),
-                "median_price": statistics.median(prices),
-                "min_price": min(prices),
-                "max_price": max(prices),
-                "avg_sqm": sum(sqms) / len(sqms),
-                "avg_ppsqm": (sum(prices) / sum(sqms)) if sum(sqms) else None,
-                "count": len(prices),
-                "last_3": [
-                    {
-                        "price": float(r["transaction_price"]),  #  ← было Decimal
-                        "sqm": r["sqm"],
-                        "date": r["date_of_transaction"].isoformat(),
-                    }
-                    for r in sorted(
-                        rows, key=lambda x: x["date_of_transaction"], reverse=True
-                    )[:3]
-                ],
-                "avg_exposure": (sum(expos) / len(expos))
-                if expos
-                else None,  # === NEW ===
-            }
-
-        s_ly, r_ly = stats(sale_ly), stats(rent_ly)
-        s_py, r_py = stats(sale_py), stats(rent_py)
-
-        # -------------------------------------------------------------- #
-        #              Дополнительные метрики per-unit / roi            #
-        # -------------------------------------------------------------- #
-        total_units = getattr(dld, "total_units", 0) or 0
 
+        outer = _report_buffer.get()
+        reports = []
+
+        for start in range(0, len(pks), BULK_BUILDINGS):
+            chunk = pks[start : start + BULK_BUILDINGS]
+            sales = load(MergedTransaction, chunk)
+            rents = load(MergedRentalTransaction, chunk)
+            batch = []
+            for i, pk in enumerate(chunk):
+                for key, bed_int in keys:
+                    g = (i * len(wanted) + bed_index[bed_int]) * 2  # LY, g + 1 - PY
+                    defaults = cls._report_defaults(
+                        total_units[pk] or 0,
+                        sales[g],
+                        rents[g],
+                        sales[g + 1],
+                        rents[g + 1],
+                    )
+                    report = cls(dld_building_id=pk, bedrooms=key, **defaults)
+                    batch.append((report, list(defaults)))
+                    reports.append(report)
+            if outer is not None:
+                outer.extend(batch)
+            else:
+                with transaction.atomic():
+                    flush_reports(batch)
+
+        return reports
+
+    @staticmethod
+    def _report_defaults(total_units: int, s_ly, r_ly, s_py, r_py) -> dict:
+        """Поля отчёта по статистике продаж / аренды за LY и PY."""
         # старые (для sales)
         tx_pu_ly_sale = s_ly["count"] / (total_units * 12) if total_units else None
         tx_pu_py_sale = s_py["count"] / (total_units * 12) if total_units else None
         # --- NEW ---  аналогично для аренды
-        tx_pu_ly_rent = (
-            r_ly["count"] / (total_units * 12) if total_units else None
-        )  # === NEW ===
-        tx_pu_py_rent = (
-            r_py["count"] / (total_units * 12) if total_units else None
-        )  # === NEW ===
+        tx_pu_ly_rent = r_ly["count"] / (total_units * 12) if total_units else None
+        tx_pu_py_rent = r_py["count"] / (total_units * 12) if total_units else None
 
         def safe_roi(r, s):
             return (
@@ -1383,79 +1451,62 @@ class DldBuildingReport(models.Model):
                 else None
             )
 
-        roi_ly = safe_roi(r_ly, s_ly)
-        roi_py = safe_roi(r_py, s_py)
-
-        # --- NEW ---  «средняя продажа / юнит» (кол-во продаж к юнитам)
-        avg_sale_per_unit_ratio = (
-            s_ly["count"] / total_units if total_units else None
-        )  # === NEW ===
-
-        # -------------------------------------------------------------- #
-        #                    Сохранение / обновление                     #
-        # -------------------------------------------------------------- #
-        with transaction.atomic():
-            report, _ = cls.objects.update_or_create(
-                dld_building=dld,
-                bedrooms=bedrooms,
-                defaults={
-                    # ---------------- LAST YEAR ----------------
-                    "avg_sale_price_ly": s_ly["avg_price"],
-                    "avg_rent_price_ly": r_ly["avg_price"],
-                    "avg_sqm_sale_ly": s_ly["avg_sqm"],
-                    "avg_sqm_rent_ly": r_ly["avg_sqm"],
-                    "avg_ppsqm_sale_ly": s_ly["avg_ppsqm"],
-                    "avg_ppsqm_rent_ly": r_ly["avg_ppsqm"],
-                    "median_sale_price_ly": s_ly["median_price"],
-                    "median_rent_price_ly": r_ly["median_price"],
-                    "min_sale_price_ly": s_ly["min_price"],
-                    "min_rent_price_ly": r_ly["min_price"],
-                    "max_sale_price_ly": s_ly["max_price"],
-                    "max_rent_price_ly": r_ly["max_price"],
-                    "count_sale_ly": s_ly["count"],
-                    "count_rent_ly": r_ly["count"],
-                    "tx_per_unit_pm_ly": tx_pu_ly_sale,
-                    "tx_per_unit_pm_ly_rent": tx_pu_ly_rent,  # === NEW ===
-                    "roi_ly": roi_ly,
-                    # ------------- PREVIOUS YEAR --------------
-                    "avg_sale_price_py": s_py["avg_price"],
-                    "avg_rent_price_py": r_py["avg_price"],
-                    "avg_sqm_sale_py": s_py["avg_sqm"],
-                    "avg_sqm_rent_py": r_py["avg_sqm"],
-                    "avg_ppsqm_sale_py": s_py["avg_ppsqm"],
-                    "avg_ppsqm_rent_py": r_py["avg_ppsqm"],
-                    "median_sale_price_py": s_py["median_price"],
-                    "median_rent_price_py": r_py["median_price"],
-                    "min_sale_price_py": s_py["min_price"],
-                    "min_rent_price_py": r_py["min_price"],
-                    "max_sale_price_py": s_py["max_price"],
-                    "max_rent_price_py": r_py["max_price"],
-                    "count_sale_py": s_py["count"],
-                    "count_rent_py": r_py["count"],
-                    "tx_per_unit_pm_py": tx_pu_py_sale,
-                    "tx_per_unit_pm_py_rent": tx_pu_py_rent,  # === NEW ===
-                    "roi_py": roi_py,
-                    # ------------- EXPOSURE + ПРОЧЕЕ ----------
-                    "avg_exposure_sale_days": s_ly["avg_exposure"],  # === NEW ===
-                    "avg_exposure_rent_days": r_ly["avg_exposure"],  # === NEW ===
-                    "avg_sale_per_unit_ratio": avg_sale_per_unit_ratio,  # === NEW ===
-                    # ------------- LAST 3 TX ------------------
-                    "last_3_sales": s_ly["last_3"],
-                    "last_3_rents": r_ly["last_3"],
-                },
-            )
-        return report
+        # «средняя продажа / юнит» (кол-во продаж к юнитам)
+        avg_sale_per_unit_ratio = s_ly["count"] / total_units if total_units else None
+
+        return {
+            # ---------------- LAST YEAR ----------------
+            "avg_sale_price_ly": s_ly["avg_price"],
+            "avg_rent_price_ly": r_ly["avg_price"],
+            "avg_sqm_sale_ly": s_ly["avg_sqm"],
+            "avg_sqm_rent_ly": r_ly["avg_sqm"],
+            "avg_ppsqm_sale_ly": s_ly["avg_ppsqm"],
+            "avg_ppsqm_rent_ly": r_ly["avg_ppsqm"],
+            "median_sale_price_ly": s_ly["median_price"],
+            "median_rent_price_ly": r_ly["median_price"],
+            "min_sale_price_ly": s_ly["min_price"],
+            "min_rent_price_ly": r_ly["min_price"],
+            "max_sale_price_ly": s_ly["max_price"],
+            "max_rent_price_ly": r_ly["max_price"],
+            "count_sale_ly": s_ly["count"],
+            "count_rent_ly": r_ly["count"],
+            "tx_per_unit_pm_ly": tx_pu_ly_sale,
+            "tx_per_unit_pm_ly_rent": tx_pu_ly_rent,
+            "roi_ly": safe_roi(r_ly, s_ly),
+            # ------------- PREVIOUS YEAR --------------
+            "avg_sale_price_py": s_py["avg_price"],
+            "avg_rent_price_py": r_py["avg_price"],
+            "avg_sqm_sale_py": s_py["avg_sqm"],
+            "avg_sqm_rent_py": r_py["avg_sqm"],
+            "avg_ppsqm_sale_py": s_py["avg_ppsqm"],
+            "avg_ppsqm_rent_py": r_py["avg_ppsqm"],
+            "median_sale_price_py": s_py["median_price"],
+            "median_rent_price_py": r_py["median_price"],
+            "min_sale_price_py": s_py["min_price"],
+            "min_rent_price_py": r_py["min_price"],
+            "max_sale_price_py": s_py["max_price"],
+            "max_rent_price_py": r_py["max_price"],
+            "count_sale_py": s_py["count"],
+            "count_rent_py": r_py["count"],
+            "tx_per_unit_pm_py": tx_pu_py_sale,
+            "tx_per_unit_pm_py_rent": tx_pu_py_rent,
+            "roi_py": safe_roi(r_py, s_py),
+            # ------------- EXPOSURE + ПРОЧЕЕ ----------
+            "avg_exposure_sale_days": s_ly["avg_exposure"],
+            "avg_exposure_rent_days": r_ly["avg_exposure"],
+            "avg_sale_per_unit_ratio": avg_sale_per_unit_ratio,
+            # ------------- LAST 3 TX ------------------
+            "last_3_sales": s_ly["last"],
+            "last_3_rents": r_ly["last"],
+        }
 
     # ------------------------------------------------------------------ #
     #  Публичная утилита — пересчитать всё сразу                         #
     # ------------------------------------------------------------------ #
     @classmethod
     def fill_all(cls):
-        from .models import DldBuilding  # локальный импорт, как и раньше
-
-        for dld in DldBuilding.objects.all():
-            for key, _ in BEDROOM_CHOICES:
-                cls.calculate(dld, key)
+        """Все здания × все комнатности одним проходом (calculate_bulk)."""
+        cls.calculate_bulk()
 
 
 class AreaReportDLD(models.Model):
@@ -1572,281 +1623,302 @@ class AreaReportDLD(models.Model):
     class Meta:
         unique_together = ("area", "bedrooms")
 
-    #
-    # @classmethod
     @classmethod
     def calculate(cls, area: DldArea, bedrooms: str) -> Optional["AreaReportDLD"]:
         """
-        Оптимизированный расчёт для одного района и одной комнатности.
+        Расчёт для одного района и одной комнатности (через calculate_bulk).
         """
+        if _bedrooms_to_int(bedrooms) is None:
+            return None
+        reports = cls.calculate_bulk([area], bedrooms=[bedrooms])
+        return reports[0] if reports else None
 
-        # ──────────────────────────────────────────────────────────────
-        # ВСЁ ЧТО НИЖЕ ‒ ВЕСЬ ПЕРЕРАБОТАННЫЙ МЕТОД ЦЕЛИКОМ
-        # новые и изменённые строки отмечены «# ★ NEW»
-        # ──────────────────────────────────────────────────────────────
-
-        from collections import defaultdict
-        from django.utils import timezone
-        from datetime import timedelta
-        from .models import (
-            MergedTransaction,
-            MergedRentalTransaction,
-            DldBuildingReport,  # ★ NEW
-        )
-        import statistics  # ★ NEW
-
+    @classmethod
+    def calculate_bulk(cls, areas=None, bedrooms=None) -> list:
+        """
+        Отчёты район × комнатность за один проход: сделки продажи и аренды за
+        последний год читаются двумя запросами и группируются в памяти по
+        (район, bedrooms_norm), показатели PY - одним запросом к
+        DldBuildingReport. Все отчёты пишутся одним bulk_create с
+        update_conflicts, внутри buffer_reports() - в общий буфер.
+
+        areas - районы или их pk (None - все), bedrooms - ключи
+        BEDROOM_CHOICES (None - все).
+        """
         today = timezone.now().date()
         one_year_ago = today - timedelta(days=365)
 
         # 1) нормализуем bedrooms  ("1br"→1, "studio"→0 и т.п.)
-        bed_int = _bedrooms_to_int(bedrooms)
-        if bed_int is None:
-            return None
+        keys = [
+            (key, _bedrooms_to_int(key))
+            for key in (bedrooms or [key for key, _ in BEDROOM_CHOICES])
+        ]
+        keys = [(key, bed_int) for key, bed_int in keys if bed_int is not None]
+
+        area_qs = DldArea.objects.all()
+        if areas is not None:
+            area_qs = area_qs.filter(pk__in=[getattr(a, "pk", a) for a in areas])
+        area_pks = list(area_qs.order_by("pk").values_list("pk", flat=True))
+        if not area_pks or not keys:
+            return []
+
+        # группа = (номер района, номер ключа комнатности)
+        area_ids = np.array(area_pks, dtype=np.float64)
+        n_keys = len(keys)
+        n_groups = len(area_pks) * n_keys
+        key_of_bed = np.zeros(max(bed_int for _, bed_int in keys) + 1, dtype=np.intp)
+        for index, (_, bed_int) in enumerate(keys):
+            key_of_bed[bed_int] = index
+
+        def grouped(qs, area_field, key_index, *fields, **kwargs):
+            """Колонки qs только по нужным районам + номер группы строки."""
+            if areas is not None:
+                qs = qs.filter(**{f"{area_field}__in": area_pks})
+            else:
+                qs = qs.filter(**{f"{area_field}__isnull": False})
+            cols = load_columns(qs, area_field, *fields, **kwargs)
+            area_col = cols.pop(area_field)
+            position = np.searchsorted(area_ids, area_col)
+            position = np.minimum(position, len(area_ids) - 1)
+            keep = area_ids[position] == area_col
+            group = position * n_keys + key_index(cols)
+            cols = {name: values[keep] for name, values in cols.items()}
+            cols["group"] = group[keep]
+            return cols
 
         # 2) —–– СЫРЫЕ ТРАНЗАКЦИИ ЗА ПОСЛЕДНИЙ ГОД (LY) ––––––––––––––
-        sale_qs = MergedTransaction.objects.filter(
-            area=area, date_of_transaction__gte=one_year_ago
-        ).values(
-            "transaction_price",
-            "sqm",
-            "date_of_transaction",
-            "building_id",
-            "number_of_rooms",
-        )
-        rent_qs = MergedRentalTransaction.objects.filter(
-            area=area, date_of_transaction__gte=one_year_ago
-        ).values(
-            "transaction_price",
-            "sqm",
-            "date_of_transaction",
-            "building_id",
-            "number_of_rooms",
-        )
-
-        def _prepare(raw):
-            out = []
-            for r in raw:
-                if (
-                    r["transaction_price"] is None
-                    or not r["sqm"]
-                    or _bedrooms_to_int(str(r["number_of_rooms"])) != bed_int
-                ):
-                    continue
-                out.append(
-                    (
-                        float(r["transaction_price"]),
-                        float(r["sqm"]),
-                        r["date_of_transaction"],
-                        r["building_id"],
-                    )
+        def load(model):
+            cols = grouped(
+                model.objects.filter(
+                    bedrooms_norm__in=[bed_int for _, bed_int in keys],
+                    date_of_transaction__gte=one_year_ago,
+                    transaction_price__isnull=False,
+                    sqm__isnull=False,
                 )
-            return out
+                .exclude(sqm=0)
+                .order_by("pk"),
+                "area_id",
+                lambda cols: key_of_bed[cols["bedrooms_norm"].astype(np.intp)],
+                "bedrooms_norm",
+                "transaction_price",
+                "sqm",
+                "building_id",
+                dates=["date_of_transaction"],
+            )
+            # сделки без здания - отдельное «здание», как в прежнем расчёте
+            cols["building_id"][np.isnan(cols["building_id"])] = -1
+            return cols
 
-        sales_ly = _prepare(sale_qs)
-        rents_ly = _prepare(rent_qs)
+        sales_ly = load(MergedTransaction)
+        rents_ly = load(MergedRentalTransaction)
 
         # 3) —–– СТАТИСТИКА ПО LY ––––––––––––––––––––––––––––––––––––
-        def _stats(rows):
-            prices = [p for p, *_ in rows]
-            sqms = [s for _, s, *_ in rows]
-
-            return {
-                "avg_price": (sum(prices) / len(prices)) if prices else None,
-                "median_price": statistics.median(prices) if prices else None,
-                "min_price": min(prices) if prices else None,
-                "max_price": max(prices) if prices else None,
-                "avg_sqm": (sum(sqms) / len(sqms)) if sqms else None,
-                "avg_ppsqm": (sum(prices) / sum(sqms)) if prices and sqms else None,
-                "count": len(prices),
-                "last_3": [
-                    {"price": p, "sqm": s, "date": d.isoformat()}
-                    for p, s, d, _ in sorted(rows, key=lambda x: x[2], reverse=True)[:3]
-                ],
-            }
+        def _stats(cols):
+            return grouped_describe(
+                cols["group"],
+                n_groups,
+                cols["transaction_price"],
+                sqm=cols["sqm"],
+                dates=cols["date_of_transaction"],
+                last=3,
+            )
 
         st_ly = _stats(sales_ly)
         rt_ly = _stats(rents_ly)
 
         # 4) —–– АГРЕГАЦИЯ ПО ЗДАНИЯМ (LY) –––––––––––––––––––––––––––
-        by_building = defaultdict(list)
-        for p, *_, bid in sales_ly:
-            by_building[bid].append(p)
-
-        avg_by_b_ly = (
-            sum(sum(v) / len(v) for v in by_building.values()) / len(by_building)
-            if by_building
-            else None
-        )
-        med_by_b_ly = (
-            statistics.median([sum(v) / len(v) for v in by_building.values()])
-            if by_building
-            else None
-        )
-        avg_tx_b_ly = (
-            sum(len(v) for v in by_building.values()) / len(by_building)
-            if by_building
-            else None
+        # ключ (группа, здание) одним числом: group * span + building_id + 1
+        span = 2 + max(
+            sales_ly["building_id"].max(initial=-1),
+            rents_ly["building_id"].max(initial=-1),
         )
-        # ROI по зданиям (LY)
-        roi_vals_ly = []
-        for bid, sale_prices in by_building.items():
-            avg_sale = sum(sale_prices) / len(sale_prices)
-            rent_prices_b = [p for p, *_, b in rents_ly if b == bid]
-            if rent_prices_b and avg_sale:
-                roi_vals_ly.append((sum(rent_prices_b) / len(rent_prices_b)) / avg_sale)
-        avg_roi_b_ly = sum(roi_vals_ly) / len(roi_vals_ly) if roi_vals_ly else None
-
-        # 5) —–– ДОПОЛНИТЕЛЬНЫЕ МЕТРИКИ ИЗ BuildingReport ––––––––––––
-        br_building_qs = DldBuildingReport.objects.filter(  # ★ NEW
-            dld_building__area=area,  # ★ NEW
-            bedrooms=bedrooms,  # ★ NEW
-        )  # ★ NEW
-
-        expo_sale_vals = [
-            br.avg_exposure_sale_days
-            for br in br_building_qs
-            if br.avg_exposure_sale_days is not None
-        ]  # ★ NEW
-        expo_rent_vals = [
-            br.avg_exposure_rent_days
-            for br in br_building_qs
-            if br.avg_exposure_rent_days is not None
-        ]  # ★ NEW
-        sale_ratio_vals = [
-            br.avg_sale_per_unit_ratio
-            for br in br_building_qs
-            if br.avg_sale_per_unit_ratio is not None
-        ]  # ★ NEW
 
-        avg_expo_sale = (
-            (sum(expo_sale_vals) / len(expo_sale_vals)) if expo_sale_vals else None
-        )  # ★ NEW
-        avg_expo_rent = (
-            (sum(expo_rent_vals) / len(expo_rent_vals)) if expo_rent_vals else None
-        )  # ★ NEW
-        avg_sale_ratio = (
-            (sum(sale_ratio_vals) / len(sale_ratio_vals)) if sale_ratio_vals else None
-        )  # ★ NEW
+        def _by_building(cols):
+            return group_means(
+                cols["group"] * span + cols["building_id"] + 1,
+                cols["transaction_price"],
+            )
 
-        # 6) —–– АГРЕГАЦИЯ PREVIOUS-YEAR (PY) ИЗ DldBuildingReport –––
-        br_py_qs = br_building_qs  # ★ NEW (alias)
+        sale_keys, sale_means, sale_counts = _by_building(sales_ly)
+        rent_keys, rent_means, _ = _by_building(rents_ly)
+        sale_groups = (sale_keys // span).astype(np.intp)
+        by_b_ly = grouped_describe(sale_groups, n_groups, sale_means)
+        tx_b_ly = grouped_describe(sale_groups, n_groups, sale_counts.astype(float))
+        # ROI по зданиям (LY): средняя аренда / средняя продажа здания
+        position = np.searchsorted(rent_keys, sale_keys)
+        has_rent = position < len(rent_keys)
+        has_rent[has_rent] = rent_keys[position[has_rent]] == sale_keys[has_rent]
+        has_rent &= sale_means != 0
+        roi_b_ly = grouped_describe(
+            sale_groups[has_rent],
+            n_groups,
+            rent_means[position[has_rent]] / sale_means[has_rent],
+        )
 
-        def _fmean(values):  # ★ NEW
-            vals = [float(v) for v in values if v is not None]
-            return sum(vals) / len(vals) if vals else None
+        # 5-6) —–– ЭКСПОЗИЦИЯ И PREVIOUS-YEAR (PY) ИЗ DldBuildingReport –
+        key_case = Case(
+            *[
+                When(bedrooms=key, then=Value(float(i)))
+                for i, (key, _) in enumerate(keys)
+            ],
+            output_field=FloatField(),
+        )
+        br = grouped(
+            DldBuildingReport.objects.filter(
+                bedrooms__in=[key for key, _ in keys]
+            ).order_by(),
+            "dld_building__area_id",
+            lambda cols: cols["key"].astype(np.intp),
+            *_AREA_PY_FIELDS,
+            key=key_case,
+        )
 
-        def _fmedian(values):  # ★ NEW
-            vals = [float(v) for v in values if v is not None]
-            return statistics.median(vals) if vals else None
+        def _py(field, stat="avg_price", nonzero=False):
+            """stat поля по отчётам зданий каждой группы (без NULL)."""
+            values = br[field]
+            present = ~np.isnan(values)
+            if nonzero:
+                present &= values != 0
+            stats = grouped_describe(br["group"][present], n_groups, values[present])
+            return [group_stats[stat] for group_stats in stats]
+
+        def _py_count(field):
+            """NULL-счётчики считаются нулями: (сумма, среднее) по всем отчётам."""
+            values = np.nan_to_num(br[field])
+            total = np.bincount(br["group"], weights=values, minlength=n_groups)
+            stats = grouped_describe(br["group"], n_groups, values)
+            return total.astype(int).tolist(), [st["avg_price"] for st in stats]
+
+        avg_expo_sale = _py("avg_exposure_sale_days")
+        avg_expo_rent = _py("avg_exposure_rent_days")
+        avg_sale_ratio = _py("avg_sale_per_unit_ratio")
 
         # --- SALE PY --------------------------------------------------
-        sale_avg_vals = [br.avg_sale_price_py for br in br_py_qs]  # ★ NEW
-        sale_med_vals = [br.median_sale_price_py for br in br_py_qs]  # ★ NEW
-        sale_min_vals = [
-            br.min_sale_price_py for br in br_py_qs if br.min_sale_price_py
-        ]  # ★ NEW
-        sale_max_vals = [
-            br.max_sale_price_py for br in br_py_qs if br.max_sale_price_py
-        ]  # ★ NEW
-        sale_sqm_vals = [br.avg_sqm_sale_py for br in br_py_qs]  # ★ NEW
-        sale_ppsqm_vals = [br.avg_ppsqm_sale_py for br in br_py_qs]  # ★ NEW
-        sale_cnt_vals = [br.count_sale_py or 0 for br in br_py_qs]  # ★ NEW
-        sale_roi_vals = [br.roi_py for br in br_py_qs]  # ★ NEW
-
-        avg_sale_price_py = _fmean(sale_avg_vals)  # ★ NEW
-        median_sale_price_py = _fmedian(sale_med_vals)  # ★ NEW
-        min_sale_price_py = min(sale_min_vals) if sale_min_vals else None  # ★ NEW
-        max_sale_price_py = max(sale_max_vals) if sale_max_vals else None  # ★ NEW
-        avg_sqm_sale_py = _fmean(sale_sqm_vals)  # ★ NEW
-        avg_ppsqm_sale_py = _fmean(sale_ppsqm_vals)  # ★ NEW
-        count_sale_py = sum(sale_cnt_vals)  # ★ NEW
-        avg_price_by_building_py = avg_sale_price_py  # ★ NEW
-        median_price_by_building_py = _fmedian(sale_avg_vals)  # ★ NEW
-        avg_tx_per_building_py = _fmean(sale_cnt_vals)  # ★ NEW
-        avg_roi_by_building_py = _fmean(sale_roi_vals)  # ★ NEW
+        avg_sale_price_py = _py("avg_sale_price_py")
+        median_sale_price_py = _py("median_sale_price_py", "median_price")
+        min_sale_price_py = _py("min_sale_price_py", "min_price", nonzero=True)
+        max_sale_price_py = _py("max_sale_price_py", "max_price", nonzero=True)
+        avg_sqm_sale_py = _py("avg_sqm_sale_py")
+        avg_ppsqm_sale_py = _py("avg_ppsqm_sale_py")
+        count_sale_py, avg_tx_per_building_py = _py_count("count_sale_py")
+        median_price_by_building_py = _py("avg_sale_price_py", "median_price")
+        avg_roi_by_building_py = _py("roi_py")
 
         # --- RENT PY --------------------------------------------------
-        rent_avg_vals = [br.avg_rent_price_py for br in br_py_qs]  # ★ NEW
-        rent_med_vals = [br.median_rent_price_py for br in br_py_qs]  # ★ NEW
-        rent_min_vals = [
-            br.min_rent_price_py for br in br_py_qs if br.min_rent_price_py
-        ]  # ★ NEW
-        rent_max_vals = [
-            br.max_rent_price_py for br in br_py_qs if br.max_rent_price_py
-        ]  # ★ NEW
-        rent_sqm_vals = [br.avg_sqm_rent_py for br in br_py_qs]  # ★ NEW
-        rent_ppsqm_vals = [br.avg_ppsqm_rent_py for br in br_py_qs]  # ★ NEW
-        rent_cnt_vals = [br.count_rent_py or 0 for br in br_py_qs]  # ★ NEW
-
-        avg_rent_price_py = _fmean(rent_avg_vals)  # ★ NEW
-        median_rent_price_py = _fmedian(rent_med_vals)  # ★ NEW
-        min_rent_price_py = min(rent_min_vals) if rent_min_vals else None  # ★ NEW
-        max_rent_price_py = max(rent_max_vals) if rent_max_vals else None  # ★ NEW
-        avg_sqm_rent_py = _fmean(rent_sqm_vals)  # ★ NEW
-        avg_ppsqm_rent_py = _fmean(rent_ppsqm_vals)  # ★ NEW
-        count_rent_py = sum(rent_cnt_vals)  # ★ NEW
-        avg_tx_per_building_py_rent = _fmean(rent_cnt_vals)  # ★ NEW
-
-        # 7) —–– СОХРАНЯЕМ ВСЁ ЗА ОДИН UPDATE_OR_CREATE –––––––––––––––
-        report, _ = cls.objects.update_or_create(
-            area=area,
-            bedrooms=bedrooms,
-            defaults={
-                # ── LY (как было) ───────────────────────────────────
-                "avg_sale_price_ly": st_ly["avg_price"],
-                "median_sale_price_ly": st_ly["median_price"],
-                "min_sale_price_ly": st_ly["min_price"],
-                "max_sale_price_ly": st_ly["max_price"],
-                "avg_sqm_sale_ly": st_ly["avg_sqm"],
-                "avg_ppsqm_sale_ly": st_ly["avg_ppsqm"],
-                "count_sale_ly": st_ly["count"],
-                "avg_price_by_building_ly": avg_by_b_ly,
-                "median_price_by_building_ly": med_by_b_ly,
-                "avg_tx_per_building_ly": avg_tx_b_ly,
-                "avg_roi_by_building_ly": avg_roi_b_ly,
-                "avg_rent_price_ly": rt_ly["avg_price"],
-                "median_rent_price_ly": rt_ly["median_price"],
-                "min_rent_price_ly": rt_ly["min_price"],
-                "max_rent_price_ly": rt_ly["max_price"],
-                "avg_sqm_rent_ly": rt_ly["avg_sqm"],
-                "avg_ppsqm_rent_ly": rt_ly["avg_ppsqm"],
-                "count_rent_ly": rt_ly["count"],
-                "last_3_sales": st_ly["last_3"],
-                "last_3_rents": rt_ly["last_3"],
-                "avg_exposure_sale_days": avg_expo_sale,
-                "avg_exposure_rent_days": avg_expo_rent,
-                "avg_sale_per_unit_ratio": avg_sale_ratio,
-                # ── PY (★ NEW) ─────────────────────────────────────
-                "avg_sale_price_py": avg_sale_price_py,  # ★ NEW
-                "median_sale_price_py": median_sale_price_py,  # ★ NEW
-                "min_sale_price_py": min_sale_price_py,  # ★ NEW
-                "max_sale_price_py": max_sale_price_py,  # ★ NEW
-                "avg_sqm_sale_py": avg_sqm_sale_py,  # ★ NEW
-                "avg_ppsqm_sale_py": avg_ppsqm_sale_py,  # ★ NEW
-                "count_sale_py": count_sale_py,  # ★ NEW
-                "avg_price_by_building_py": avg_price_by_building_py,  # ★ NEW
-                "median_price_by_building_py": median_price_by_building_py,  # ★ NEW
-                "avg_tx_per_building_py": avg_tx_per_building_py,  # ★ NEW
-                "avg_roi_by_building_py": avg_roi_by_building_py,  # ★ NEW
-                "avg_rent_price_py": avg_rent_price_py,  # ★ NEW
-                "median_rent_price_py": median_rent_price_py,  # ★ NEW
-                "min_rent_price_py": min_rent_price_py,  # ★ NEW
-                "max_rent_price_py": max_rent_price_py,  # ★ NEW
-                "avg_sqm_rent_py": avg_sqm_rent_py,  # ★ NEW
-                "avg_ppsqm_rent_py": avg_ppsqm_rent_py,  # ★ NEW
-                "count_rent_py": count_rent_py,  # ★ NEW
-                "avg_tx_per_building_py_rent": avg_tx_per_building_py_rent,  # ★ NEW
-            },
-        )
+        avg_rent_price_py = _py("avg_rent_price_py")
+        median_rent_price_py = _py("median_rent_price_py", "median_price")
+        min_rent_price_py = _py("min_rent_price_py", "min_price", nonzero=True)
+        max_rent_price_py = _py("max_rent_price_py", "max_price", nonzero=True)
+        avg_sqm_rent_py = _py("avg_sqm_rent_py")
+        avg_ppsqm_rent_py = _py("avg_ppsqm_rent_py")
+        count_rent_py, avg_tx_per_building_py_rent = _py_count("count_rent_py")
+
+        # 7) —–– СОХРАНЯЕМ ВСЁ ОДНИМ BULK UPSERT ––––––––––––––––––––––
+        outer = _report_buffer.get()
+        batch, reports = [], []
+        for g in range(n_groups):
+            area_pk, (key, _) = area_pks[g // n_keys], keys[g % n_keys]
+            st, rt = st_ly[g], rt_ly[g]
+            defaults = {
+                # ── LY ──────────────────────────────────────────────
+                "avg_sale_price_ly": st["avg_price"],
+                "median_sale_price_ly": st["median_price"],
+                "min_sale_price_ly": st["min_price"],
+                "max_sale_price_ly": st["max_price"],
+                "avg_sqm_sale_ly": st["avg_sqm"],
+                "avg_ppsqm_sale_ly": st["avg_ppsqm"],
+                "count_sale_ly": st["count"],
+                "avg_price_by_building_ly": by_b_ly[g]["avg_price"],
+                "median_price_by_building_ly": by_b_ly[g]["median_price"],
+                "avg_tx_per_building_ly": tx_b_ly[g]["avg_price"],
+                "avg_roi_by_building_ly": roi_b_ly[g]["avg_price"],
+                "avg_rent_price_ly": rt["avg_price"],
+                "median_rent_price_ly": rt["median_price"],
+                "min_rent_price_ly": rt["min_price"],
+                "max_rent_price_ly": rt["max_price"],
+                "avg_sqm_rent_ly": rt["avg_sqm"],
+                "avg_ppsqm_rent_ly": rt["avg_ppsqm"],
+                "count_rent_ly": rt["count"],
+                "last_3_sales": st["last"],
+                "last_3_rents": rt["last"],
+                "avg_exposure_sale_days": avg_expo_sale[g],
+                "avg_exposure_rent_days": avg_expo_rent[g],
+                "avg_sale_per_unit_ratio": avg_sale_ratio[g],
+                # ── PY ──────────────────────────────────────────────
+                "avg_sale_price_py": avg_sale_price_py[g],
+                "median_sale_price_py": median_sale_price_py[g],
+                "min_sale_price_py": min_sale_price_py[g],
+                "max_sale_price_py": max_sale_price_py[g],
+                "avg_sqm_sale_py": avg_sqm_sale_py[g],
+                "avg_ppsqm_sale_py": avg_ppsqm_sale_py[g],
+                "count_sale_py": count_sale_py[g],
+                "avg_price_by_building_py": avg_sale_price_py[g],
+                "median_price_by_building_py": median_price_by_building_py[g],
+                "avg_tx_per_building_py": avg_tx_per_building_py[g],
+                "avg_roi_by_building_py": avg_roi_by_building_py[g],
+                "avg_rent_price_py": avg_rent_price_py[g],
+                "median_rent_price_py": median_rent_price_py[g],
+                "min_rent_price_py": min_rent_price_py[g],
+                "max_rent_price_py": max_rent_price_py[g],
+                "avg_sqm_rent_py": avg_sqm_rent_py[g],
+                "avg_ppsqm_rent_py": avg_ppsqm_rent_py[g],
+                "count_rent_py": count_rent_py[g],
+                "avg_tx_per_building_py_rent": avg_tx_per_building_py_rent[g],
+            }
+            report = cls(area_id=area_pk, bedrooms=key, **defaults)
+            batch.append((report, list(defaults)))
+            reports.append(report)
 
-        return report
+        if outer is not None:
+            outer.extend(batch)
+        else:
+            with transaction.atomic():
+                flush_reports(batch)
+        return reports
 
     @classmethod
     def fill_all(cls):
-        """Запустить для всех районов и всех типов комнат."""
-        for area in DldArea.objects.all():
-            for key, _ in BEDROOM_CHOICES:
-                cls.calculate(area, key)
+        """Все районы × все комнатности одним проходом (calculate_bulk)."""
+        cls.calculate_bulk()
 
     def __str__(self):
         return f"Отчёт по {self.area} / {self.get_bedrooms_display()}"
+
+
+class ReportRecalcRun(models.Model):
+    """
+    Журнал параллельного пересчёта отчётов (realty.reports.recalc).
+    Работа делится на партиции (объект, комнатность); номера готовых партиций
+    сохраняются, поэтому упавший запуск продолжается с --resume.
+    """
+
+    STATUS_CHOICES = [
+        ("running", "Running"),
+        ("completed", "Completed"),
+        ("failed", "Failed"),
+    ]
+
+    model = models.CharField(max_length=20, db_index=True)
+    bedrooms = models.JSONField(default=list)
+    object_ids = models.JSONField(default=list, help_text="Снимок pk объектов")
+    chunk_size = models.PositiveIntegerField(default=50)
+    workers = models.PositiveSmallIntegerField(default=1)
+    started_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    status = models.CharField(max_length=12, choices=STATUS_CHOICES, default="running")
+    total_partitions = models.PositiveIntegerField(default=0)
+    completed_partitions = models.JSONField(default=list)
+    reports_written = models.PositiveIntegerField(default=0)
+    reports_skipped = models.PositiveIntegerField(default=0)
+    errors = models.PositiveIntegerField(default=0)
+    duration_seconds = models.FloatField(blank=True, null=True)
+    log = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ("-started_at",)
+
+    def __str__(self):
+        return (
+            f"Recalc {self.model} #{self.pk} ({self.status}, "
+            f"{len(self.completed_partitions)}/{self.total_partitions})"
+        )
@@ -0,0 +1,282 @@
+"""
+Параллельный пересчёт отчётов (manage.py recalc).
+
+Работа - пары (объект, комнатность), отсортированные по pk и нарезанные на
+партиции по chunk_size. Партиции считаются в пуле процессов, у каждого
+процесса своё соединение с БД. Внутри партиции calculate() не пишет в БД
+(см. models.buffer_reports): отчёты партиции сохраняются одним
+bulk_create(update_conflicts=True) в одной транзакции. Если у отчёта есть
+calculate_bulk (DldBuildingReport, AreaReportDLD), партиция считается им -
+по проходу на все её объекты, а не по запросам на каждую пару.
+
+Номера готовых партиций пишутся в ReportRecalcRun после каждой партиции,
+поэтому упавший запуск продолжается с того же места (resume) по
+сохранённому снимку объектов, комнатностей и размеру партиций; resume с
+другими аргументами - ValueError, а не тихий пересчёт по старым.
+"""
+
+import logging
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from realty.main.models import Area as DldArea
+from realty.main.models import Building as DldBuilding
+from realty.pfimport.models import Area, Building
+
+from .models import (
+    BEDROOM_CHOICES,
+    AreaReport,
+    AreaReportDLD,
+    BuildingReport,
+    CityReport,
+    CityReportPF,
+    DldBuildingReport,
+    ReportRecalcRun,
+    buffer_reports,
+    flush_reports,
+)
+
+logger = logging.getLogger(__name__)
+
+BR_CHOICES = [key for key, _ in BEDROOM_CHOICES]
+
+# модель -> (класс отчёта, queryset объектов или None для города)
+TARGETS: Dict[str, Tuple[type, Optional[Callable]]] = {
+    "building": (
+        BuildingReport,
+        lambda: Building.objects.exclude(dld_building__isnull=True),
+    ),
+    "area": (AreaReport, lambda: Area.objects.all()),
+    "citypf": (CityReportPF, None),
+    "citydld": (CityReport, None),
+    "dldbuilding": (DldBuildingReport, lambda: DldBuilding.objects.all()),
+    "areadld": (AreaReportDLD, lambda: DldArea.objects.all()),
+}
+
+Unit = Tuple[Optional[int], str]  # (pk объекта, комнатность)
+
+
+def partitions(object_ids: List[Optional[int]], bedrooms: List[str], chunk_size):
+    """Пары (объект, комнатность) по порядку pk, нарезанные на партиции."""
+    units: List[Unit] = [(pk, br) for pk in object_ids for br in bedrooms]
+    return [units[i : i + chunk_size] for i in range(0, len(units), chunk_size)]
+
+
+def _calculate_units(report_model, source, units: List[Unit], errors: List[str]):
+    """calculate() по каждой паре, возвращает число пропущенных."""
+    objects = source().in_bulk([pk for pk, _ in units]) if source else {}
+    skipped = 0
+    for pk, bedrooms in units:
+        try:
+            if source is None:
+                report = report_model.calculate(bedrooms)
+            elif pk in objects:
+                report = report_model.calculate(objects[pk], bedrooms)
+            else:
+                report = None  # объект удалён после снимка
+        except Exception as e:  # pylint: disable=broad-except
+            errors.append(f"{pk}/{bedrooms}: {e}")
+            continue
+        if report is None:
+            skipped += 1
+    return skipped
+
+
+def _calculate_bulk(report_model, units: List[Unit], errors: List[str]):
+    """
+    Отчёты с calculate_bulk: по проходу на набор комнатностей (обычно один,
+    на границах партиции объект может попасть не со всеми комнатностями).
+    """
+    bedrooms_by_pk = defaultdict(list)
+    for pk, bedrooms in units:
+        bedrooms_by_pk[pk].append(bedrooms)
+    pks_by_bedrooms = defaultdict(list)
+    for pk, bedrooms in bedrooms_by_pk.items():
+        pks_by_bedrooms[tuple(bedrooms)].append(pk)
+
+    skipped = 0
+    for bedrooms, pks in pks_by_bedrooms.items():
+        try:
+            reports = report_model.calculate_bulk(pks, bedrooms=bedrooms)
+        except Exception as e:  # pylint: disable=broad-except
+            errors.append(f"{pks[0]}..{pks[-1]}/{','.join(bedrooms)}: {e}")
+            continue
+        skipped += len(pks) * len(bedrooms) - len(reports)
+    return skipped
+
+
+def recalc_partition(model_key: str, index: int, units: List[Unit]):
+    """Считает одну партицию (в дочернем процессе), возвращает статистику."""
+    report_model, source = TARGETS[model_key]
+    t0 = time.monotonic()
+    errors = []
+
+    with buffer_reports() as buffer:
+        if hasattr(report_model, "calculate_bulk"):
+            skipped = _calculate_bulk(report_model, units, errors)
+        else:
+            skipped = _calculate_units(report_model, source, units, errors)
+
+    with transaction.atomic():
+        written = flush_reports(buffer)
+    return index, written, skipped, errors, time.monotonic() - t0
+
+
+def _check_resume(run, object_ids, bedrooms, chunk_size):
+    """Аргументы resume (None - не заданы) должны совпадать с запуском run."""
+    conflicts = []
+    if object_ids is not None and set(object_ids) != set(run.object_ids):
+        conflicts.append("--id")
+    if bedrooms is not None and set(bedrooms) != set(run.bedrooms):
+        conflicts.append("--bedrooms")
+    if chunk_size is not None and chunk_size != run.chunk_size:
+        conflicts.append("--chunk-size")
+    if conflicts:
+        raise ValueError(
+            f"{run.model} run #{run.pk} was started with other "
+            f"{', '.join(conflicts)}; drop them or start without --resume"
+        )
+
+
+def _start_run(model_key, object_ids, bedrooms, chunk_size, workers, resume):
+    if resume:
+        run = (
+            ReportRecalcRun.objects.filter(model=model_key)
+            .exclude(status="completed")
+            .order_by("-started_at")
+            .first()
+        )
+        if run is not None:
+            _check_resume(run, object_ids, bedrooms, chunk_size)
+            run.status = "running"
+            run.workers = workers
+            run.log += f"RESUMED at {timezone.now():%Y-%m-%d %H:%M:%S}\n"
+            run.save(update_fields=["status", "workers", "log"])
+            return run
+
+    bedrooms = bedrooms or BR_CHOICES
+    if chunk_size is None:
+        chunk_size = getattr(settings, "REPORT_RECALC_CHUNK_SIZE", 50)
+    if object_ids is None:
+        source = TARGETS[model_key][1]
+        object_ids = (
+            list(source().order_by("pk").values_list("pk", flat=True))
+            if source
+            else [None]
+        )
+    return ReportRecalcRun.objects.create(
+        model=model_key,
+        bedrooms=bedrooms,
+        object_ids=sorted(object_ids, key=lambda pk: pk or 0),
+        chunk_size=chunk_size,
+        workers=workers,
+        total_partitions=len(partitions(object_ids, bedrooms, chunk_size)),
+    )
+
+
+def recalculate(
+    model_key: str,
+    object_ids: Optional[List[int]] = None,
+    bedrooms: Optional[List[str]] = None,
+    workers: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+    resume: bool = False,
+    on_progress: Optional[Callable] = None,
+) -> ReportRecalcRun:
+    """
+    Пересчитывает отчёты model_key (ключ TARGETS) для object_ids (None - все)
+    и bedrooms (None - все). resume=True - продолжить последний незавершённый
+    запуск этой модели с его объектами, комнатностями и партициями; заданные
+    object_ids / bedrooms / chunk_size должны совпадать с ними (ValueError).
+    on_progress(run, index, written, skipped, errors) - после каждой партиции.
+    У отчётов по городу (citypf, citydld) объектов нет - object_ids только None.
+    """
+    if object_ids is not None and TARGETS[model_key][1] is None:
+        raise ValueError(f"{model_key} is a city-wide report, object_ids not allowed")
+    if workers is None:
+        workers = getattr(settings, "REPORT_RECALC_WORKERS", 0)
+    workers = workers or os.cpu_count() or 1
+
+    run = _start_run(model_key, object_ids, bedrooms, chunk_size, workers, resume)
+    done = set(run.completed_partitions)
+    pending = [
+        (index, units)
+        for index, units in enumerate(
+            partitions(run.object_ids, run.bedrooms, run.chunk_size)
+        )
+        if index not in done
+    ]
+    t0 = time.monotonic()
+    logger.info(
+        "Recalc %s #%s: %s partitions pending (%s done), workers=%s",
+        model_key,
+        run.pk,
+        len(pending),
+        len(done),
+        workers,
+    )
+
+    def on_done(index, written, skipped, errors, elapsed):
+        run.completed_partitions.append(index)
+        run.reports_written += written
+        run.reports_skipped += skipped
+        run.errors += len(errors)
+        for error in errors:
+            run.log += f"FAILED {error}\n"
+            logger.error("Recalc %s failed for %s", model_key, error)
+        logger.debug("Recalc %s partition %s in %.2fs", model_key, index, elapsed)
+        # checkpoint после каждой партиции: она уже записана, resume её пропустит
+        run.save(
+            update_fields=[
+                "completed_partitions",
+                "reports_written",
+                "reports_skipped",
+                "errors",
+                "log",
+            ]
+        )
+        if on_progress:
+            on_progress(run, index, written, skipped, errors)
+
+    try:
+        if workers <= 1:
+            for index, units in pending:
+                on_done(*recalc_partition(model_key, index, units))
+        else:
+            # Соединения родителя не должны достаться дочерним процессам
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [
+                    pool.submit(recalc_partition, model_key, index, units)
+                    for index, units in pending
+                ]
+                for future in as_completed(futures):
+                    on_done(*future.result())
+        run.status = "completed"
+    except BaseException as e:
+        logger.exception("Recalc %s #%s failed", model_key, run.pk)
+        run.status = "failed"
+        run.log += f"ERROR: {e!r}\n"
+        raise
+    finally:
+        run.finished_at = timezone.now()
+        run.duration_seconds = (run.duration_seconds or 0) + time.monotonic() - t0
+        run.save()
+
+    logger.info(
+        "Recalc %s #%s: %s reports written, %s skipped, %s errors in %.1fs",
+        model_key,
+        run.pk,
+        run.reports_written,
+        run.reports_skipped,
+        run.errors,
+        run.duration_seconds,
+    )
+    return run
@@ -0,0 +1,218 @@
+"""
+Векторное ядро статистики для калькуляторов отчётов (NumPy).
+
+Колонки читаются одним values_list и сразу становятся массивами: числовые
+поля приводятся к float в SQL (Cast), NULL -> nan, даты -> datetime64[D].
+Дальше avg / median / min / max / count / avg_sqm / avg_ppsqm / экспозиция /
+последние сделки считаются без циклов Python - в том числе сразу для многих
+групп (здание × комнатность × год в DldBuildingReport.calculate_bulk,
+средние "по зданиям" в AreaReportDLD).
+
+Результаты совпадают с прежними списковыми расчётами: суммы накапливаются в
+порядке строк (np.bincount), медиана - как statistics.median, последние
+сделки - стабильная сортировка по дате (при равных датах - порядок строк).
+"""
+
+from datetime import date
+from typing import List, Optional, Sequence
+
+import numpy as np
+from django.db.models import FloatField
+from django.db.models.functions import Cast
+
+from realty.main.sketch import QuantileSketch
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+EMPTY_STATS = {
+    "avg_price": None,
+    "median_price": None,
+    "min_price": None,
+    "max_price": None,
+    "avg_sqm": None,
+    "avg_ppsqm": None,
+    "count": 0,
+    "avg_exposure": None,
+    "last": [],
+}
+
+
+def load_columns(qs, *fields, dates: Sequence[str] = (), **expressions):
+    """
+    {имя: массив} по queryset: fields и expressions - float64 (NULL -> nan),
+    dates - datetime64[D]. Порядок строк - порядок qs.
+    """
+    casts = {f"_k{i}": Cast(field, FloatField()) for i, field in enumerate(fields)}
+    casts.update(
+        {f"_k{len(fields) + i}": expr for i, expr in enumerate(expressions.values())}
+    )
+    names = [*fields, *expressions]
+    rows = list(qs.annotate(**casts).values_list(*casts, *dates))
+    columns = list(zip(*rows)) if rows else [()] * (len(names) + len(dates))
+
+    result = {
+        name: np.array(column, dtype=np.float64) for name, column in zip(names, columns)
+    }
+    for name, column in zip(dates, columns[len(names) :]):
+        result[name] = date_array(column)
+    return result
+
+
+def date_array(values: Sequence[date]) -> np.ndarray:
+    """Даты -> datetime64[D] (через toordinal - в разы быстрее np.array)."""
+    try:
+        ordinals = np.fromiter(map(date.toordinal, values), np.int64, len(values))
+    except TypeError:  # есть NULL
+        return np.array(values, dtype="datetime64[D]")
+    return (ordinals - _EPOCH_ORDINAL).astype("datetime64[D]")
+
+
+def _radix(values: np.ndarray) -> np.ndarray:
+    """Неотрицательные целые < 2**16 -> uint16: stable argsort по ним поразрядный."""
+    if values.dtype.kind in "iu" and len(values) and values.max() < 1 << 16:
+        return values.astype(np.uint16)
+    return values
+
+
+def _group_order(groups: np.ndarray, keys: np.ndarray, kind="stable") -> np.ndarray:
+    """Порядок строк по группам, внутри группы - по keys."""
+    order = np.argsort(_radix(keys), kind=kind)
+    return order[np.argsort(_radix(groups[order]), kind="stable")]
+
+
+def _floats(values: np.ndarray) -> list:
+    """Массив -> список float / None (nan), для полей отчётов и JSON."""
+    return [None if v != v else v for v in values.tolist()]
+
+
+def grouped_describe(
+    groups: np.ndarray,
+    n_groups: int,
+    prices: np.ndarray,
+    sqm: Optional[np.ndarray] = None,
+    dates: Optional[np.ndarray] = None,
+    exposure: Optional[np.ndarray] = None,
+    last: int = 0,
+) -> List[dict]:
+    """
+    Статистика цен по группам 0..n_groups-1 (groups - номер группы строки).
+    Пустая группа - EMPTY_STATS. avg_sqm / avg_ppsqm - если передан sqm,
+    avg_exposure - среднее по не-nan exposure, last - последние сделки.
+    """
+    if not len(prices):
+        return [dict(EMPTY_STATS, last=[]) for _ in range(n_groups)]
+
+    groups = np.asarray(groups, dtype=np.intp)
+    count = np.bincount(groups, minlength=n_groups)
+    nonempty = count > 0
+    safe_count = np.where(nonempty, count, 1)
+    price_sum = np.bincount(groups, weights=prices, minlength=n_groups)
+
+    # медиана / минимум / максимум - по ценам, отсортированным внутри группы
+    starts = np.concatenate(([0], np.cumsum(count)[:-1]))
+    sorted_prices = prices[_group_order(groups, prices, kind="quicksort")]
+    first = np.where(nonempty, starts, 0)
+    end = np.where(nonempty, starts + count - 1, 0)
+    lo = np.where(nonempty, starts + (count - 1) // 2, 0)
+    hi = np.where(nonempty, starts + count // 2, 0)
+
+    columns = {
+        "avg_price": price_sum / safe_count,
+        "median_price": (sorted_prices[lo] + sorted_prices[hi]) / 2,
+        "min_price": sorted_prices[first],
+        "max_price": sorted_prices[end],
+    }
+    if sqm is not None:
+        sqm_sum = np.bincount(groups, weights=sqm, minlength=n_groups)
+        columns["avg_sqm"] = sqm_sum / safe_count
+        columns["avg_ppsqm"] = np.divide(
+            price_sum, sqm_sum, out=np.full(n_groups, np.nan), where=sqm_sum != 0
+        )
+    if exposure is not None:
+        known = ~np.isnan(exposure)
+        expo_count = np.bincount(groups[known], minlength=n_groups)
+        expo_sum = np.bincount(
+            groups[known], weights=exposure[known], minlength=n_groups
+        )
+        columns["avg_exposure"] = np.divide(
+            expo_sum, expo_count, out=np.full(n_groups, np.nan), where=expo_count > 0
+        )
+    for values in columns.values():
+        values[~nonempty] = np.nan
+
+    lists = {name: _floats(values) for name, values in columns.items()}
+    counts = count.tolist()
+    result = []
+    for g in range(n_groups):
+        stats = dict(EMPTY_STATS, last=[], count=counts[g])
+        for name, values in lists.items():
+            stats[name] = values[g]
+        result.append(stats)
+
+    if last and dates is not None:
+        # новые сверху; сортировки стабильны - при равных датах порядок строк
+        days = dates.astype(np.int64)
+        order = _group_order(groups, days.max() - days)
+        rank = np.arange(len(order)) - starts[groups[order]]
+        picked = order[rank < last]
+        iso = np.datetime_as_string(dates[picked], unit="D").tolist()
+        sqm_list = sqm[picked].tolist() if sqm is not None else [None] * len(picked)
+        for g, price, area, day in zip(
+            groups[picked].tolist(), prices[picked].tolist(), sqm_list, iso
+        ):
+            result[g]["last"].append({"price": price, "sqm": area, "date": day})
+    return result
+
+
+def describe(prices: np.ndarray, **kwargs) -> dict:
+    """grouped_describe для одной группы."""
+    groups = np.zeros(len(prices), dtype=np.intp)
+    return grouped_describe(groups, 1, prices, **kwargs)[0]
+
+
+def group_means(keys: np.ndarray, values: np.ndarray):
+    """(ключи по возрастанию, среднее values по ключу, число строк по ключу)."""
+    unique, inverse = np.unique(keys, return_inverse=True)
+    counts = np.bincount(inverse, minlength=len(unique))
+    sums = np.bincount(inverse, weights=values, minlength=len(unique))
+    return unique, sums / np.maximum(counts, 1), counts
+
+
+def _present(values: np.ndarray, nonzero: bool) -> np.ndarray:
+    values = values[~np.isnan(values)]
+    return values[values != 0] if nonzero else values
+
+
+def nan_mean(values: np.ndarray, nonzero: bool = False) -> Optional[float]:
+    """Среднее без NULL (nonzero=True - и без нулей, как фильтр `if v`)."""
+    values = _present(values, nonzero)
+    return float(values.mean()) if values.size else None
+
+
+def nan_median(values: np.ndarray, nonzero: bool = False) -> Optional[float]:
+    values = _present(values, nonzero)
+    return float(np.median(values)) if values.size else None
+
+
+def nan_min(values: np.ndarray, nonzero: bool = False) -> Optional[float]:
+    values = _present(values, nonzero)
+    return float(values.min()) if values.size else None
+
+
+def nan_max(values: np.ndarray, nonzero: bool = False) -> Optional[float]:
+    values = _present(values, nonzero)
+    return float(values.max()) if values.size else None
+
+
+def price_sketch(prices: np.ndarray) -> QuantileSketch:
+    """QuantileSketch.from_values(prices) без прохода по значениям в Python."""
+    sketch = QuantileSketch()
+    positive = prices[prices > 0]
+    sketch.zero_count = int(len(prices) - len(positive))
+    if len(positive):
+        keys, counts = np.unique(
+            np.ceil(np.log(positive) / sketch._log_gamma).astype(np.int64),
+            return_counts=True,
+        )
+        sketch.buckets = dict(zip(keys.tolist(), counts.tolist()))
+    return sketch
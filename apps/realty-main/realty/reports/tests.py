@@ -1,3 +1,139 @@
+import datetime
+import random
+import statistics
+
+import numpy as np
+from django.test import SimpleTestCase
 from django.test import TestCase
 
-# Create your tests here.
+from realty.main.sketch import QuantileSketch
+
+from .models import ReportRecalcRun
+from .recalc import _start_run
+from .stats_kernel import date_array
+from .stats_kernel import describe
+from .stats_kernel import EMPTY_STATS
+from .stats_kernel import grouped_describe
+from .stats_kernel import nan_mean
+from .stats_kernel import nan_median
+from .stats_kernel import price_sketch
+
+
+class StatsKernelTests(SimpleTestCase):
+    """Векторное ядро против прежних списковых расчётов (statistics)."""
+
+    def setUp(self):
+        rnd = random.Random(5)
+        self.n = 300
+        self.groups = [rnd.randrange(3) for _ in range(self.n)]  # группа 3 пустая
+        self.prices = [float(rnd.randint(300, 9000) * 1000) for _ in range(self.n)]
+        self.sqm = [rnd.uniform(30, 300) for _ in range(self.n)]
+        self.dates = [
+            np.datetime64("2024-01-01") + rnd.randrange(400) for _ in range(self.n)
+        ]
+
+    def expected(self, rows):
+        prices = [self.prices[i] for i in rows]
+        sqm = [self.sqm[i] for i in rows]
+        return {
+            "count": len(rows),
+            "avg_price": statistics.mean(prices),
+            "median_price": statistics.median(prices),
+            "min_price": min(prices),
+            "max_price": max(prices),
+            "avg_sqm": statistics.mean(sqm),
+            "avg_ppsqm": sum(prices) / sum(sqm),
+        }
+
+    def test_grouped_describe_matches_statistics(self):
+        result = grouped_describe(
+            np.array(self.groups),
+            4,
+            np.array(self.prices),
+            sqm=np.array(self.sqm),
+            dates=np.array(self.dates),
+            last=3,
+        )
+        for g in range(3):
+            rows = [i for i, grp in enumerate(self.groups) if grp == g]
+            stats = result[g]
+            for name, value in self.expected(rows).items():
+                self.assertAlmostEqual(stats[name], value, places=6, msg=(g, name))
+            # последние сделки: новые сверху, при равных датах - порядок строк
+            newest = sorted(rows, key=lambda i: self.dates[i], reverse=True)[:3]
+            self.assertEqual(
+                [row["date"] for row in stats["last"]],
+                [str(self.dates[i]) for i in newest],
+            )
+            self.assertEqual(
+                [row["price"] for row in stats["last"]],
+                [self.prices[i] for i in newest],
+            )
+        self.assertEqual(result[3], dict(EMPTY_STATS, last=[]))
+
+    def test_describe_single_group(self):
+        stats = describe(np.array([3.0, 1.0, 2.0, 10.0]))
+        self.assertEqual(stats["count"], 4)
+        self.assertEqual(stats["median_price"], 2.5)
+        self.assertEqual(stats["avg_price"], 4.0)
+        self.assertIsNone(stats["avg_sqm"])
+        self.assertEqual(describe(np.array([])), dict(EMPTY_STATS, last=[]))
+
+    def test_exposure_ignores_nan(self):
+        stats = describe(
+            np.array([1.0, 2.0, 3.0]), exposure=np.array([10.0, np.nan, 20.0])
+        )
+        self.assertEqual(stats["avg_exposure"], 15.0)
+        stats = describe(np.array([1.0]), exposure=np.array([np.nan]))
+        self.assertIsNone(stats["avg_exposure"])
+
+    def test_nan_helpers(self):
+        values = np.array([np.nan, 0.0, 4.0, 1.0, 2.0])
+        self.assertEqual(nan_median(values), statistics.median([0.0, 4.0, 1.0, 2.0]))
+        self.assertEqual(nan_median(values, nonzero=True), 2.0)
+        self.assertEqual(nan_mean(values, nonzero=True), statistics.mean([4, 1, 2]))
+        self.assertIsNone(nan_median(np.array([np.nan])))
+
+    def test_price_sketch_matches_from_values(self):
+        prices = self.prices + [0.0, 0.0]
+        fast = price_sketch(np.array(prices))
+        slow = QuantileSketch.from_values(prices)
+        self.assertEqual(fast.buckets, slow.buckets)
+        self.assertEqual(fast.zero_count, slow.zero_count)
+        self.assertEqual(fast.to_bytes(), slow.to_bytes())
+
+    def test_date_array_with_nulls(self):
+        days = [datetime.date(2024, 2, 29), datetime.date(1999, 12, 31)]
+        self.assertEqual(
+            date_array(days).tolist(), np.array(days, dtype="datetime64[D]").tolist()
+        )
+        self.assertTrue(np.isnat(date_array([None, days[0]])[0]))
+
+
+class RecalcResumeTests(TestCase):
+    """resume продолжает запуск по его снимку и не принимает другие аргументы."""
+
+    def setUp(self):
+        self.run = ReportRecalcRun.objects.create(
+            model="building",
+            bedrooms=["1br", "2br"],
+            object_ids=[3, 5],
+            chunk_size=10,
+            status="failed",
+            completed_partitions=[0],
+        )
+
+    def test_resume_with_matching_args(self):
+        run = _start_run("building", None, None, None, 2, resume=True)
+        self.assertEqual(run.pk, self.run.pk)
+        run = _start_run("building", [5, 3], ["2br", "1br"], 10, 2, resume=True)
+        self.assertEqual(run.pk, self.run.pk)
+        self.assertEqual(run.completed_partitions, [0])
+        self.assertEqual(run.status, "running")
+
+    def test_resume_rejects_conflicting_args(self):
+        for args in (([3], None, None), (None, ["3br"], None), (None, None, 50)):
+            with self.assertRaisesMessage(ValueError, f"run #{self.run.pk}"):
+                _start_run("building", *args, 2, resume=True)
+        self.run.refresh_from_db()
+        self.assertEqual(self.run.status, "failed")
@@ -47,7 +47,7 @@ CACHES = {
 # Включать diskcache только если явно указано переменной окружения
 if PROD and env.bool("USE_DISKCACHE", default=False):
     # https://grantjenks.com/docs/diskcache/tutorial.html#djangocache
-    CACHES["default"] = {
+    CACHES["shared"] = {
         "BACKEND": "diskcache.DjangoCache",
         "LOCATION": env.str("CACHE_LOCATION", default=".diskcache"),
         "TIMEOUT": 300,
@@ -55,6 +55,54 @@ if PROD and env.bool("USE_DISKCACHE", default=False):
         "DATABASE_TIMEOUT": 0.010,  # 10 milliseconds
         "OPTIONS": {"size_limit": 2**30},  # 1 gigabyte
     }
+elif PROD and env.str("REDIS_URL", default=""):
+    CACHES["shared"] = {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": env.str("REDIS_URL"),
+        "TIMEOUT": 300,
+    }
+# LRU процесса перед общим кэшем (realty.core.cache.TwoTierCache)
+if "shared" in CACHES:
+    if env.bool("CACHE_LOCAL_TIER", default=True):
+        CACHES["default"] = {
+            "BACKEND": "realty.core.cache.TwoTierCache",
+            "OPTIONS": {
+                "SHARED_CACHE": "shared",
+                "LOCAL_MAX_ENTRIES": env.int("CACHE_LOCAL_MAX_ENTRIES", default=1024),
+                "LOCAL_TIMEOUT": env.int("CACHE_LOCAL_TIMEOUT", default=30),
+            },
+        }
+    else:
+        CACHES["default"] = CACHES.pop("shared")
+
+# Число процессов для прогрева кэша статистики (realty.main.cache_warmer)
+CACHE_WARMER_WORKERS = env.int("CACHE_WARMER_WORKERS", default=2)
+
+# Single-flight для кэша статистики (realty.main.single_flight): аренда ключа
+# на время пересчёта, сколько ждать первого значения и сколько отдавать старое
+STATS_CACHE_LEASE_TIMEOUT = env.int("STATS_CACHE_LEASE_TIMEOUT", default=600)
+STATS_CACHE_LEASE_WAIT = env.float("STATS_CACHE_LEASE_WAIT", default=30.0)
+STATS_CACHE_STALE_TTL = env.int("STATS_CACHE_STALE_TTL", default=60 * 60 * 6)
+
+# Считать статистику по помесячным rollup (TransactionMonthlyRollup), если они построены
+STATS_USE_ROLLUPS = env.bool("STATS_USE_ROLLUPS", default=True)
+
+# Проверки теневой таблицы перед blue/green-обменом (realty.main.table_swap):
+# минимум строк относительно живой таблицы и допустимый сдвиг средней цены (в разы)
+TABLE_SWAP_MIN_ROW_RATIO = env.float("TABLE_SWAP_MIN_ROW_RATIO", default=0.9)
+TABLE_SWAP_MAX_PRICE_SHIFT = env.float("TABLE_SWAP_MAX_PRICE_SHIFT", default=3.0)
+
+# Пересчёт отчётов (realty.reports.recalc): процессы (0 - по числу ядер) и
+# размер партиции в парах (объект, комнатность)
+REPORT_RECALC_WORKERS = env.int("REPORT_RECALC_WORKERS", default=0)
+REPORT_RECALC_CHUNK_SIZE = env.int("REPORT_RECALC_CHUNK_SIZE", default=50)
+
+# Ограничения GraphQL-схемы (realty.main.schema): глубина и «стоимость» запроса,
+# размер страницы списков и число id в batched analytics
+GRAPHQL_MAX_DEPTH = env.int("GRAPHQL_MAX_DEPTH", default=8)
+GRAPHQL_MAX_COST = env.int("GRAPHQL_MAX_COST", default=20000)
+GRAPHQL_MAX_PAGE_SIZE = env.int("GRAPHQL_MAX_PAGE_SIZE", default=200)
+GRAPHQL_MAX_ANALYTICS_IDS = env.int("GRAPHQL_MAX_ANALYTICS_IDS", default=100)
 
 CSRF_COOKIE_SECURE = PROD
 